@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -208,6 +210,81 @@ CELERY_TASK_ALWAYS_EAGER = False # Для асинхронного выполн
 CELERY_WORKER_SEND_TASK_EVENTS = False
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True # Для совместимости с будущими версиями Celery
 
+# Прогнозирование: способ расчета конфигураций прогноза
+#   'chord'        - пакеты конфигураций с общими исходными данными параллельно в подзадачах (Celery group + chord)
+#   'process_pool' - в локальном пуле процессов внутри задачи (один воркер с concurrency 1 на многоядерной машине)
+#   'sequential'   - последовательно внутри одной задачи
+FORECAST_EXECUTION_MODE = 'chord'
+FORECAST_PROCESS_POOL_SIZE = None  # None - по числу ядер
+
+# Прогнозирование: прогресс задач хранится в Redis (forecasting/progress.py)
+FORECAST_PROGRESS_TTL_SECONDS = 3600
+# Проект работает под WSGI: открытый SSE-поток занимает поток (процесс) веб-сервера, поэтому соединение
+# короткое - по истечении этого времени сервер закрывает поток, и браузер (EventSource) переподключается.
+# Значение ограничено сверху PROGRESS_STREAM_MAX_SECONDS_LIMIT (forecasting/progress.py)
+FORECAST_PROGRESS_STREAM_MAX_SECONDS = 45
+FORECAST_PROGRESS_STREAM_HEARTBEAT_SECONDS = 15
+# Задача отменяется, если клиент дольше этого времени не запрашивал ее прогресс (закрыл страницу)
+FORECAST_ABANDON_TIMEOUT_SECONDS = 60
+
+# Прогнозирование: базовая версия исторических данных. Входит в хеш сохраненных результатов
+# (forecasting/shared_results.py); загрузчики данных дополняют ее при каждой загрузке.
+FORECAST_DATA_VERSION = 1
+# Общие файлы результатов (и строки ForecastResultRow), на которые не ссылается ни один ForecastRun, удаляются
+# задачей cleanup_shared_results_task (вручную - python manage.py cleanup_shared_results) через столько секунд
+# после записи или после следующей загрузки данных
+FORECAST_SHARED_RESULT_MAX_AGE_SECONDS = 3 * 24 * 3600
+
+# Прогнозирование: исторические коэффициенты рождаемости и смертности читаются из таблицы historical_rates
+# (числитель и знаменатель по региону, году, полу и возрасту) вместо пересчета из населения, смертей и рождений.
+# Таблица заполняется командой после загрузки данных: python manage.py build_historical_rates
+FORECAST_USE_HISTORICAL_RATES_TABLE = False
+
+# Прогнозирование: легкие и тяжелые прогнозы обрабатываются разными воркерами (forecasting/admission.py)
+#   celery -A Demographics worker -Q forecast_light -c 4 -n light@%h
+#   celery -A Demographics worker -Q forecast_heavy -c 1 -n heavy@%h
+FORECAST_QUEUE_LIGHT = 'forecast_light'
+FORECAST_QUEUE_HEAVY = 'forecast_heavy'
+CELERY_TASK_DEFAULT_QUEUE = FORECAST_QUEUE_LIGHT
+# Стоимость = число конфигураций x число лет прогноза (x FORECAST_COST_DETAIL_FACTOR при выводе по возрастам)
+FORECAST_COST_DETAIL_FACTOR = 4
+FORECAST_HEAVY_COST_THRESHOLD = 1000
+FORECAST_MAX_HEAVY_JOBS_PER_USER = 2  # Одновременно выполняемых тяжелых прогнозов на пользователя (сессию, IP)
+# Заголовок с IP-адресом клиента за доверенным прокси (например, 'HTTP_X_FORWARDED_FOR'); None - REMOTE_ADDR.
+# По IP считаются лимиты клиентов без сессии (JSON API)
+FORECAST_CLIENT_IP_HEADER = None
+# Прогнозы стоимостью не выше FORECAST_INLINE_MAX_COST считаются прямо в запросе (без Celery и опроса прогресса),
+# если укладываются в FORECAST_INLINE_TIME_BUDGET_SECONDS, иначе ставятся в очередь. 0 - всегда через Celery
+FORECAST_INLINE_MAX_COST = 60
+FORECAST_INLINE_TIME_BUDGET_SECONDS = 1.5
+
+# Прогрев процессов воркера при старте (forecasting/worker_warmup.py): справочник регионов,
+# шаблоны результатов, соединение с БД и исходные данные часто запрашиваемых регионов
+FORECAST_WORKER_WARMUP_ENABLED = True
+FORECAST_WORKER_WARMUP_TEMPLATES = ['forecast_results.html']
+FORECAST_WORKER_HOT_REGION_IDS = []  # id регионов (data_collector.Region), например [1] - Российская Федерация
+
+# Фоновый экспорт (forecasting/export_jobs.py): прогнозы, в таблицах которых не меньше
+# FORECAST_EXPORT_ASYNC_MIN_ROWS строк, экспортируются задачей Celery в файл, который затем отдается повторно
+FORECAST_EXPORT_ASYNC_MIN_ROWS = 20000
+FORECAST_EXPORT_JOB_STALE_SECONDS = 900  # Задача экспорта без обновлений дольше этого считается потерянной
+
+# Ночной расчет прогнозов с параметрами по умолчанию для всех регионов и типов поселений
+# (forecasting/default_forecasts.py; вручную - python manage.py precompute_default_forecasts).
+# Требует запущенного планировщика: celery -A Demographics beat
+FORECAST_PRECOMPUTE_BATCH_SIZE = 20  # Запросов с общей загрузкой исходных данных
+CELERY_BEAT_SCHEDULE = {
+    'precompute-default-forecasts': {
+        'task': 'forecasting.tasks.precompute_default_forecasts_task',
+        'schedule': crontab(hour=3, minute=0),
+        'options': {'queue': FORECAST_QUEUE_HEAVY},
+    },
+    'cleanup-shared-results': {
+        'task': 'forecasting.tasks.cleanup_shared_results_task',
+        'schedule': crontab(hour=4, minute=30),
+    },
+}
+
 
 
 LOGIN_REDIRECT_URL = 'home'  # Имя URL-паттерна для страницы, на которую перенаправлять после входа
@@ -0,0 +1,50 @@
+# data_collector/data_version.py
+
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import DataVersion
+
+logger = logging.getLogger(__name__)
+
+# Версия исторических данных (population, birth_rate, death_rate, migration_saldo).
+# Входит в ключ сохраненных результатов прогноза: после загрузки новых данных
+# ранее рассчитанные прогнозы перестают совпадать с новыми запросами.
+# Источник версии - строка таблицы data_version; кеш - только копия для чтения (после очистки
+# или перезапуска Redis версия снова читается из БД, а не сбрасывается к FORECAST_DATA_VERSION).
+DATA_VERSION_CACHE_KEY = 'demographics_data_version'
+DATA_VERSION_CACHE_TIMEOUT = 300  # секунд
+DATA_VERSION_ROW_ID = 1
+
+
+def get_data_version() -> str:
+    """
+    Возвращает текущую версию данных: settings.FORECAST_DATA_VERSION и версия последней загрузки
+    (если данные еще не перезагружались - только settings.FORECAST_DATA_VERSION).
+    """
+    base_version = str(getattr(settings, 'FORECAST_DATA_VERSION', 1))
+    loaded_version = cache.get(DATA_VERSION_CACHE_KEY)
+    if loaded_version is None:
+        loaded_version = DataVersion.objects.filter(pk=DATA_VERSION_ROW_ID).values_list(
+            'version', flat=True).first() or ''
+        cache.set(DATA_VERSION_CACHE_KEY, loaded_version, timeout=DATA_VERSION_CACHE_TIMEOUT)
+    return f"{base_version}.{loaded_version}" if loaded_version else base_version
+
+
+def bump_data_version() -> str:
+    """Вызывается загрузчиками данных после успешного коммита в БД."""
+    new_loaded_version = str(time.time_ns())
+    DataVersion.objects.update_or_create(pk=DATA_VERSION_ROW_ID, defaults={'version': new_loaded_version})
+    cache.set(DATA_VERSION_CACHE_KEY, new_loaded_version, timeout=DATA_VERSION_CACHE_TIMEOUT)
+    logger.info(f"Версия данных обновлена: {new_loaded_version}")
+    return get_data_version()
+
+
+def get_data_version_updated_at() -> Optional[datetime]:
+    """Время последней загрузки данных; None, если данные еще не перезагружались."""
+    return DataVersion.objects.filter(pk=DATA_VERSION_ROW_ID).values_list('updated_at', flat=True).first()
@@ -1,3 +1,6 @@
+import os
+import threading
+
 import mysql.connector
 from django.conf import settings
 from django.core.management.base import CommandError
@@ -7,9 +10,12 @@ logger = logging.getLogger(__name__)  # Создаем логгер для эт
 
 
 class DBConnector:
-    def __init__(self):
+    def __init__(self, autocommit: bool = False):
         self.conn = None
         self.db_settings = None
+        # autocommit=True для долгоживущих соединений только на чтение: без него первый SELECT
+        # открывает транзакцию, и соединение не видит данные, загруженные после этого
+        self.autocommit = autocommit
         try:
             self._load_settings()
         except Exception as e:
@@ -60,7 +66,8 @@ class DBConnector:
                 "user": str(user_val),
                 "password": str(password_val),
                 "database": str(database_val),
-                "port": int(port_val_str)  # mysql.connector ожидает порт как int
+                "port": int(port_val_str),  # mysql.connector ожидает порт как int
+                "autocommit": self.autocommit,
             }
 
             self.conn = mysql.connector.connect(**db_params)
@@ -96,4 +103,19 @@ class DBConnector:
             except mysql.connector.Error as err:
                 logger.warning(f"DBConnector: Ошибка при закрытии соединения с БД: {err}")
             finally:  # В любом случае сбрасываем self.conn
-                self.conn = None
\ No newline at end of file
+                self.conn = None
+
+
+# Соединение для чтения исторических данных, общее для всех прогнозов потока
+# (воркер Celery открывает его при старте, см. forecasting/worker_warmup.py).
+# Соединение не наследуется через fork: в дочернем процессе создается новое.
+_shared_connector_state = threading.local()
+
+
+def get_shared_connector() -> DBConnector:
+    connector = getattr(_shared_connector_state, 'connector', None)
+    if connector is None or _shared_connector_state.pid != os.getpid():
+        connector = DBConnector(autocommit=True)
+        _shared_connector_state.connector = connector
+        _shared_connector_state.pid = os.getpid()
+    return connector
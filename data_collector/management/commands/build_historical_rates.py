@@ -0,0 +1,136 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from data_collector.db_connector import DBConnector
+from data_collector.data_version import bump_data_version
+from forecasting.data_providers.db_data_provider import HISTORICAL_RATES_TABLE, RATE_TYPE_BIRTH, RATE_TYPE_DEATH, \
+    SEX_FEMALE_CODE
+
+# --- НАСТРОЙКИ СКРИПТА ---
+
+# Исторические возрастные коэффициенты рождаемости и смертности по регионам (reg), типам поселений, полу и возрасту.
+# Хранятся числитель (рождения/смерти) и знаменатель (население), а не только коэффициент: для группы регионов
+# коэффициент пересчитывается по суммам числителей и знаменателей и совпадает с расчетом из исходных таблиц.
+# Возраст матери 55 - "55 лет и старше", его знаменатель - женщины 55 лет и старше (как в CoefficientProcessor).
+# Строки строятся по населению (LEFT JOIN событий): знаменатель хранится, даже если событий в ячейке нет
+# (числитель NULL), - загрузчики пропускают пустые ячейки, и знаменатель группы регионов должен включать все
+# регионы с населением, как при расчете из исходных таблиц.
+BIRTH_RATE_OPEN_AGE = 55
+
+CREATE_TABLE_QUERY = f"""
+    CREATE TABLE IF NOT EXISTS {HISTORICAL_RATES_TABLE} (
+        rate_type CHAR(1) NOT NULL,
+        year INT NOT NULL,
+        reg INT NOT NULL,
+        settlement_type_id INT NOT NULL,
+        sex CHAR(1) NOT NULL,
+        age INT NOT NULL,
+        rate DOUBLE NULL,
+        numerator DOUBLE NULL,
+        denominator DOUBLE NOT NULL,
+        PRIMARY KEY (settlement_type_id, reg, year, rate_type, sex, age)
+    )
+"""
+
+# Таблицы, созданные до появления строк без событий
+ALLOW_NULL_NUMERATOR_QUERY = f"ALTER TABLE {HISTORICAL_RATES_TABLE} MODIFY numerator DOUBLE NULL"
+
+# Умножение на 1e0 - деление в DOUBLE, а не в DECIMAL с 4 знаками после запятой (div_precision_increment)
+INSERT_DEATH_RATES_QUERY = f"""
+    INSERT INTO {HISTORICAL_RATES_TABLE}
+        (rate_type, year, reg, settlement_type_id, sex, age, rate, numerator, denominator)
+    SELECT %s, p.year, p.reg, p.settlement_type_id, p.sex, p.age,
+           CASE WHEN p.population > 0 THEN d.deaths * 1e0 / p.population END, d.deaths, p.population
+    FROM (SELECT year, reg, settlement_type_id, sex, age, SUM(population) AS population
+          FROM population
+          GROUP BY year, reg, settlement_type_id, sex, age) p
+    LEFT JOIN (SELECT year, reg, settlement_type_id, sex, age, SUM(death_rate) AS deaths
+               FROM death_rate
+               GROUP BY year, reg, settlement_type_id, sex, age) d
+      ON p.year = d.year AND p.reg = d.reg AND p.settlement_type_id = d.settlement_type_id
+     AND p.sex = d.sex AND p.age = d.age
+"""
+
+INSERT_BIRTH_RATES_QUERY = f"""
+    INSERT INTO {HISTORICAL_RATES_TABLE}
+        (rate_type, year, reg, settlement_type_id, sex, age, rate, numerator, denominator)
+    SELECT %s, p.year, p.reg, p.settlement_type_id, %s, p.mother_age,
+           CASE WHEN p.population > 0 THEN b.births * 1e0 / p.population END, b.births, p.population
+    FROM (SELECT year, reg, settlement_type_id,
+                 CASE WHEN age >= {BIRTH_RATE_OPEN_AGE} THEN {BIRTH_RATE_OPEN_AGE} ELSE age END AS mother_age,
+                 SUM(population) AS population
+          FROM population
+          WHERE sex = %s
+          GROUP BY year, reg, settlement_type_id,
+                   CASE WHEN age >= {BIRTH_RATE_OPEN_AGE} THEN {BIRTH_RATE_OPEN_AGE} ELSE age END) p
+    LEFT JOIN (SELECT year, reg, settlement_type_id, age, SUM(birth_rate) AS births
+               FROM birth_rate
+               GROUP BY year, reg, settlement_type_id, age) b
+      ON p.year = b.year AND p.reg = b.reg AND p.settlement_type_id = b.settlement_type_id
+     AND p.mother_age = b.age
+"""
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает таблицу исторических коэффициентов рождаемости и смертности (historical_rates) '
+            'по загруженным данным. Запускается после каждой загрузки населения, рождаемости или смертности.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f"Начало пересчета таблицы {HISTORICAL_RATES_TABLE}..."))
+
+        db_manager = None
+        conn = None
+        cursor = None
+        death_rows = 0
+        birth_rows = 0
+
+        try:
+            db_manager = DBConnector()
+            conn = db_manager.get_connection()
+
+            if not conn:
+                self.stderr.write(self.style.ERROR("Не удалось установить соединение с БД."))
+                return
+            self.stdout.write(self.style.SUCCESS(f"Успешное подключение к БД '{db_manager.db_settings.get('NAME')}'."))
+        except CommandError as e:
+            self.stderr.write(self.style.ERROR(str(e)))
+            return
+        except Exception as e_init_conn:
+            self.stderr.write(self.style.ERROR(f"Непредвиденная ошибка при подключении: {e_init_conn}"))
+            return
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute(CREATE_TABLE_QUERY)
+            cursor.execute(ALLOW_NULL_NUMERATOR_QUERY)
+            # Таблица пересчитывается целиком в одной транзакции: прогнозы не видят ее частично заполненной
+            cursor.execute(f"DELETE FROM {HISTORICAL_RATES_TABLE}")
+
+            cursor.execute(INSERT_DEATH_RATES_QUERY, (RATE_TYPE_DEATH,))
+            death_rows = cursor.rowcount
+            self.stdout.write(f"  Коэффициентов смертности: {death_rows}")
+
+            cursor.execute(INSERT_BIRTH_RATES_QUERY, (RATE_TYPE_BIRTH, SEX_FEMALE_CODE, SEX_FEMALE_CODE))
+            birth_rows = cursor.rowcount
+            self.stdout.write(f"  Коэффициентов рождаемости: {birth_rows}")
+
+            conn.commit()
+            self.stdout.write(self.style.SUCCESS(f"Таблица {HISTORICAL_RATES_TABLE} пересчитана и закоммичена."))
+            bump_data_version()  # Ранее сохраненные результаты прогнозов больше не актуальны
+
+        except Exception as e_glob:
+            if conn:
+                try:
+                    conn.rollback(); self.stdout.write(self.style.WARNING("Откат транзакции из-за ошибки."))
+                except:
+                    pass
+            self.stderr.write(self.style.ERROR(
+                f"ГЛОБАЛЬНАЯ ОШИБКА ({HISTORICAL_RATES_TABLE}): {type(e_glob).__name__} - {e_glob}"))
+            import traceback
+            traceback.print_exc()
+        finally:
+            if cursor: cursor.close()
+            if db_manager: db_manager.close()
+
+            self.stdout.write(self.style.SUCCESS(f"\n--- Итоги пересчета {HISTORICAL_RATES_TABLE} ---"))
+            self.stdout.write(f"Коэффициентов смертности: {death_rows}")
+            self.stdout.write(f"Коэффициентов рождаемости: {birth_rows}")
@@ -6,6 +6,8 @@ from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 
 from data_collector.db_connector import DBConnector
+from data_collector import region_registry
+from data_collector.data_version import bump_data_version
 
 # --- НАСТРОЙКИ СКРИПТА ---
 
@@ -34,21 +36,11 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR("get_region_id_map: Соединение с БД отсутствует."))
             return region_map
 
-        cursor = None
         try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT country_id, id FROM regions WHERE country_id IS NOT NULL")
-            for rosstat_code, region_db_id in cursor:
-                if rosstat_code is not None:
-                    try:
-                        region_map[int(rosstat_code)] = region_db_id
-                    except ValueError:
-                        self.stdout.write(self.style.WARNING(
-                            f"Не удалось преобразовать country_id '{rosstat_code}' в число для региона с id {region_db_id}"))
+            # Справочник регионов загружается одним запросом и переиспользуется (см. region_registry)
+            region_map = region_registry.get_country_id_to_region_id_map()
         except Exception as err:
             self.stderr.write(f"Ошибка получения кодов регионов из БД: {err}")
-        finally:
-            if cursor: cursor.close()
 
         if not region_map:
             self.stdout.write(self.style.WARNING("Словарь регионов пуст."))
@@ -200,6 +192,7 @@ class Command(BaseCommand):
 
             conn.commit()
             self.stdout.write(self.style.SUCCESS("Все данные по рождаемости успешно закоммичены в БД."))
+            bump_data_version()  # Ранее сохраненные результаты прогнозов больше не актуальны
 
         except FileNotFoundError:
             self.stderr.write(self.style.ERROR(f"ОШИБКА: Файл данных рождаемости не найден: {BIRTH_RATE_FILE_PATH}"))
@@ -7,6 +7,8 @@ from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 
 from data_collector.db_connector import DBConnector
+from data_collector import region_registry
+from data_collector.data_version import bump_data_version
 
 # --- НАСТРОЙКИ СКРИПТА ---
 MIGRATION_URBAN_FILE_PATH = os.path.join(settings.BASE_DIR, 'data_store', 'migration',
@@ -38,17 +40,11 @@ class Command(BaseCommand):
         if not conn:
             self.stderr.write(self.style.ERROR("get_region_okato_to_id_map: Соединение с БД отсутствует."))
             return region_map
-        cursor = None
         try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT okato_code, id FROM regions WHERE okato_code IS NOT NULL AND okato_code != ''")
-            for okato_code_from_db, region_db_id in cursor:
-                if okato_code_from_db:
-                    region_map[str(okato_code_from_db).strip()] = region_db_id
+            # Справочник регионов загружается одним запросом и переиспользуется (см. region_registry)
+            region_map = region_registry.get_okato_to_region_id_map()
         except Exception as err:
             self.stderr.write(f"Ошибка получения кодов регионов (ОКАТО) из БД: {err}")
-        finally:
-            if cursor: cursor.close()
         if not region_map:
             self.stdout.write(self.style.WARNING(
                 "Словарь кодов регионов (ОКАТО) пуст. Убедитесь, что таблица 'regions' и поле 'okato_code' корректно заполнены."))
@@ -289,6 +285,7 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.WARNING(
                     f"Всего {total_records_prepared_overall} записей по миграции ПОДГОТОВЛЕНО. КОММИТ В БД ЗАКОММЕНТИРОВАН ДЛЯ ОТЛАДКИ."))
                 self.stdout.write(self.style.SUCCESS(f"Всего {total_records_prepared_overall} записей по миграции успешно закоммичены в БД."))
+                bump_data_version()  # Ранее сохраненные результаты прогнозов больше не актуальны
             else:
                 self.stdout.write(self.style.WARNING("Не было подготовлено записей по миграции для коммита."))
 
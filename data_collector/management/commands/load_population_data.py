@@ -7,6 +7,8 @@ from django.conf import settings
 
 
 from data_collector.db_connector import DBConnector
+from data_collector import region_registry
+from data_collector.data_version import bump_data_version
 
 
 
@@ -38,22 +40,11 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR("get_region_id_map: Соединение с БД отсутствует."))
             return region_map
 
-        cursor = None  # Инициализируем
         try:
-            cursor = conn.cursor()  # conn теперь передается от DBConnector
-            cursor.execute("SELECT country_id, id FROM regions WHERE country_id IS NOT NULL")
-            for rosstat_code, region_db_id in cursor:
-                if rosstat_code is not None:
-                    try:
-                        region_map[int(rosstat_code)] = region_db_id
-                    except ValueError:
-                        self.stdout.write(self.style.WARNING(
-                            f"Не удалось преобразовать country_id '{rosstat_code}' в число для региона с id {region_db_id} в таблице regions."))
-
-        except Exception as err:  # Ловим общую ошибку, т.к. тип ошибки зависит от драйвера
+            # Справочник регионов загружается одним запросом и переиспользуется (см. region_registry)
+            region_map = region_registry.get_country_id_to_region_id_map()
+        except Exception as err:
             self.stderr.write(f"Ошибка получения кодов регионов из БД: {err}")
-        finally:
-            if cursor: cursor.close()
 
         if not region_map:
             self.stdout.write(self.style.WARNING(
@@ -213,6 +204,7 @@ class Command(BaseCommand):
 
             conn.commit()  # Один главный коммит после всех вставок
             self.stdout.write(self.style.SUCCESS("Все подготовленные данные успешно закоммичены в БД."))
+            bump_data_version()  # Ранее сохраненные результаты прогнозов больше не актуальны
 
         except FileNotFoundError:
             self.stderr.write(self.style.ERROR(f"ОШИБКА: Файл данных не найден по пути: {CSV_FILE_PATH}"))
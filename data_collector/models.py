@@ -40,4 +40,20 @@ class Region(models.Model):
         db_table = 'regions' # Явно указываем Django, с какой таблицей работать
         verbose_name = 'Регион'
         verbose_name_plural = 'Регионы'
-        ordering = ['name'] # Сортировка по умолчанию в админке и при запросах без order_by
\ No newline at end of file
+        ordering = ['name'] # Сортировка по умолчанию в админке и при запросах без order_by
+
+class DataVersion(models.Model):
+    """
+    Версия загруженных исторических данных (одна строка, см. data_collector.data_version).
+    Обновляется загрузчиками и build_historical_rates; кеш хранит только ее копию.
+    """
+    version = models.CharField(max_length=32, verbose_name="Версия данных")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлена")
+
+    def __str__(self):
+        return self.version
+
+    class Meta:
+        db_table = 'data_version'
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
@@ -0,0 +1,163 @@
+# data_collector/region_registry.py
+
+import logging
+import threading
+import time
+from typing import Dict, Any, Optional, List
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Справочник регионов в памяти процесса: id -> {'id', 'code', 'map_code', 'okato_code', 'country_id', 'name'}
+# и индексы по map_code, okato_code и country_id. Загружается целиком одним запросом при первом обращении
+# (в воркере Celery - при старте, см. forecasting/worker_warmup.py), после этого ни views, ни задачи,
+# ни загрузчики данных не делают запросов к таблице regions. Регион, которого нет в справочнике
+# (например, добавлен напрямую в БД после загрузки), загружается из БД при первом обращении по id.
+REGION_REGISTRY_FIELDS = ('id', 'code', 'map_code', 'okato_code', 'country_id', 'name')
+
+# Сохранение или удаление региона (см. signals.py) сбрасывает справочник текущего процесса и меняет
+# версию справочника в общем кеше. Остальные процессы сверяют версию не чаще раза в
+# REGION_REGISTRY_VERSION_CHECK_INTERVAL секунд и перезагружают справочник при ее изменении.
+REGION_REGISTRY_VERSION_CACHE_KEY = 'region_registry_version'
+REGION_REGISTRY_VERSION_CHECK_INTERVAL = 5.0
+
+
+class _RegionRegistrySnapshot:
+    """
+    Загруженный справочник с индексами. После публикации не изменяется: перезагрузка и добавление
+    региона создают новый снимок и заменяют ссылку _registry целиком, поэтому читатели без блокировки
+    видят либо старый, либо новый справочник, но не частично заполненный.
+    """
+    __slots__ = ('regions_by_id', 'region_ids_by_map_code', 'region_ids_by_okato_code',
+                 'region_ids_by_country_id', 'version')
+
+    def __init__(self, regions: List[Dict[str, Any]], version: Optional[str]):
+        self.regions_by_id: Dict[int, Dict[str, Any]] = {}
+        self.region_ids_by_map_code: Dict[str, int] = {}
+        self.region_ids_by_okato_code: Dict[str, int] = {}
+        self.region_ids_by_country_id: Dict[int, int] = {}
+        self.version = version
+        for region in regions:
+            self._index_region(region)
+
+    def _index_region(self, region: Dict[str, Any]) -> None:
+        self.regions_by_id[region['id']] = region
+        if region.get('map_code'):
+            self.region_ids_by_map_code[region['map_code']] = region['id']
+        okato_code = str(region['okato_code']).strip() if region.get('okato_code') else ''
+        if okato_code:
+            self.region_ids_by_okato_code[okato_code] = region['id']
+        if region.get('country_id') is not None:
+            self.region_ids_by_country_id[int(region['country_id'])] = region['id']
+
+    def with_region(self, region: Dict[str, Any]) -> '_RegionRegistrySnapshot':
+        """Новый снимок с добавленным (или замененным) регионом."""
+        return _RegionRegistrySnapshot(
+            [existing for region_id, existing in self.regions_by_id.items() if region_id != region['id']] + [region],
+            self.version)
+
+
+_registry_lock = threading.RLock()
+_registry = _RegionRegistrySnapshot([], None)
+_registry_loaded = False
+_version_checked_at = 0.0
+
+
+def _get_shared_version() -> Optional[str]:
+    try:
+        return cache.get(REGION_REGISTRY_VERSION_CACHE_KEY)
+    except Exception as e:
+        logger.warning(f"Не удалось получить версию справочника регионов из кеша: {e}")
+        return _registry.version
+
+
+def load_region_registry() -> int:
+    """Загружает все регионы одним запросом. Возвращает число загруженных регионов."""
+    global _registry, _registry_loaded, _version_checked_at
+    from .models import Region
+
+    with _registry_lock:
+        shared_version = _get_shared_version()
+        regions = list(Region.objects.values(*REGION_REGISTRY_FIELDS))
+        _registry = _RegionRegistrySnapshot(regions, shared_version)
+        _registry_loaded = True
+        _version_checked_at = time.monotonic()
+    return len(regions)
+
+
+def invalidate_region_registry(notify_other_processes: bool = True) -> None:
+    """Сбрасывает справочник; при следующем обращении он будет загружен заново."""
+    global _registry_loaded
+    with _registry_lock:
+        _registry_loaded = False
+    if notify_other_processes:
+        try:
+            cache.set(REGION_REGISTRY_VERSION_CACHE_KEY, str(time.time_ns()), timeout=None)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить версию справочника регионов в кеше: {e}")
+
+
+def _ensure_loaded() -> _RegionRegistrySnapshot:
+    """Актуальный снимок справочника; читатели берут ссылку на него один раз за вызов."""
+    global _registry_loaded, _version_checked_at
+    if _registry_loaded and time.monotonic() - _version_checked_at >= REGION_REGISTRY_VERSION_CHECK_INTERVAL:
+        _version_checked_at = time.monotonic()
+        if _get_shared_version() != _registry.version:
+            _registry_loaded = False
+    if not _registry_loaded:
+        with _registry_lock:
+            if not _registry_loaded:
+                count = load_region_registry()
+                logger.debug(f"Справочник регионов загружен ({count} регионов).")
+    return _registry
+
+
+def get_region(region_id: int) -> Optional[Dict[str, Any]]:
+    """Возвращает данные региона из справочника или None, если региона нет и в БД."""
+    global _registry
+    region = _ensure_loaded().regions_by_id.get(region_id)
+    if region is not None:
+        return region
+
+    from .models import Region
+
+    region = Region.objects.filter(id=region_id).values(*REGION_REGISTRY_FIELDS).first()
+    if region is not None:
+        with _registry_lock:
+            _registry = _registry.with_region(region)
+    return region
+
+
+def get_region_name(region_id: int) -> Optional[str]:
+    region = get_region(region_id)
+    return region['name'] if region is not None else None
+
+
+def get_region_by_map_code(map_code: str) -> Optional[Dict[str, Any]]:
+    registry = _ensure_loaded()
+    region_id = registry.region_ids_by_map_code.get(map_code)
+    return registry.regions_by_id.get(region_id) if region_id is not None else None
+
+
+def get_map_code_to_region_id_map(map_code_prefix: str = '') -> Dict[str, int]:
+    """{map_code: id} для регионов с кодом карты (в порядке названий регионов, как Region.Meta.ordering)."""
+    return {region['map_code']: region['id'] for region in _ensure_loaded().regions_by_id.values()
+            if region.get('map_code') and region['map_code'].startswith(map_code_prefix)}
+
+
+def get_okato_to_region_id_map() -> Dict[str, int]:
+    """{okato_code: id} для регионов с заполненным кодом ОКАТО."""
+    return dict(_ensure_loaded().region_ids_by_okato_code)
+
+
+def get_country_id_to_region_id_map() -> Dict[int, int]:
+    """{country_id: id} - коды регионов Росстата/HSE CDE в файлах данных."""
+    return dict(_ensure_loaded().region_ids_by_country_id)
+
+
+def get_region_ids_by_map_codes(map_codes: List[str]) -> Dict[str, int]:
+    """{map_code: id} для найденных кодов из map_codes."""
+    region_ids_by_map_code = _ensure_loaded().region_ids_by_map_code
+    return {map_code: region_ids_by_map_code[map_code] for map_code in map_codes
+            if map_code in region_ids_by_map_code}
@@ -0,0 +1,14 @@
+# data_collector/signals.py
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import region_registry
+from .models import Region
+
+
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+def _invalidate_region_registry(sender, instance: Region, **kwargs) -> None:
+    # Справочник регионов в памяти процессов перезагружается после изменения любого региона
+    region_registry.invalidate_region_registry()
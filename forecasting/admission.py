@@ -0,0 +1,144 @@
+# forecasting/admission.py
+
+import logging
+from typing import Dict, List, Any
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from . import progress
+
+logger = logging.getLogger(__name__)
+
+# Допуск задач прогноза в очередь:
+# - оценка стоимости запроса (число конфигураций x длина горизонта x детализация);
+# - выбор очереди Celery: легкие и тяжелые прогнозы обрабатываются разными воркерами,
+#   поэтому прогноз по одному региону не ждет, пока посчитается прогноз по 20 регионам;
+# - ограничение числа одновременно выполняемых тяжелых прогнозов одного пользователя:
+#   forecast:heavy:<user_key>        - set task_id тяжелых задач пользователя
+#   forecast:heavy:task:<task_id>    - ключ set, в котором учтена задача (для освобождения)
+
+# Добавляет задачу в set пользователя, только если число его тяжелых задач меньше лимита
+_ACQUIRE_HEAVY_SLOT_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    return 1
+end
+if redis.call('SCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+class HeavyForecastLimitExceeded(Exception):
+    """У пользователя уже выполняется максимальное число тяжелых прогнозов."""
+    pass
+
+
+def _heavy_slots_key(user_key: str) -> str:
+    return f'forecast:heavy:{user_key}'
+
+
+def _heavy_task_key(task_id: str) -> str:
+    return f'forecast:heavy:task:{task_id}'
+
+
+def _redis():
+    return get_redis_connection('default')
+
+
+def light_queue_name() -> str:
+    return getattr(settings, 'FORECAST_QUEUE_LIGHT', 'forecast_light')
+
+
+def heavy_queue_name() -> str:
+    return getattr(settings, 'FORECAST_QUEUE_HEAVY', 'forecast_heavy')
+
+
+def estimate_forecast_cost(all_run_configurations: List[Dict[str, Any]], output_detailed_by_age: bool) -> int:
+    """
+    Оценка стоимости прогноза в условных единицах: число конфигураций x число прогнозируемых лет,
+    с множителем FORECAST_COST_DETAIL_FACTOR для вывода по отдельным возрастам
+    (детальный вывод увеличивает объем результатов и время рендеринга в разы).
+    """
+    cost = 0
+    for run_spec in all_run_configurations:
+        run_params = run_spec['params']
+        horizon_years = max(1, run_params['forecast_end_year'] - run_params['forecast_start_year'] + 1)
+        cost += horizon_years
+    if output_detailed_by_age:
+        cost *= getattr(settings, 'FORECAST_COST_DETAIL_FACTOR', 4)
+    return cost
+
+
+def queue_for_cost(cost: int) -> str:
+    if cost >= getattr(settings, 'FORECAST_HEAVY_COST_THRESHOLD', 1000):
+        return heavy_queue_name()
+    return light_queue_name()
+
+
+def can_run_inline(cost: int) -> bool:
+    """Прогноз достаточно дешевый, чтобы посчитать его в запросе (см. tasks.run_forecast_inline)."""
+    return cost <= getattr(settings, 'FORECAST_INLINE_MAX_COST', 0)
+
+
+def acquire_heavy_slot(user_key: str, task_id: str) -> None:
+    """
+    Учитывает тяжелую задачу пользователя. Если лимит FORECAST_MAX_HEAVY_JOBS_PER_USER исчерпан,
+    выбрасывает HeavyForecastLimitExceeded. Задачи, которые уже завершились (или прогресс которых
+    устарел), перед проверкой лимита удаляются.
+    """
+    redis_conn = _redis()
+    slots_key = _heavy_slots_key(user_key)
+    max_heavy_jobs = getattr(settings, 'FORECAST_MAX_HEAVY_JOBS_PER_USER', 2)
+    ttl = getattr(settings, 'FORECAST_PROGRESS_TTL_SECONDS', 3600)
+
+    for member in redis_conn.smembers(slots_key):
+        member_task_id = member.decode('utf-8')
+        member_progress = progress.get_progress(member_task_id, include_warnings=False)
+        if not member_progress or member_progress['status'] not in progress.ACTIVE_STATUSES:
+            redis_conn.srem(slots_key, member_task_id)
+
+    acquired = redis_conn.register_script(_ACQUIRE_HEAVY_SLOT_SCRIPT)(
+        keys=[slots_key], args=[task_id, max_heavy_jobs, ttl])
+    if not acquired:
+        raise HeavyForecastLimitExceeded(
+            f"Одновременно можно выполнять не более {max_heavy_jobs} больших прогнозов. "
+            f"Дождитесь завершения уже запущенных прогнозов.")
+    redis_conn.set(_heavy_task_key(task_id), slots_key, ex=ttl)
+
+
+def release_heavy_slot(task_id: str) -> None:
+    """Освобождает место тяжелой задачи (для легких задач ничего не делает)."""
+    redis_conn = _redis()
+    slots_key = redis_conn.get(_heavy_task_key(task_id))
+    if slots_key is None:
+        return
+    redis_conn.srem(slots_key.decode('utf-8'), task_id)
+    redis_conn.delete(_heavy_task_key(task_id))
+
+
+def client_ip(request) -> str:
+    """
+    IP-адрес клиента: REMOTE_ADDR или, за доверенным прокси, заголовок settings.FORECAST_CLIENT_IP_HEADER
+    (например, 'HTTP_X_FORWARDED_FOR' - берется последний адрес, его добавил сам прокси).
+    """
+    ip_header = getattr(settings, 'FORECAST_CLIENT_IP_HEADER', None)
+    if ip_header and request.META.get(ip_header):
+        return request.META[ip_header].split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR') or 'unknown'
+
+
+def user_key_for_request(request) -> str:
+    """
+    Ключ пользователя для лимитов: id пользователя, ключ уже существующей сессии или, для клиентов
+    без сессии (JSON API), IP-адрес. Сессия здесь не создается: иначе каждый запрос API без cookie
+    создавал бы новую запись сессии и получал бы новый ключ (и свой лимит тяжелых прогнозов).
+    """
+    if request.user.is_authenticated:
+        return f'user:{request.user.id}'
+    if request.session.session_key:
+        return f'session:{request.session.session_key}'
+    return f'ip:{client_ip(request)}'
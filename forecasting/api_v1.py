@@ -0,0 +1,329 @@
+# forecasting/api_v1.py
+
+import json
+import logging
+import math
+import os
+import uuid
+from typing import Dict, List, Any, Optional, Tuple
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from data_collector import region_registry
+from . import admission, columnar_results, forecast_params, result_store, shared_results
+from . import progress as forecast_progress
+from .tasks import (calculate_forecast_task, RESULT_FORMAT_COLUMNAR, MAP_CODE_FOR_ALL_RUSSIA,
+                    ID_SETTLEMENT_TOTAL, ID_SETTLEMENT_URBAN, ID_SETTLEMENT_RURAL,
+                    SEX_CODE_TOTAL, SEX_CODE_MALE, SEX_CODE_FEMALE,
+                    SCENARIO_LAST_YEAR, SCENARIO_HISTORICAL_TREND, SCENARIO_MANUAL_PERCENT)
+from .views import gzip_result_response
+
+logger = logging.getLogger(__name__)
+
+# JSON API прогнозов, версия 1 (для дашбордов и скриптов): без рендеринга шаблонов и названий для показа.
+#   POST api/v1/forecasts/                     - параметры прогноза (JSON) -> task_id и ссылки
+#   GET  api/v1/forecasts/<task_id>/           - состояние задачи (как progress/, плюс предупреждения)
+#   GET  api/v1/forecasts/<task_id>/events/    - то же потоком Server-Sent Events
+#   GET  api/v1/forecasts/<task_id>/result/    - результат в колоночном JSON (см. columnar_results)
+# Параметры проверяются строго: некорректное значение - ошибка 400 с описанием по полям, а не замена
+# значением по умолчанию, как в форме. Год начала прогноза не передается: он следует за historical_data_end_year.
+# Ранее рассчитанный результат с теми же параметрами (общий файл результатов, см. shared_results)
+# отдается без запуска задачи. Результаты API хранятся только в Redis и в историю прогнозов не попадают.
+API_SCENARIOS = (SCENARIO_LAST_YEAR, SCENARIO_HISTORICAL_TREND, SCENARIO_MANUAL_PERCENT)
+API_YEAR_FIELDS = ('historical_data_start_year', 'historical_data_end_year', 'forecast_end_year')
+API_SCENARIO_FIELDS = ('birth_rate_scenario', 'death_rate_scenario_male', 'death_rate_scenario_female',
+                       'migration_scenario')
+API_PERCENT_FIELDS = ('birth_rate_manual_change_percent', 'death_rate_manual_change_percent_male',
+                      'death_rate_manual_change_percent_female', 'migration_manual_change_percent')
+API_FLAG_FIELDS = ('output_detailed_by_age', 'include_migration')
+API_FIELDS = ('regions', 'settlement_type_id', 'sex_code_target', 'target_age', 'target_age_bands') + \
+             API_YEAR_FIELDS + API_SCENARIO_FIELDS + API_PERCENT_FIELDS + API_FLAG_FIELDS
+
+API_MIN_YEAR = 1900
+API_MAX_YEAR = 2200
+API_MAX_AGE = 150
+API_MAX_REGIONS = 100
+
+RESULT_CONTENT_TYPE = 'application/json'
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_valid_age_band(age_band: Any) -> bool:
+    if not (isinstance(age_band, list) and len(age_band) == 3):
+        return False
+    band_name, band_start_age, band_end_age = age_band
+    return isinstance(band_name, str) and bool(band_name.strip()) \
+        and not any(separator in band_name for separator in forecast_params.AGE_BAND_SEPARATORS + (':',)) \
+        and _is_int(band_start_age) and _is_int(band_end_age) and 0 <= band_start_age <= band_end_age <= API_MAX_AGE
+
+
+def parse_api_parameters(payload: Any) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Проверяет параметры запроса API и приводит их к полям формы (см. forecast_params.build_forecast_plan).
+    Возвращает (данные формы, ошибки по полям); при ошибках данные формы не используются.
+    """
+    if not isinstance(payload, dict):
+        return {}, {'__all__': "Ожидается JSON-объект с параметрами прогноза."}
+
+    errors: Dict[str, str] = {}
+    form_data: Dict[str, str] = {}
+    for field_name in sorted(set(payload) - set(API_FIELDS)):
+        errors[field_name] = "Неизвестный параметр."
+
+    regions = payload.get('regions', [MAP_CODE_FOR_ALL_RUSSIA])
+    if not isinstance(regions, list) or not regions or len(regions) > API_MAX_REGIONS or \
+            not all(isinstance(code, str) and code.strip() and ',' not in code for code in regions):
+        errors['regions'] = f"Ожидается непустой список кодов регионов (не более {API_MAX_REGIONS})."
+    else:
+        map_codes = [code.strip() for code in regions]
+        # Неизвестные коды - ошибка, а не пропуск (в форме они пропускаются с предупреждением,
+        # а без найденных регионов используется вся РФ)
+        region_ids_by_map_code = region_registry.get_region_ids_by_map_codes(map_codes)
+        unknown_map_codes = [code for code in map_codes
+                             if code not in region_ids_by_map_code and code != MAP_CODE_FOR_ALL_RUSSIA]
+        if unknown_map_codes:
+            errors['regions'] = "Неизвестные коды регионов: " + ", ".join(unknown_map_codes) + "."
+        else:
+            form_data['region_ids'] = ','.join(map_codes)
+
+    settlement_type_id = payload.get('settlement_type_id', ID_SETTLEMENT_TOTAL)
+    if settlement_type_id not in (ID_SETTLEMENT_TOTAL, ID_SETTLEMENT_URBAN, ID_SETTLEMENT_RURAL) or \
+            not _is_int(settlement_type_id):
+        errors['settlement_type_id'] = "Допустимые значения: 1 (все), 2 (городское), 3 (сельское)."
+    else:
+        form_data['settlement_type_id'] = str(settlement_type_id)
+
+    sex_code = payload.get('sex_code_target', SEX_CODE_TOTAL)
+    if sex_code not in (SEX_CODE_TOTAL, SEX_CODE_MALE, SEX_CODE_FEMALE):
+        errors['sex_code_target'] = "Допустимые значения: A, M, F."
+    else:
+        form_data['sex_code_target'] = sex_code
+
+    for field_name in API_YEAR_FIELDS:
+        if field_name not in payload:
+            continue
+        year = payload[field_name]
+        if not _is_int(year) or not API_MIN_YEAR <= year <= API_MAX_YEAR:
+            errors[field_name] = f"Ожидается год от {API_MIN_YEAR} до {API_MAX_YEAR}."
+        else:
+            form_data[field_name] = str(year)
+
+    target_age = payload.get('target_age')
+    if target_age is not None:
+        if not (isinstance(target_age, list) and len(target_age) == 2 and all(_is_int(age) for age in target_age)
+                and 0 <= target_age[0] <= target_age[1] <= API_MAX_AGE):
+            errors['target_age'] = f"Ожидается null или [начальный возраст, конечный возраст] от 0 до {API_MAX_AGE}."
+        else:
+            form_data['target_age_group_type'] = 'specific_range'
+            form_data['target_age_start'], form_data['target_age_end'] = str(target_age[0]), str(target_age[1])
+
+    # Именованные возрастные группы: [[название, первый возраст, последний возраст], ...]
+    target_age_bands = payload.get('target_age_bands')
+    if target_age_bands is not None:
+        if not (isinstance(target_age_bands, list) and len(target_age_bands) <= forecast_params.MAX_AGE_BANDS
+                and all(_is_valid_age_band(age_band) for age_band in target_age_bands)
+                and len({age_band[0].strip() for age_band in target_age_bands}) == len(target_age_bands)):
+            errors['target_age_bands'] = (
+                f"Ожидается null или список (не более {forecast_params.MAX_AGE_BANDS}) групп "
+                f"[название, первый возраст, последний возраст] с разными названиями (без ';' и ':') "
+                f"и возрастами от 0 до {API_MAX_AGE}.")
+        elif target_age_bands:
+            form_data['target_age_bands'] = forecast_params.format_age_bands(
+                [[age_band[0].strip(), age_band[1], age_band[2]] for age_band in target_age_bands])
+
+    for field_name in API_SCENARIO_FIELDS:
+        scenario = payload.get(field_name, SCENARIO_LAST_YEAR)
+        if scenario not in API_SCENARIOS:
+            errors[field_name] = "Допустимые значения: " + ", ".join(API_SCENARIOS) + "."
+        else:
+            form_data[field_name] = scenario
+
+    for field_name in API_PERCENT_FIELDS:
+        percent = payload.get(field_name)
+        if percent is None:
+            continue
+        if not isinstance(percent, (int, float)) or isinstance(percent, bool) or not math.isfinite(percent) \
+                or percent <= -100:
+            errors[field_name] = "Ожидается число больше -100 или null."
+        else:
+            form_data[field_name] = repr(float(percent))
+
+    for field_name in API_FLAG_FIELDS:
+        flag = payload.get(field_name, False)
+        if not isinstance(flag, bool):
+            errors[field_name] = "Ожидается true или false."
+        elif flag:
+            form_data[field_name] = 'on'  # Как флажок формы: учитывается само наличие поля
+
+    return form_data, errors
+
+
+def _task_urls(task_id: str) -> Dict[str, str]:
+    return {
+        'status_url': reverse('forecasting:api_v1_forecast_status', args=[task_id]),
+        'events_url': reverse('forecasting:api_v1_forecast_events', args=[task_id]),
+        'result_url': reverse('forecasting:api_v1_forecast_result', args=[task_id]),
+    }
+
+
+def _error_response(message: str, status: int, errors: Optional[Dict[str, str]] = None) -> JsonResponse:
+    response_data: Dict[str, Any] = {'status': 'error', 'message': message}
+    if errors:
+        response_data['errors'] = errors
+    return JsonResponse(response_data, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+def _respond_with_stored_result(task_id: str, input_hash: str, total_configurations: int,
+                                form_warnings: List[str], group_order: List[str]) -> Optional[JsonResponse]:
+    """
+    Отдает ранее рассчитанный результат как завершенную задачу (группы - в порядке group_order).
+    None, если результата нет или он не читается.
+    """
+    relative_path = shared_results.find_artifact(input_hash)
+    if relative_path is None:
+        return None
+    try:
+        with result_store.open_result(os.path.join(settings.MEDIA_ROOT, relative_path),
+                                      group_order=group_order) as result_reader:
+            result_data = columnar_results.columnar_result_from_reader(result_reader, form_warnings)
+    except Exception as e:
+        logger.error(f"API: не удалось прочитать сохраненный результат {input_hash}: {e}", exc_info=True)
+        return None
+
+    forecast_progress.init_progress(task_id, total_configurations, result_data['warnings'],
+                                   result_type=forecast_progress.RESULT_TYPE_JSON)
+    forecast_progress.save_result_json(task_id, result_data)
+    forecast_progress.set_status(task_id, forecast_progress.STATUS_COMPLETED,
+                                 completed_configurations=total_configurations)
+    logger.info(f"API task {task_id}: Found stored result {input_hash}, skipping calculation.")
+    return JsonResponse(dict({'task_id': task_id, 'status': forecast_progress.STATUS_COMPLETED},
+                             **_task_urls(task_id)))
+
+
+# POST без CSRF-токена: принимается только application/json, который браузер не отправит на другой сайт
+# без предварительного CORS-запроса, поэтому сторонняя страница не может запустить прогноз от имени пользователя
+@csrf_exempt
+@require_POST
+def submit_forecast_view(request: HttpRequest) -> JsonResponse:
+    if request.content_type != 'application/json':
+        return _error_response("Ожидается тело запроса application/json.", status=415)
+    try:
+        payload = json.loads(request.body.decode('utf-8') or '{}')
+    except (UnicodeDecodeError, ValueError) as e:
+        return _error_response(f"Некорректный JSON: {e}", status=400)
+
+    form_data, errors = parse_api_parameters(payload)
+    if errors:
+        return _error_response("Некорректные параметры прогноза.", status=400, errors=errors)
+
+    task_id = str(uuid.uuid4())
+    form_warnings: List[str] = []
+    try:
+        forecast_plan = forecast_params.build_forecast_plan(form_data, form_warnings)
+    except ValueError as ve:
+        return _error_response(f"Ошибка в параметрах: {ve}", status=400)
+
+    all_run_configurations = forecast_plan['all_run_configurations']
+    input_hash = shared_results.compute_input_hash(
+        forecast_plan['base_forecast_params_no_combination_specifics'],
+        forecast_plan['initial_processed_region_db_ids'],
+        forecast_plan['user_selected_settlement_id'], forecast_plan['user_selected_sex_code'])
+
+    stored_result_response = _respond_with_stored_result(
+        task_id, input_hash, len(all_run_configurations), form_warnings,
+        [group_title for _, group_title in forecast_plan['region_configs']])
+    if stored_result_response is not None:
+        return stored_result_response
+
+    # Клиенты API не обязаны опрашивать прогресс, поэтому брошенные задачи не отменяются
+    forecast_progress.init_progress(task_id, len(all_run_configurations), form_warnings,
+                                   result_type=forecast_progress.RESULT_TYPE_JSON)
+
+    forecast_cost = admission.estimate_forecast_cost(all_run_configurations,
+                                                     forecast_plan['output_detailed_by_age_global'])
+    queue_name = admission.queue_for_cost(forecast_cost)
+    if queue_name == admission.heavy_queue_name():
+        try:
+            admission.acquire_heavy_slot(admission.user_key_for_request(request), task_id)
+        except admission.HeavyForecastLimitExceeded as e_limit:
+            logger.info(f"API task {task_id}: Heavy forecast rejected (cost {forecast_cost}): {e_limit}")
+            forecast_progress.set_status(task_id, forecast_progress.STATUS_ERROR, error_message=str(e_limit))
+            return _error_response(str(e_limit), status=429)
+    forecast_progress.enqueue(task_id, queue_name)
+
+    try:
+        calculate_forecast_task.apply_async(kwargs=dict(
+            task_id=task_id,
+            all_run_configurations=all_run_configurations,
+            base_forecast_params_no_combination_specifics=forecast_plan['base_forecast_params_no_combination_specifics'],
+            output_detailed_by_age_global=forecast_plan['output_detailed_by_age_global'],
+            user_selected_settlement_id=forecast_plan['user_selected_settlement_id'],
+            user_selected_sex_code=forecast_plan['user_selected_sex_code'],
+            initial_processed_region_db_ids=forecast_plan['initial_processed_region_db_ids'],
+            form_warnings_initial=list(form_warnings),
+            params_for_group_context_map={},
+            active_data_keys_list=forecast_plan['active_data_keys'],
+            results_template_name=None,
+            current_user_id=None,
+            input_hash=input_hash,
+            queue_name=queue_name,
+            result_format=RESULT_FORMAT_COLUMNAR,
+        ), queue=queue_name)
+    except Exception as e:
+        logger.error(f"API task {task_id}: Failed to dispatch Celery task: {e}", exc_info=True)
+        forecast_progress.set_status(task_id, forecast_progress.STATUS_ERROR,
+                                     error_message=f"Системная ошибка: ({type(e).__name__}) {e}")
+        forecast_progress.dequeue(task_id)
+        admission.release_heavy_slot(task_id)
+        return _error_response(f"Произошла системная ошибка: ({type(e).__name__})", status=500)
+
+    logger.info(f"API task {task_id}: Forecast cost {forecast_cost}, queue '{queue_name}'.")
+    return JsonResponse(dict({'task_id': task_id, 'status': forecast_progress.STATUS_QUEUED}, **_task_urls(task_id)),
+                        status=202)
+
+
+@require_GET
+def forecast_status_view(request: HttpRequest, task_id) -> JsonResponse:
+    task_id = str(task_id)
+    progress_data = forecast_progress.get_progress(task_id)
+    if not progress_data:
+        return _error_response("Задача не найдена. Возможно, она устарела или была удалена.", status=404)
+    response_data = forecast_progress.build_progress_payload(
+        task_id, progress_data, _task_urls(task_id)['result_url'])
+    response_data['warnings'] = progress_data['warnings']
+    return JsonResponse(response_data, json_dumps_params={'ensure_ascii': False})
+
+
+@require_GET
+def forecast_events_view(request: HttpRequest, task_id) -> HttpResponse:
+    task_id = str(task_id)
+    response = StreamingHttpResponse(
+        forecast_progress.iter_progress_events(task_id, _task_urls(task_id)['result_url']),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Отключает буферизацию ответа в nginx
+    return response
+
+
+@require_GET
+def forecast_result_view(request: HttpRequest, task_id) -> HttpResponse:
+    task_id = str(task_id)
+    progress_data = forecast_progress.get_progress(task_id, include_warnings=False)
+    if not progress_data or progress_data.get('result_type') != forecast_progress.RESULT_TYPE_JSON:
+        return _error_response("Задача не найдена. Возможно, она устарела или была удалена.", status=404)
+
+    stored_result = forecast_progress.get_result_gzip(task_id)
+    if stored_result is None:
+        # Результат еще не готов (или задача завершилась ошибкой) - клиент получает текущее состояние
+        response_data = forecast_progress.build_progress_payload(
+            task_id, progress_data, _task_urls(task_id)['result_url'])
+        return JsonResponse(response_data, status=409, json_dumps_params={'ensure_ascii': False})
+    compressed_result, result_etag = stored_result
+    return gzip_result_response(request, compressed_result, result_etag, RESULT_CONTENT_TYPE)
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class ForecastingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'forecasting'
\ No newline at end of file
+    name = 'forecasting'
+
+    def ready(self):
+        from . import signals  # noqa: F401 (регистрация обработчиков сигналов)
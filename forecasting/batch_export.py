@@ -0,0 +1,112 @@
+# forecasting/batch_export.py
+
+import itertools
+import logging
+import os
+import tempfile
+import zipfile
+from typing import List, Iterator
+
+from django.conf import settings
+
+from . import export_jobs, result_store, shared_results, tidy_export
+from .csv_export_utils import iter_forecast_csv_chunks
+from .models import ForecastRun
+
+logger = logging.getLogger(__name__)
+
+# Экспорт нескольких прогнозов одним ZIP-архивом (по файлу на прогноз), формируемый на лету.
+# Архив пишется в буфер без seek (zipfile в этом случае пишет размеры после данных каждого файла),
+# и содержимое буфера отдается клиенту после каждого записанного куска. В памяти одновременно находятся
+# только текущая группа регионов и один кусок файла, независимо от числа и размера прогнозов.
+BATCH_EXPORT_FORMATS = (export_jobs.EXPORT_FORMAT_CSV, export_jobs.EXPORT_FORMAT_NDJSON,
+                        export_jobs.EXPORT_FORMAT_PARQUET, export_jobs.EXPORT_FORMAT_XLSX)
+BATCH_EXPORT_COPY_CHUNK_SIZE = 1024 * 1024
+BATCH_EXPORT_ERRORS_FILENAME = 'errors.txt'
+
+
+class _ZipStreamBuffer:
+    """Файловый объект только для записи: накапливает байты архива до следующего drain()."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _iter_run_file_chunks(forecast_run: ForecastRun, export_format: str) -> Iterator[bytes]:
+    """Содержимое файла экспорта одного прогноза кусками байт."""
+    # Уже сформированный фоновой задачей файл копируется в архив как есть
+    ready_artifact = export_jobs.get_ready_artifact(forecast_run, export_format)
+    if ready_artifact is not None:
+        with open(os.path.join(settings.MEDIA_ROOT, ready_artifact.file_path), 'rb') as artifact_file:
+            yield from iter(lambda: artifact_file.read(BATCH_EXPORT_COPY_CHUNK_SIZE), b'')
+        return
+
+    if not forecast_run.results_file_path:
+        raise FileNotFoundError("для прогноза отсутствует файл с результатами")
+    with result_store.open_result(os.path.join(settings.MEDIA_ROOT, forecast_run.results_file_path),
+                                  group_order=shared_results.run_group_order(forecast_run)) as result_reader:
+        grouped_forecasts_data = result_reader.iter_groups()
+        if export_format == export_jobs.EXPORT_FORMAT_CSV:
+            export_kwargs = export_jobs.export_kwargs_from_meta(result_reader.meta)
+            for chunk in iter_forecast_csv_chunks(grouped_forecasts_data=grouped_forecasts_data, **export_kwargs):
+                yield chunk.encode('utf-8')
+        elif export_format == export_jobs.EXPORT_FORMAT_NDJSON:
+            output_detailed_by_age_global = result_reader.meta.get('output_detailed_by_age_global', False)
+            for chunk in tidy_export.iter_ndjson_chunks(grouped_forecasts_data, output_detailed_by_age_global):
+                yield chunk.encode('utf-8')
+        else:
+            # XLSX и Parquet записываются целиком, поэтому сначала во временный файл
+            with tempfile.TemporaryFile() as export_file:
+                export_jobs.write_export_file(export_file, export_format, result_reader.meta, grouped_forecasts_data)
+                export_file.seek(0)
+                yield from iter(lambda: export_file.read(BATCH_EXPORT_COPY_CHUNK_SIZE), b'')
+
+
+def _archive_member_name(forecast_run: ForecastRun, export_format: str) -> str:
+    return export_jobs.export_filename(forecast_run.id, export_format)
+
+
+def iter_batch_export_zip(forecast_runs: List[ForecastRun], export_format: str) -> Iterator[bytes]:
+    """
+    ZIP-архив с файлами экспорта прогнозов кусками байт (для StreamingHttpResponse).
+    Прогнозы, которые не удалось экспортировать, перечисляются в errors.txt в конце архива.
+    """
+    zip_stream = _ZipStreamBuffer()
+    export_errors: List[str] = []
+    with zipfile.ZipFile(zip_stream, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as batch_zip:
+        for forecast_run in forecast_runs:
+            member_name = _archive_member_name(forecast_run, export_format)
+            run_chunks = _iter_run_file_chunks(forecast_run, export_format)
+            try:
+                first_chunk = next(run_chunks, b'')
+            except Exception as e:
+                # Ошибка до начала записи файла в архив - прогноз пропускается
+                logger.error(f"Пакетный экспорт: прогноз ID {forecast_run.id} пропущен: {e}", exc_info=True)
+                export_errors.append(f"{member_name}: {e}")
+                continue
+
+            with batch_zip.open(member_name, 'w') as member_file:
+                for chunk in itertools.chain([first_chunk], run_chunks):
+                    member_file.write(chunk)
+                    archive_data = zip_stream.drain()
+                    if archive_data:
+                        yield archive_data
+            yield zip_stream.drain()  # Хвост сжатых данных и дескриптор файла
+
+        if export_errors:
+            batch_zip.writestr(BATCH_EXPORT_ERRORS_FILENAME,
+                               "Не удалось экспортировать:\n" + "\n".join(export_errors) + "\n")
+    yield zip_stream.drain()  # Центральный каталог архива
@@ -6,6 +6,7 @@ from collections import defaultdict
 
 # Предполагается, что linear_regression.py находится в forecasting.utils
 from .utils.linear_regression import calculate_linear_regression_trend, predict_value_from_trend
+from .data_providers.db_data_provider import RATE_COMPONENT_NUMERATOR, RATE_COMPONENT_DENOMINATOR
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +32,13 @@ FERTILE_AGE_START = 15
 FERTILE_AGE_END = 49  # Включительно
 
 
+def _is_birth_rate_age_key(mother_age: int) -> bool:
+    """Возраст матери, для которого рассчитывается исторический ВКР."""
+    return FERTILE_AGE_START <= mother_age <= FERTILE_AGE_END or \
+        mother_age == BIRTH_RATE_AGE_15_AND_YOUNGER_DB_KEY or \
+        mother_age == BIRTH_RATE_AGE_55_AND_OLDER_DB_KEY
+
+
 class CoefficientProcessor:
     """
     Обрабатывает и рассчитывает демографические коэффициенты (рождаемости, смертности, дожития)
@@ -46,7 +54,13 @@ class CoefficientProcessor:
             forecast_start_year: int,
             forecast_end_year: int,
             all_ages_list: List[int],  # Список всех однолетних возрастов, например [0, 1, ..., 100]
-            open_age_group: int = 100  # Например, 100 для 100+
+            open_age_group: int = 100,  # Например, 100 для 100+
+            # Числители и знаменатели исторических коэффициентов из таблицы historical_rates
+            # ({RATE_COMPONENT_*: {mother_age: {year: value}}} и {RATE_COMPONENT_*: {sex: {age: {year: value}}}}).
+            # Если переданы, коэффициенты рассчитываются по ним, а соответствующие числа событий и население
+            # не используются (могут быть пустыми).
+            historical_birth_rate_components: Optional[Dict[str, Dict]] = None,
+            historical_death_rate_components: Optional[Dict[str, Dict]] = None
     ):
         self.historical_birth_counts = historical_birth_counts
         self.historical_female_population = historical_female_population
@@ -56,6 +70,8 @@ class CoefficientProcessor:
         self.forecast_end_year = forecast_end_year
         self.all_ages_list = all_ages_list
         self.open_age_group = open_age_group
+        self.historical_birth_rate_components = historical_birth_rate_components
+        self.historical_death_rate_components = historical_death_rate_components
 
         self.historical_years = self._get_common_historical_years()
         if self.historical_years:
@@ -81,6 +97,15 @@ class CoefficientProcessor:
             for age_data in sex_data.values():
                 all_years.update(age_data.keys())
 
+        # Годы из знаменателей коэффициентов таблицы historical_rates
+        if self.historical_birth_rate_components:
+            for age_data in self.historical_birth_rate_components.get(RATE_COMPONENT_DENOMINATOR, {}).values():
+                all_years.update(age_data.keys())
+        if self.historical_death_rate_components:
+            for sex_data in self.historical_death_rate_components.get(RATE_COMPONENT_DENOMINATOR, {}).values():
+                for age_data in sex_data.values():
+                    all_years.update(age_data.keys())
+
         if not all_years:
             return []
 
@@ -207,40 +232,52 @@ class CoefficientProcessor:
         historical_asfr = defaultdict(dict)  # {mother_age: {year: rate}}
 
         # Сначала рассчитываем исторические ВКР (ASFR)
-        for mother_age, births_by_year in self.historical_birth_counts.items():
-            # Проверяем, что возраст матери попадает в фертильный диапазон и есть данные о женском населении
-            if FERTILE_AGE_START <= mother_age <= FERTILE_AGE_END or \
-                    mother_age == BIRTH_RATE_AGE_15_AND_YOUNGER_DB_KEY or \
-                    mother_age == BIRTH_RATE_AGE_55_AND_OLDER_DB_KEY:
-
-                female_pop_for_age_by_year = {}
-                if mother_age == BIRTH_RATE_AGE_15_AND_YOUNGER_DB_KEY:
-                    # Для "15 и младше" используем численность 15-летних женщин
-                    female_pop_for_age_by_year = self.historical_female_population.get(15, {})
-                elif mother_age == BIRTH_RATE_AGE_55_AND_OLDER_DB_KEY:
-
-                    # TODO: Улучшить расчет знаменателя для "55 и старше"
-                    pop_sum_for_55_plus = defaultdict(int)
-                    for age_f, pop_data_f_year in self.historical_female_population.items():
-                        if age_f >= BIRTH_RATE_AGE_55_AND_OLDER_DB_KEY:
-                            for year_f, pop_val_f in pop_data_f_year.items():
-                                pop_sum_for_55_plus[year_f] += pop_val_f
-                    female_pop_for_age_by_year = pop_sum_for_55_plus
-
-                else:  # Обычные фертильные возраста
-                    female_pop_for_age_by_year = self.historical_female_population.get(mother_age, {})
-
-                if female_pop_for_age_by_year:  # Если есть данные о женском населении для этого возраста
+        if self.historical_birth_rate_components is not None:
+            # Знаменатели для "15 и младше" и "55 и старше" уже собраны при заполнении historical_rates
+            female_pop_by_mother_age = self.historical_birth_rate_components.get(RATE_COMPONENT_DENOMINATOR, {})
+            for mother_age, births_by_year in self.historical_birth_rate_components.get(
+                    RATE_COMPONENT_NUMERATOR, {}).items():
+                if _is_birth_rate_age_key(mother_age):
                     rates = self._calculate_historical_age_specific_rates(
                         births_by_year,
-                        female_pop_for_age_by_year,
+                        female_pop_by_mother_age.get(mother_age, {}),
                         self.historical_years
                     )
                     if rates:
                         historical_asfr[mother_age] = rates
-                else:
-                    logger.warning(
-                        f"Нет данных о женском населении для возраста матери {mother_age} для расчета исторических ВКР.")
+        else:
+            for mother_age, births_by_year in self.historical_birth_counts.items():
+                # Проверяем, что возраст матери попадает в фертильный диапазон и есть данные о женском населении
+                if _is_birth_rate_age_key(mother_age):
+
+                    female_pop_for_age_by_year = {}
+                    if mother_age == BIRTH_RATE_AGE_15_AND_YOUNGER_DB_KEY:
+                        # Для "15 и младше" используем численность 15-летних женщин
+                        female_pop_for_age_by_year = self.historical_female_population.get(15, {})
+                    elif mother_age == BIRTH_RATE_AGE_55_AND_OLDER_DB_KEY:
+
+                        # TODO: Улучшить расчет знаменателя для "55 и старше"
+                        pop_sum_for_55_plus = defaultdict(int)
+                        for age_f, pop_data_f_year in self.historical_female_population.items():
+                            if age_f >= BIRTH_RATE_AGE_55_AND_OLDER_DB_KEY:
+                                for year_f, pop_val_f in pop_data_f_year.items():
+                                    pop_sum_for_55_plus[year_f] += pop_val_f
+                        female_pop_for_age_by_year = pop_sum_for_55_plus
+
+                    else:  # Обычные фертильные возраста
+                        female_pop_for_age_by_year = self.historical_female_population.get(mother_age, {})
+
+                    if female_pop_for_age_by_year:  # Если есть данные о женском населении для этого возраста
+                        rates = self._calculate_historical_age_specific_rates(
+                            births_by_year,
+                            female_pop_for_age_by_year,
+                            self.historical_years
+                        )
+                        if rates:
+                            historical_asfr[mother_age] = rates
+                    else:
+                        logger.warning(
+                            f"Нет данных о женском населении для возраста матери {mother_age} для расчета исторических ВКР.")
 
         if not historical_asfr:
             logger.error("Не удалось рассчитать ни одного исторического ВКР. Прогноз невозможен.")
@@ -266,8 +303,14 @@ class CoefficientProcessor:
             f"Расчет прогнозных коэффициентов смертности для пола {sex_code_to_process}. Сценарий: {scenario}, ручное изм %: {manual_annual_change_percent}")
         historical_asdr = defaultdict(dict)  # {age: {year: rate}}
 
-        death_counts_for_sex = self.historical_death_counts.get(sex_code_to_process, {})
-        population_for_sex = self.historical_population_for_deaths.get(sex_code_to_process, {})
+        if self.historical_death_rate_components is not None:
+            death_counts_for_sex = self.historical_death_rate_components.get(
+                RATE_COMPONENT_NUMERATOR, {}).get(sex_code_to_process, {})
+            population_for_sex = self.historical_death_rate_components.get(
+                RATE_COMPONENT_DENOMINATOR, {}).get(sex_code_to_process, {})
+        else:
+            death_counts_for_sex = self.historical_death_counts.get(sex_code_to_process, {})
+            population_for_sex = self.historical_population_for_deaths.get(sex_code_to_process, {})
 
         if not death_counts_for_sex or not population_for_sex:
             logger.warning(f"Нет исторических данных о смертях или населении для пола {sex_code_to_process}.")
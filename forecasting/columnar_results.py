@@ -0,0 +1,60 @@
+# forecasting/columnar_results.py
+
+from typing import Dict, List, Any, Optional, Iterable
+
+from . import result_store
+
+# Результат прогноза для JSON API (см. api_v1) в колоночном виде - без параметров отображения,
+# названий сценариев и HTML:
+#   {"format_version": 1, "output_detailed_by_age": bool, "warnings": [...],
+#    "groups": [{"title", "warnings", "years", "ages", "columns": {ключ данных: [значения]},
+#                "age_bands", "band_columns": {ключ данных: [значения]}}]}
+# Строки колонок - как в файле результатов (result_store.group_columns): годы, а при выводе по возрастам -
+# пары (год, возраст) построчно, т.е. значение для years[i], ages[j] - columns[key][i * len(ages) + j].
+# Ключ данных - тип поселения и пол (urban_male, total_total, ...), отсутствующее значение - null.
+# age_bands - названия именованных возрастных групп (target_age_bands) или null; значение группы
+# age_bands[j] в году years[i] - band_columns[key][i * len(age_bands) + j].
+COLUMNAR_RESULT_VERSION = 1
+
+
+def columnar_group(title: str, warnings: List[str], years: List[int], ages: Optional[List[str]],
+                   columns: Dict[str, List[Any]], age_bands: Optional[List[str]] = None,
+                   band_columns: Optional[Dict[str, List[Any]]] = None) -> Dict[str, Any]:
+    return {'title': title, 'warnings': warnings, 'years': years, 'ages': ages, 'columns': columns,
+            'age_bands': age_bands, 'band_columns': band_columns or {}}
+
+
+def _columnar_result(groups: List[Dict[str, Any]], output_detailed_by_age: bool,
+                     warnings: Iterable[str]) -> Dict[str, Any]:
+    return {
+        'format_version': COLUMNAR_RESULT_VERSION,
+        'output_detailed_by_age': output_detailed_by_age,
+        'warnings': sorted(set(warnings)),
+        'groups': groups,
+    }
+
+
+def build_columnar_result(grouped_forecasts_data: Iterable[Dict[str, Any]], output_detailed_by_age: bool,
+                          warnings: Iterable[str]) -> Dict[str, Any]:
+    """Из групп в структуре grouped_forecasts_data (результат задачи прогноза)."""
+    groups = []
+    for group_data in grouped_forecasts_data:
+        years, ages, columns = result_store.group_columns(group_data, output_detailed_by_age)
+        age_bands, band_columns = result_store.group_band_columns(group_data)
+        groups.append(columnar_group(group_data['title'], list(group_data.get('warnings', [])), years, ages, columns,
+                                     age_bands, band_columns))
+    return _columnar_result(groups, output_detailed_by_age, warnings)
+
+
+def columnar_result_from_reader(result_reader: result_store.ForecastResultReader,
+                                extra_warnings: Iterable[str] = ()) -> Dict[str, Any]:
+    """Из сохраненного файла результатов: колонки читаются напрямую, без сборки строк таблиц."""
+    groups = []
+    for group_number in result_reader.group_numbers:
+        group_entry = result_reader.groups_index[group_number]
+        years, ages, columns = result_reader.read_group_columns(group_number)
+        age_bands, band_columns = result_reader.read_group_band_columns(group_number)
+        groups.append(columnar_group(group_entry['title'], list(group_entry.get('warnings', [])),
+                                     years, ages, columns, age_bands, band_columns))
+    warnings = list(result_reader.meta.get('all_warnings', [])) + list(extra_warnings)
+    return _columnar_result(groups, bool(result_reader.meta.get('output_detailed_by_age_global', False)), warnings)
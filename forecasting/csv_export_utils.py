@@ -1,6 +1,6 @@
 import csv
 import logging
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterable, Iterator
 
 # Импортируем константы, если они нужны для логики формирования заголовков
 # Лучше, если бы они были в общем файле constants.py
@@ -13,6 +13,11 @@ SEX_CODE_FEMALE = "F"
 
 logger = logging.getLogger(__name__)
 
+# Потоковая выдача CSV (см. iter_forecast_csv_chunks): строки копятся в куске примерно такого размера (символов),
+# чтобы не отдавать серверу каждую строку отдельно
+CSV_STREAM_CHUNK_SIZE = 64 * 1024
+CSV_DELIMITER = ';'
+
 # Карта ключей параметров на человекочитаемые метки (может быть общей с Excel utils)
 PARAM_LABELS_MAP_FOR_EXPORT = {
     'region_names_display': "Изначально запрошенные регионы",
@@ -21,6 +26,7 @@ PARAM_LABELS_MAP_FOR_EXPORT = {
     'forecast_period_display': "Период прогноза",
     'historical_period_display': "Период ист. данных",
     'target_age_group_input_display': "Возрастная группа (исходно)",
+    'target_age_bands_display': "Возрастные группы",
     'output_detailed_by_age_display': "Детализация по возрастам (на момент запроса)",
     'birth_rate_scenario_name_display': "Сценарий рождаемости",
     'death_rate_scenario_male_name_display': "Сценарий смертности (М)",
@@ -30,11 +36,46 @@ PARAM_LABELS_MAP_FOR_EXPORT = {
 }
 
 
+# (ключ данных, заголовок колонки) в порядке колонок таблицы
+_DATA_COLUMNS = (
+    (ID_SETTLEMENT_URBAN, SEX_CODE_MALE, 'urban_male', 'Городское (М)'),
+    (ID_SETTLEMENT_URBAN, SEX_CODE_FEMALE, 'urban_female', 'Городское (Ж)'),
+    (ID_SETTLEMENT_URBAN, SEX_CODE_TOTAL, 'urban_total', 'Городское (Всего)'),
+    (ID_SETTLEMENT_RURAL, SEX_CODE_MALE, 'rural_male', 'Сельское (М)'),
+    (ID_SETTLEMENT_RURAL, SEX_CODE_FEMALE, 'rural_female', 'Сельское (Ж)'),
+    (ID_SETTLEMENT_RURAL, SEX_CODE_TOTAL, 'rural_total', 'Сельское (Всего)'),
+)
+
+
+def _iter_age_band_rows(group_data: Dict, user_selected_settlement_id: int,
+                        user_selected_sex_code: str) -> Iterator[List[Any]]:
+    """Таблица именованных возрастных групп (target_age_bands) группы регионов, если они есть."""
+    if not any(year_item.get('band_rows') for year_item in group_data['data_by_year']):
+        return
+    data_columns = [(data_key, header) for settlement_id, sex_code, data_key, header in _DATA_COLUMNS
+                    if user_selected_settlement_id in (ID_SETTLEMENT_TOTAL, settlement_id)
+                    and user_selected_sex_code in (SEX_CODE_TOTAL, sex_code)]
+    yield []
+    yield ["Возрастные группы"]
+    yield ['Год', 'Возрастная группа'] + [header for _, header in data_columns]
+    for year_item in group_data['data_by_year']:
+        for band_row_idx, band_row in enumerate(year_item.get('band_rows', [])):
+            yield [year_item['year'] if band_row_idx == 0 else '', band_row['band_name']] + \
+                  [band_row.get(data_key, '-') for data_key, _ in data_columns]
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: write() возвращает строку вместо записи, чтобы ее можно было отдать в генераторе."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
 def write_forecast_data_to_csv(
         writer: csv.writer,  # Объект csv.writer
         params_display_overall: Dict,
         all_warnings: List[str],
-        grouped_forecasts_data: List[Dict],
+        grouped_forecasts_data: Iterable[Dict],
         # Параметры, влияющие на структуру таблицы:
         output_detailed_by_age_global: bool,
         user_selected_settlement_id: int,
@@ -43,10 +84,56 @@ def write_forecast_data_to_csv(
     """
     Записывает данные прогноза в предоставленный csv.writer.
     """
+    writer.writerows(iter_forecast_csv_rows(
+        params_display_overall, all_warnings, grouped_forecasts_data,
+        output_detailed_by_age_global, user_selected_settlement_id, user_selected_sex_code))
+
+
+def iter_forecast_csv_chunks(
+        params_display_overall: Dict,
+        all_warnings: List[str],
+        grouped_forecasts_data: Iterable[Dict],
+        output_detailed_by_age_global: bool,
+        user_selected_settlement_id: int,
+        user_selected_sex_code: str
+) -> Iterator[str]:
+    """
+    CSV-файл прогноза кусками текста (для StreamingHttpResponse), начиная с BOM.
+    Группы читаются из grouped_forecasts_data по мере записи, поэтому в памяти одновременно
+    находятся только текущая группа и один кусок текста.
+    """
+    pseudo_writer = csv.writer(Echo(), delimiter=CSV_DELIMITER)
+    chunk_lines = [u'\ufeff']  # BOM для Excel, чтобы кириллица отображалась корректно
+    chunk_size = 0
+    for row_values in iter_forecast_csv_rows(
+            params_display_overall, all_warnings, grouped_forecasts_data,
+            output_detailed_by_age_global, user_selected_settlement_id, user_selected_sex_code):
+        line = pseudo_writer.writerow(row_values)
+        chunk_lines.append(line)
+        chunk_size += len(line)
+        if chunk_size >= CSV_STREAM_CHUNK_SIZE:
+            yield ''.join(chunk_lines)
+            chunk_lines = []
+            chunk_size = 0
+    if chunk_lines:
+        yield ''.join(chunk_lines)
+
+
+def iter_forecast_csv_rows(
+        params_display_overall: Dict,
+        all_warnings: List[str],
+        grouped_forecasts_data: Iterable[Dict],
+        output_detailed_by_age_global: bool,
+        user_selected_settlement_id: int,
+        user_selected_sex_code: str
+) -> Iterator[List[Any]]:
+    """
+    Строки CSV-файла прогноза (списки значений ячеек) по одной.
+    """
 
     # --- Секция 1: Параметры и Предупреждения ---
-    writer.writerow(["Общие параметры исходного запроса"])
-    writer.writerow([])  # Пустая строка для разделения
+    yield ["Общие параметры исходного запроса"]
+    yield []  # Пустая строка для разделения
 
     display_values_for_params = params_display_overall.copy()
     # Подготовка отображаемых значений (копипаста из excel_export_utils, лучше унифицировать)
@@ -70,19 +157,19 @@ def write_forecast_data_to_csv(
 
         if value_to_write is not None:
             if isinstance(value_to_write, list): value_to_write = ", ".join(map(str, value_to_write))
-            writer.writerow([label, str(value_to_write)])
+            yield [label, str(value_to_write)]
 
-    writer.writerow([])  # Пустая строка
+    yield []  # Пустая строка
     if all_warnings:
-        writer.writerow(["Предупреждения и примечания"])
+        yield ["Предупреждения и примечания"]
         for warning in all_warnings:
-            writer.writerow([warning])
-        writer.writerow([])
+            yield [warning]
+        yield []
 
     # --- Секция 2: Данные по группам регионов ---
     for group_data in grouped_forecasts_data:
-        writer.writerow([])  # Пустая строка перед новой группой
-        writer.writerow([f"Результаты для: {group_data['title']}"])
+        yield []  # Пустая строка перед новой группой
+        yield [f"Результаты для: {group_data['title']}"]
 
         # Формирование заголовков таблицы (аналогично Excel)
         header_cols = ['Год']
@@ -108,7 +195,7 @@ def write_forecast_data_to_csv(
             if user_selected_sex_code == SEX_CODE_TOTAL: rural_subheaders.append('Сельское (Всего)')
             if rural_subheaders: header_cols.extend(rural_subheaders)
 
-        writer.writerow(header_cols)
+        yield header_cols
 
         # Данные
         for year_item in group_data['data_by_year']:
@@ -131,7 +218,7 @@ def write_forecast_data_to_csv(
                         if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_FEMALE: row_values.append(
                             age_row.get('rural_female', '-'))
                         if user_selected_sex_code == SEX_CODE_TOTAL: row_values.append(age_row.get('rural_total', '-'))
-                    writer.writerow(row_values)
+                    yield row_values
             else:  # Недетализированный по возрастам
                 row_values = [year_item['year']]
                 # Городские данные
@@ -148,4 +235,6 @@ def write_forecast_data_to_csv(
                     if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_FEMALE: row_values.append(
                         year_item.get('rural_female', '-'))
                     if user_selected_sex_code == SEX_CODE_TOTAL: row_values.append(year_item.get('rural_total', '-'))
-                writer.writerow(row_values)
+                yield row_values
+
+        yield from _iter_age_band_rows(group_data, user_selected_settlement_id, user_selected_sex_code)
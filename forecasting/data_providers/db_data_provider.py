@@ -2,7 +2,7 @@ import logging
 from typing import List, Dict, Any, Optional, Union, Tuple  # <--- ДОБАВЛЕН Tuple
 
 
-from data_collector.db_connector import DBConnector
+from data_collector.db_connector import DBConnector, get_shared_connector
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +15,28 @@ SEX_TOTAL_CODE = 'A'
 SEX_MALE_CODE = 'M'
 SEX_FEMALE_CODE = 'F'
 
+# --- Ключи набора исходных данных одного региона (см. get_historical_datasets_by_region) ---
+DATASET_INITIAL_POPULATION = 'initial_population'  # {age: {sex: population}}
+DATASET_POPULATION_FOR_DEATHS = 'population_for_deaths'  # {sex: {age: {year: population}}}
+DATASET_FEMALE_POPULATION_FOR_BIRTHS = 'female_population_for_births'  # {age: {year: population}}
+DATASET_DEATH_COUNTS = 'death_counts'  # {sex: {age: {year: deaths}}}
+DATASET_BIRTH_COUNTS = 'birth_counts'  # {mother_age: {year: births}}
+DATASET_MIGRATION_SALDO = 'migration_saldo'  # {sex: {(age_start, age_end): {year: saldo}}}
+# Наборы, загруженные из таблицы historical_rates (use_rates_table=True), вместо многолетнего населения,
+# смертей и рождений содержат числители и знаменатели исторических коэффициентов:
+#   {RATE_COMPONENT_NUMERATOR: {...: {year: число}}, RATE_COMPONENT_DENOMINATOR: {...: {year: число}}}
+# Числители и знаменатели группы регионов складываются (sum_region_datasets), поэтому коэффициент
+# группы пересчитывается точно, как при расчете из сумм событий и населения.
+DATASET_BIRTH_RATE_COMPONENTS = 'birth_rate_components'  # ключи внутри - mother_age
+DATASET_DEATH_RATE_COMPONENTS = 'death_rate_components'  # ключи внутри - sex, age
+RATE_COMPONENT_NUMERATOR = 'numerator'
+RATE_COMPONENT_DENOMINATOR = 'denominator'
+
+# --- Таблица исторических коэффициентов (заполняется командой build_historical_rates) ---
+HISTORICAL_RATES_TABLE = 'historical_rates'
+RATE_TYPE_BIRTH = 'B'  # sex = 'F', знаменатель - женщины того же возраста (для 55 - 55 лет и старше)
+RATE_TYPE_DEATH = 'D'
+
 
 # --------------------------------------------------------------------
 
@@ -23,8 +45,9 @@ class DBDataProvider:
     Предоставляет методы для загрузки демографических данных из базы данных.
     """
 
-    def __init__(self):
-        self.db_connector = DBConnector()
+    def __init__(self, db_connector: Optional[DBConnector] = None):
+        # По умолчанию используется общее соединение процесса, а не новое на каждый прогноз
+        self.db_connector = db_connector or get_shared_connector()
 
     def _execute_query(self, query: str, params: Optional[tuple] = None) -> List[Dict[str, Any]]:
         """
@@ -272,6 +295,201 @@ class DBDataProvider:
             migration_data[sex][age_key][year] = saldo
         return migration_data
 
+    def get_historical_datasets_by_region(
+            self,
+            start_year: int,
+            end_year: int,
+            initial_population_year: int,
+            region_ids: List[int],
+            settlement_type_id: int,
+            include_migration: bool = False,
+            use_rates_table: bool = False
+    ) -> Dict[int, Dict[str, Any]]:  # {region_id: {DATASET_*: ...}}
+        """
+        Загружает исторические данные сразу для всех переданных регионов одним запросом на таблицу
+        (с группировкой по reg) и раскладывает их по регионам.
+        Структуры внутри набора совпадают с результатами get_initial_population,
+        get_historical_population_for_death_rates и т.д. (при sex_code = SEX_TOTAL_CODE),
+        поэтому сумму по группе регионов можно получить в памяти через sum_region_datasets.
+        use_rates_table=True - исторические коэффициенты берутся из таблицы historical_rates
+        (DATASET_*_RATE_COMPONENTS), население загружается только за initial_population_year,
+        смерти и рождения не запрашиваются.
+        """
+        datasets: Dict[int, Dict[str, Any]] = {region_id: _empty_region_dataset(use_rates_table)
+                                               for region_id in region_ids}
+        if not region_ids:
+            return datasets
+
+        placeholders_region = ', '.join(['%s'] * len(region_ids))
+        if use_rates_table:
+            pop_start_year = pop_end_year = initial_population_year
+        else:
+            pop_start_year = min(start_year, initial_population_year)
+            pop_end_year = max(end_year, initial_population_year)
+
+        # 1. Население: одним запросом покрывает исходное население, знаменатели смертности и рождаемости
+        #    (при use_rates_table знаменатели уже есть в historical_rates, нужно только исходное население)
+        query = f"""
+            SELECT reg, year, sex, age, SUM(population) as total_population
+            FROM population
+            WHERE year BETWEEN %s AND %s
+              AND reg IN ({placeholders_region})
+              AND settlement_type_id = %s
+            GROUP BY reg, year, sex, age;
+        """
+        params = tuple([pop_start_year, pop_end_year] + region_ids + [settlement_type_id])
+        logger.debug(f"Запрос get_historical_datasets_by_region (population): {query} с параметрами {params}")
+        for row in self._execute_query(query, params):
+            dataset = datasets.get(int(row['reg']))
+            if dataset is None:
+                continue
+            year = int(row['year'])
+            sex = row['sex']
+            age = int(row['age'])
+            pop = int(row['total_population'])
+
+            if year == initial_population_year:
+                age_entry = dataset[DATASET_INITIAL_POPULATION].setdefault(age, {})
+                age_entry[sex] = age_entry.get(sex, 0) + pop
+            if not use_rates_table and start_year <= year <= end_year:
+                dataset[DATASET_POPULATION_FOR_DEATHS].setdefault(sex, {}).setdefault(age, {})[year] = pop
+                if sex == SEX_FEMALE_CODE:
+                    dataset[DATASET_FEMALE_POPULATION_FOR_BIRTHS].setdefault(age, {})[year] = pop
+
+        params = tuple([start_year, end_year] + region_ids + [settlement_type_id])
+        if use_rates_table:
+            # 2-3. Числители и знаменатели коэффициентов смертности и рождаемости
+            self._load_rate_components_by_region(datasets, params, placeholders_region)
+        else:
+            self._load_event_counts_by_region(datasets, params, placeholders_region)
+
+        # 4. Миграция (только если она нужна прогнозу)
+        if include_migration:
+            query = f"""
+                SELECT region_id, year, sex, age_group_start, age_group_end, SUM(migration_saldo) as total_saldo
+                FROM migration_saldo
+                WHERE year BETWEEN %s AND %s
+                  AND region_id IN ({placeholders_region})
+                  AND settlement_type_id = %s
+                GROUP BY region_id, year, sex, age_group_start, age_group_end;
+            """
+            logger.debug(f"Запрос get_historical_datasets_by_region (migration_saldo): {query} с параметрами {params}")
+            for row in self._execute_query(query, params):
+                dataset = datasets.get(int(row['region_id']))
+                if dataset is None:
+                    continue
+                age_start = int(row['age_group_start'])
+                age_end = int(row['age_group_end']) if row['age_group_end'] is not None else age_start
+                saldo_by_year = dataset[DATASET_MIGRATION_SALDO].setdefault(row['sex'], {}).setdefault(
+                    (age_start, age_end), {})
+                year = int(row['year'])
+                saldo_by_year[year] = saldo_by_year.get(year, 0) + int(row['total_saldo'])
+
+        return datasets
+
+    def _load_event_counts_by_region(self, datasets: Dict[int, Dict[str, Any]], params: tuple,
+                                     placeholders_region: str) -> None:
+        # 2. Смерти
+        query = f"""
+            SELECT reg, year, sex, age, SUM(death_rate) as total_deaths
+            FROM death_rate
+            WHERE year BETWEEN %s AND %s
+              AND reg IN ({placeholders_region})
+              AND settlement_type_id = %s
+            GROUP BY reg, year, sex, age;
+        """
+        logger.debug(f"Запрос get_historical_datasets_by_region (death_rate): {query} с параметрами {params}")
+        for row in self._execute_query(query, params):
+            dataset = datasets.get(int(row['reg']))
+            if dataset is None:
+                continue
+            dataset[DATASET_DEATH_COUNTS].setdefault(row['sex'], {}).setdefault(int(row['age']), {})[
+                int(row['year'])] = float(row['total_deaths'])
+
+        # 3. Рождения
+        query = f"""
+            SELECT reg, year, age as mother_age, SUM(birth_rate) as total_births
+            FROM birth_rate
+            WHERE year BETWEEN %s AND %s
+              AND reg IN ({placeholders_region})
+              AND settlement_type_id = %s
+            GROUP BY reg, year, mother_age;
+        """
+        logger.debug(f"Запрос get_historical_datasets_by_region (birth_rate): {query} с параметрами {params}")
+        for row in self._execute_query(query, params):
+            dataset = datasets.get(int(row['reg']))
+            if dataset is None:
+                continue
+            dataset[DATASET_BIRTH_COUNTS].setdefault(int(row['mother_age']), {})[int(row['year'])] = float(
+                row['total_births'])
+
+    def _load_rate_components_by_region(self, datasets: Dict[int, Dict[str, Any]], params: tuple,
+                                        placeholders_region: str) -> None:
+        query = f"""
+            SELECT reg, rate_type, year, sex, age, numerator, denominator
+            FROM {HISTORICAL_RATES_TABLE}
+            WHERE year BETWEEN %s AND %s
+              AND reg IN ({placeholders_region})
+              AND settlement_type_id = %s;
+        """
+        logger.debug(f"Запрос get_historical_datasets_by_region ({HISTORICAL_RATES_TABLE}): {query} с параметрами {params}")
+        for row in self._execute_query(query, params):
+            dataset = datasets.get(int(row['reg']))
+            if dataset is None:
+                continue
+            year = int(row['year'])
+            age = int(row['age'])
+            # Числитель NULL - событий в ячейке нет: знаменатель все равно входит в сумму группы регионов,
+            # а возраст и год пропускаются, только если числителя нет ни в одном регионе (как counts_data)
+            if row['rate_type'] == RATE_TYPE_BIRTH:
+                components = dataset[DATASET_BIRTH_RATE_COMPONENTS]
+                if row['numerator'] is not None:
+                    components[RATE_COMPONENT_NUMERATOR].setdefault(age, {})[year] = float(row['numerator'])
+                components[RATE_COMPONENT_DENOMINATOR].setdefault(age, {})[year] = float(row['denominator'])
+            elif row['rate_type'] == RATE_TYPE_DEATH:
+                components = dataset[DATASET_DEATH_RATE_COMPONENTS]
+                if row['numerator'] is not None:
+                    components[RATE_COMPONENT_NUMERATOR].setdefault(row['sex'], {}).setdefault(age, {})[year] = \
+                        float(row['numerator'])
+                components[RATE_COMPONENT_DENOMINATOR].setdefault(row['sex'], {}).setdefault(age, {})[year] = float(
+                    row['denominator'])
+
+
+def _empty_region_dataset(with_rate_components: bool = False) -> Dict[str, Any]:
+    dataset = {
+        DATASET_INITIAL_POPULATION: {},
+        DATASET_POPULATION_FOR_DEATHS: {},
+        DATASET_FEMALE_POPULATION_FOR_BIRTHS: {},
+        DATASET_DEATH_COUNTS: {},
+        DATASET_BIRTH_COUNTS: {},
+        DATASET_MIGRATION_SALDO: {},
+    }
+    if with_rate_components:
+        for dataset_key in (DATASET_BIRTH_RATE_COMPONENTS, DATASET_DEATH_RATE_COMPONENTS):
+            dataset[dataset_key] = {RATE_COMPONENT_NUMERATOR: {}, RATE_COMPONENT_DENOMINATOR: {}}
+    return dataset
+
+
+def _add_nested_values(target: Dict, source: Dict) -> None:
+    """Рекурсивно складывает числовые листья source в target (структуры вида {k: {k: {k: number}}})."""
+    for key, value in source.items():
+        if isinstance(value, dict):
+            _add_nested_values(target.setdefault(key, {}), value)
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+def sum_region_datasets(datasets: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Суммирует наборы данных нескольких регионов в памяти.
+    Эквивалентно запросам с SUM(...) и reg IN (...) по тем же регионам.
+    """
+    combined = _empty_region_dataset()
+    for dataset in datasets:
+        for dataset_key, values in dataset.items():
+            _add_nested_values(combined.setdefault(dataset_key, {}), values)
+    return combined
+
 
 if __name__ == '__main__':
     provider = DBDataProvider()
@@ -0,0 +1,104 @@
+# forecasting/default_forecasts.py
+
+import logging
+import time
+from typing import Dict, List, Any, Optional, Set
+
+from django.conf import settings
+
+from data_collector import region_registry
+from . import forecast_params, shared_results
+from .tasks import (DEFAULT_HISTORICAL_START_YEAR, DEFAULT_HISTORICAL_END_YEAR, DEFAULT_FORECAST_END_YEAR,
+                    ID_SETTLEMENT_TOTAL, ID_SETTLEMENT_URBAN, ID_SETTLEMENT_RURAL, SEX_CODE_TOTAL, SCENARIO_LAST_YEAR,
+                    _prepare_display_params_for_task, store_precomputed_forecasts)
+
+logger = logging.getLogger(__name__)
+
+# Предварительный расчет самых частых запросов - прогноза с параметрами формы по умолчанию для одного региона
+# карты - для всех регионов и типов поселений. Результаты сохраняются в общие файлы результатов
+# (shared_results) под тем же хешем входных параметров, что и у запроса из формы, поэтому ForecastView.post
+# отдает их как уже рассчитанные, без задачи Celery. Хеш включает версию данных: после загрузки новых
+# данных прежние результаты перестают совпадать с запросами, и следующий запуск рассчитывает их заново.
+# Запускается командой precompute_default_forecasts или задачей precompute_default_forecasts_task (Celery beat).
+DEFAULT_FORECAST_SETTLEMENT_TYPE_IDS = (ID_SETTLEMENT_TOTAL, ID_SETTLEMENT_URBAN, ID_SETTLEMENT_RURAL)
+DEFAULT_FORECAST_MAP_CODE_PREFIX = 'RU-'
+
+# Поля формы forecasting_parameters.html в состоянии по умолчанию (без региона и типа поселения)
+DEFAULT_FORECAST_FORM_DATA = {
+    'sex_code_target': SEX_CODE_TOTAL,
+    'historical_data_start_year': str(DEFAULT_HISTORICAL_START_YEAR),
+    'historical_data_end_year': str(DEFAULT_HISTORICAL_END_YEAR),
+    'forecast_start_year': str(DEFAULT_HISTORICAL_END_YEAR + 1),
+    'forecast_end_year': str(DEFAULT_FORECAST_END_YEAR),
+    'target_age_group_type': 'all_ages',
+    'birth_rate_scenario': SCENARIO_LAST_YEAR,
+    'death_rate_scenario_male': SCENARIO_LAST_YEAR,
+    'death_rate_scenario_female': SCENARIO_LAST_YEAR,
+    'migration_scenario': SCENARIO_LAST_YEAR,
+}
+
+
+def default_forecast_form_data(map_code: str, settlement_type_id: int) -> Dict[str, str]:
+    return dict(DEFAULT_FORECAST_FORM_DATA, region_ids=map_code, settlement_type_id=str(settlement_type_id))
+
+
+def build_default_forecast_plans(map_codes: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Планы расчета (forecast_params.build_forecast_plan + 'input_hash') для регионов x типов поселений."""
+    if map_codes is None:
+        map_codes = list(region_registry.get_map_code_to_region_id_map(
+            map_code_prefix=DEFAULT_FORECAST_MAP_CODE_PREFIX))
+
+    forecast_plans = []
+    for map_code in map_codes:
+        for settlement_type_id in DEFAULT_FORECAST_SETTLEMENT_TYPE_IDS:
+            form_warnings: List[str] = []
+            forecast_plan = forecast_params.build_forecast_plan(
+                default_forecast_form_data(map_code, settlement_type_id), form_warnings,
+                display_params_func=_prepare_display_params_for_task)
+            if form_warnings:
+                # Неизвестный код региона: план построен для РФ, такой результат рассчитывается отдельно
+                logger.warning(f"Default forecast for {map_code} skipped: {'; '.join(form_warnings)}")
+                continue
+            forecast_plan['form_warnings'] = form_warnings
+            forecast_plan['input_hash'] = shared_results.compute_input_hash(
+                forecast_plan['base_forecast_params_no_combination_specifics'],
+                forecast_plan['initial_processed_region_db_ids'],
+                forecast_plan['user_selected_settlement_id'], forecast_plan['user_selected_sex_code'])
+            forecast_plans.append(forecast_plan)
+    return forecast_plans
+
+
+def default_forecast_input_hashes() -> Set[str]:
+    """Хеши прогнозов по умолчанию для текущей версии данных (их файлы результатов не удаляются при очистке)."""
+    return {forecast_plan['input_hash'] for forecast_plan in build_default_forecast_plans()}
+
+
+def precompute_default_forecasts(map_codes: Optional[List[str]] = None, force: bool = False,
+                                 batch_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Рассчитывает и сохраняет прогнозы по умолчанию, которых еще нет в общих файлах результатов
+    (force=True - все заново). Запросы считаются пакетами по batch_size с общей загрузкой исходных данных.
+    Возвращает статистику расчета, включая пропускную способность.
+    """
+    batch_size = batch_size or getattr(settings, 'FORECAST_PRECOMPUTE_BATCH_SIZE', 20)
+    started_at = time.monotonic()
+
+    forecast_plans = build_default_forecast_plans(map_codes)
+    pending_plans = [forecast_plan for forecast_plan in forecast_plans
+                     if force or shared_results.find_artifact(forecast_plan['input_hash']) is None]
+
+    stats = {'plans': len(forecast_plans), 'already_stored': len(forecast_plans) - len(pending_plans),
+             'stored': 0, 'failed': 0, 'configurations': 0}
+    for batch_start in range(0, len(pending_plans), batch_size):
+        batch_stats = store_precomputed_forecasts(pending_plans[batch_start:batch_start + batch_size])
+        for stats_key, value in batch_stats.items():
+            stats[stats_key] += value
+        logger.info(f"Default forecasts: {min(batch_start + batch_size, len(pending_plans))} "
+                    f"of {len(pending_plans)} processed.")
+
+    elapsed_seconds = time.monotonic() - started_at
+    stats['elapsed_seconds'] = round(elapsed_seconds, 3)
+    stats['forecasts_per_second'] = round(stats['stored'] / elapsed_seconds, 2) if elapsed_seconds > 0 else 0.0
+    stats['configurations_per_second'] = round(stats['configurations'] / elapsed_seconds, 2) \
+        if elapsed_seconds > 0 else 0.0
+    return stats
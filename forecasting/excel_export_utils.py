@@ -1,9 +1,9 @@
 import logging
-from io import BytesIO
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment
 from openpyxl.utils import get_column_letter
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Tuple, IO, Union
 
 # Константы (лучше вынести в отдельный файл constants.py и импортировать оттуда)
 ID_SETTLEMENT_TOTAL = 1
@@ -15,21 +15,105 @@ SEX_CODE_FEMALE = "F"
 
 logger = logging.getLogger(__name__)
 
-
-def generate_forecast_excel_workbook(
+# Книга формируется в режиме write_only: строки листа пишутся в файл по мере добавления и в памяти
+# не хранятся. Поэтому ширины колонок, объединения ячеек и высоты строк задаются до записи строк
+# (ширины колонок листа группы считаются отдельным проходом по данным группы), а стили - через WriteOnlyCell.
+MIN_DATA_COLUMN_WIDTH = 10
+MAX_DATA_COLUMN_WIDTH = 50
+
+# Строки листа группы: заголовок группы, пустая строка, заголовки типов поселения, заголовки пола, данные
+GROUP_TITLE_ROW = 1
+DATA_HEADER_ROW = GROUP_TITLE_ROW + 2
+SUB_HEADER_ROW = DATA_HEADER_ROW + 1
+
+# (ключ данных, подзаголовок) для каждого типа поселения; порядок колонок - как в таблице результатов
+_SETTLEMENT_COLUMN_GROUPS = (
+    (ID_SETTLEMENT_URBAN, 'Городское население', 'urban'),
+    (ID_SETTLEMENT_RURAL, 'Сельское население', 'rural'),
+)
+_SEX_COLUMNS = (
+    (SEX_CODE_MALE, 'Мужчины', 'male'),
+    (SEX_CODE_FEMALE, 'Женщины', 'female'),
+    (SEX_CODE_TOTAL, 'Всего', 'total'),
+)
+
+
+def _data_column_groups(user_selected_settlement_id: int, user_selected_sex_code: str) -> List[Tuple[str, List[Tuple[str, str]]]]:
+    """[(заголовок типа поселения, [(ключ данных, подзаголовок пола), ...]), ...] для выбранных типа поселения и пола."""
+    column_groups = []
+    for settlement_id, settlement_header, data_key_prefix in _SETTLEMENT_COLUMN_GROUPS:
+        if user_selected_settlement_id not in (ID_SETTLEMENT_TOTAL, settlement_id):
+            continue
+        sex_columns = [(f"{data_key_prefix}_{data_key_suffix}", sex_header)
+                       for sex_code, sex_header, data_key_suffix in _SEX_COLUMNS
+                       if user_selected_sex_code in (SEX_CODE_TOTAL, sex_code)]
+        if sex_columns:
+            column_groups.append((settlement_header, sex_columns))
+    return column_groups
+
+
+def _styled_cell(ws, value: Any, font: Optional[Font] = None, alignment: Optional[Alignment] = None) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=value)
+    if font is not None:
+        cell.font = font
+    if alignment is not None:
+        cell.alignment = alignment
+    return cell
+
+
+def _iter_group_data_rows(group_data: Dict, output_detailed_by_age_global: bool,
+                          data_keys: List[str]) -> Iterator[List[Any]]:
+    """Строки данных листа группы (значения ячеек)."""
+    for year_item in group_data['data_by_year']:
+        year_val = year_item['year']
+        if output_detailed_by_age_global:
+            # Если нет детализации по возрасту для этого года, год пропускается
+            for age_row_idx, age_row_data in enumerate(year_item.get('age_rows', [])):
+                # Год - только для первой возрастной строки
+                row_values = [year_val if age_row_idx == 0 else "", age_row_data.get('age_display', '-')]
+                row_values.extend(age_row_data.get(data_key, '-') for data_key in data_keys)
+                yield row_values
+        else:  # Недетализированный по возрастам
+            yield [year_val] + [year_item.get(data_key, '-') for data_key in data_keys]
+
+
+def _iter_group_band_rows(group_data: Dict, data_keys: List[str]) -> Iterator[List[Any]]:
+    """Строки таблицы именованных возрастных групп (target_age_bands) листа группы."""
+    for year_item in group_data['data_by_year']:
+        for band_row_idx, band_row in enumerate(year_item.get('band_rows', [])):
+            yield [year_item['year'] if band_row_idx == 0 else "", band_row['band_name']] + \
+                  [band_row.get(data_key, '-') for data_key in data_keys]
+
+
+def _unique_sheet_title(wb: Workbook, group_title: str, group_idx: int) -> str:
+    clean_title = group_title.replace('[', '').replace(']', '').replace('*', '').replace(':', '').replace(
+        '?', '').replace('/', '-').replace('\\', '-')
+    sheet_title_base = f"Прогноз_{clean_title}"[:25]  # Оставляем место для индекса, если что
+
+    sheet_title = sheet_title_base
+    title_suffix_idx = 1
+    while sheet_title in wb.sheetnames:
+        sheet_title = f"{sheet_title_base}_{title_suffix_idx}"[:30]  # Excel limit ~31 chars
+        title_suffix_idx += 1
+        if title_suffix_idx > 10:  # Fallback
+            sheet_title = f"DataSheet_{group_idx}_{title_suffix_idx}"[:30]
+    return sheet_title
+
+
+def save_forecast_excel_workbook(
+        output_file: Union[str, IO[bytes]],
         params_display_overall: Dict,
         all_warnings: List[str],
-        grouped_forecasts_data: List[Dict],
+        grouped_forecasts_data: Iterable[Dict],
         output_detailed_by_age_global: bool,
         user_selected_settlement_id: int,
         user_selected_sex_code: str
-) -> Workbook:
+) -> None:
     """
-    Генерирует Excel книгу (Workbook) с данными прогноза.
+    Формирует Excel книгу с данными прогноза и записывает ее в output_file (путь или бинарный файл).
+    Группы читаются из grouped_forecasts_data по одной.
     """
-    wb = Workbook()
-    if "Sheet" in wb.sheetnames:
-        wb.remove(wb["Sheet"])
+    wb = Workbook(write_only=True)
 
     # --- Стили ---
     bold_font_main_header = Font(bold=True, size=14)
@@ -40,11 +124,13 @@ def generate_forecast_excel_workbook(
 
     # --- ЛИСТ 1: Параметры и Предупреждения ---
     ws_params = wb.create_sheet(title="Параметры_и_Предупреждения")
+    ws_params.column_dimensions[get_column_letter(1)].width = 45
+    ws_params.column_dimensions[get_column_letter(2)].width = 65
     current_row = 1
 
-    param_title_cell = ws_params.cell(row=current_row, column=1, value="Общие параметры исходного запроса")
-    param_title_cell.font = bold_font_main_header
-    ws_params.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=2)
+    ws_params.append([_styled_cell(ws_params, "Общие параметры исходного запроса", font=bold_font_main_header)])
+    ws_params.merged_cells.add(f"A{current_row}:B{current_row}")
+    ws_params.append([])
     current_row += 2
 
     param_labels_map = {
@@ -54,6 +140,7 @@ def generate_forecast_excel_workbook(
         'forecast_period_display': "Период прогноза",
         'historical_period_display': "Период ист. данных",
         'target_age_group_input_display': "Возрастная группа (исходно)",
+        'target_age_bands_display': "Возрастные группы",
         'output_detailed_by_age_display': "Детализация по возрастам (на момент запроса)",
         'birth_rate_scenario_name_display': "Сценарий рождаемости",
         'death_rate_scenario_male_name_display': "Сценарий смертности (М)",
@@ -81,244 +168,104 @@ def generate_forecast_excel_workbook(
             continue
         if value_to_write is not None:
             if isinstance(value_to_write, list): value_to_write = ", ".join(map(str, value_to_write))
-            ws_params.cell(row=current_row, column=1, value=label).font = param_label_font
-            ws_params.cell(row=current_row, column=2, value=str(value_to_write))
+            ws_params.append([_styled_cell(ws_params, label, font=param_label_font), str(value_to_write)])
             current_row += 1
 
-    ws_params.column_dimensions[get_column_letter(1)].width = 45
-    ws_params.column_dimensions[get_column_letter(2)].width = 65
-
+    ws_params.append([])
     current_row += 1
     if all_warnings:
-        warning_header_cell = ws_params.cell(row=current_row, column=1, value="Предупреждения и примечания")
-        warning_header_cell.font = bold_font_subheader
-        ws_params.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=3)
+        ws_params.append([_styled_cell(ws_params, "Предупреждения и примечания", font=bold_font_subheader)])
+        ws_params.merged_cells.add(f"A{current_row}:C{current_row}")
         current_row += 1
-        for warning_idx, warning in enumerate(all_warnings):
-            cell = ws_params.cell(row=current_row + warning_idx, column=1, value=warning)
-            cell.alignment = wrap_text_alignment
-            ws_params.merge_cells(start_row=current_row + warning_idx, start_column=1,
-                                  end_row=current_row + warning_idx, end_column=3)  # Объединяем на 3 колонки
-            ws_params.row_dimensions[current_row + warning_idx].height = (
-                                                                                     len(warning) // 80 + 1) * 15  # Примерный автоподбор высоты
-        current_row += len(all_warnings)
+        for warning in all_warnings:
+            ws_params.row_dimensions[current_row].height = (len(warning) // 80 + 1) * 15  # Примерный автоподбор высоты
+            ws_params.append([_styled_cell(ws_params, warning, alignment=wrap_text_alignment)])
+            ws_params.merged_cells.add(f"A{current_row}:C{current_row}")  # Объединяем на 3 колонки
+            current_row += 1
 
     # --- ЛИСТЫ ДЛЯ КАЖДОЙ ГРУППЫ РЕГИОНОВ ---
+    column_groups = _data_column_groups(user_selected_settlement_id, user_selected_sex_code)
+    data_keys = [data_key for _, sex_columns in column_groups for data_key, _ in sex_columns]
+
+    # Основные столбцы (Год, Возраст)
+    main_data_cols = ['Год']
+    if output_detailed_by_age_global:
+        main_data_cols.append('Возраст')
+    total_data_cols = len(main_data_cols) + len(data_keys)
+
+    # Строки заголовков данных: "Год"/"Возраст" объединяются по вертикали,
+    # заголовок типа поселения - по горизонтали над колонками пола
+    data_header_values: List[Optional[str]] = list(main_data_cols)
+    sub_header_values: List[Optional[str]] = [None] * len(main_data_cols)
+    header_merges = [(DATA_HEADER_ROW, col_idx, SUB_HEADER_ROW, col_idx) for col_idx in range(1, len(main_data_cols) + 1)]
+    for settlement_header, sex_columns in column_groups:
+        start_col = len(data_header_values) + 1
+        data_header_values.extend([settlement_header] + [None] * (len(sex_columns) - 1))
+        sub_header_values.extend(sex_header for _, sex_header in sex_columns)
+        if len(sex_columns) > 1:
+            header_merges.append((DATA_HEADER_ROW, start_col, DATA_HEADER_ROW, start_col + len(sex_columns) - 1))
+    # Таблица возрастных групп (под основной таблицей): одна строка заголовков
+    band_header_values = ['Год', 'Возрастная группа'] + [
+        f"{settlement_header} ({sex_header})" for settlement_header, sex_columns in column_groups
+        for _, sex_header in sex_columns]
+
     for group_idx, group_data in enumerate(grouped_forecasts_data):
-        clean_title = group_data['title'].replace('[', '').replace(']', '').replace('*', '').replace(':', '').replace(
-            '?', '').replace('/', '-').replace('\\', '-')
-        sheet_title_base = f"Прогноз_{clean_title}"[:25]  # Оставляем место для индекса, если что
-
-        sheet_title = sheet_title_base
-        title_suffix_idx = 1
-        while sheet_title in wb.sheetnames:
-            sheet_title = f"{sheet_title_base}_{title_suffix_idx}"[:30]  # Excel limit ~31 chars
-            title_suffix_idx += 1
-            if title_suffix_idx > 10:  # Fallback
-                sheet_title = f"DataSheet_{group_idx}_{title_suffix_idx}"[:30]
-
-        ws_data = wb.create_sheet(title=sheet_title)
-        header_start_row = 1  # Строка для заголовка "Прогноз для..."
-        data_header_row = header_start_row + 2  # Строка для "Городское/Сельское" и "Год/Возраст"
-        sub_header_row = data_header_row + 1  # Строка для "Мужчины/Женщины/Всего"
-        data_start_row = sub_header_row + 1  # Строка, с которой начинаются фактические данные
-
-        # Заголовок группы регионов
-        group_title_cell = ws_data.cell(row=header_start_row, column=1, value=f"Прогноз для: {group_data['title']}")
-        group_title_cell.font = bold_font_main_header
-        group_title_cell.alignment = center_aligned_text
-        # Объединим этот заголовок позже, когда будем знать общую ширину таблицы
-
-        # Формирование заголовков данных
-        # Основные столбцы (Год, Возраст)
-        main_data_cols = ['Год']
-        if output_detailed_by_age_global:
-            main_data_cols.append('Возраст')
-
-        # Пишем основные заголовки "Год" и "Возраст"
-        for i, col_title in enumerate(main_data_cols):
-            cell = ws_data.cell(row=data_header_row, column=i + 1, value=col_title)
-            cell.font = bold_font_subheader
-            cell.alignment = center_aligned_text
-            ws_data.merge_cells(start_row=data_header_row, start_column=i + 1,
-                                end_row=sub_header_row, end_column=i + 1)  # Объединяем по вертикали
-
-        current_col_for_data_headers = len(main_data_cols) + 1
-
-        # Заголовки для "Городское население"
-        if user_selected_settlement_id == ID_SETTLEMENT_TOTAL or user_selected_settlement_id == ID_SETTLEMENT_URBAN:
-            colspan_urban = 0
-            sub_headers_urban = []
-            if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_MALE:
-                sub_headers_urban.append('Мужчины');
-                colspan_urban += 1
-            if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_FEMALE:
-                sub_headers_urban.append('Женщины');
-                colspan_urban += 1
-            if user_selected_sex_code == SEX_CODE_TOTAL:
-                sub_headers_urban.append('Всего');
-                colspan_urban += 1
-
-            if colspan_urban > 0:
-                urban_header_cell = ws_data.cell(row=data_header_row, column=current_col_for_data_headers)
-                urban_header_cell.value = 'Городское население'
-                urban_header_cell.font = bold_font_subheader
-                urban_header_cell.alignment = center_aligned_text
-                if colspan_urban > 1:
-                    ws_data.merge_cells(start_row=data_header_row, start_column=current_col_for_data_headers,
-                                        end_row=data_header_row,
-                                        end_column=current_col_for_data_headers + colspan_urban - 1)
-
-                for i, sub_h_val in enumerate(sub_headers_urban):
-                    sub_h_cell = ws_data.cell(row=sub_header_row, column=current_col_for_data_headers + i)
-                    sub_h_cell.value = sub_h_val
-                    sub_h_cell.font = bold_font_subheader
-                    sub_h_cell.alignment = center_aligned_text
-
-                current_col_for_data_headers += colspan_urban
-
-        # Заголовки для "Сельское население"
-        if user_selected_settlement_id == ID_SETTLEMENT_TOTAL or user_selected_settlement_id == ID_SETTLEMENT_RURAL:
-            colspan_rural = 0
-            sub_headers_rural = []
-            if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_MALE:
-                sub_headers_rural.append('Мужчины');
-                colspan_rural += 1
-            if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_FEMALE:
-                sub_headers_rural.append('Женщины');
-                colspan_rural += 1
-            if user_selected_sex_code == SEX_CODE_TOTAL:
-                sub_headers_rural.append('Всего');
-                colspan_rural += 1
-
-            if colspan_rural > 0:
-                rural_header_cell = ws_data.cell(row=data_header_row, column=current_col_for_data_headers)
-                rural_header_cell.value = 'Сельское население'
-                rural_header_cell.font = bold_font_subheader
-                rural_header_cell.alignment = center_aligned_text
-                if colspan_rural > 1:
-                    ws_data.merge_cells(start_row=data_header_row, start_column=current_col_for_data_headers,
-                                        end_row=data_header_row,
-                                        end_column=current_col_for_data_headers + colspan_rural - 1)
-
-                for i, sub_h_val in enumerate(sub_headers_rural):
-                    sub_h_cell = ws_data.cell(row=sub_header_row, column=current_col_for_data_headers + i)
-                    sub_h_cell.value = sub_h_val
-                    sub_h_cell.font = bold_font_subheader
-                    sub_h_cell.alignment = center_aligned_text
-
-                current_col_for_data_headers += colspan_rural
-
-        # Объединение заголовка группы регионов на всю ширину таблицы
-        total_data_cols = current_col_for_data_headers - 1
-        if total_data_cols > 0:  # Проверка, что есть хотя бы одна колонка данных
-            ws_data.merge_cells(start_row=header_start_row, start_column=1, end_row=header_start_row,
-                                end_column=total_data_cols)
-
-        # Заполнение данными
-        current_data_write_row = data_start_row
-        for year_item in group_data['data_by_year']:
-            year_val = year_item['year']
-            if output_detailed_by_age_global:
-                age_rows_for_year = year_item.get('age_rows', [])
-                if not age_rows_for_year:  # Если нет детализации по возрасту для этого года, пропускаем
-                    # Можно добавить запись суммарных данных, если они есть на уровне year_item
-                    pass
-                for age_row_idx, age_row_data in enumerate(age_rows_for_year):
-                    col_idx = 1
-                    # Год (только для первой возрастной строки)
-                    ws_data.cell(row=current_data_write_row, column=col_idx, value=year_val if age_row_idx == 0 else "")
-                    col_idx += 1
-                    # Возраст
-                    ws_data.cell(row=current_data_write_row, column=col_idx, value=age_row_data.get('age_display', '-'))
-                    col_idx += 1
-
-                    # Городские данные
-                    if user_selected_settlement_id == ID_SETTLEMENT_TOTAL or user_selected_settlement_id == ID_SETTLEMENT_URBAN:
-                        if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_MALE:
-                            ws_data.cell(row=current_data_write_row, column=col_idx,
-                                         value=age_row_data.get('urban_male', '-'));
-                            col_idx += 1
-                        if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_FEMALE:
-                            ws_data.cell(row=current_data_write_row, column=col_idx,
-                                         value=age_row_data.get('urban_female', '-'));
-                            col_idx += 1
-                        if user_selected_sex_code == SEX_CODE_TOTAL:
-                            ws_data.cell(row=current_data_write_row, column=col_idx,
-                                         value=age_row_data.get('urban_total', '-'));
-                            col_idx += 1
-                    # Сельские данные
-                    if user_selected_settlement_id == ID_SETTLEMENT_TOTAL or user_selected_settlement_id == ID_SETTLEMENT_RURAL:
-                        if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_MALE:
-                            ws_data.cell(row=current_data_write_row, column=col_idx,
-                                         value=age_row_data.get('rural_male', '-'));
-                            col_idx += 1
-                        if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_FEMALE:
-                            ws_data.cell(row=current_data_write_row, column=col_idx,
-                                         value=age_row_data.get('rural_female', '-'));
-                            col_idx += 1
-                        if user_selected_sex_code == SEX_CODE_TOTAL:
-                            ws_data.cell(row=current_data_write_row, column=col_idx,
-                                         value=age_row_data.get('rural_total', '-'));
-                            col_idx += 1
-                    current_data_write_row += 1
-            else:  # Недетализированный по возрастам
-                col_idx = 1
-                ws_data.cell(row=current_data_write_row, column=col_idx, value=year_val);
-                col_idx += 1
-                # Городские данные
-                if user_selected_settlement_id == ID_SETTLEMENT_TOTAL or user_selected_settlement_id == ID_SETTLEMENT_URBAN:
-                    if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_MALE:
-                        ws_data.cell(row=current_data_write_row, column=col_idx,
-                                     value=year_item.get('urban_male', '-'));
-                        col_idx += 1
-                    if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_FEMALE:
-                        ws_data.cell(row=current_data_write_row, column=col_idx,
-                                     value=year_item.get('urban_female', '-'));
-                        col_idx += 1
-                    if user_selected_sex_code == SEX_CODE_TOTAL:
-                        ws_data.cell(row=current_data_write_row, column=col_idx,
-                                     value=year_item.get('urban_total', '-'));
-                        col_idx += 1
-                # Сельские данные
-                if user_selected_settlement_id == ID_SETTLEMENT_TOTAL or user_selected_settlement_id == ID_SETTLEMENT_RURAL:
-                    if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_MALE:
-                        ws_data.cell(row=current_data_write_row, column=col_idx,
-                                     value=year_item.get('rural_male', '-'));
-                        col_idx += 1
-                    if user_selected_sex_code == SEX_CODE_TOTAL or user_selected_sex_code == SEX_CODE_FEMALE:
-                        ws_data.cell(row=current_data_write_row, column=col_idx,
-                                     value=year_item.get('rural_female', '-'));
-                        col_idx += 1
-                    if user_selected_sex_code == SEX_CODE_TOTAL:
-                        ws_data.cell(row=current_data_write_row, column=col_idx,
-                                     value=year_item.get('rural_total', '-'));
-                        col_idx += 1
-                current_data_write_row += 1
-
-        # Автоподбор ширины колонок для текущего листа данных
-        for col_idx_dim in range(1, total_data_cols + 1):
-            max_len = 0
-            col_letter = get_column_letter(col_idx_dim)
-            for cell_dim in ws_data[col_letter]:  # Проходим по всем ячейкам колонки
-                if cell_dim.value:
-                    try:
-                        cell_len = len(str(cell_dim.value))
-                        if cell_len > max_len:
-                            max_len = cell_len
-                    except:  # pragma: no cover (на случай экзотических типов данных)
-                        pass
-            adjusted_width = max(max_len + 2, 10) if max_len > 0 else 10  # мин. ширина 10
-            # Для объединенных ячеек заголовочных строк, max_len может быть некорректным.
-            # Можно добавить проверку, что если это заголовочная ячейка, то брать ширину из значения.
-            header_cell_value_data_row = ws_data.cell(row=data_header_row, column=col_idx_dim).value
-            header_cell_value_sub_row = ws_data.cell(row=sub_header_row, column=col_idx_dim).value
-
-            if header_cell_value_data_row and len(str(header_cell_value_data_row)) + 2 > adjusted_width:
-                adjusted_width = len(str(header_cell_value_data_row)) + 4  # +4 для центрированных заголовков
-            if header_cell_value_sub_row and len(str(header_cell_value_sub_row)) + 2 > adjusted_width:
-                adjusted_width = len(str(header_cell_value_sub_row)) + 4
-
-            ws_data.column_dimensions[col_letter].width = min(adjusted_width, 50)  # Ограничим макс. ширину
-
-    return wb
\ No newline at end of file
+        ws_data = wb.create_sheet(title=_unique_sheet_title(wb, group_data['title'], group_idx))
+        group_title_value = f"Прогноз для: {group_data['title']}"
+
+        has_age_bands = any(year_item.get('band_rows') for year_item in group_data['data_by_year'])
+        sheet_cols = max(total_data_cols, len(band_header_values)) if has_age_bands else total_data_cols
+
+        # Автоподбор ширины колонок: первый проход по данным группы (строки не сохраняются)
+        max_lens = [0] * sheet_cols
+        header_rows = [[group_title_value], data_header_values, sub_header_values]
+        for row_values in header_rows + [band_header_values] if has_age_bands else header_rows:
+            for col_idx, value in enumerate(row_values):
+                if value:
+                    max_lens[col_idx] = max(max_lens[col_idx], len(str(value)))
+        for row_values in _iter_group_data_rows(group_data, output_detailed_by_age_global, data_keys):
+            for col_idx, value in enumerate(row_values):
+                if value:
+                    max_lens[col_idx] = max(max_lens[col_idx], len(str(value)))
+        if has_age_bands:
+            for row_values in _iter_group_band_rows(group_data, data_keys):
+                for col_idx, value in enumerate(row_values):
+                    if value:
+                        max_lens[col_idx] = max(max_lens[col_idx], len(str(value)))
+        for col_idx_dim in range(1, sheet_cols + 1):
+            max_len = max_lens[col_idx_dim - 1]
+            adjusted_width = max(max_len + 2, MIN_DATA_COLUMN_WIDTH) if max_len > 0 else MIN_DATA_COLUMN_WIDTH
+            # Для центрированных заголовков - небольшой запас
+            header_values = (data_header_values[col_idx_dim - 1], sub_header_values[col_idx_dim - 1]) \
+                if col_idx_dim <= total_data_cols else ()
+            for header_value in header_values:
+                if header_value and len(header_value) + 2 > adjusted_width:
+                    adjusted_width = len(header_value) + 4
+            ws_data.column_dimensions[get_column_letter(col_idx_dim)].width = min(adjusted_width, MAX_DATA_COLUMN_WIDTH)
+
+        # Заголовок группы регионов на всю ширину таблицы
+        ws_data.append([_styled_cell(ws_data, group_title_value, font=bold_font_main_header,
+                                     alignment=center_aligned_text)])
+        if total_data_cols > 0:
+            ws_data.merged_cells.add(f"A{GROUP_TITLE_ROW}:{get_column_letter(total_data_cols)}{GROUP_TITLE_ROW}")
+        ws_data.append([])
+
+        for header_values in (data_header_values, sub_header_values):
+            ws_data.append([_styled_cell(ws_data, value, font=bold_font_subheader, alignment=center_aligned_text)
+                            if value is not None else None for value in header_values])
+        for start_row, start_col, end_row, end_col in header_merges:
+            ws_data.merged_cells.add(f"{get_column_letter(start_col)}{start_row}:{get_column_letter(end_col)}{end_row}")
+
+        # Заполнение данными: второй проход, строки пишутся в файл по одной
+        for row_values in _iter_group_data_rows(group_data, output_detailed_by_age_global, data_keys):
+            ws_data.append(row_values)
+
+        if has_age_bands:
+            ws_data.append([])
+            ws_data.append([_styled_cell(ws_data, "Возрастные группы", font=bold_font_subheader)])
+            ws_data.append([_styled_cell(ws_data, value, font=bold_font_subheader, alignment=center_aligned_text)
+                            for value in band_header_values])
+            for row_values in _iter_group_band_rows(group_data, data_keys):
+                ws_data.append(row_values)
+
+    wb.save(output_file)
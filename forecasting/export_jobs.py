@@ -0,0 +1,205 @@
+# forecasting/export_jobs.py
+
+import io
+import logging
+import os
+import tempfile
+from datetime import timedelta
+from typing import Dict, Any, Optional, Iterable, Iterator, Tuple, IO
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import result_store, shared_results, tidy_export
+from .csv_export_utils import iter_forecast_csv_chunks
+from .excel_export_utils import save_forecast_excel_workbook
+from .models import ForecastRun, ForecastExportArtifact
+
+logger = logging.getLogger(__name__)
+
+# Фоновый экспорт прогнозов. Экспорт большого прогноза (см. is_large_export) формируется задачей Celery
+# (tasks.generate_export_artifact_task) в файл рядом с результатами; состояние и прогресс (число записанных
+# групп регионов) хранятся в ForecastExportArtifact. Готовый файл отдается при каждом следующем скачивании
+# того же прогноза в том же формате, пока прогноз не удален (файл удаляется сигналом, см. signals.py).
+# Небольшие прогнозы и экспорт части результата (параметры group, year_from, ...) формируются в запросе, как раньше.
+EXPORT_FORMAT_CSV = 'csv'
+EXPORT_FORMAT_XLSX = 'xlsx'
+EXPORT_FORMAT_NDJSON = 'ndjson'  # Машиночитаемые форматы, см. tidy_export
+EXPORT_FORMAT_PARQUET = 'parquet'
+EXPORT_CONTENT_TYPES = {
+    EXPORT_FORMAT_CSV: 'text/csv; charset=utf-8',
+    EXPORT_FORMAT_XLSX: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    EXPORT_FORMAT_NDJSON: 'application/x-ndjson; charset=utf-8',
+    EXPORT_FORMAT_PARQUET: 'application/vnd.apache.parquet',
+}
+
+EXPORTS_DIR = os.path.join('forecast_history', 'exports')
+
+ID_SETTLEMENT_TOTAL = 1
+SEX_CODE_TOTAL = "A"
+
+
+def export_artifact_relative_path(forecast_run_id, export_format: str) -> str:
+    return os.path.join(EXPORTS_DIR, f'forecast_export_{forecast_run_id}.{export_format}')
+
+
+def export_filename(forecast_run_id, export_format: str) -> str:
+    """Имя файла для скачивания (короткий префикс из UUID)."""
+    return f"forecast_export_{str(forecast_run_id)[:8]}.{export_format}"
+
+
+def is_large_export(forecast_run: ForecastRun) -> bool:
+    """Экспорт стоит формировать в фоне: в результате не меньше FORECAST_EXPORT_ASYNC_MIN_ROWS строк."""
+    if not forecast_run.results_file_path:
+        return False
+    full_results_path = os.path.join(settings.MEDIA_ROOT, forecast_run.results_file_path)
+    try:
+        with result_store.open_result(full_results_path) as result_reader:
+            row_count = result_reader.row_count()
+    except Exception as e:
+        logger.warning(f"Не удалось оценить размер результата прогноза {forecast_run.id}: {e}")
+        return False
+    return row_count >= getattr(settings, 'FORECAST_EXPORT_ASYNC_MIN_ROWS', 20000)
+
+
+def get_ready_artifact(forecast_run: ForecastRun, export_format: str) -> Optional[ForecastExportArtifact]:
+    """Готовый файл экспорта или None (нет записи, файл еще формируется или был удален с диска)."""
+    artifact = ForecastExportArtifact.objects.filter(
+        forecast_run=forecast_run, export_format=export_format, status=ForecastExportArtifact.STATUS_COMPLETED
+    ).first()
+    if artifact is None or not artifact.file_path:
+        return None
+    if not os.path.exists(os.path.join(settings.MEDIA_ROOT, artifact.file_path)):
+        return None
+    return artifact
+
+
+def claim_export_job(forecast_run: ForecastRun, export_format: str) -> Tuple[ForecastExportArtifact, bool]:
+    """
+    Возвращает (запись экспорта, нужно ли ставить задачу в очередь). Задача ставится, если экспорта
+    еще не было, предыдущая попытка завершилась ошибкой, файл пропал с диска или задача зависла
+    (запись не обновлялась дольше FORECAST_EXPORT_JOB_STALE_SECONDS).
+    """
+    stale_before = timezone.now() - timedelta(seconds=getattr(settings, 'FORECAST_EXPORT_JOB_STALE_SECONDS', 900))
+    with transaction.atomic():
+        artifact, created = ForecastExportArtifact.objects.select_for_update().get_or_create(
+            forecast_run=forecast_run, export_format=export_format)
+        if created:
+            return artifact, True
+        if artifact.status in (ForecastExportArtifact.STATUS_PENDING, ForecastExportArtifact.STATUS_RUNNING) \
+                and artifact.updated_at >= stale_before:
+            return artifact, False
+        if artifact.status == ForecastExportArtifact.STATUS_COMPLETED and get_ready_artifact(
+                forecast_run, export_format) is not None:
+            return artifact, False
+        artifact.status = ForecastExportArtifact.STATUS_PENDING
+        artifact.completed_groups = 0
+        artifact.error_message = ''
+        artifact.save(update_fields=['status', 'completed_groups', 'error_message', 'updated_at'])
+        return artifact, True
+
+
+def export_kwargs_from_meta(results_meta: Dict[str, Any]) -> Dict[str, Any]:
+    """Параметры функций записи CSV/XLSX из метаданных результата (кроме самих групп)."""
+    return {
+        'params_display_overall': results_meta.get('display_params_overall', {}),
+        'all_warnings': results_meta.get('all_warnings', []),
+        'output_detailed_by_age_global': results_meta.get('output_detailed_by_age_global', False),
+        'user_selected_settlement_id': results_meta.get('user_selected_settlement_id', ID_SETTLEMENT_TOTAL),
+        'user_selected_sex_code': results_meta.get('user_selected_sex_code', SEX_CODE_TOTAL),
+    }
+
+
+def write_export_file(output_file: IO[bytes], export_format: str, results_meta: Dict[str, Any],
+                      grouped_forecasts_data: Iterable[Dict]) -> None:
+    """Записывает экспорт в открытый бинарный файл. Группы читаются из grouped_forecasts_data по одной."""
+    export_kwargs = export_kwargs_from_meta(results_meta)
+    output_detailed_by_age_global = export_kwargs['output_detailed_by_age_global']
+    if export_format == EXPORT_FORMAT_XLSX:
+        save_forecast_excel_workbook(output_file, grouped_forecasts_data=grouped_forecasts_data, **export_kwargs)
+    elif export_format == EXPORT_FORMAT_PARQUET:
+        tidy_export.write_parquet(output_file, grouped_forecasts_data, output_detailed_by_age_global)
+    elif export_format in (EXPORT_FORMAT_CSV, EXPORT_FORMAT_NDJSON):
+        if export_format == EXPORT_FORMAT_CSV:
+            chunks = iter_forecast_csv_chunks(grouped_forecasts_data=grouped_forecasts_data, **export_kwargs)
+        else:
+            chunks = tidy_export.iter_ndjson_chunks(grouped_forecasts_data, output_detailed_by_age_global)
+        text_file = io.TextIOWrapper(output_file, encoding='utf-8', newline='')
+        for chunk in chunks:
+            text_file.write(chunk)
+        text_file.flush()
+        text_file.detach()  # Файл закрывает вызывающий код
+    else:
+        raise ValueError(f"Неподдерживаемый формат экспорта: {export_format}")
+
+
+def _iter_groups_with_progress(result_reader: result_store.ForecastResultReader,
+                               artifact: ForecastExportArtifact) -> Iterator[Dict[str, Any]]:
+    for group_number, group_data in enumerate(result_reader.iter_groups()):
+        yield group_data
+        # Группа записана (генератор продолжается, когда функция записи запрашивает следующую)
+        ForecastExportArtifact.objects.filter(id=artifact.id).update(
+            completed_groups=group_number + 1, updated_at=timezone.now())
+
+
+def run_export_job(artifact_id: int) -> Optional[ForecastExportArtifact]:
+    """Формирует файл экспорта (вызывается из задачи Celery). Ошибка записывается в artifact.error_message."""
+    artifact = ForecastExportArtifact.objects.select_related('forecast_run').filter(id=artifact_id).first()
+    if artifact is None:
+        logger.warning(f"Export artifact {artifact_id} not found (forecast run deleted?).")
+        return None
+    forecast_run = artifact.forecast_run
+    relative_path = export_artifact_relative_path(forecast_run.id, artifact.export_format)
+    full_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+    temp_path = None
+
+    try:
+        if not forecast_run.results_file_path:
+            raise FileNotFoundError("Для прогноза отсутствует файл с результатами.")
+        full_results_path = os.path.join(settings.MEDIA_ROOT, forecast_run.results_file_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        with result_store.open_result(full_results_path,
+                                      group_order=shared_results.run_group_order(forecast_run)) as result_reader:
+            artifact.status = ForecastExportArtifact.STATUS_RUNNING
+            artifact.total_groups = len(result_reader.groups_index)
+            artifact.completed_groups = 0
+            artifact.save(update_fields=['status', 'total_groups', 'completed_groups', 'updated_at'])
+
+            # Временный файл в том же каталоге и os.replace: недописанный файл никогда не будет отдан
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as output_file:
+                write_export_file(output_file, artifact.export_format, result_reader.meta,
+                                  _iter_groups_with_progress(result_reader, artifact))
+        os.replace(temp_path, full_path)
+        temp_path = None
+    except Exception as e:
+        logger.error(f"Export artifact {artifact_id} ({artifact.export_format}, forecast run {forecast_run.id}) "
+                     f"failed: {e}", exc_info=True)
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+        artifact.status = ForecastExportArtifact.STATUS_ERROR
+        artifact.error_message = f"Ошибка при формировании файла экспорта: {e}"
+        artifact.save(update_fields=['status', 'error_message', 'updated_at'])
+        return artifact
+
+    artifact.status = ForecastExportArtifact.STATUS_COMPLETED
+    artifact.file_path = relative_path
+    artifact.file_size = os.path.getsize(full_path)
+    artifact.completed_groups = artifact.total_groups
+    artifact.save(update_fields=['status', 'file_path', 'file_size', 'completed_groups', 'updated_at'])
+    logger.info(f"Export artifact {artifact_id} ({artifact.export_format}, forecast run {forecast_run.id}) "
+                f"written: {artifact.file_size} bytes.")
+    return artifact
+
+
+def delete_export_file(artifact: ForecastExportArtifact) -> None:
+    if not artifact.file_path:
+        return
+    try:
+        os.remove(os.path.join(settings.MEDIA_ROOT, artifact.file_path))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Не удалось удалить файл экспорта {artifact.file_path}: {e}")
@@ -0,0 +1,242 @@
+# forecasting/forecast_params.py
+
+import logging
+from typing import Dict, List, Any, Optional, Tuple, Union, Callable
+
+from data_collector import region_registry
+from .tasks import (MAP_CODE_FOR_ALL_RUSSIA, ID_FOR_ALL_RUSSIA,
+                    ID_SETTLEMENT_TOTAL, ID_SETTLEMENT_URBAN, ID_SETTLEMENT_RURAL,
+                    SEX_CODE_TOTAL, SEX_CODE_MALE, SEX_CODE_FEMALE,
+                    SCENARIO_LAST_YEAR, SCENARIO_MANUAL_PERCENT,
+                    DEFAULT_HISTORICAL_START_YEAR, DEFAULT_HISTORICAL_END_YEAR, DEFAULT_FORECAST_END_YEAR)
+
+logger = logging.getLogger(__name__)
+
+# Разбор параметров запроса прогноза и построение конфигураций расчета. Используется формой
+# (ForecastView.post, данные - request.POST) и JSON API (api_v1, данные уже проверены и приведены
+# к тем же полям формы). Флаги (output_detailed_by_age, include_migration) включены, если поле передано.
+RATE_CATEGORIES = ('birth_rate', 'death_rate_male', 'death_rate_female', 'migration')
+
+# Именованные возрастные группы (target_age_bands): в форме - текст "Дети: 0-14; Пожилые: 65-100"
+# (группы через ";" или перевод строки; последний возраст 100 и больше - включая "100 и старше"),
+# в параметрах прогноза - [[название, первый возраст, последний возраст], ...]. Все группы считаются
+# из той же передвижки, что и целевая группа (PopulationForecaster.resolve_age_bands).
+MAX_AGE_BANDS = 10
+AGE_BAND_SEPARATORS = (';', '\n')
+
+
+def format_age_bands(age_bands: List[List[Any]]) -> str:
+    """Текст поля формы target_age_bands для списка [[название, первый возраст, последний возраст], ...]."""
+    return '; '.join(f"{band_name}: {band_start_age}-{band_end_age}"
+                     for band_name, band_start_age, band_end_age in age_bands)
+
+
+def parse_age_bands(age_bands_str: Optional[str], form_warnings: List[str]) -> List[List[Any]]:
+    """
+    Группы из текста поля формы target_age_bands. Некорректные группы, повторы названий и группы
+    сверх MAX_AGE_BANDS пропускаются с предупреждением.
+    """
+    age_bands: List[List[Any]] = []
+    band_texts = [age_bands_str or '']
+    for separator in AGE_BAND_SEPARATORS:
+        band_texts = [part for band_text in band_texts for part in band_text.split(separator)]
+    for band_text in (band_text.strip() for band_text in band_texts):
+        if not band_text:
+            continue
+        band_name, _, ages_str = band_text.rpartition(':')
+        start_a_str, _, end_a_str = ages_str.strip().partition('-')
+        band_name, start_a_str, end_a_str = band_name.strip(), start_a_str.strip(), end_a_str.strip()
+        if not (band_name and start_a_str.isdigit() and end_a_str.isdigit()) \
+                or int(start_a_str) > int(end_a_str):
+            form_warnings.append(f"Некорректная возрастная группа '{band_text}'. Ожидается 'Название: 0-14'. "
+                                 f"Группа пропущена.")
+        elif any(band_name == existing_band[0] for existing_band in age_bands):
+            form_warnings.append(f"Возрастная группа '{band_name}' указана повторно. Группа пропущена.")
+        elif len(age_bands) >= MAX_AGE_BANDS:
+            form_warnings.append(f"Возрастных групп больше {MAX_AGE_BANDS}. Группа '{band_name}' пропущена.")
+        else:
+            age_bands.append([band_name, int(start_a_str), int(end_a_str)])
+    return age_bands
+
+
+def _default_region_name(region_id: int) -> str:
+    region_name = region_registry.get_region_name(region_id)
+    return region_name if region_name is not None else f"Регион ID {region_id}"
+
+
+def safe_float(val_str: Optional[str]) -> Optional[float]:
+    if val_str is None or val_str.strip() == '': return None
+    try:
+        return float(val_str.replace(',', '.'))
+    except (ValueError, TypeError):
+        logger.warning(f"Не удалось преобразовать '{val_str}' в float."); return None
+
+
+def resolve_region_ids(region_map_codes_str: str, form_warnings: List[str]) -> List[int]:
+    """ID регионов по кодам карты через запятую (без повторов, по возрастанию). Неизвестные коды пропускаются."""
+    initial_processed_region_db_ids: List[int] = []
+    if not region_map_codes_str: region_map_codes_str = MAP_CODE_FOR_ALL_RUSSIA
+    map_codes_to_query_initial = [MAP_CODE_FOR_ALL_RUSSIA] if region_map_codes_str == MAP_CODE_FOR_ALL_RUSSIA \
+        else [code.strip() for code in region_map_codes_str.split(',') if code.strip()]
+    if not map_codes_to_query_initial: map_codes_to_query_initial = [MAP_CODE_FOR_ALL_RUSSIA]
+
+    map_code_to_id_dict = region_registry.get_region_ids_by_map_codes(map_codes_to_query_initial)
+    for mc_req in map_codes_to_query_initial:
+        if mc_req in map_code_to_id_dict:
+            initial_processed_region_db_ids.append(map_code_to_id_dict[mc_req])
+        else:
+            form_warnings.append(f"Код региона '{mc_req}' не найден в БД и будет проигнорирован.")
+    if not initial_processed_region_db_ids:
+        russia_fallback = region_registry.get_region_by_map_code(MAP_CODE_FOR_ALL_RUSSIA) \
+            or region_registry.get_region(ID_FOR_ALL_RUSSIA)
+        if russia_fallback:
+            initial_processed_region_db_ids = [russia_fallback['id']]
+            form_warnings.append(f"Запрошенные регионы не найдены. Используется '{russia_fallback['name']}'.")
+        else:
+            raise ValueError(f"Не удалось определить регионы из '{region_map_codes_str}'. РФ не найдена.")
+
+    # Повторы убираются, порядок выбора сохраняется (группы результата - в этом порядке);
+    # хеш входных параметров от порядка не зависит (shared_results.compute_input_hash)
+    return list(dict.fromkeys(initial_processed_region_db_ids))
+
+
+def build_forecast_plan(form_data, form_warnings: List[str],
+                        region_name_func: Optional[Callable[[int], str]] = None,
+                        display_params_func: Optional[Callable[[Dict, List], Dict]] = None) -> Dict[str, Any]:
+    """
+    Параметры прогноза и конфигурации расчета из данных формы (form_data - request.POST или словарь
+    с теми же полями). Предупреждения о скорректированных параметрах добавляются в form_warnings.
+    region_name_func - название группы регионов (по умолчанию из справочника регионов).
+    display_params_func(params, form_warnings) - параметры для показа каждой группы на странице
+    результатов; без нее params_for_group_context_map пуст (JSON API их не использует).
+    ValueError, если параметры некорректны.
+    """
+    region_name_func = region_name_func or _default_region_name
+
+    region_map_codes_str = form_data.get('region_ids', MAP_CODE_FOR_ALL_RUSSIA).strip()
+    initial_processed_region_db_ids = resolve_region_ids(region_map_codes_str, form_warnings)
+
+    user_selected_settlement_id = int(form_data.get('settlement_type_id', ID_SETTLEMENT_TOTAL))
+    user_selected_sex_code = form_data.get('sex_code_target', SEX_CODE_TOTAL)
+    historical_data_end_year = int(form_data.get('historical_data_end_year', DEFAULT_HISTORICAL_END_YEAR))
+    forecast_start_year_from_form = int(form_data.get('forecast_start_year', historical_data_end_year + 1))
+    forecast_end_year = int(form_data.get('forecast_end_year', DEFAULT_FORECAST_END_YEAR))
+    historical_data_start_year = int(form_data.get('historical_data_start_year', DEFAULT_HISTORICAL_START_YEAR))
+    expected_start_year = historical_data_end_year + 1
+    actual_forecast_start_year = forecast_start_year_from_form
+    if forecast_start_year_from_form != expected_start_year:
+        msg = f"Год начала прогноза ({forecast_start_year_from_form}) скорректирован на {expected_start_year}."
+        form_warnings.append(msg)
+        logger.warning(msg)
+        actual_forecast_start_year = expected_start_year
+    if actual_forecast_start_year > forecast_end_year: raise ValueError("Год начала прогноза > года окончания.")
+
+    target_age_group_type = form_data.get('target_age_group_type', 'all_ages')
+    target_age_val: Union[str, Tuple[int, int]] = "Все возрасты"
+    if target_age_group_type == 'specific_range':
+        start_a_str, end_a_str = form_data.get('target_age_start'), form_data.get('target_age_end')
+        if not (start_a_str and end_a_str and start_a_str.isdigit() and end_a_str.isdigit()):
+            form_warnings.append("Некорректный диапазон возраста. Используются 'Все возрасты'.")
+        else:
+            start_a, end_a = int(start_a_str), int(end_a_str)
+            if start_a > end_a:
+                form_warnings.append("Начальный возраст > конечного. Используются 'Все возрасты'.")
+            else:
+                target_age_val = (start_a, end_a)
+
+    target_age_bands = parse_age_bands(form_data.get('target_age_bands'), form_warnings)
+
+    output_detailed_by_age_global = 'output_detailed_by_age' in form_data
+
+    base_forecast_params_no_combination_specifics: Dict[str, Any] = {
+        'forecast_start_year': actual_forecast_start_year, 'forecast_end_year': forecast_end_year,
+        'historical_data_start_year': historical_data_start_year,
+        'historical_data_end_year': historical_data_end_year,
+        'target_age_group_input': target_age_val, 'output_detailed_by_age': output_detailed_by_age_global,
+        'settlement_type_id': user_selected_settlement_id,  # Будет перезаписано в цикле конфигураций
+        'sex_code_target': user_selected_sex_code,  # Будет перезаписано в цикле конфигураций
+        'birth_rate_scenario': form_data.get('birth_rate_scenario', SCENARIO_LAST_YEAR),
+        'birth_rate_manual_change_percent': safe_float(form_data.get('birth_rate_manual_change_percent')),
+        'death_rate_scenario_male': form_data.get('death_rate_scenario_male', SCENARIO_LAST_YEAR),
+        'death_rate_manual_change_percent_male': safe_float(form_data.get('death_rate_manual_change_percent_male')),
+        'death_rate_scenario_female': form_data.get('death_rate_scenario_female', SCENARIO_LAST_YEAR),
+        'death_rate_manual_change_percent_female': safe_float(
+            form_data.get('death_rate_manual_change_percent_female')),
+        'include_migration': 'include_migration' in form_data,
+        'migration_scenario': form_data.get('migration_scenario', SCENARIO_LAST_YEAR),
+        'migration_manual_change_percent': safe_float(form_data.get('migration_manual_change_percent')),
+    }
+    for cat_key in RATE_CATEGORIES:
+        scenario_val_key = f'{cat_key}_scenario'
+        manual_perc_key = f'{cat_key}_manual_change_percent'
+        if base_forecast_params_no_combination_specifics.get(scenario_val_key) != SCENARIO_MANUAL_PERCENT or \
+                (cat_key == 'migration' and not base_forecast_params_no_combination_specifics.get(
+                    'include_migration')):
+            base_forecast_params_no_combination_specifics[manual_perc_key] = None
+    # Только при заданных группах: хеш входных параметров прогнозов без групп (shared_results) не меняется
+    if target_age_bands:
+        base_forecast_params_no_combination_specifics['target_age_bands'] = target_age_bands
+
+    # Группы регионов: каждый выбранный регион отдельно (если их несколько) и их сумма
+    region_configs: List[Tuple[List[int], str]] = []
+    is_selected_all_russia_by_id = (
+            len(initial_processed_region_db_ids) == 1 and initial_processed_region_db_ids[0] == ID_FOR_ALL_RUSSIA)
+    if len(initial_processed_region_db_ids) > 1 and not is_selected_all_russia_by_id:
+        for rid in initial_processed_region_db_ids: region_configs.append(([rid], region_name_func(rid)))
+    sum_title_regions = region_name_func(initial_processed_region_db_ids[0]) \
+        if len(initial_processed_region_db_ids) == 1 \
+        else f"Сумма по {len(initial_processed_region_db_ids)} выбранным регионам"
+    region_configs.append((initial_processed_region_db_ids, sum_title_regions))
+
+    params_for_group_context_map: Dict[str, Dict] = {}
+    if display_params_func is not None:
+        for region_ids_to_run_cfg, region_title_part_cfg in region_configs:
+            temp_params_for_group_ctx = base_forecast_params_no_combination_specifics.copy()
+            temp_params_for_group_ctx['region_ids'] = region_ids_to_run_cfg
+            temp_params_for_group_ctx['settlement_type_id'] = user_selected_settlement_id
+            temp_params_for_group_ctx['sex_code_target'] = user_selected_sex_code
+            params_for_group_context_map[region_title_part_cfg] = display_params_func(
+                temp_params_for_group_ctx, form_warnings)
+
+    settlement_ids_to_run_forecaster: List[int] = []
+    if user_selected_settlement_id == ID_SETTLEMENT_TOTAL:
+        settlement_ids_to_run_forecaster.extend([ID_SETTLEMENT_URBAN, ID_SETTLEMENT_RURAL])
+    else:
+        settlement_ids_to_run_forecaster.append(user_selected_settlement_id)
+
+    sex_codes_to_run_forecaster: List[str] = []
+    if user_selected_sex_code == SEX_CODE_TOTAL:
+        sex_codes_to_run_forecaster.extend([SEX_CODE_MALE, SEX_CODE_FEMALE, SEX_CODE_TOTAL])
+    else:
+        sex_codes_to_run_forecaster.append(user_selected_sex_code)
+
+    all_run_configurations: List[Dict[str, Any]] = []
+    active_data_keys: set[str] = set()
+    for region_ids_to_run, region_title_part in region_configs:
+        for settlement_id_for_run in settlement_ids_to_run_forecaster:
+            for sex_code_for_run in sex_codes_to_run_forecaster:
+                current_run_params = base_forecast_params_no_combination_specifics.copy()
+                current_run_params['region_ids'] = region_ids_to_run
+                current_run_params['settlement_type_id'] = settlement_id_for_run
+                current_run_params['sex_code_target'] = sex_code_for_run
+                all_run_configurations.append({'params': current_run_params, 'region_group_key': region_title_part})
+
+                s_prefix = "urban_" if settlement_id_for_run == ID_SETTLEMENT_URBAN else \
+                    ("rural_" if settlement_id_for_run == ID_SETTLEMENT_RURAL else \
+                         ("total_" if settlement_id_for_run == ID_SETTLEMENT_TOTAL else "unknown_sett_"))
+                g_suffix = "male" if sex_code_for_run == SEX_CODE_MALE else \
+                    ("female" if sex_code_for_run == SEX_CODE_FEMALE else \
+                         ("total" if sex_code_for_run == SEX_CODE_TOTAL else "unknown_sex_"))
+                active_data_keys.add(f"{s_prefix}{g_suffix}")
+
+    return {
+        'initial_processed_region_db_ids': initial_processed_region_db_ids,
+        'user_selected_settlement_id': user_selected_settlement_id,
+        'user_selected_sex_code': user_selected_sex_code,
+        'output_detailed_by_age_global': output_detailed_by_age_global,
+        'base_forecast_params_no_combination_specifics': base_forecast_params_no_combination_specifics,
+        'region_configs': region_configs,
+        'params_for_group_context_map': params_for_group_context_map,
+        'all_run_configurations': all_run_configurations,
+        'active_data_keys': sorted(active_data_keys),
+    }
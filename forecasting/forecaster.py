@@ -1,11 +1,17 @@
 # forecasting/forecaster.py
 
 import logging
-from typing import Dict, List, Any, Optional, Tuple, Union  # Union добавлен для target_age_group_input
+from typing import Dict, List, Any, Optional, Tuple, Union, Callable  # Union добавлен для target_age_group_input
 from collections import defaultdict
 import copy  # Для глубокого копирования структур данных
 
-from .data_providers.db_data_provider import DBDataProvider, SEX_MALE_CODE, SEX_FEMALE_CODE, SEX_TOTAL_CODE
+from django.conf import settings
+
+from data_collector.data_version import get_data_version
+from .data_providers.db_data_provider import DBDataProvider, SEX_MALE_CODE, SEX_FEMALE_CODE, SEX_TOTAL_CODE, \
+    DATASET_INITIAL_POPULATION, DATASET_POPULATION_FOR_DEATHS, DATASET_FEMALE_POPULATION_FOR_BIRTHS, \
+    DATASET_DEATH_COUNTS, DATASET_BIRTH_COUNTS, DATASET_MIGRATION_SALDO, DATASET_BIRTH_RATE_COMPONENTS, \
+    DATASET_DEATH_RATE_COMPONENTS, sum_region_datasets
 from .coefficient_calculator import CoefficientProcessor, SCENARIO_LAST_YEAR, SCENARIO_HISTORICAL_TREND, \
     SCENARIO_MANUAL_PERCENT
 from .migration_handler import MigrationProcessor
@@ -22,14 +28,46 @@ BIRTH_RATE_AGE_55_AND_OLDER_DB_KEY = 55
 FERTILE_AGE_START = 15
 FERTILE_AGE_END = 49
 
+class ForecastCancelled(Exception):
+    """Прогноз остановлен по запросу (см. параметр should_cancel PopulationForecaster)."""
+    pass
+
+
+def population_by_single_age(population_by_sex_age: Dict[str, Dict[int, float]], sex_codes: List[str],
+                             open_age_group: int) -> List[float]:
+    """Численность по однолетним возрастам 0..open_age_group (сумма по полам sex_codes)."""
+    population_by_age = []
+    for age in range(open_age_group + 1):
+        population_for_age = 0
+        for sex_code in sex_codes:
+            population_for_age += population_by_sex_age.get(sex_code, {}).get(age, 0)
+        population_by_age.append(population_for_age)
+    return population_by_age
+
+
+def cumulative_population_by_age(population_by_age: List[float]) -> List[float]:
+    """Накопленные суммы: [i] - численность возрастов 0..i-1, т.е. возрасты a..b - [b + 1] - [a]."""
+    cumulative_population = [0]
+    for population_for_age in population_by_age:
+        cumulative_population.append(cumulative_population[-1] + population_for_age)
+    return cumulative_population
+
+
 class PopulationForecaster:
     """
     Выполняет демографический прогноз методом передвижки возрастов (компонентный метод).
     """
 
-    def __init__(self, forecast_params: Dict[str, Any]):
+    def __init__(self, forecast_params: Dict[str, Any], preloaded_data: Optional[Dict[str, Any]] = None,
+                 should_cancel: Optional[Callable[[], bool]] = None):
         self.params = forecast_params
+        # Функция без аргументов, проверяемая перед каждым годом прогноза; если она вернула True,
+        # run_forecast выбрасывает ForecastCancelled
+        self.should_cancel = should_cancel
         self.data_provider = DBDataProvider()
+        # Заранее загруженный набор исходных данных (см. preload_input_data_for_configurations).
+        # Если он передан, прогноз не обращается к БД.
+        self.preloaded_data = preloaded_data
 
         self.region_ids = self.params['region_ids']
         self.settlement_type_id = self.params['settlement_type_id']
@@ -46,26 +84,51 @@ class PopulationForecaster:
         self.all_ages_list = list(range(0, 100))  # 0...99
         self.open_age_group = 100  # Возраст 100 и старше
         self.warnings = []
+        # Заполняются в _prepare_coefficients_and_migration; по ним можно пересчитать коэффициенты
+        # по другому сценарию без повторной обработки исходных данных (см. scenario_solver.py)
+        self.coefficient_processor: Optional[CoefficientProcessor] = None
+        self.migration_processor: Optional[MigrationProcessor] = None
+
+    def _get_input_data(self, dataset_key: str, loader):
+        if self.preloaded_data is not None:
+            return self.preloaded_data.get(dataset_key, {})
+        return loader()
 
     def _prepare_coefficients_and_migration(self) -> Dict[str, Any]:
         logger.info("Начало подготовки коэффициентов и миграции...")
 
-        hist_pop_for_deaths = self.data_provider.get_historical_population_for_death_rates(
-            self.hist_data_request_start_year, self.hist_data_request_end_year,
-            self.region_ids, self.settlement_type_id, SEX_TOTAL_CODE
-        )
-        hist_death_counts = self.data_provider.get_historical_death_counts_data(
-            self.hist_data_request_start_year, self.hist_data_request_end_year,
-            self.region_ids, self.settlement_type_id, SEX_TOTAL_CODE
-        )
-        hist_birth_counts = self.data_provider.get_historical_birth_rates_data(
-            self.hist_data_request_start_year, self.hist_data_request_end_year,
-            self.region_ids, self.settlement_type_id
-        )
-        hist_female_pop_for_births = self.data_provider.get_historical_female_population_for_birth_rates(
-            self.hist_data_request_start_year, self.hist_data_request_end_year,
-            self.region_ids, self.settlement_type_id
-        )
+        if self.preloaded_data is not None and DATASET_BIRTH_RATE_COMPONENTS in self.preloaded_data:
+            # Набор загружен из таблицы historical_rates: коэффициенты считаются по готовым числителям
+            # и знаменателям, числа событий и многолетнее население не нужны
+            hist_pop_for_deaths, hist_death_counts, hist_birth_counts, hist_female_pop_for_births = {}, {}, {}, {}
+            birth_rate_components = self.preloaded_data[DATASET_BIRTH_RATE_COMPONENTS]
+            death_rate_components = self.preloaded_data.get(DATASET_DEATH_RATE_COMPONENTS, {})
+        else:
+            birth_rate_components = death_rate_components = None
+            hist_pop_for_deaths = self._get_input_data(
+                DATASET_POPULATION_FOR_DEATHS,
+                lambda: self.data_provider.get_historical_population_for_death_rates(
+                    self.hist_data_request_start_year, self.hist_data_request_end_year,
+                    self.region_ids, self.settlement_type_id, SEX_TOTAL_CODE
+                ))
+            hist_death_counts = self._get_input_data(
+                DATASET_DEATH_COUNTS,
+                lambda: self.data_provider.get_historical_death_counts_data(
+                    self.hist_data_request_start_year, self.hist_data_request_end_year,
+                    self.region_ids, self.settlement_type_id, SEX_TOTAL_CODE
+                ))
+            hist_birth_counts = self._get_input_data(
+                DATASET_BIRTH_COUNTS,
+                lambda: self.data_provider.get_historical_birth_rates_data(
+                    self.hist_data_request_start_year, self.hist_data_request_end_year,
+                    self.region_ids, self.settlement_type_id
+                ))
+            hist_female_pop_for_births = self._get_input_data(
+                DATASET_FEMALE_POPULATION_FOR_BIRTHS,
+                lambda: self.data_provider.get_historical_female_population_for_birth_rates(
+                    self.hist_data_request_start_year, self.hist_data_request_end_year,
+                    self.region_ids, self.settlement_type_id
+                ))
 
         coeff_processor = CoefficientProcessor(
             historical_birth_counts=hist_birth_counts,
@@ -75,8 +138,11 @@ class PopulationForecaster:
             forecast_start_year=self.forecast_start_year,
             forecast_end_year=self.forecast_end_year,
             all_ages_list=self.all_ages_list,
-            open_age_group=self.open_age_group
+            open_age_group=self.open_age_group,
+            historical_birth_rate_components=birth_rate_components,
+            historical_death_rate_components=death_rate_components
         )
+        self.coefficient_processor = coeff_processor
 
         forecasted_birth_rates = coeff_processor.get_forecasted_birth_rates(
             scenario=self.params['birth_rate_scenario'],
@@ -117,12 +183,14 @@ class PopulationForecaster:
             pop_for_mig_dist_year = self.initial_population_data_year  # Используем год начального населения для структуры
 
             logger.debug(f"Загрузка населения для распределения миграции за {pop_for_mig_dist_year} год...")
-            initial_pop_for_migration_raw = self.data_provider.get_initial_population(
-                year=pop_for_mig_dist_year,
-                region_ids=self.region_ids,
-                settlement_type_id=self.settlement_type_id,
-                sex_code=SEX_TOTAL_CODE
-            )
+            initial_pop_for_migration_raw = self._get_input_data(
+                DATASET_INITIAL_POPULATION,
+                lambda: self.data_provider.get_initial_population(
+                    year=pop_for_mig_dist_year,
+                    region_ids=self.region_ids,
+                    settlement_type_id=self.settlement_type_id,
+                    sex_code=SEX_TOTAL_CODE
+                ))
             initial_pop_for_migration_dist = {SEX_MALE_CODE: {}, SEX_FEMALE_CODE: {}}
             for age, sex_data in initial_pop_for_migration_raw.items():
                 if SEX_MALE_CODE in sex_data: initial_pop_for_migration_dist[SEX_MALE_CODE][age] = sex_data[
@@ -130,10 +198,12 @@ class PopulationForecaster:
                 if SEX_FEMALE_CODE in sex_data: initial_pop_for_migration_dist[SEX_FEMALE_CODE][age] = sex_data[
                     SEX_FEMALE_CODE]
 
-            hist_mig_saldo_raw = self.data_provider.get_historical_migration_saldo(
-                self.hist_data_request_start_year, self.hist_data_request_end_year,
-                self.region_ids, self.settlement_type_id, SEX_TOTAL_CODE
-            )
+            hist_mig_saldo_raw = self._get_input_data(
+                DATASET_MIGRATION_SALDO,
+                lambda: self.data_provider.get_historical_migration_saldo(
+                    self.hist_data_request_start_year, self.hist_data_request_end_year,
+                    self.region_ids, self.settlement_type_id, SEX_TOTAL_CODE
+                ))
 
             mig_processor = MigrationProcessor(
                 historical_migration_saldo_raw=hist_mig_saldo_raw,
@@ -143,6 +213,7 @@ class PopulationForecaster:
                 all_ages_list=self.all_ages_list,
                 open_age_group=self.open_age_group
             )
+            self.migration_processor = mig_processor
             forecasted_migration_male = mig_processor.get_forecasted_migration_saldo(
                 SEX_MALE_CODE, self.params['migration_scenario'], self.params.get('migration_manual_change_percent')
             )
@@ -162,38 +233,26 @@ class PopulationForecaster:
             "migration_female": forecasted_migration_female,
         }
 
-    def run_forecast(self) -> Dict[str, Any]:
-        logger.info(f"Запуск демографического прогноза с {self.forecast_start_year} по {self.forecast_end_year}...")
-
-        # 1. Получение исходного населения.
-
-        if self.forecast_start_year != self.initial_population_data_year + 1:
-            warning_msg = (
-                f"Несоответствие годов! Год начала прогноза ({self.forecast_start_year}) должен быть на один год позже "
-                f"года последних данных о населении ({self.initial_population_data_year}). "
-                f"Для корректного прогноза, пожалуйста, скорректируйте входные параметры."
-            )
-            self.warnings.append(warning_msg)
-            logger.error(warning_msg)
-
-            return self._format_results([], self.warnings)
-
+    def load_initial_population(self) -> Optional[Dict[str, Dict[int, float]]]:
+        """Население на начало прогноза {пол: {возраст: численность}}; None, если его нет."""
         logger.info(
             f"Загрузка исходного населения за {self.initial_population_data_year} год (используется как население на начало {self.forecast_start_year})...")
 
-        initial_pop_raw = self.data_provider.get_initial_population(
-            year=self.initial_population_data_year,  # Год, ЗА который есть данные о населении
-            region_ids=self.region_ids,
-            settlement_type_id=self.settlement_type_id,
-            sex_code=SEX_TOTAL_CODE
-        )
+        initial_pop_raw = self._get_input_data(
+            DATASET_INITIAL_POPULATION,
+            lambda: self.data_provider.get_initial_population(
+                year=self.initial_population_data_year,  # Год, ЗА который есть данные о населении
+                region_ids=self.region_ids,
+                settlement_type_id=self.settlement_type_id,
+                sex_code=SEX_TOTAL_CODE
+            ))
 
         current_population = {SEX_MALE_CODE: defaultdict(int), SEX_FEMALE_CODE: defaultdict(int)}
         if not initial_pop_raw:
             self.warnings.append(
                 f"Не удалось загрузить исходное население за {self.initial_population_data_year} год. Прогноз невозможен.")
             logger.error(f"Исходное население за {self.initial_population_data_year} не найдено.")
-            return self._format_results([], self.warnings)
+            return None
 
         for age, sex_data in initial_pop_raw.items():
             try:
@@ -202,11 +261,16 @@ class PopulationForecaster:
                 continue
             if SEX_MALE_CODE in sex_data: current_population[SEX_MALE_CODE][age_int] = sex_data[SEX_MALE_CODE]
             if SEX_FEMALE_CODE in sex_data: current_population[SEX_FEMALE_CODE][age_int] = sex_data[SEX_FEMALE_CODE]
+        return current_population
 
-        prepared_data = self._prepare_coefficients_and_migration()
+    def project_population(self, current_population: Dict[str, Dict[int, float]],
+                           prepared_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Передвижка возрастов по годам прогноза: [{'year', 'population_by_sex_age'}] на конец каждого года."""
         forecast_results_over_time = []
 
         for year_t in range(self.forecast_start_year, self.forecast_end_year + 1):
+            if self.should_cancel is not None and self.should_cancel():
+                raise ForecastCancelled(f"Прогноз остановлен перед расчетом {year_t} года.")
             logger.debug(f"Прогнозирование для года {year_t} (результат на конец года / начало {year_t + 1})...")
             population_next_year = {SEX_MALE_CODE: defaultdict(int), SEX_FEMALE_CODE: defaultdict(int)}
 
@@ -295,27 +359,43 @@ class PopulationForecaster:
             })
             current_population = copy.deepcopy(population_next_year)
 
-        logger.info("Демографический прогноз завершен.")
-        return self._format_results(forecast_results_over_time, self.warnings)
+        return forecast_results_over_time
 
-    def _format_results(self,
-                        forecast_data_by_year: List[Dict[str, Any]],
-                        warnings: List[str]  # Это список предупреждений, собранных ДО этого метода
-                        ) -> Dict[str, Any]:
+    def run_forecast(self) -> Dict[str, Any]:
+        logger.info(f"Запуск демографического прогноза с {self.forecast_start_year} по {self.forecast_end_year}...")
 
-        # Создаем копию списка warnings, чтобы не изменять оригинал напрямую, если он передан извне
-        # или если warnings может быть None
-        current_warnings: List[str] = list(warnings) if warnings is not None else []
+        # 1. Получение исходного населения.
 
-        output_results = []
-        target_sex = self.params.get('sex_code_target')  # Используем .get
+        if self.forecast_start_year != self.initial_population_data_year + 1:
+            warning_msg = (
+                f"Несоответствие годов! Год начала прогноза ({self.forecast_start_year}) должен быть на один год позже "
+                f"года последних данных о населении ({self.initial_population_data_year}). "
+                f"Для корректного прогноза, пожалуйста, скорректируйте входные параметры."
+            )
+            self.warnings.append(warning_msg)
+            logger.error(warning_msg)
+
+            return self._format_results([], self.warnings)
+
+        current_population = self.load_initial_population()
+        if current_population is None:
+            return self._format_results([], self.warnings)
+
+        prepared_data = self._prepare_coefficients_and_migration()
+        forecast_results_over_time = self.project_population(current_population, prepared_data)
+
+        logger.info("Демографический прогноз завершен.")
+        return self._format_results(forecast_results_over_time, self.warnings)
+
+    def resolve_target_single_ages(self, current_warnings: List[str]) -> List[int]:
+        """
+        Однолетние возрасты целевой группы (target_age_group_input). При некорректной группе - все возрасты,
+        предупреждение добавляется в current_warnings.
+        """
         # Получаем значение, которое пришло для возрастной группы
         target_age_group_input_val = self.params.get('target_age_group_input')
-        output_detailed_by_age = self.params.get('output_detailed_by_age', False)
-
         logger.debug(
             f"FORECASTER _format_results: Получено target_age_group_input: {target_age_group_input_val} (тип: {type(target_age_group_input_val)})")
-        logger.debug(f"FORECASTER _format_results: output_detailed_by_age: {output_detailed_by_age}")
 
         target_single_ages: List[int] = []
 
@@ -385,36 +465,82 @@ class PopulationForecaster:
             )
             target_single_ages = self.all_ages_list + [self.open_age_group]
 
-        # --- Дальнейшая обработка и формирование результатов ---
-        # (Этот блок кода остается как в вашем оригинале, я просто скопирую его для полноты)
-        for year_data in forecast_data_by_year:
-            year_val = year_data['year']
-            pop_by_sex_age_for_year = year_data['population_by_sex_age']
+        return target_single_ages
 
-            yearly_result_item: Dict[str, Any] = {"year": year_val}  # Явная типизация
-            total_pop_in_target_group_for_year = 0
-            population_by_age_output: List[Dict[str, Any]] = []
+    def resolve_age_bands(self, current_warnings: List[str]) -> List[Tuple[str, int, int]]:
+        """
+        Именованные возрастные группы из target_age_bands ([[название, первый возраст, последний возраст], ...];
+        последний возраст >= open_age_group - включая "100 и старше"). Некорректные группы пропускаются
+        с предупреждением в current_warnings.
+        """
+        age_bands: List[Tuple[str, int, int]] = []
+        for age_band in self.params.get('target_age_bands') or []:
+            try:
+                band_name, band_start_age, band_end_age = age_band
+                band_start_age, band_end_age = int(band_start_age), int(band_end_age)
+            except (ValueError, TypeError):
+                current_warnings.append(f"Некорректная возрастная группа: {age_band}. Группа пропущена.")
+                continue
+            if not 0 <= band_start_age <= min(band_end_age, self.open_age_group):
+                current_warnings.append(
+                    f"Некорректный диапазон возрастной группы '{band_name}': ({band_start_age}, {band_end_age}). "
+                    f"Группа пропущена.")
+                continue
+            age_bands.append((str(band_name), band_start_age, min(band_end_age, self.open_age_group)))
+        return age_bands
 
-            # Убедимся, что SEX_MALE_CODE, SEX_FEMALE_CODE, SEX_TOTAL_CODE импортированы или определены в классе/глобально
-            sexes_to_iterate = [SEX_MALE_CODE, SEX_FEMALE_CODE] if target_sex == SEX_TOTAL_CODE else [target_sex]
+    def _population_by_age_output(self, population_by_age: List[float], first_age: int,
+                                  last_age: int) -> List[Dict[str, Any]]:
+        return [{"age": str(age) if age != self.open_age_group else f"{self.open_age_group}+",
+                 "population": round(population_by_age[age])}
+                for age in range(first_age, last_age + 1)]
 
-            for age_val in target_single_ages:
-                pop_for_age_val_target_sex = 0
-                for sex_iter in sexes_to_iterate:
-                    pop_for_age_val_target_sex += pop_by_sex_age_for_year.get(sex_iter, {}).get(age_val, 0)
+    def _format_results(self,
+                        forecast_data_by_year: List[Dict[str, Any]],
+                        warnings: List[str]  # Это список предупреждений, собранных ДО этого метода
+                        ) -> Dict[str, Any]:
 
-                total_pop_in_target_group_for_year += pop_for_age_val_target_sex
+        # Создаем копию списка warnings, чтобы не изменять оригинал напрямую, если он передан извне
+        # или если warnings может быть None
+        current_warnings: List[str] = list(warnings) if warnings is not None else []
 
-                if output_detailed_by_age:
-                    age_label = str(age_val) if age_val != self.open_age_group else f"{self.open_age_group}+"
-                    population_by_age_output.append({
-                        "age": age_label,
-                        "population": round(pop_for_age_val_target_sex)
-                    })
+        output_results = []
+        target_sex = self.params.get('sex_code_target')  # Используем .get
+        output_detailed_by_age = self.params.get('output_detailed_by_age', False)
+        logger.debug(f"FORECASTER _format_results: output_detailed_by_age: {output_detailed_by_age}")
+
+        target_single_ages = self.resolve_target_single_ages(current_warnings)
+
+        age_bands = self.resolve_age_bands(current_warnings)
+        # Целевая группа - непрерывный диапазон возрастов, ее численность и численность каждой именованной
+        # группы - разность накопленных по возрасту сумм
+        first_target_age, last_target_age = target_single_ages[0], target_single_ages[-1]
+        sexes_to_iterate = [SEX_MALE_CODE, SEX_FEMALE_CODE] if target_sex == SEX_TOTAL_CODE else [target_sex]
 
-            yearly_result_item["total_population_in_target_group"] = round(total_pop_in_target_group_for_year)
+        for year_data in forecast_data_by_year:
+            population_by_age_for_year = population_by_single_age(
+                year_data['population_by_sex_age'], sexes_to_iterate, self.open_age_group)
+            cumulative_population = cumulative_population_by_age(population_by_age_for_year)
+
+            yearly_result_item: Dict[str, Any] = {"year": year_data['year']}  # Явная типизация
+            yearly_result_item["total_population_in_target_group"] = round(
+                cumulative_population[last_target_age + 1] - cumulative_population[first_target_age])
             if output_detailed_by_age:
-                yearly_result_item["population_by_age"] = population_by_age_output
+                yearly_result_item["population_by_age"] = self._population_by_age_output(
+                    population_by_age_for_year, first_target_age, last_target_age)
+
+            if age_bands:
+                yearly_result_item["age_bands"] = []
+                for band_name, band_start_age, band_end_age in age_bands:
+                    band_item: Dict[str, Any] = {
+                        "name": band_name,
+                        "population": round(cumulative_population[band_end_age + 1]
+                                            - cumulative_population[band_start_age]),
+                    }
+                    if output_detailed_by_age:
+                        band_item["population_by_age"] = self._population_by_age_output(
+                            population_by_age_for_year, band_start_age, band_end_age)
+                    yearly_result_item["age_bands"].append(band_item)
 
             output_results.append(yearly_result_item)
 
@@ -426,5 +552,130 @@ class PopulationForecaster:
         }
 
 
+# Исходные данные «горячих» регионов, загруженные заранее при старте процесса воркера
+# (см. prefetch_hot_region_datasets). Ключ: (region_id, settlement_type_id, hist_start, hist_end).
+# Наборы загружаются вместе с миграцией и поэтому подходят и для прогнозов без нее.
+# При смене версии данных (загрузка новых данных) наборы сбрасываются.
+_hot_region_datasets: Dict[Tuple, Dict[str, Any]] = {}
+_hot_region_datasets_version: Optional[str] = None
+
+
+def historical_rates_table_enabled() -> bool:
+    """Исторические коэффициенты берутся из таблицы historical_rates (команда build_historical_rates)."""
+    return bool(getattr(settings, 'FORECAST_USE_HISTORICAL_RATES_TABLE', False))
+
+
+def prefetch_hot_region_datasets(region_ids: List[int], settlement_type_ids: List[int],
+                                 hist_start_year: int, hist_end_year: int,
+                                 data_provider: Optional[DBDataProvider] = None) -> int:
+    """Загружает в память процесса исходные данные для регионов. Возвращает число загруженных наборов."""
+    global _hot_region_datasets_version
+    data_provider = data_provider or DBDataProvider()
+    data_version = get_data_version()
+    if data_version != _hot_region_datasets_version:
+        _hot_region_datasets.clear()
+        _hot_region_datasets_version = data_version
+
+    for settlement_id in settlement_type_ids:
+        region_datasets = data_provider.get_historical_datasets_by_region(
+            start_year=hist_start_year,
+            end_year=hist_end_year,
+            initial_population_year=hist_end_year,
+            region_ids=list(region_ids),
+            settlement_type_id=settlement_id,
+            include_migration=True,
+            use_rates_table=historical_rates_table_enabled()
+        )
+        for region_id, dataset in region_datasets.items():
+            _hot_region_datasets[(region_id, settlement_id, hist_start_year, hist_end_year)] = dataset
+    return len(_hot_region_datasets)
+
+
+def _get_hot_region_datasets(region_ids: List[int], settlement_id: int,
+                             hist_start: int, hist_end: int) -> Dict[int, Dict[str, Any]]:
+    """Заранее загруженные наборы для тех регионов из region_ids, для которых они есть."""
+    global _hot_region_datasets_version
+    if not _hot_region_datasets:
+        return {}
+    if get_data_version() != _hot_region_datasets_version:
+        logger.info("Версия данных изменилась, заранее загруженные данные регионов сброшены.")
+        _hot_region_datasets.clear()
+        _hot_region_datasets_version = None
+        return {}
+    hot_datasets = {}
+    for region_id in region_ids:
+        dataset = _hot_region_datasets.get((region_id, settlement_id, hist_start, hist_end))
+        if dataset is not None:
+            hot_datasets[region_id] = dataset
+    return hot_datasets
+
+
+def input_data_key(forecast_params: Dict[str, Any]) -> Tuple:
+    """Ключ, по которому конфигурации прогноза с одинаковыми исходными данными используют общий набор."""
+    return (
+        tuple(forecast_params['region_ids']),
+        forecast_params['settlement_type_id'],
+        forecast_params['historical_data_start_year'],
+        forecast_params['historical_data_end_year'],
+        bool(forecast_params.get('include_migration', False)),
+    )
+
+
+def preload_input_data_for_configurations(
+        run_configurations: List[Dict[str, Any]],
+        data_provider: Optional[DBDataProvider] = None
+) -> Dict[Tuple, Dict[str, Any]]:
+    """
+    Загружает исходные данные для всех конфигураций прогноза: один набор запросов
+    на каждый тип поселения (все регионы сразу, с группировкой по reg).
+    Наборы для групп из нескольких регионов суммируются в памяти.
+    Регионы, данные которых уже загружены при старте процесса, из БД не запрашиваются.
+    Возвращает {input_data_key(params): dataset}.
+    """
+    data_provider = data_provider or DBDataProvider()
+
+    # (settlement, hist_start, hist_end, include_migration) -> множество регионов
+    region_ids_by_fetch: Dict[Tuple, List[int]] = {}
+    for run_spec in run_configurations:
+        region_ids, settlement_id, hist_start, hist_end, include_migration = input_data_key(run_spec['params'])
+        fetch_region_ids = region_ids_by_fetch.setdefault((settlement_id, hist_start, hist_end, include_migration), [])
+        for region_id in region_ids:
+            if region_id not in fetch_region_ids:
+                fetch_region_ids.append(region_id)
+
+    datasets_by_fetch: Dict[Tuple, Dict[int, Dict[str, Any]]] = {}
+    for fetch_key, fetch_region_ids in region_ids_by_fetch.items():
+        settlement_id, hist_start, hist_end, include_migration = fetch_key
+        region_datasets = _get_hot_region_datasets(fetch_region_ids, settlement_id, hist_start, hist_end)
+        missing_region_ids = [region_id for region_id in fetch_region_ids if region_id not in region_datasets]
+        if missing_region_ids:
+            region_datasets.update(data_provider.get_historical_datasets_by_region(
+                start_year=hist_start,
+                end_year=hist_end,
+                initial_population_year=hist_end,
+                region_ids=missing_region_ids,
+                settlement_type_id=settlement_id,
+                include_migration=include_migration,
+                use_rates_table=historical_rates_table_enabled()
+            ))
+        datasets_by_fetch[fetch_key] = region_datasets
+
+    preloaded: Dict[Tuple, Dict[str, Any]] = {}
+    for run_spec in run_configurations:
+        data_key = input_data_key(run_spec['params'])
+        if data_key in preloaded:
+            continue
+        region_ids, settlement_id, hist_start, hist_end, include_migration = data_key
+        region_datasets = datasets_by_fetch[(settlement_id, hist_start, hist_end, include_migration)]
+        if len(region_ids) == 1:
+            preloaded[data_key] = region_datasets[region_ids[0]]
+        else:
+            preloaded[data_key] = sum_region_datasets([region_datasets[rid] for rid in region_ids])
+
+    logger.info(
+        f"Исходные данные загружены для {len(preloaded)} наборов конфигураций за {len(region_ids_by_fetch)} выборок.")
+    return preloaded
+
+
 if __name__ == '__main__':
     print("PopulationForecaster - для тестирования запустите через Django или отдельный тестовый скрипт.")
\ No newline at end of file
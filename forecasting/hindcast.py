@@ -0,0 +1,228 @@
+# forecasting/hindcast.py
+
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Tuple
+
+from billiard.pool import Pool
+from django.conf import settings
+
+from .data_providers.db_data_provider import DBDataProvider, SEX_MALE_CODE, SEX_FEMALE_CODE, \
+    DATASET_INITIAL_POPULATION, DATASET_POPULATION_FOR_DEATHS, DATASET_FEMALE_POPULATION_FOR_BIRTHS, \
+    DATASET_DEATH_COUNTS, DATASET_BIRTH_COUNTS, DATASET_MIGRATION_SALDO
+from .forecaster import PopulationForecaster, cumulative_population_by_age, population_by_single_age
+
+logger = logging.getLogger(__name__)
+
+# Ретроспективная проверка (hindcast) сценариев: прогноз по скользящим историческим окнам
+# (например, коэффициенты по 2012-2016, прогноз на 2017-2022) сравнивается с фактическим населением.
+# Исходные данные загружаются один раз на тип поселения за весь период и нарезаются по окнам в памяти;
+# прогнозы одного региона и типа поселения (все окна и сценарии) выполняются одним заданием пула процессов.
+# Возрастные группы для ошибок: (название, первый возраст, последний возраст; 100 - "100 и старше")
+HINDCAST_AGE_BANDS = (
+    ('0-14', 0, 14),
+    ('15-64', 15, 64),
+    ('65+', 65, 100),
+    ('Все возрасты', 0, 100),
+)
+HINDCAST_OPEN_AGE_GROUP = 100
+
+# Глубина вложенности словарей набора исходных данных до словаря {год: значение}
+_DATASET_YEAR_DEPTHS = {
+    DATASET_POPULATION_FOR_DEATHS: 2,  # {sex: {age: {year: ...}}}
+    DATASET_FEMALE_POPULATION_FOR_BIRTHS: 1,  # {age: {year: ...}}
+    DATASET_DEATH_COUNTS: 2,  # {sex: {age: {year: ...}}}
+    DATASET_BIRTH_COUNTS: 1,  # {mother_age: {year: ...}}
+    DATASET_MIGRATION_SALDO: 2,  # {sex: {(age_start, age_end): {year: ...}}}
+}
+
+
+def hindcast_windows(first_year: int, last_year: int, fit_years: int) -> List[Tuple[int, int]]:
+    """Окна (начало, конец) исторических данных длиной fit_years, после каждого - хотя бы год для проверки."""
+    return [(fit_end - fit_years + 1, fit_end) for fit_end in range(first_year + fit_years - 1, last_year)]
+
+
+def _slice_years(data: Dict, depth: int, start_year: int, end_year: int) -> Dict:
+    if depth == 0:
+        return {year: value for year, value in data.items() if start_year <= year <= end_year}
+    return {key: _slice_years(value, depth - 1, start_year, end_year) for key, value in data.items()}
+
+
+def slice_dataset(dataset: Dict[str, Any], start_year: int, end_year: int) -> Dict[str, Any]:
+    """
+    Набор исходных данных для окна start_year-end_year из набора за весь период (use_rates_table=False):
+    то же, что get_historical_datasets_by_region вернул бы для этого окна.
+    """
+    window_dataset = {dataset_key: _slice_years(dataset.get(dataset_key, {}), depth, start_year, end_year)
+                      for dataset_key, depth in _DATASET_YEAR_DEPTHS.items()}
+    initial_population: Dict[int, Dict[str, int]] = {}
+    for sex_code, population_by_age in dataset.get(DATASET_POPULATION_FOR_DEATHS, {}).items():
+        for age, population_by_year in population_by_age.items():
+            if end_year in population_by_year:
+                initial_population.setdefault(age, {})[sex_code] = population_by_year[end_year]
+    window_dataset[DATASET_INITIAL_POPULATION] = initial_population
+    return window_dataset
+
+
+def _band_totals(population_by_sex_age: Dict[str, Dict[int, float]]) -> Dict[str, float]:
+    cumulative_population = cumulative_population_by_age(population_by_single_age(
+        population_by_sex_age, [SEX_MALE_CODE, SEX_FEMALE_CODE], HINDCAST_OPEN_AGE_GROUP))
+    return {band_name: cumulative_population[last_age + 1] - cumulative_population[first_age]
+            for band_name, first_age, last_age in HINDCAST_AGE_BANDS}
+
+
+def _actual_band_totals(dataset: Dict[str, Any], year: int) -> Optional[Dict[str, float]]:
+    population_for_deaths = dataset.get(DATASET_POPULATION_FOR_DEATHS, {})
+    population_by_sex_age = {
+        sex_code: {age: population_by_year[year] for age, population_by_year in population_by_age.items()
+                   if year in population_by_year}
+        for sex_code, population_by_age in population_for_deaths.items()
+    }
+    if not any(population_by_sex_age.values()):
+        return None
+    return _band_totals(population_by_sex_age)
+
+
+def run_region_hindcasts(region_id: int, settlement_id: int, dataset: Dict[str, Any],
+                         windows: List[Tuple[int, int]], scenarios: List[str], last_year: int,
+                         include_migration: bool) -> Dict[str, Any]:
+    """
+    Все прогнозы одного региона и типа поселения. Возвращает {'records': [...], 'projections', 'errors'};
+    запись - region_id, settlement_type_id, fit_start, fit_end, scenario, year, horizon, band, projected, actual.
+    """
+    records: List[Dict[str, Any]] = []
+    projections = 0
+    errors: List[str] = []
+    actual_by_year = {year: _actual_band_totals(dataset, year)
+                      for year in range(min(fit_end for _, fit_end in windows) + 1, last_year + 1)}
+    for fit_start, fit_end in windows:
+        window_dataset = slice_dataset(dataset, fit_start, fit_end)
+        for scenario in scenarios:
+            forecast_params = {
+                'region_ids': [region_id], 'settlement_type_id': settlement_id,
+                'historical_data_start_year': fit_start, 'historical_data_end_year': fit_end,
+                'forecast_start_year': fit_end + 1, 'forecast_end_year': last_year,
+                'birth_rate_scenario': scenario, 'death_rate_scenario_male': scenario,
+                'death_rate_scenario_female': scenario, 'migration_scenario': scenario,
+                'include_migration': include_migration,
+            }
+            try:
+                forecaster = PopulationForecaster(forecast_params, preloaded_data=window_dataset)
+                initial_population = forecaster.load_initial_population()
+                if initial_population is None:
+                    continue
+                forecast_data_by_year = forecaster.project_population(
+                    initial_population, forecaster._prepare_coefficients_and_migration())
+            except Exception as e:
+                errors.append(f"{region_id}/{settlement_id} {fit_start}-{fit_end} {scenario}: "
+                              f"({type(e).__name__}) {e}")
+                continue
+            projections += 1
+            for year_data in forecast_data_by_year:
+                year = year_data['year']
+                actual_totals = actual_by_year.get(year)
+                if actual_totals is None:
+                    continue
+                for band_name, projected in _band_totals(year_data['population_by_sex_age']).items():
+                    records.append({
+                        'region_id': region_id, 'settlement_type_id': settlement_id,
+                        'fit_start': fit_start, 'fit_end': fit_end, 'scenario': scenario,
+                        'year': year, 'horizon': year - fit_end, 'band': band_name,
+                        'projected': projected, 'actual': actual_totals[band_name],
+                    })
+    return {'records': records, 'projections': projections, 'errors': errors}
+
+
+# Исходные данные, переданные в процессы пула через initializer (при fork они наследуются без копирования)
+_pool_datasets: Dict[Tuple[int, int], Dict[str, Any]] = {}
+
+
+def _init_hindcast_pool_worker(datasets: Dict[Tuple[int, int], Dict[str, Any]]) -> None:
+    global _pool_datasets
+    _pool_datasets = datasets
+
+
+def _run_region_hindcasts_in_pool(job: Tuple) -> Dict[str, Any]:
+    region_id, settlement_id = job[:2]
+    return run_region_hindcasts(region_id, settlement_id, _pool_datasets[(region_id, settlement_id)], *job[2:])
+
+
+def summarize_errors(records: List[Dict[str, Any]], group_fields: Tuple[str, ...]) -> List[Dict[str, Any]]:
+    """
+    Метрики по группам записей: mape - средняя абсолютная ошибка в % от факта, mpe - средняя ошибка в %
+    (смещение: > 0 - завышение), count. Записи с нулевым фактическим населением не учитываются.
+    """
+    errors_by_group: Dict[Tuple, List[float]] = defaultdict(list)
+    for record in records:
+        if record['actual'] > 0:
+            errors_by_group[tuple(record[field] for field in group_fields)].append(
+                (record['projected'] - record['actual']) / record['actual'] * 100.0)
+    summary = []
+    for group_key, percent_errors in sorted(errors_by_group.items(), key=lambda item: str(item[0])):
+        summary.append(dict(zip(group_fields, group_key),
+                            mape=sum(abs(error) for error in percent_errors) / len(percent_errors),
+                            mpe=sum(percent_errors) / len(percent_errors),
+                            count=len(percent_errors)))
+    return summary
+
+
+def run_hindcasts(region_ids: List[int], settlement_type_ids: List[int], first_year: int, last_year: int,
+                  fit_years: List[int], scenarios: List[str], include_migration: bool = False,
+                  pool_size: Optional[int] = None,
+                  data_provider: Optional[DBDataProvider] = None) -> Dict[str, Any]:
+    """
+    Прогнозы по всем окнам (fit_years - длины окон) и сценариям (один сценарий для рождаемости, смертности
+    и миграции) для регионов и типов поселений. Возвращает {'records', 'projections', 'errors',
+    'elapsed_seconds', 'projections_per_second'}.
+    """
+    started_at = time.monotonic()
+    data_provider = data_provider or DBDataProvider()
+    windows = sorted({window for window_length in fit_years
+                      for window in hindcast_windows(first_year, last_year, window_length)})
+    if not windows:
+        raise ValueError(f"В периоде {first_year}-{last_year} нет окон длиной {fit_years} с годами для проверки.")
+
+    # Один набор запросов на тип поселения: все регионы, все годы (и для окон, и для фактических данных)
+    datasets: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for settlement_id in settlement_type_ids:
+        region_datasets = data_provider.get_historical_datasets_by_region(
+            start_year=first_year, end_year=last_year, initial_population_year=last_year,
+            region_ids=list(region_ids), settlement_type_id=settlement_id, include_migration=include_migration)
+        for region_id, dataset in region_datasets.items():
+            datasets[(region_id, settlement_id)] = dataset
+    logger.info(f"Hindcast: data loaded for {len(datasets)} region/settlement pairs, {len(windows)} windows, "
+                f"{len(scenarios)} scenarios.")
+
+    jobs = [(region_id, settlement_id, windows, scenarios, last_year, include_migration)
+            for region_id, settlement_id in datasets]
+    pool_size = pool_size or getattr(settings, 'FORECAST_PROCESS_POOL_SIZE', None) or os.cpu_count() or 1
+    pool_size = min(pool_size, len(jobs))
+    if pool_size <= 1:
+        job_results = [run_region_hindcasts(job[0], job[1], datasets[job[:2]], *job[2:]) for job in jobs]
+    else:
+        pool = Pool(processes=pool_size, initializer=_init_hindcast_pool_worker, initargs=(datasets,))
+        try:
+            async_results = [pool.apply_async(_run_region_hindcasts_in_pool, (job,)) for job in jobs]
+            job_results = [async_result.get() for async_result in async_results]
+        finally:
+            pool.close()
+            pool.join()
+
+    records: List[Dict[str, Any]] = []
+    errors: List[str] = []
+    projections = 0
+    for job_result in job_results:
+        records.extend(job_result['records'])
+        errors.extend(job_result['errors'])
+        projections += job_result['projections']
+
+    elapsed_seconds = time.monotonic() - started_at
+    return {
+        'records': records,
+        'projections': projections,
+        'errors': errors,
+        'elapsed_seconds': round(elapsed_seconds, 3),
+        'projections_per_second': round(projections / elapsed_seconds, 2) if elapsed_seconds > 0 else 0.0,
+    }
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from forecasting.default_forecasts import default_forecast_input_hashes
+from forecasting.shared_results import cleanup_shared_results
+
+
+class Command(BaseCommand):
+    help = ('Удаляет общие файлы результатов прогнозов и строки результатов, на которые не ссылается история: '
+            'записанные до последней загрузки данных или старше FORECAST_SHARED_RESULT_MAX_AGE_SECONDS. '
+            'Прогнозы по умолчанию для текущей версии данных не удаляются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-hours', type=float, default=None,
+                            help="Удалять файлы без ссылок старше стольких часов "
+                                 "(по умолчанию FORECAST_SHARED_RESULT_MAX_AGE_SECONDS).")
+
+    def handle(self, *args, **options):
+        max_age_seconds = int(options['max_age_hours'] * 3600) if options['max_age_hours'] is not None else None
+        stats = cleanup_shared_results(protected_hashes=default_forecast_input_hashes(),
+                                       max_age_seconds=max_age_seconds)
+        self.stdout.write(self.style.SUCCESS("--- Итоги очистки общих результатов ---"))
+        self.stdout.write(f"Удалено файлов: {stats['files_deleted']}, оставлено: {stats['files_kept']}")
+        self.stdout.write(f"Удалено строк результатов для хешей: {stats['row_hashes_deleted']}")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from forecasting.default_forecasts import precompute_default_forecasts
+
+
+class Command(BaseCommand):
+    help = ('Рассчитывает прогнозы с параметрами по умолчанию для всех регионов карты и типов поселений '
+            'и сохраняет их в общие файлы результатов (запросы из формы с этими параметрами не ставятся в очередь).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--regions', default='',
+                            help="Коды регионов карты через запятую (например, RU-MOW,RU-SPE); по умолчанию - все.")
+        parser.add_argument('--force', action='store_true',
+                            help="Пересчитать и уже сохраненные результаты.")
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Запросов в пакете с общей загрузкой данных (FORECAST_PRECOMPUTE_BATCH_SIZE).")
+
+    def handle(self, *args, **options):
+        map_codes = [code.strip() for code in options['regions'].split(',') if code.strip()] or None
+        self.stdout.write(self.style.SUCCESS("Начало расчета прогнозов по умолчанию..."))
+
+        stats = precompute_default_forecasts(map_codes=map_codes, force=options['force'],
+                                             batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS("\n--- Итоги расчета прогнозов по умолчанию ---"))
+        self.stdout.write(f"Запросов (регион x тип поселения): {stats['plans']}")
+        self.stdout.write(f"Уже были сохранены: {stats['already_stored']}")
+        self.stdout.write(f"Рассчитано и сохранено: {stats['stored']}")
+        if stats['failed']:
+            self.stdout.write(self.style.WARNING(f"Не удалось рассчитать: {stats['failed']}"))
+        self.stdout.write(f"Конфигураций прогноза: {stats['configurations']}")
+        self.stdout.write(f"Время: {stats['elapsed_seconds']:.2f} с")
+        self.stdout.write(f"Пропускная способность: {stats['forecasts_per_second']:.2f} прогнозов/с, "
+                          f"{stats['configurations_per_second']:.2f} конфигураций/с")
@@ -0,0 +1,97 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from data_collector import region_registry
+from forecasting.hindcast import run_hindcasts, summarize_errors
+from forecasting.tasks import DEFAULT_HISTORICAL_START_YEAR, DEFAULT_HISTORICAL_END_YEAR, ID_SETTLEMENT_URBAN, \
+    ID_SETTLEMENT_RURAL, SCENARIO_LAST_YEAR, SCENARIO_HISTORICAL_TREND
+
+HINDCAST_SCENARIOS = (SCENARIO_LAST_YEAR, SCENARIO_HISTORICAL_TREND)
+CSV_FIELDS = ('region_id', 'settlement_type_id', 'fit_start', 'fit_end', 'scenario', 'year', 'horizon', 'band',
+              'projected', 'actual')
+
+
+def _int_list(value: str):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+class Command(BaseCommand):
+    help = ('Ретроспективная проверка сценариев (hindcast): прогнозы по скользящим историческим окнам '
+            'сравниваются с фактическим населением; выводятся ошибки по сценариям, регионам, '
+            'возрастным группам и горизонту прогноза.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--regions', default='',
+                            help="Коды регионов карты через запятую (например, RU-MOW,RU-SPE); по умолчанию - все.")
+        parser.add_argument('--settlement-types', default=f"{ID_SETTLEMENT_URBAN},{ID_SETTLEMENT_RURAL}",
+                            help="id типов поселений через запятую.")
+        parser.add_argument('--first-year', type=int, default=DEFAULT_HISTORICAL_START_YEAR)
+        parser.add_argument('--last-year', type=int, default=DEFAULT_HISTORICAL_END_YEAR,
+                            help="Последний год с фактическими данными (конец всех прогнозов).")
+        parser.add_argument('--fit-years', default='5',
+                            help="Длины окон исторических данных через запятую, например 3,5.")
+        parser.add_argument('--scenarios', default=','.join(HINDCAST_SCENARIOS),
+                            help="Сценарии через запятую (один сценарий для рождаемости, смертности и миграции).")
+        parser.add_argument('--include-migration', action='store_true')
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Процессов в пуле (по умолчанию FORECAST_PROCESS_POOL_SIZE или число ядер).")
+        parser.add_argument('--csv', default='', help="Файл для записи всех сравнений (прогноз/факт).")
+
+    def handle(self, *args, **options):
+        if options['regions']:
+            map_codes = [code.strip() for code in options['regions'].split(',') if code.strip()]
+            region_ids_by_map_code = region_registry.get_region_ids_by_map_codes(map_codes)
+            for map_code in map_codes:
+                if map_code not in region_ids_by_map_code:
+                    self.stdout.write(self.style.WARNING(f"Код региона '{map_code}' не найден и будет пропущен."))
+        else:
+            region_ids_by_map_code = region_registry.get_map_code_to_region_id_map(map_code_prefix='RU-')
+        region_ids = sorted(set(region_ids_by_map_code.values()))
+        scenarios = [scenario.strip() for scenario in options['scenarios'].split(',') if scenario.strip()]
+        for scenario in scenarios:
+            if scenario not in HINDCAST_SCENARIOS:
+                raise CommandError(f"Неизвестный сценарий: {scenario}. Доступны: {', '.join(HINDCAST_SCENARIOS)}.")
+        if not region_ids:
+            raise CommandError("Не найдено ни одного региона.")
+
+        self.stdout.write(self.style.SUCCESS(f"Начало ретроспективной проверки ({len(region_ids)} регионов)..."))
+        try:
+            hindcast = run_hindcasts(
+                region_ids, _int_list(options['settlement_types']), options['first_year'], options['last_year'],
+                _int_list(options['fit_years']), scenarios, include_migration=options['include_migration'],
+                pool_size=options['workers'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        records = hindcast['records']
+        if options['csv']:
+            with open(options['csv'], 'w', newline='', encoding='utf-8') as csv_file:
+                writer = csv.DictWriter(csv_file, fieldnames=CSV_FIELDS)
+                writer.writeheader()
+                writer.writerows(records)
+            self.stdout.write(f"Сравнения записаны в {options['csv']} ({len(records)} строк).")
+
+        self._write_summary("По сценариям", summarize_errors(records, ('scenario',)))
+        self._write_summary("По горизонту прогноза (лет)", summarize_errors(records, ('scenario', 'horizon')))
+        self._write_summary("По возрастным группам", summarize_errors(records, ('scenario', 'band')))
+        region_summary = summarize_errors(
+            [record for record in records if record['band'] == 'Все возрасты'], ('scenario', 'region_id'))
+        for summary_row in region_summary:
+            summary_row['region_id'] = region_registry.get_region_name(summary_row['region_id']) or \
+                                       summary_row['region_id']
+        self._write_summary("По регионам (все возрасты)", region_summary)
+
+        for error in hindcast['errors']:
+            self.stdout.write(self.style.WARNING(f"Ошибка прогноза {error}"))
+        self.stdout.write(self.style.SUCCESS("\n--- Итоги ретроспективной проверки ---"))
+        self.stdout.write(f"Прогнозов: {hindcast['projections']}, ошибок: {len(hindcast['errors'])}")
+        self.stdout.write(f"Время: {hindcast['elapsed_seconds']:.2f} с "
+                          f"({hindcast['projections_per_second']:.2f} прогнозов/с)")
+
+    def _write_summary(self, title: str, summary):
+        self.stdout.write(self.style.SUCCESS(f"\n{title}: MAPE, % / смещение, % / сравнений"))
+        for summary_row in summary:
+            group = ' / '.join(str(value) for key, value in summary_row.items() if key not in ('mape', 'mpe', 'count'))
+            self.stdout.write(f"  {group}: {summary_row['mape']:.2f} / {summary_row['mpe']:+.2f} / "
+                              f"{summary_row['count']}")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forecasting', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forecastrun',
+            name='input_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True, verbose_name='Хеш входных параметров'),
+        ),
+    ]
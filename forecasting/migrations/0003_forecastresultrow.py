@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forecasting', '0002_forecastrun_input_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastResultRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('input_hash', models.CharField(max_length=64, verbose_name='Хеш входных параметров')),
+                ('group_title', models.CharField(max_length=255, verbose_name='Группа регионов')),
+                ('is_summary_group', models.BooleanField(default=False, verbose_name='Итоговая группа')),
+                ('settlement_type_id', models.PositiveSmallIntegerField(verbose_name='Тип поселения')),
+                ('sex_code', models.CharField(max_length=1, verbose_name='Пол')),
+                ('year', models.PositiveSmallIntegerField(verbose_name='Год')),
+                ('age', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Возраст')),
+                ('population', models.BigIntegerField(verbose_name='Численность')),
+            ],
+            options={
+                'verbose_name': 'Строка результата прогноза',
+                'verbose_name_plural': 'Строки результатов прогнозов',
+                'indexes': [models.Index(fields=['input_hash', 'group_title', 'settlement_type_id', 'sex_code', 'year', 'age'], name='forecast_result_row_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forecasting', '0003_forecastresultrow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastExportArtifact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('export_format', models.CharField(max_length=8, verbose_name='Формат')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Формируется'), ('completed', 'Готов'), ('error', 'Ошибка')], default='pending', max_length=16, verbose_name='Статус')),
+                ('file_path', models.CharField(blank=True, max_length=512, null=True, verbose_name='Путь к файлу экспорта (относительно MEDIA_ROOT)')),
+                ('file_size', models.BigIntegerField(blank=True, null=True, verbose_name='Размер файла, байт')),
+                ('total_groups', models.PositiveIntegerField(default=0, verbose_name='Всего групп регионов')),
+                ('completed_groups', models.PositiveIntegerField(default=0, verbose_name='Записано групп регионов')),
+                ('error_message', models.TextField(blank=True, default='', verbose_name='Сообщение об ошибке')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлен')),
+                ('forecast_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_artifacts', to='forecasting.forecastrun', verbose_name='Запуск прогноза')),
+            ],
+            options={
+                'verbose_name': 'Файл экспорта прогноза',
+                'verbose_name_plural': 'Файлы экспорта прогнозов',
+                'constraints': [models.UniqueConstraint(fields=('forecast_run', 'export_format'), name='forecast_export_artifact_unique')],
+            },
+        ),
+    ]
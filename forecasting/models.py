@@ -34,6 +34,15 @@ class ForecastRun(models.Model):
         verbose_name="Путь к файлу результатов (относительно MEDIA_ROOT)"
     )
 
+    # Хеш нормализованных входных параметров и версии данных (см. shared_results.compute_input_hash).
+    # Запуски с одинаковым хешем ссылаются на один общий файл результатов.
+    input_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        db_index=True,
+        verbose_name="Хеш входных параметров"
+    )
 
     warnings_json = models.JSONField(default=list, blank=True, verbose_name="Предупреждения")
 
@@ -53,4 +62,84 @@ class ForecastRun(models.Model):
 
     def get_results_display_url(self):
 
-        return None
\ No newline at end of file
+        return None
+
+
+class ForecastResultRow(models.Model):
+    """
+    Строка результата прогноза: численность населения одной группы регионов, типа поселения
+    и пола за год (и возраст - при выводе по возрастам). Строки дублируют файл результатов
+    в виде, удобном для SQL-запросов (сводки и сравнение прогнозов в истории без чтения файлов).
+    Как и файл результатов, строки общие для всех запусков с одинаковым input_hash.
+    """
+    input_hash = models.CharField(max_length=64, verbose_name="Хеш входных параметров")
+    group_title = models.CharField(max_length=255, verbose_name="Группа регионов")
+    # Последняя группа прогноза: выбранный регион или сумма по всем выбранным регионам
+    is_summary_group = models.BooleanField(default=False, verbose_name="Итоговая группа")
+    settlement_type_id = models.PositiveSmallIntegerField(verbose_name="Тип поселения")
+    sex_code = models.CharField(max_length=1, verbose_name="Пол")
+    year = models.PositiveSmallIntegerField(verbose_name="Год")
+    # None - численность целевой возрастной группы в целом (прогноз без вывода по возрастам)
+    age = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Возраст")
+    population = models.BigIntegerField(verbose_name="Численность")
+
+    class Meta:
+        verbose_name = "Строка результата прогноза"
+        verbose_name_plural = "Строки результатов прогнозов"
+        indexes = [
+            models.Index(fields=['input_hash', 'group_title', 'settlement_type_id', 'sex_code', 'year', 'age'],
+                         name='forecast_result_row_key'),
+        ]
+
+    def __str__(self):
+        age_str = f", возраст {self.age}" if self.age is not None else ""
+        return f"{self.group_title}: {self.year}{age_str} - {self.population}"
+
+
+class ForecastExportArtifact(models.Model):
+    """
+    Файл экспорта прогноза (CSV/XLSX), сформированный фоновой задачей (см. export_jobs).
+    Один файл на прогноз и формат; повторное скачивание отдает готовый файл.
+    Запись и файл удаляются вместе с прогнозом.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_ERROR = 'error'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "В очереди"),
+        (STATUS_RUNNING, "Формируется"),
+        (STATUS_COMPLETED, "Готов"),
+        (STATUS_ERROR, "Ошибка"),
+    ]
+
+    forecast_run = models.ForeignKey(
+        ForecastRun,
+        on_delete=models.CASCADE,
+        related_name='export_artifacts',
+        verbose_name="Запуск прогноза"
+    )
+    export_format = models.CharField(max_length=8, verbose_name="Формат")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="Статус")
+    file_path = models.CharField(
+        max_length=512,
+        blank=True,
+        null=True,
+        verbose_name="Путь к файлу экспорта (относительно MEDIA_ROOT)"
+    )
+    file_size = models.BigIntegerField(null=True, blank=True, verbose_name="Размер файла, байт")
+    total_groups = models.PositiveIntegerField(default=0, verbose_name="Всего групп регионов")
+    completed_groups = models.PositiveIntegerField(default=0, verbose_name="Записано групп регионов")
+    error_message = models.TextField(blank=True, default='', verbose_name="Сообщение об ошибке")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создан")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлен")
+
+    class Meta:
+        verbose_name = "Файл экспорта прогноза"
+        verbose_name_plural = "Файлы экспорта прогнозов"
+        constraints = [
+            models.UniqueConstraint(fields=['forecast_run', 'export_format'], name='forecast_export_artifact_unique'),
+        ]
+
+    def __str__(self):
+        return f"Экспорт {self.export_format} прогноза {self.forecast_run_id} ({self.get_status_display()})"
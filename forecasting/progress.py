@@ -0,0 +1,494 @@
+# forecasting/progress.py
+
+import gzip
+import hashlib
+import json
+import logging
+import time
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Tuple, Callable
+
+from django.conf import settings
+from django.urls import reverse
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+# Прогресс задачи хранится в Redis:
+#   forecast:progress:<task_id>           - hash (статус, счетчики, сообщение об ошибке, ...)
+#   forecast:progress:<task_id>:warnings  - set предупреждений
+#   forecast:progress:<task_id>:events    - канал pub/sub, в который публикуется уведомление о каждом изменении
+#   forecast:result:<task_id>             - HTML результатов, сжатый gzip (хранится один раз, отдается ForecastResultView);
+#                                           для задач JSON API (api_v1) - колоночный JSON (поле result_type в hash)
+#   forecast:queue:<queue_name>           - list task_id задач, ожидающих воркера в очереди Celery (для позиции в очереди)
+# Счетчик выполненных конфигураций увеличивается атомарно (HINCRBY), поэтому прогресс остается
+# корректным, когда конфигурации считаются параллельно в разных воркерах/процессах.
+# Отмена задачи - флаг cancel_requested в hash прогресса, который задача проверяет между конфигурациями
+# и между годами прогноза. Поле last_seen обновляется при каждом запросе прогресса клиентом: если клиент
+# не запрашивает прогресс дольше FORECAST_ABANDON_TIMEOUT_SECONDS, задача считается брошенной и отменяется.
+
+STATUS_QUEUED = 'queued'
+STATUS_STARTING = 'starting'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_ERROR = 'error'
+STATUS_CANCELLED = 'cancelled'
+
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_STARTING, STATUS_RUNNING)
+TERMINAL_STATUSES = (STATUS_COMPLETED, STATUS_ERROR, STATUS_CANCELLED)
+
+RESULT_TYPE_HTML = 'html'
+RESULT_TYPE_JSON = 'json'
+
+CANCEL_REASON_USER = 'user'
+CANCEL_REASON_ABANDONED = 'abandoned'
+
+INT_FIELDS = ('total_configurations', 'completed_configurations')
+
+# Минимальный интервал между обращениями к Redis при проверке флага отмены из цикла прогноза
+CANCEL_CHECK_INTERVAL_SECONDS = 0.5
+
+# SSE-поток под WSGI занимает поток веб-сервера на все время соединения, поэтому его длительность
+# ограничена независимо от настроек; клиент переподключается через PROGRESS_STREAM_RECONNECT_MS
+PROGRESS_STREAM_MAX_SECONDS_LIMIT = 60
+PROGRESS_STREAM_RECONNECT_MS = 1000
+
+# Увеличивает счетчик и переводит задачу в 'running', только если она еще не завершена
+_INCREMENT_COMPLETED_SCRIPT = """
+local completed = redis.call('HINCRBY', KEYS[1], 'completed_configurations', ARGV[1])
+local status = redis.call('HGET', KEYS[1], 'status')
+if status == 'queued' or status == 'starting' then
+    redis.call('HSET', KEYS[1], 'status', 'running')
+end
+return completed
+"""
+
+# Переводит задачу в 'starting', если ее не отменили, пока она ждала в очереди
+_MARK_STARTED_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'status') == 'cancelled' then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'status', 'starting', 'completed_configurations', 0, 'total_configurations', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_TOUCH_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[1], 'last_seen', ARGV[1])
+end
+return 0
+"""
+
+# Задача в очереди отменяется сразу, выполняемой задаче выставляется флаг отмены
+_REQUEST_CANCEL_SCRIPT = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if status == 'queued' then
+    redis.call('HSET', KEYS[1], 'status', 'cancelled', 'cancel_reason', ARGV[2])
+    return 'cancelled'
+end
+if status == 'starting' or status == 'running' then
+    redis.call('HSET', KEYS[1], 'cancel_requested', '1', 'keep_partial', ARGV[1], 'cancel_reason', ARGV[2])
+    return 'cancel_requested'
+end
+return status
+"""
+
+# Удаляет ожидающего из подписчиков задачи: -1, если он не был подписан, иначе число оставшихся подписчиков
+_REMOVE_SUBSCRIBER_SCRIPT = """
+if redis.call('SREM', KEYS[1], ARGV[1]) == 0 then
+    return -1
+end
+return redis.call('SCARD', KEYS[1])
+"""
+
+
+def _progress_key(task_id: str) -> str:
+    return f'forecast:progress:{task_id}'
+
+
+def _warnings_key(task_id: str) -> str:
+    return f'forecast:progress:{task_id}:warnings'
+
+
+def _subscribers_key(task_id: str) -> str:
+    return f'forecast:progress:{task_id}:subscribers'
+
+
+def _events_channel(task_id: str) -> str:
+    return f'forecast:progress:{task_id}:events'
+
+
+def _result_key(task_id: str) -> str:
+    return f'forecast:result:{task_id}'
+
+
+def _queue_key(queue_name: str) -> str:
+    return f'forecast:queue:{queue_name}'
+
+
+def _progress_ttl() -> int:
+    return getattr(settings, 'FORECAST_PROGRESS_TTL_SECONDS', 3600)
+
+
+def _redis():
+    return get_redis_connection('default')
+
+
+def _decode(value: Any) -> Any:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _publish_change(redis_conn, task_id: str) -> None:
+    # В канал публикуется только уведомление; состояние читается из hash при отправке клиенту
+    redis_conn.publish(_events_channel(task_id), b'changed')
+
+
+def init_progress(task_id: str, total_configurations: int, warnings: Iterable[str],
+                  status: str = STATUS_QUEUED, track_abandonment: bool = False,
+                  result_type: str = RESULT_TYPE_HTML) -> None:
+    """
+    Создает (или пересоздает) запись о прогрессе задачи.
+    track_abandonment - отменять задачу, если клиент перестал запрашивать ее прогресс.
+    result_type - вид результата задачи (HTML или JSON API).
+    """
+    redis_conn = _redis()
+    warnings = list(warnings)
+    pipe = redis_conn.pipeline()
+    pipe.delete(_progress_key(task_id), _warnings_key(task_id), _result_key(task_id))
+    pipe.hset(_progress_key(task_id), mapping={
+        'status': status,
+        'total_configurations': total_configurations,
+        'completed_configurations': 0,
+        'error_message': '',
+        'track_abandonment': '1' if track_abandonment else '0',
+        'last_seen': time.time(),
+        'result_type': result_type,
+    })
+    if warnings:
+        pipe.sadd(_warnings_key(task_id), *warnings)
+    pipe.expire(_progress_key(task_id), _progress_ttl())
+    pipe.expire(_warnings_key(task_id), _progress_ttl())
+    pipe.execute()
+    _publish_change(redis_conn, task_id)
+
+
+def mark_started(task_id: str, total_configurations: int, warnings: Iterable[str]) -> bool:
+    """
+    Отмечает начало выполнения задачи воркером. Возвращает False, если задача была отменена,
+    пока ждала в очереди. Поля записи (флаги отмены, last_seen) при этом сохраняются.
+    """
+    redis_conn = _redis()
+    if not redis_conn.exists(_progress_key(task_id)):
+        init_progress(task_id, total_configurations, warnings, status=STATUS_STARTING)
+        return True
+    started = redis_conn.register_script(_MARK_STARTED_SCRIPT)(
+        keys=[_progress_key(task_id)], args=[total_configurations, _progress_ttl()])
+    _publish_change(redis_conn, task_id)
+    return bool(started)
+
+
+def request_cancel(task_id: str, keep_partial: bool = False, reason: str = CANCEL_REASON_USER) -> Optional[str]:
+    """
+    Запрашивает отмену задачи. Возвращает 'cancelled' (задача отменена, не начав выполняться),
+    'cancel_requested' (задача остановится при ближайшей проверке флага), текущий статус
+    завершенной задачи или None, если задача не найдена.
+    """
+    redis_conn = _redis()
+    outcome = redis_conn.register_script(_REQUEST_CANCEL_SCRIPT)(
+        keys=[_progress_key(task_id)], args=['1' if keep_partial else '0', reason])
+    outcome = _decode(outcome)
+    if outcome == STATUS_CANCELLED:
+        dequeue(task_id)
+    _publish_change(redis_conn, task_id)
+    return outcome
+
+
+def add_subscriber(task_id: str, subscriber_key: str) -> None:
+    """
+    Добавляет ожидающего результат задачи (admission.user_key_for_request): запустившего задачу
+    или присоединившегося к расчету с такими же параметрами.
+    """
+    pipe = _redis().pipeline()
+    pipe.sadd(_subscribers_key(task_id), subscriber_key)
+    pipe.expire(_subscribers_key(task_id), _progress_ttl())
+    pipe.execute()
+
+
+def remove_subscriber(task_id: str, subscriber_key: str) -> Optional[int]:
+    """
+    Удаляет ожидающего из подписчиков задачи. Возвращает число оставшихся подписчиков
+    или None, если он не был подписан на задачу.
+    """
+    remaining = _redis().register_script(_REMOVE_SUBSCRIBER_SCRIPT)(
+        keys=[_subscribers_key(task_id)], args=[subscriber_key])
+    return None if int(remaining) < 0 else int(remaining)
+
+
+def get_cancel_state(task_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Возвращает {'keep_partial': bool, 'reason': str}, если задачу нужно остановить, иначе None.
+    Брошенная задача (клиент давно не запрашивал прогресс) отменяется без сохранения результатов.
+    """
+    cancel_requested, keep_partial, reason, track_abandonment, last_seen = _redis().hmget(
+        _progress_key(task_id), 'cancel_requested', 'keep_partial', 'cancel_reason', 'track_abandonment', 'last_seen')
+    if _decode(cancel_requested) == '1':
+        return {'keep_partial': _decode(keep_partial) == '1', 'reason': _decode(reason) or CANCEL_REASON_USER}
+    abandon_timeout = getattr(settings, 'FORECAST_ABANDON_TIMEOUT_SECONDS', None)
+    if abandon_timeout and _decode(track_abandonment) == '1' and last_seen is not None:
+        if time.time() - float(last_seen) > abandon_timeout:
+            return {'keep_partial': False, 'reason': CANCEL_REASON_ABANDONED}
+    return None
+
+
+def make_cancellation_checker(task_id: str) -> Callable[[], bool]:
+    """
+    Функция без аргументов для проверки отмены из циклов прогноза (PopulationForecaster.should_cancel).
+    Redis опрашивается не чаще CANCEL_CHECK_INTERVAL_SECONDS; однажды обнаруженная отмена запоминается.
+    """
+    checker_state = {'checked_at': 0.0, 'cancelled': False}
+
+    def should_cancel() -> bool:
+        if checker_state['cancelled']:
+            return True
+        now = time.monotonic()
+        if now - checker_state['checked_at'] >= CANCEL_CHECK_INTERVAL_SECONDS:
+            checker_state['checked_at'] = now
+            checker_state['cancelled'] = get_cancel_state(task_id) is not None
+        return checker_state['cancelled']
+
+    return should_cancel
+
+
+def touch(task_id: str) -> None:
+    """Отмечает, что клиент все еще ждет результат задачи (см. get_cancel_state)."""
+    # Через скрипт, чтобы не создать заново запись, срок хранения которой уже истек
+    _redis().register_script(_TOUCH_SCRIPT)(keys=[_progress_key(task_id)], args=[time.time()])
+
+
+def increment_completed(task_id: str, count: int = 1, warnings: Optional[Iterable[str]] = None) -> int:
+    """Атомарно увеличивает число выполненных конфигураций и добавляет предупреждения."""
+    redis_conn = _redis()
+    completed = redis_conn.register_script(_INCREMENT_COMPLETED_SCRIPT)(
+        keys=[_progress_key(task_id)], args=[count])
+    warnings = list(warnings or [])
+    if warnings:
+        redis_conn.sadd(_warnings_key(task_id), *warnings)
+        redis_conn.expire(_warnings_key(task_id), _progress_ttl())
+    _publish_change(redis_conn, task_id)
+    return int(completed)
+
+
+def enqueue(task_id: str, queue_name: str) -> None:
+    """Отмечает, что задача поставлена в очередь queue_name и ждет свободного воркера."""
+    redis_conn = _redis()
+    pipe = redis_conn.pipeline()
+    pipe.rpush(_queue_key(queue_name), task_id)
+    pipe.expire(_queue_key(queue_name), _progress_ttl())
+    pipe.hset(_progress_key(task_id), 'queue', queue_name)
+    pipe.execute()
+
+
+def dequeue(task_id: str) -> None:
+    """Убирает задачу из списка ожидающих (вызывается, когда воркер начал ее выполнение)."""
+    redis_conn = _redis()
+    queue_name = redis_conn.hget(_progress_key(task_id), 'queue')
+    if queue_name is None:
+        return
+    redis_conn.lrem(_queue_key(_decode(queue_name)), 0, task_id)
+    _publish_change(redis_conn, task_id)
+
+
+def queue_position(task_id: str, queue_name: str) -> Optional[int]:
+    """Число задач, стоящих в очереди перед task_id (None, если задачи в очереди нет)."""
+    return _redis().lpos(_queue_key(queue_name), task_id)
+
+
+def add_warnings(task_id: str, warnings: Iterable[str]) -> None:
+    warnings = list(warnings)
+    if not warnings:
+        return
+    redis_conn = _redis()
+    redis_conn.sadd(_warnings_key(task_id), *warnings)
+    redis_conn.expire(_warnings_key(task_id), _progress_ttl())
+
+
+def set_status(task_id: str, status: str, warnings: Optional[List[str]] = None, **fields: Any) -> None:
+    """
+    Устанавливает статус задачи и дополнительные поля hash (например, error_message).
+    Если передан warnings, множество предупреждений заменяется этим списком.
+    """
+    redis_conn = _redis()
+    mapping = {'status': status}
+    mapping.update({key: ('' if value is None else value) for key, value in fields.items()})
+    pipe = redis_conn.pipeline()
+    pipe.hset(_progress_key(task_id), mapping=mapping)
+    pipe.expire(_progress_key(task_id), _progress_ttl())
+    if warnings is not None:
+        pipe.delete(_warnings_key(task_id))
+        if warnings:
+            pipe.sadd(_warnings_key(task_id), *warnings)
+            pipe.expire(_warnings_key(task_id), _progress_ttl())
+    pipe.execute()
+    _publish_change(redis_conn, task_id)
+
+
+def get_progress(task_id: str, include_warnings: bool = True) -> Optional[Dict[str, Any]]:
+    """Возвращает прогресс задачи в виде словаря или None, если задача не найдена."""
+    redis_conn = _redis()
+    raw_progress = redis_conn.hgetall(_progress_key(task_id))
+    if not raw_progress:
+        return None
+    progress = {_decode(key): _decode(value) for key, value in raw_progress.items()}
+    for int_field in INT_FIELDS:
+        try:
+            progress[int_field] = int(progress.get(int_field) or 0)
+        except ValueError:
+            progress[int_field] = 0
+    for optional_field in ('error_message', 'result_etag'):
+        if not progress.get(optional_field):
+            progress[optional_field] = None
+    if include_warnings:
+        progress['warnings'] = sorted(_decode(w) for w in redis_conn.smembers(_warnings_key(task_id)))
+    return progress
+
+
+def _save_result(task_id: str, result_bytes: bytes, result_type: str) -> str:
+    compressed_result = gzip.compress(result_bytes, compresslevel=6)
+    result_etag = hashlib.sha1(compressed_result).hexdigest()
+    redis_conn = _redis()
+    pipe = redis_conn.pipeline()
+    pipe.set(_result_key(task_id), compressed_result, ex=_progress_ttl())
+    pipe.hset(_progress_key(task_id), mapping={'result_etag': result_etag, 'result_type': result_type})
+    pipe.execute()
+    logger.debug(f"Результат задачи {task_id} ({result_type}) сохранен: {len(result_bytes)} байт, "
+                 f"{len(compressed_result)} байт после сжатия")
+    return result_etag
+
+
+def save_result_html(task_id: str, html_result: str) -> str:
+    """
+    Сохраняет отрендеренный HTML результатов в сжатом виде под отдельным ключом.
+    Возвращает ETag результата (он же записывается в hash прогресса).
+    """
+    return _save_result(task_id, html_result.encode('utf-8'), RESULT_TYPE_HTML)
+
+
+def save_result_json(task_id: str, result_data: Dict[str, Any]) -> str:
+    """То же для результата JSON API: данные сериализуются компактно (без пробелов) и сжимаются."""
+    result_json = json.dumps(result_data, ensure_ascii=False, separators=(',', ':'))
+    return _save_result(task_id, result_json.encode('utf-8'), RESULT_TYPE_JSON)
+
+
+def get_result_gzip(task_id: str) -> Optional[Tuple[bytes, Optional[str]]]:
+    """Возвращает (сжатый gzip результат - HTML или JSON, ETag) или None, если результата нет."""
+    redis_conn = _redis()
+    pipe = redis_conn.pipeline()
+    pipe.get(_result_key(task_id))
+    pipe.hget(_progress_key(task_id), 'result_etag')
+    compressed_html, result_etag = pipe.execute()
+    if compressed_html is None:
+        return None
+    return compressed_html, _decode(result_etag)
+
+
+def build_progress_payload(task_id: str, progress_data: Dict[str, Any],
+                           result_url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Формирует ответ о прогрессе для клиента (общий для polling- и SSE-эндпоинтов).
+    result_url - ссылка на результат (по умолчанию - HTML результатов, ForecastResultView).
+    """
+    if result_url is None:
+        result_url = f"{reverse('forecasting:forecast_result')}?task_id={task_id}"
+    response_data = {
+        'task_id': task_id,
+        'status': progress_data.get('status', 'unknown'),
+        'progress': 0,
+        'total_configurations': progress_data.get('total_configurations', 0),
+        'completed_configurations': progress_data.get('completed_configurations', 0),
+        'message': ''
+    }
+
+    if response_data['status'] == STATUS_ERROR:
+        response_data['message'] = progress_data.get('error_message') or 'Произошла неизвестная ошибка.'
+        return response_data
+
+    if response_data['status'] == STATUS_COMPLETED:
+        response_data['progress'] = 100
+        # Сам HTML не передается: клиент загружает его один раз по ссылке
+        response_data['result_url'] = result_url
+        return response_data
+
+    if response_data['status'] == STATUS_CANCELLED:
+        response_data['message'] = ('Прогноз остановлен: страница результатов не запрашивала прогресс.'
+                                    if progress_data.get('cancel_reason') == CANCEL_REASON_ABANDONED
+                                    else 'Прогноз остановлен пользователем.')
+        if progress_data.get('result_etag'):  # Сохранены результаты, рассчитанные до отмены
+            response_data['result_url'] = result_url
+        return response_data
+
+    if response_data['status'] == STATUS_QUEUED and progress_data.get('queue'):
+        tasks_ahead = queue_position(task_id, progress_data['queue'])
+        if tasks_ahead is not None:
+            response_data['queue_position'] = tasks_ahead
+            response_data['message'] = f"В очереди, перед этим прогнозом: {tasks_ahead}"
+
+    if response_data['total_configurations'] > 0:
+        response_data['progress'] = round(
+            (response_data['completed_configurations'] / response_data['total_configurations']) * 100
+        )
+    return response_data
+
+
+def _sse_event(payload: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def iter_progress_events(task_id: str, result_url: Optional[str] = None) -> Iterator[str]:
+    """
+    Генератор событий Server-Sent Events: текущее состояние сразу после подключения,
+    затем новое состояние при каждом изменении прогресса. Завершается, когда задача
+    завершена (или ошибка), либо по истечении FORECAST_PROGRESS_STREAM_MAX_SECONDS (не больше
+    PROGRESS_STREAM_MAX_SECONDS_LIMIT) - после этого браузер переподключается сам.
+    result_url - как в build_progress_payload.
+    """
+    max_seconds = min(getattr(settings, 'FORECAST_PROGRESS_STREAM_MAX_SECONDS', 45), PROGRESS_STREAM_MAX_SECONDS_LIMIT)
+    heartbeat_seconds = min(getattr(settings, 'FORECAST_PROGRESS_STREAM_HEARTBEAT_SECONDS', 15), max_seconds)
+
+    pubsub = _redis().pubsub(ignore_subscribe_messages=True)
+    # Подписываемся до чтения состояния, чтобы не пропустить изменение между чтением и подпиской
+    pubsub.subscribe(_events_channel(task_id))
+    try:
+        progress_data = get_progress(task_id, include_warnings=False)
+        if not progress_data:
+            yield _sse_event({'task_id': task_id, 'status': 'not_found', 'progress': 0,
+                              'message': 'Задача не найдена. Возможно, она устарела или была удалена.'})
+            return
+
+        touch(task_id)
+        last_payload = build_progress_payload(task_id, progress_data, result_url)
+        yield f"retry: {PROGRESS_STREAM_RECONNECT_MS}\n" + _sse_event(last_payload)
+        if last_payload['status'] in TERMINAL_STATUSES:
+            return
+
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=heartbeat_seconds)
+            touch(task_id)  # Пока соединение открыто, клиент ждет результат
+            progress_data = get_progress(task_id, include_warnings=False)
+            if not progress_data:
+                return
+            payload = build_progress_payload(task_id, progress_data, result_url)
+            if payload == last_payload:
+                # Позиция в очереди меняется без уведомлений, поэтому состояние перечитывается и по таймауту
+                if message is None:
+                    yield ": heartbeat\n\n"  # Комментарий SSE, не дает прокси закрыть соединение
+                continue
+            last_payload = payload
+            yield _sse_event(payload)
+            if payload['status'] in TERMINAL_STATUSES:
+                return
+    finally:
+        try:
+            pubsub.close()
+        except Exception as e_close:
+            logger.warning(f"Ошибка при закрытии подписки на прогресс задачи {task_id}: {e_close}")
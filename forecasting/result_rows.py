@@ -0,0 +1,103 @@
+# forecasting/result_rows.py
+
+import logging
+from typing import Dict, List, Any, Optional, Tuple, Iterable
+
+from django.db import transaction
+from django.db.models import Sum
+
+from .data_providers.db_data_provider import SETTLEMENT_TYPE_TOTAL_ID, SETTLEMENT_TYPE_URBAN_ID, \
+    SETTLEMENT_TYPE_RURAL_ID, SEX_TOTAL_CODE, SEX_MALE_CODE, SEX_FEMALE_CODE
+from .models import ForecastResultRow
+
+logger = logging.getLogger(__name__)
+
+# Результаты прогноза в таблице ForecastResultRow (дополнительно к файлу результатов, см. result_store).
+# Ключи данных результата (urban_male, rural_total, ...) раскладываются на тип поселения и пол.
+RESULT_ROWS_BATCH_SIZE = 2000
+
+_SETTLEMENT_BY_DATA_KEY_PREFIX = {
+    'urban': SETTLEMENT_TYPE_URBAN_ID,
+    'rural': SETTLEMENT_TYPE_RURAL_ID,
+    'total': SETTLEMENT_TYPE_TOTAL_ID,
+}
+_SEX_BY_DATA_KEY_SUFFIX = {
+    'male': SEX_MALE_CODE,
+    'female': SEX_FEMALE_CODE,
+    'total': SEX_TOTAL_CODE,
+}
+
+
+def parse_data_key(data_key: str) -> Optional[Tuple[int, str]]:
+    """'urban_male' -> (2, 'M'). None для служебных полей и неизвестных ключей."""
+    prefix, _, suffix = data_key.partition('_')
+    if prefix not in _SETTLEMENT_BY_DATA_KEY_PREFIX or suffix not in _SEX_BY_DATA_KEY_SUFFIX:
+        return None
+    return _SETTLEMENT_BY_DATA_KEY_PREFIX[prefix], _SEX_BY_DATA_KEY_SUFFIX[suffix]
+
+
+def _age_from_display(age_display: str) -> Optional[int]:
+    age_str = str(age_display).split('-')[0].rstrip('+')
+    return int(age_str) if age_str.isdigit() else None
+
+
+def _iter_result_rows(input_hash: str, grouped_forecasts_data: List[Dict[str, Any]],
+                      output_detailed_by_age: bool) -> Iterable[ForecastResultRow]:
+    last_group_number = len(grouped_forecasts_data) - 1
+    for group_number, group_data in enumerate(grouped_forecasts_data):
+        row_fields = {
+            'input_hash': input_hash,
+            'group_title': group_data['title'],
+            'is_summary_group': group_number == last_group_number,
+        }
+        for year_item in group_data['data_by_year']:
+            value_rows = year_item.get('age_rows', []) if output_detailed_by_age else [year_item]
+            for value_row in value_rows:
+                age = _age_from_display(value_row['age_display']) if output_detailed_by_age else None
+                for data_key, population in value_row.items():
+                    settlement_and_sex = parse_data_key(data_key)
+                    if settlement_and_sex is None or population is None:
+                        continue
+                    yield ForecastResultRow(settlement_type_id=settlement_and_sex[0], sex_code=settlement_and_sex[1],
+                                            year=year_item['year'], age=age, population=round(population),
+                                            **row_fields)
+
+
+def save_result_rows(input_hash: str, grouped_forecasts_data: List[Dict[str, Any]],
+                     output_detailed_by_age: bool) -> int:
+    """Записывает результат пакетными INSERT (строки с тем же хешем заменяются). Возвращает число строк."""
+    result_rows = list(_iter_result_rows(input_hash, grouped_forecasts_data, output_detailed_by_age))
+    with transaction.atomic():
+        ForecastResultRow.objects.filter(input_hash=input_hash).delete()
+        ForecastResultRow.objects.bulk_create(result_rows, batch_size=RESULT_ROWS_BATCH_SIZE)
+    return len(result_rows)
+
+
+def get_summary_series(input_hashes: Iterable[str]) -> Dict[str, Dict[str, Dict[int, int]]]:
+    """
+    Численность итоговой группы по годам для нескольких результатов одним запросом:
+    {input_hash: {sex_code: {year: population}}}. Численность суммируется по типам поселения
+    и возрастам (при выводе по возрастам).
+    """
+    summary_series: Dict[str, Dict[str, Dict[int, int]]] = {}
+    summary_rows = ForecastResultRow.objects.filter(
+        input_hash__in=set(input_hashes), is_summary_group=True
+    ).values('input_hash', 'sex_code', 'year').annotate(total_population=Sum('population')).order_by('year')
+    for row in summary_rows:
+        summary_series.setdefault(row['input_hash'], {}).setdefault(row['sex_code'], {})[row['year']] = \
+            row['total_population']
+    return summary_series
+
+
+def summarize_series(population_by_year: Dict[int, int]) -> Optional[Dict[str, Any]]:
+    """Первый и последний год ряда и изменение численности за период."""
+    if not population_by_year:
+        return None
+    start_year, end_year = min(population_by_year), max(population_by_year)
+    start_population, end_population = population_by_year[start_year], population_by_year[end_year]
+    change_percent = (end_population - start_population) / start_population * 100 if start_population else None
+    return {
+        'start_year': start_year, 'start_population': start_population,
+        'end_year': end_year, 'end_population': end_population,
+        'change_percent': change_percent,
+    }
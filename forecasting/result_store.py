@@ -0,0 +1,357 @@
+# forecasting/result_store.py
+
+import json
+import logging
+import math
+import sys
+import zipfile
+from array import array
+from typing import Dict, List, Any, Optional, Tuple, Iterator, Iterable, IO
+
+logger = logging.getLogger(__name__)
+
+# Формат файла результатов прогноза: ZIP-архив (deflate) со следующими файлами:
+#   meta.json                      - все поля результата, кроме данных групп, и индекс групп:
+#                                    'groups': [{title, warnings, ..., years, ages, columns}]
+#   groups/<номер группы>/<ключ>   - колонка значений одного ключа данных (например, urban_male)
+#                                    в двоичном виде (array, little-endian): по годам или, при выводе
+#                                    по возрастам, матрица годы x возрасты построчно
+#   groups/<номер группы>/bands/<ключ> - то же для именованных возрастных групп (target_age_bands):
+#                                    матрица годы x группы построчно; названия групп - 'age_bands'
+#                                    в индексе группы (у результатов без групп этих полей нет)
+# Каждая колонка сжата отдельно, поэтому для показа одной группы (или диапазона лет/возрастов)
+# читаются и распаковываются только ее колонки, а не весь результат.
+# Файлы прежнего формата (JSON) читаются через тот же интерфейс (см. open_result).
+RESULT_FORMAT_VERSION = 1
+RESULT_FILE_EXTENSION = '.zip'
+
+META_MEMBER_NAME = 'meta.json'
+
+# Типы колонок: целые (значения прогноза округляются), дробные и, на всякий случай, произвольные JSON-значения
+COLUMN_TYPE_INT = 'q'
+COLUMN_TYPE_FLOAT = 'd'
+COLUMN_TYPE_JSON = 'json'
+MISSING_INT_VALUE = -2 ** 63  # Отсутствующее значение в целой колонке (в дробной - NaN)
+
+# Поля строк data_by_year / age_rows, которые не являются колонками данных
+_ROW_SERVICE_FIELDS = ('year', 'age_rows', 'age_display', 'band_rows', 'band_name')
+
+YearRange = Optional[Tuple[Optional[int], Optional[int]]]
+AgeRange = Optional[Tuple[Optional[int], Optional[int]]]
+
+
+def _column_member_name(group_number: int, data_key: str) -> str:
+    return f'groups/{group_number}/{data_key}'
+
+
+def _band_column_member_name(group_number: int, data_key: str) -> str:
+    return f'groups/{group_number}/bands/{data_key}'
+
+
+def _age_from_display(age_display: str) -> Optional[int]:
+    age_str = str(age_display).split('-')[0].rstrip('+')
+    return int(age_str) if age_str.isdigit() else None
+
+
+def _in_range(value: Optional[int], value_range: Optional[Tuple[Optional[int], Optional[int]]]) -> bool:
+    if value_range is None:
+        return True
+    if value is None:
+        return False
+    range_start, range_end = value_range
+    return (range_start is None or value >= range_start) and (range_end is None or value <= range_end)
+
+
+def _column_type(values: List[Any]) -> str:
+    present_values = [value for value in values if value is not None]
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in present_values):
+        return COLUMN_TYPE_INT
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present_values):
+        return COLUMN_TYPE_FLOAT
+    return COLUMN_TYPE_JSON
+
+
+def _encode_column(values: List[Any], column_type: str) -> bytes:
+    if column_type == COLUMN_TYPE_JSON:
+        return json.dumps(values, ensure_ascii=False).encode('utf-8')
+    missing_value = MISSING_INT_VALUE if column_type == COLUMN_TYPE_INT else math.nan
+    column = array(column_type, [missing_value if value is None else value for value in values])
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _decode_column(raw_column: bytes, column_type: str) -> List[Any]:
+    if column_type == COLUMN_TYPE_JSON:
+        return json.loads(raw_column.decode('utf-8'))
+    column = array(column_type)
+    column.frombytes(raw_column)
+    if sys.byteorder != 'little':
+        column.byteswap()
+    if column_type == COLUMN_TYPE_INT:
+        return [None if value == MISSING_INT_VALUE else value for value in column]
+    return [None if math.isnan(value) else value for value in column]
+
+
+def preferred_order(items: List[str], preferred_items: Iterable[str]) -> List[int]:
+    """Номера элементов items: сначала в порядке preferred_items, затем остальные в прежнем порядке."""
+    positions: Dict[str, int] = {}
+    for position, item in enumerate(preferred_items):
+        positions.setdefault(item, position)
+    return sorted(range(len(items)), key=lambda item_number: positions.get(items[item_number], len(positions)))
+
+
+def group_columns(group_data: Dict[str, Any],
+                  output_detailed_by_age: bool) -> Tuple[List[int], Optional[List[str]], Dict[str, List[Any]]]:
+    """
+    Данные группы (структура grouped_forecasts_data) по колонкам: (годы, возрасты, {ключ данных: значения}).
+    Строки - годы, а при выводе по возрастам - пары (год, возраст) по всем возрастам группы построчно
+    (возрасты None без вывода по возрастам). Отсутствующее значение - None.
+    """
+    years = [year_item['year'] for year_item in group_data['data_by_year']]
+    if output_detailed_by_age:
+        ages: Optional[List[str]] = []
+        for year_item in group_data['data_by_year']:
+            for age_row in year_item.get('age_rows', []):
+                if age_row['age_display'] not in ages:
+                    ages.append(age_row['age_display'])
+        rows = []
+        for year_item in group_data['data_by_year']:
+            age_rows_by_age = {age_row['age_display']: age_row for age_row in year_item.get('age_rows', [])}
+            rows.extend(age_rows_by_age.get(age_display, {}) for age_display in ages)
+    else:
+        ages = None
+        rows = group_data['data_by_year']
+
+    data_keys = sorted({key for row in rows for key in row if key not in _ROW_SERVICE_FIELDS})
+    return years, ages, {data_key: [row.get(data_key) for row in rows] for data_key in data_keys}
+
+
+def group_band_columns(group_data: Dict[str, Any]) -> Tuple[Optional[List[str]], Dict[str, List[Any]]]:
+    """
+    Именованные возрастные группы по колонкам: (названия групп, {ключ данных: значения}), строки -
+    пары (год, группа) построчно по годам group_columns. Названия None, если групп в результате нет.
+    """
+    band_names: List[str] = []
+    for year_item in group_data['data_by_year']:
+        for band_row in year_item.get('band_rows', []):
+            if band_row['band_name'] not in band_names:
+                band_names.append(band_row['band_name'])
+    if not band_names:
+        return None, {}
+    rows = []
+    for year_item in group_data['data_by_year']:
+        band_rows_by_name = {band_row['band_name']: band_row for band_row in year_item.get('band_rows', [])}
+        rows.extend(band_rows_by_name.get(band_name, {}) for band_name in band_names)
+    data_keys = sorted({key for row in rows for key in row if key not in _ROW_SERVICE_FIELDS})
+    return band_names, {data_key: [row.get(data_key) for row in rows] for data_key in data_keys}
+
+
+def write_result(file_obj: IO[bytes], results_data: Dict[str, Any]) -> None:
+    """Записывает результат прогноза (структура data_for_file_storage из tasks.py) в открытый бинарный файл."""
+    output_detailed_by_age = bool(results_data.get('output_detailed_by_age_global', False))
+    meta = {key: value for key, value in results_data.items() if key != 'grouped_forecasts_data'}
+    meta['format_version'] = RESULT_FORMAT_VERSION
+    groups_index: List[Dict[str, Any]] = []
+
+    with zipfile.ZipFile(file_obj, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as result_zip:
+        for group_number, group_data in enumerate(results_data.get('grouped_forecasts_data', [])):
+            years, ages, column_values = group_columns(group_data, output_detailed_by_age)
+            columns: Dict[str, str] = {}
+            for data_key, values in column_values.items():
+                column_type = _column_type(values)
+                result_zip.writestr(_column_member_name(group_number, data_key), _encode_column(values, column_type))
+                columns[data_key] = column_type
+
+            group_index_entry = {key: value for key, value in group_data.items() if key != 'data_by_year'}
+            group_index_entry.update({'years': years, 'ages': ages, 'columns': columns})
+
+            band_names, band_column_values = group_band_columns(group_data)
+            if band_names is not None:
+                band_columns: Dict[str, str] = {}
+                for data_key, values in band_column_values.items():
+                    column_type = _column_type(values)
+                    result_zip.writestr(_band_column_member_name(group_number, data_key),
+                                        _encode_column(values, column_type))
+                    band_columns[data_key] = column_type
+                group_index_entry.update({'age_bands': band_names, 'band_columns': band_columns})
+            groups_index.append(group_index_entry)
+
+        meta['groups'] = groups_index
+        result_zip.writestr(META_MEMBER_NAME, json.dumps(meta, ensure_ascii=False))
+
+
+class ForecastResultReader:
+    """
+    Чтение результата прогноза по частям. Метаданные (параметры, предупреждения, индекс групп)
+    читаются при открытии, данные группы - только при обращении к ней.
+    """
+
+    def __init__(self, full_path: str):
+        self._result_zip = zipfile.ZipFile(full_path, 'r')
+        try:
+            self.meta: Dict[str, Any] = json.loads(self._result_zip.read(META_MEMBER_NAME).decode('utf-8'))
+        except Exception:
+            self._result_zip.close()
+            raise
+        self.groups_index: List[Dict[str, Any]] = self.meta.pop('groups', [])
+        self.group_numbers: List[int] = list(range(len(self.groups_index)))
+
+    def close(self) -> None:
+        self._result_zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def group_titles(self) -> List[str]:
+        return [self.groups_index[group_number]['title'] for group_number in self.group_numbers]
+
+    def order_groups(self, preferred_titles: Iterable[str]) -> None:
+        """
+        Группы (и названия регионов в display_params_overall) в порядке preferred_titles - порядке регионов
+        запроса: общий файл результатов сохранен в порядке запроса, который его рассчитал.
+        """
+        preferred_titles = list(preferred_titles)
+        self.group_numbers = preferred_order([group_entry['title'] for group_entry in self.groups_index],
+                                             preferred_titles)
+        region_names = self.meta.get('display_params_overall', {}).get('region_names_display')
+        if region_names:
+            self.meta['display_params_overall'] = dict(self.meta['display_params_overall'], region_names_display=[
+                region_names[name_number] for name_number in preferred_order(region_names, preferred_titles)])
+
+    def row_count(self) -> int:
+        """Число строк таблиц результата (годы или пары год-возраст по всем группам), без чтения данных."""
+        return sum(len(group_entry['years']) * len(group_entry.get('ages') or [None])
+                   for group_entry in self.groups_index)
+
+    def read_group_columns(self, group_number: int) -> Tuple[List[int], Optional[List[str]], Dict[str, List[Any]]]:
+        """Данные группы по колонкам, как в group_columns, без сборки строк таблицы."""
+        group_entry = self.groups_index[group_number]
+        columns = {data_key: _decode_column(self._result_zip.read(_column_member_name(group_number, data_key)),
+                                            column_type)
+                   for data_key, column_type in group_entry['columns'].items()}
+        return group_entry['years'], group_entry.get('ages'), columns
+
+    def read_group_band_columns(self, group_number: int) -> Tuple[Optional[List[str]], Dict[str, List[Any]]]:
+        """Именованные возрастные группы по колонкам, как в group_band_columns."""
+        group_entry = self.groups_index[group_number]
+        columns = {data_key: _decode_column(self._result_zip.read(_band_column_member_name(group_number, data_key)),
+                                            column_type)
+                   for data_key, column_type in group_entry.get('band_columns', {}).items()}
+        return group_entry.get('age_bands'), columns
+
+    def read_group(self, group_number: int, year_range: YearRange = None,
+                   age_range: AgeRange = None) -> Dict[str, Any]:
+        """Группа в структуре grouped_forecasts_data (как в JSON-формате), только выбранные годы и возрасты."""
+        group_entry = self.groups_index[group_number]
+        years, ages, columns = self.read_group_columns(group_number)
+
+        group_data = {key: value for key, value in group_entry.items()
+                      if key not in ('years', 'ages', 'columns', 'age_bands', 'band_columns')}
+        band_names, band_columns = self.read_group_band_columns(group_number)
+        data_by_year = []
+        for year_number, year in enumerate(years):
+            if not _in_range(year, year_range):
+                continue
+            if ages is None:
+                year_item = {'year': year}
+                year_item.update({data_key: column[year_number] for data_key, column in columns.items()
+                                  if column[year_number] is not None})
+            else:
+                age_rows = []
+                for age_number, age_display in enumerate(ages):
+                    if not _in_range(_age_from_display(age_display), age_range):
+                        continue
+                    row_number = year_number * len(ages) + age_number
+                    age_values = {data_key: column[row_number] for data_key, column in columns.items()
+                                  if column[row_number] is not None}
+                    if age_values:
+                        age_rows.append(dict({'age_display': age_display}, **age_values))
+                year_item = {'year': year, 'age_rows': age_rows}
+            if band_names:
+                year_item['band_rows'] = []
+                for band_number, band_name in enumerate(band_names):
+                    row_number = year_number * len(band_names) + band_number
+                    band_values = {data_key: column[row_number] for data_key, column in band_columns.items()
+                                   if column[row_number] is not None}
+                    if band_values:
+                        year_item['band_rows'].append(dict({'band_name': band_name}, **band_values))
+            data_by_year.append(year_item)
+        group_data['data_by_year'] = data_by_year
+        return group_data
+
+    def iter_groups(self, group_titles: Optional[List[str]] = None, year_range: YearRange = None,
+                    age_range: AgeRange = None) -> Iterator[Dict[str, Any]]:
+        """Группы по одной (в памяти одновременно только одна группа)."""
+        for group_number in self.group_numbers:
+            if group_titles is None or self.groups_index[group_number]['title'] in group_titles:
+                yield self.read_group(group_number, year_range, age_range)
+
+    def to_results_data(self, group_titles: Optional[List[str]] = None, year_range: YearRange = None,
+                        age_range: AgeRange = None) -> Dict[str, Any]:
+        """Результат в структуре JSON-формата (data_for_file_storage) с выбранными группами."""
+        results_data = dict(self.meta)
+        results_data['grouped_forecasts_data'] = list(self.iter_groups(group_titles, year_range, age_range))
+        return results_data
+
+
+class LegacyJsonResultReader(ForecastResultReader):
+    """Тот же интерфейс для файлов результатов в прежнем формате (JSON целиком)."""
+
+    def __init__(self, full_path: str):
+        with open(full_path, 'r', encoding='utf-8') as f:
+            results_data = json.load(f)
+        self._groups: List[Dict[str, Any]] = results_data.pop('grouped_forecasts_data', [])
+        self.meta = results_data
+        self.groups_index = [{key: value for key, value in group_data.items() if key != 'data_by_year'}
+                             for group_data in self._groups]
+        self.group_numbers = list(range(len(self.groups_index)))
+
+    def close(self) -> None:
+        pass
+
+    def row_count(self) -> int:
+        return sum(len(year_item.get('age_rows', [])) if 'age_rows' in year_item else 1
+                   for group_data in self._groups for year_item in group_data.get('data_by_year', []))
+
+    def read_group_columns(self, group_number: int) -> Tuple[List[int], Optional[List[str]], Dict[str, List[Any]]]:
+        return group_columns(self._groups[group_number], bool(self.meta.get('output_detailed_by_age_global', False)))
+
+    def read_group_band_columns(self, group_number: int) -> Tuple[Optional[List[str]], Dict[str, List[Any]]]:
+        return group_band_columns(self._groups[group_number])
+
+    def read_group(self, group_number: int, year_range: YearRange = None,
+                   age_range: AgeRange = None) -> Dict[str, Any]:
+        group_data = dict(self._groups[group_number])
+        data_by_year = []
+        for year_item in group_data.get('data_by_year', []):
+            if not _in_range(year_item.get('year'), year_range):
+                continue
+            if 'age_rows' in year_item and age_range is not None:
+                year_item = dict(year_item, age_rows=[
+                    age_row for age_row in year_item['age_rows']
+                    if _in_range(_age_from_display(age_row.get('age_display')), age_range)])
+            data_by_year.append(year_item)
+        group_data['data_by_year'] = data_by_year
+        return group_data
+
+
+def open_result(full_path: str, group_order: Optional[Iterable[str]] = None) -> ForecastResultReader:
+    """
+    Открывает файл результатов любого формата. group_order - порядок групп (см. ForecastResultReader.order_groups).
+    FileNotFoundError, если файла нет.
+    """
+    reader = ForecastResultReader(full_path) if zipfile.is_zipfile(full_path) else LegacyJsonResultReader(full_path)
+    if group_order:
+        reader.order_groups(group_order)
+    return reader
+
+
+def load_result_data(full_path: str, group_titles: Optional[List[str]] = None, year_range: YearRange = None,
+                     age_range: AgeRange = None, group_order: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    with open_result(full_path, group_order) as reader:
+        return reader.to_results_data(group_titles, year_range, age_range)
@@ -0,0 +1,188 @@
+# forecasting/scenario_solver.py
+
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Any
+
+from .coefficient_calculator import SCENARIO_MANUAL_PERCENT
+from .data_providers.db_data_provider import SEX_MALE_CODE, SEX_FEMALE_CODE, SEX_TOTAL_CODE
+from .forecaster import PopulationForecaster, input_data_key, preload_input_data_for_configurations
+
+logger = logging.getLogger(__name__)
+
+# Подбор ежегодного изменения (%) одного сценария (ручной процент), при котором численность целевой группы
+# (регионы, тип поселения, пол и возраст из формы) в заданном году равна целевой. Исходные данные загружаются
+# один раз, исторические коэффициенты рассчитываются один раз; на каждом шаге пересчитываются только
+# коэффициенты подбираемого сценария и передвижка возрастов до целевого года. Численность монотонна по
+# проценту, поэтому после поиска интервала с решением (расширением начального интервала) используется деление
+# отрезка пополам.
+# Категория: (поле сценария, поле процента)
+SOLVER_CATEGORIES = {
+    'birth_rate': ('birth_rate_scenario', 'birth_rate_manual_change_percent'),
+    'death_rate_male': ('death_rate_scenario_male', 'death_rate_manual_change_percent_male'),
+    'death_rate_female': ('death_rate_scenario_female', 'death_rate_manual_change_percent_female'),
+    'migration': ('migration_scenario', 'migration_manual_change_percent'),
+}
+SOLVER_INITIAL_PERCENT_BRACKET = 5.0  # Начальный интервал поиска: [-5%, +5%] в год
+SOLVER_MAX_PERCENT = 50.0  # Интервал расширяется не дальше [-50%, +50%] в год
+SOLVER_POPULATION_TOLERANCE = 0.5  # Точность по численности, человек
+SOLVER_PERCENT_TOLERANCE = 1e-6
+SOLVER_MAX_ITERATIONS = 100
+
+STATUS_SOLVED = 'solved'
+STATUS_UNREACHABLE = 'unreachable'
+
+
+class _SettlementProjection:
+    """Прогноз одного типа поселения с подготовленными один раз данными и коэффициентами."""
+
+    def __init__(self, forecast_params: Dict[str, Any], preloaded_data: Dict[str, Any], solve_for: str):
+        self.forecaster = PopulationForecaster(forecast_params, preloaded_data=preloaded_data)
+        self.solve_for = solve_for
+        self.initial_population = self.forecaster.load_initial_population()
+        if self.initial_population is None:
+            raise ValueError("; ".join(self.forecaster.warnings))
+        self.prepared_data = self.forecaster._prepare_coefficients_and_migration()
+        self.target_ages = self.forecaster.resolve_target_single_ages(self.forecaster.warnings)
+        target_sex = forecast_params['sex_code_target']
+        self.target_sexes = [SEX_MALE_CODE, SEX_FEMALE_CODE] if target_sex == SEX_TOTAL_CODE else [target_sex]
+
+    def _prepared_data_for_percent(self, percent: float) -> Dict[str, Any]:
+        prepared_data = dict(self.prepared_data)
+        coeff_processor = self.forecaster.coefficient_processor
+        if self.solve_for == 'birth_rate':
+            prepared_data['birth_rates'] = coeff_processor.get_forecasted_birth_rates(
+                scenario=SCENARIO_MANUAL_PERCENT, manual_annual_change_percent=percent
+            ) or defaultdict(lambda: defaultdict(float))
+        elif self.solve_for in ('death_rate_male', 'death_rate_female'):
+            sex_code = SEX_MALE_CODE if self.solve_for == 'death_rate_male' else SEX_FEMALE_CODE
+            death_rates = coeff_processor.get_forecasted_death_rates(
+                sex_code_to_process=sex_code, scenario=SCENARIO_MANUAL_PERCENT, manual_annual_change_percent=percent
+            ) or defaultdict(lambda: defaultdict(float))
+            survival_key = 'survival_rates_male' if sex_code == SEX_MALE_CODE else 'survival_rates_female'
+            prepared_data[survival_key] = coeff_processor.calculate_survival_rates(death_rates)
+        else:
+            mig_processor = self.forecaster.migration_processor
+            prepared_data['migration_male'] = mig_processor.get_forecasted_migration_saldo(
+                SEX_MALE_CODE, SCENARIO_MANUAL_PERCENT, percent)
+            prepared_data['migration_female'] = mig_processor.get_forecasted_migration_saldo(
+                SEX_FEMALE_CODE, SCENARIO_MANUAL_PERCENT, percent)
+        return prepared_data
+
+    def population_by_year(self, percent: float) -> Dict[int, float]:
+        """Численность целевой группы (без округления) по годам прогноза."""
+        forecast_data_by_year = self.forecaster.project_population(
+            self.initial_population, self._prepared_data_for_percent(percent))
+        return {
+            year_data['year']: sum(year_data['population_by_sex_age'][sex_code].get(age, 0)
+                                   for sex_code in self.target_sexes for age in self.target_ages)
+            for year_data in forecast_data_by_year
+        }
+
+
+def _solver_forecast_params(forecast_plan: Dict[str, Any], solve_for: str, target_year: int) -> Dict[str, Any]:
+    base_params = forecast_plan['base_forecast_params_no_combination_specifics']
+    if not base_params['forecast_start_year'] <= target_year <= base_params['forecast_end_year']:
+        raise ValueError(f"Год цели ({target_year}) должен быть в периоде прогноза "
+                         f"({base_params['forecast_start_year']}-{base_params['forecast_end_year']}).")
+    if solve_for == 'migration' and not base_params.get('include_migration'):
+        raise ValueError("Для подбора сальдо миграции нужно включить учет миграции.")
+
+    scenario_key, percent_key = SOLVER_CATEGORIES[solve_for]
+    solver_params = dict(base_params, forecast_end_year=target_year, output_detailed_by_age=False)
+    solver_params[scenario_key] = SCENARIO_MANUAL_PERCENT
+    solver_params[percent_key] = 0.0
+    return solver_params
+
+
+def solve_scenario_percent(forecast_plan: Dict[str, Any], solve_for: str, target_year: int,
+                           target_population: float) -> Dict[str, Any]:
+    """
+    Подбирает ежегодное изменение (%) сценария solve_for (ключ SOLVER_CATEGORIES) для плана прогноза
+    forecast_params.build_forecast_plan. Цель - сумма по выбранным регионам. ValueError, если параметры
+    некорректны. Если цель недостижима в пределах SOLVER_MAX_PERCENT, возвращается ближайшая граница
+    со статусом STATUS_UNREACHABLE.
+    """
+    if solve_for not in SOLVER_CATEGORIES:
+        raise ValueError(f"Неизвестный параметр для подбора: {solve_for}.")
+    started_at = time.monotonic()
+    solver_params = _solver_forecast_params(forecast_plan, solve_for, target_year)
+
+    # Одна передвижка на тип поселения (для "Всего" - городское и сельское) для суммы выбранных регионов
+    region_ids = forecast_plan['initial_processed_region_db_ids']
+    settlement_ids = sorted({run_spec['params']['settlement_type_id']
+                             for run_spec in forecast_plan['all_run_configurations']})
+    run_configurations = [
+        {'params': dict(solver_params, region_ids=region_ids, settlement_type_id=settlement_id,
+                        sex_code_target=forecast_plan['user_selected_sex_code'])}
+        for settlement_id in settlement_ids
+    ]
+    preloaded_input_data = preload_input_data_for_configurations(run_configurations)
+    projections = [_SettlementProjection(run_spec['params'], preloaded_input_data[input_data_key(run_spec['params'])],
+                                         solve_for)
+                   for run_spec in run_configurations]
+
+    evaluations = 0
+
+    def population_by_year(percent: float) -> Dict[int, float]:
+        nonlocal evaluations
+        evaluations += 1
+        totals: Dict[int, float] = defaultdict(float)
+        for projection in projections:
+            for year, population in projection.population_by_year(percent).items():
+                totals[year] += population
+        return totals
+
+    def gap(percent: float) -> float:
+        return population_by_year(percent)[target_year] - target_population
+
+    # 1. Интервал [low, high], на концах которого численность по разные стороны от цели
+    low, high = -SOLVER_INITIAL_PERCENT_BRACKET, SOLVER_INITIAL_PERCENT_BRACKET
+    gap_low, gap_high = gap(low), gap(high)
+    while gap_low * gap_high > 0 and (low > -SOLVER_MAX_PERCENT or high < SOLVER_MAX_PERCENT):
+        low, high = max(low * 2, -SOLVER_MAX_PERCENT), min(high * 2, SOLVER_MAX_PERCENT)
+        gap_low, gap_high = gap(low), gap(high)
+
+    status = STATUS_SOLVED
+    iterations = 0
+    if gap_low * gap_high > 0:
+        status = STATUS_UNREACHABLE
+        percent = low if abs(gap_low) < abs(gap_high) else high
+    else:
+        # 2. Деление отрезка пополам
+        percent, gap_percent = (low, gap_low) if abs(gap_low) < abs(gap_high) else (high, gap_high)
+        while abs(gap_percent) > SOLVER_POPULATION_TOLERANCE and high - low > SOLVER_PERCENT_TOLERANCE \
+                and iterations < SOLVER_MAX_ITERATIONS:
+            iterations += 1
+            percent = (low + high) / 2
+            gap_percent = gap(percent)
+            if gap_percent * gap_low > 0:
+                low, gap_low = percent, gap_percent
+            else:
+                high, gap_high = percent, gap_percent
+
+    # Ответ - только для найденного процента
+    population_for_percent = population_by_year(percent)
+    warnings: List[str] = []
+    for projection in projections:
+        warnings.extend(projection.forecaster.warnings)
+    scenario_key, percent_key = SOLVER_CATEGORIES[solve_for]
+    elapsed_seconds = time.monotonic() - started_at
+    logger.info(f"Подбор {solve_for}: {status}, {percent:.4f}% за {evaluations} расчетов ({elapsed_seconds:.3f} с).")
+    return {
+        'status': status,
+        'solve_for': solve_for,
+        'percent': round(percent, 4),
+        'target_year': target_year,
+        'target_population': target_population,
+        'achieved_population': round(population_for_percent[target_year]),
+        'population_by_year': [{'year': year, 'population': round(population)}
+                               for year, population in sorted(population_for_percent.items())],
+        'iterations': iterations,
+        'evaluations': evaluations,
+        'elapsed_seconds': round(elapsed_seconds, 3),
+        'warnings': sorted(set(warnings)),
+        # Поля формы, с которыми полный прогноз дает найденный результат
+        'form_fields': {scenario_key: SCENARIO_MANUAL_PERCENT, percent_key: str(round(percent, 4))},
+    }
@@ -0,0 +1,246 @@
+# forecasting/shared_results.py
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List, Any, Optional, Iterable
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from data_collector.data_version import get_data_version, get_data_version_updated_at
+from . import progress, result_store
+from .models import ForecastRun, ForecastResultRow
+
+logger = logging.getLogger(__name__)
+
+# Результаты прогноза адресуются хешем нормализованных входных параметров и версии данных.
+# Одинаковые запросы (от разных пользователей или повторные) используют один файл результатов:
+#   MEDIA_ROOT/forecast_history/shared/forecast_results_<hash>.zip - сохраненный результат (см. result_store;
+#                                                                     ранее сохраненные результаты - .json)
+#   forecast:shared:<hash>:task   (Redis) - task_id задачи, которая сейчас считает этот результат
+#   forecast:shared:<hash>:users  (Redis) - пользователи, ожидающие результат этой задачи
+# Файлы без записей в истории (анонимные запросы, API) удаляются cleanup_shared_results.
+SHARED_RESULTS_DIR = os.path.join('forecast_history', 'shared')
+SHARED_RESULT_FILE_PREFIX = 'forecast_results_'
+CLEANUP_ROWS_HASH_BATCH_SIZE = 500
+
+# Параметры, которые задаются для каждой конфигурации отдельно и не входят в хеш в составе базовых
+_PER_CONFIGURATION_PARAMS = ('settlement_type_id', 'sex_code_target', 'region_ids')
+
+
+def _in_flight_key(input_hash: str) -> str:
+    return f'forecast:shared:{input_hash}:task'
+
+
+def _waiting_users_key(input_hash: str) -> str:
+    return f'forecast:shared:{input_hash}:users'
+
+
+def _redis():
+    return get_redis_connection('default')
+
+
+def compute_input_hash(base_forecast_params: Dict[str, Any], region_ids: List[int],
+                       user_selected_settlement_id: int, user_selected_sex_code: str,
+                       data_version: Optional[str] = None) -> str:
+    """
+    Канонический хеш входных параметров прогноза. Параметры сериализуются с сортировкой ключей,
+    кортежи приводятся к спискам, числа - к float, регионы сортируются, поэтому эквивалентные запросы
+    (в том числе с другим порядком регионов) дают один хеш.
+    """
+    normalized_params = {key: value for key, value in base_forecast_params.items()
+                         if key not in _PER_CONFIGURATION_PARAMS}
+    for key, value in normalized_params.items():
+        if isinstance(value, tuple):
+            normalized_params[key] = list(value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key.endswith('_percent'):
+            normalized_params[key] = float(value)
+
+    canonical_input = {
+        'params': normalized_params,
+        'region_ids': sorted(int(region_id) for region_id in region_ids),
+        'settlement_type_id': int(user_selected_settlement_id),
+        'sex_code_target': user_selected_sex_code,
+        'data_version': data_version if data_version is not None else get_data_version(),
+    }
+    canonical_json = json.dumps(canonical_input, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical_json.encode('utf-8')).hexdigest()
+
+
+def artifact_relative_path(input_hash: str) -> str:
+    return os.path.join(SHARED_RESULTS_DIR, f"{SHARED_RESULT_FILE_PREFIX}{input_hash}{result_store.RESULT_FILE_EXTENSION}")
+
+
+def _legacy_artifact_relative_path(input_hash: str) -> str:
+    return os.path.join(SHARED_RESULTS_DIR, f"{SHARED_RESULT_FILE_PREFIX}{input_hash}.json")
+
+
+def find_artifact(input_hash: str) -> Optional[str]:
+    """Путь (относительно MEDIA_ROOT) к сохраненному результату с этим хешем или None."""
+    for relative_path in (artifact_relative_path(input_hash), _legacy_artifact_relative_path(input_hash)):
+        if os.path.exists(os.path.join(settings.MEDIA_ROOT, relative_path)):
+            return relative_path
+    return None
+
+
+def run_group_order(forecast_run: ForecastRun) -> Optional[List[str]]:
+    """Порядок групп результата для записи истории - порядок регионов ее запроса."""
+    return (forecast_run.input_parameters_json or {}).get('region_names_display')
+
+
+def load_artifact(input_hash: str, group_order: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Загружает сохраненный результат по хешу или возвращает None. group_order - названия групп
+    в порядке регионов запроса (см. result_store.ForecastResultReader.order_groups).
+    """
+    relative_path = find_artifact(input_hash)
+    if relative_path is None:
+        return None
+    full_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+    try:
+        return result_store.load_result_data(full_path, group_order=group_order)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка чтения сохраненного результата прогноза {full_path}: {e}")
+        return None
+
+
+def save_artifact(input_hash: str, data_for_file_storage: Dict[str, Any]) -> str:
+    """
+    Сохраняет результат под его хешем и возвращает путь относительно MEDIA_ROOT.
+    Файл записывается во временный и затем переименовывается, поэтому читатели
+    никогда не видят частично записанный результат.
+    """
+    relative_path = artifact_relative_path(input_hash)
+    full_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            result_store.write_result(f, data_for_file_storage)
+        os.replace(temp_path, full_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return relative_path
+
+
+def _artifact_hash(file_name: str) -> Optional[str]:
+    """Хеш из имени общего файла результатов (.zip или ранее сохраненного .json) или None."""
+    stem, extension = os.path.splitext(file_name)
+    if not stem.startswith(SHARED_RESULT_FILE_PREFIX) or extension not in (result_store.RESULT_FILE_EXTENSION,
+                                                                             '.json'):
+        return None
+    return stem[len(SHARED_RESULT_FILE_PREFIX):]
+
+
+def _remove_file(full_path: str) -> bool:
+    try:
+        os.remove(full_path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def cleanup_shared_results(protected_hashes: Iterable[str] = (),
+                           max_age_seconds: Optional[int] = None) -> Dict[str, int]:
+    """
+    Удаляет общие файлы результатов, на которые не ссылается ни один ForecastRun и хеш которых не входит
+    в protected_hashes (прогнозы по умолчанию), если файл записан до последней загрузки данных (его хеш
+    уже не совпадет ни с одним запросом) или раньше чем max_age_seconds назад
+    (по умолчанию settings.FORECAST_SHARED_RESULT_MAX_AGE_SECONDS). Строки ForecastResultRow удаляются
+    для всех хешей без файла и без ссылок. Возвращает {'files_deleted', 'files_kept', 'row_hashes_deleted'}.
+    """
+    if max_age_seconds is None:
+        max_age_seconds = getattr(settings, 'FORECAST_SHARED_RESULT_MAX_AGE_SECONDS', 3 * 24 * 3600)
+    # Хеши строк читаются до просмотра файлов: результаты, записанные во время очистки, не затрагиваются
+    row_hashes = set(ForecastResultRow.objects.values_list('input_hash', flat=True).distinct())
+    kept_hashes = set(protected_hashes)
+    kept_hashes.update(ForecastRun.objects.exclude(input_hash__isnull=True).values_list('input_hash', flat=True))
+    data_updated_at = get_data_version_updated_at()
+    data_loaded_timestamp = data_updated_at.timestamp() if data_updated_at else None
+    oldest_kept_timestamp = time.time() - max_age_seconds
+
+    stats = {'files_deleted': 0, 'files_kept': 0, 'row_hashes_deleted': 0}
+    shared_dir = os.path.join(settings.MEDIA_ROOT, SHARED_RESULTS_DIR)
+    for file_name in sorted(os.listdir(shared_dir)) if os.path.isdir(shared_dir) else []:
+        full_path = os.path.join(shared_dir, file_name)
+        try:
+            modified_timestamp = os.path.getmtime(full_path)
+        except FileNotFoundError:
+            continue
+        if file_name.endswith('.tmp'):
+            # Временный файл прерванной записи (save_artifact)
+            if modified_timestamp < oldest_kept_timestamp:
+                _remove_file(full_path)
+            continue
+        input_hash = _artifact_hash(file_name)
+        if input_hash is None:
+            continue
+        is_outdated = modified_timestamp < oldest_kept_timestamp or \
+            (data_loaded_timestamp is not None and modified_timestamp < data_loaded_timestamp)
+        # Повторная проверка ссылок: запись в истории могла появиться после чтения kept_hashes
+        if input_hash in kept_hashes or not is_outdated or ForecastRun.objects.filter(input_hash=input_hash).exists():
+            kept_hashes.add(input_hash)
+            stats['files_kept'] += 1
+        elif _remove_file(full_path):
+            stats['files_deleted'] += 1
+
+    orphan_row_hashes = sorted(row_hashes - kept_hashes)
+    for batch_start in range(0, len(orphan_row_hashes), CLEANUP_ROWS_HASH_BATCH_SIZE):
+        ForecastResultRow.objects.filter(
+            input_hash__in=orphan_row_hashes[batch_start:batch_start + CLEANUP_ROWS_HASH_BATCH_SIZE]).delete()
+    stats['row_hashes_deleted'] = len(orphan_row_hashes)
+    logger.info(f"Shared results cleanup: {stats}")
+    return stats
+
+
+def claim_in_flight(input_hash: str, task_id: str) -> Optional[str]:
+    """
+    Регистрирует task_id как задачу, считающую результат с этим хешем.
+    Если такой результат уже считается другой (активной) задачей, возвращает ее task_id.
+    """
+    redis_conn = _redis()
+    ttl = getattr(settings, 'FORECAST_PROGRESS_TTL_SECONDS', 3600)
+    for _ in range(2):
+        if redis_conn.set(_in_flight_key(input_hash), task_id, nx=True, ex=ttl):
+            return None
+        existing_task_id = redis_conn.get(_in_flight_key(input_hash))
+        if existing_task_id is None:
+            continue  # Ключ истек между SET и GET
+        existing_task_id = existing_task_id.decode('utf-8')
+        existing_progress = progress.get_progress(existing_task_id, include_warnings=False)
+        if existing_progress and existing_progress['status'] in progress.ACTIVE_STATUSES:
+            return existing_task_id
+        # Задача завершилась ошибкой или устарела - результат считаем заново
+        redis_conn.delete(_in_flight_key(input_hash))
+    return None
+
+
+def release_in_flight(input_hash: str, task_id: str) -> None:
+    redis_conn = _redis()
+    existing_task_id = redis_conn.get(_in_flight_key(input_hash))
+    if existing_task_id is not None and existing_task_id.decode('utf-8') == task_id:
+        redis_conn.delete(_in_flight_key(input_hash))
+
+
+def add_waiting_user(input_hash: str, user_id: int) -> None:
+    """Пользователь получит запись в истории, когда задача, считающая этот результат, завершится."""
+    redis_conn = _redis()
+    redis_conn.sadd(_waiting_users_key(input_hash), user_id)
+    redis_conn.expire(_waiting_users_key(input_hash), getattr(settings, 'FORECAST_PROGRESS_TTL_SECONDS', 3600))
+
+
+def pop_waiting_users(input_hash: str) -> List[int]:
+    redis_conn = _redis()
+    pipe = redis_conn.pipeline()
+    pipe.smembers(_waiting_users_key(input_hash))
+    pipe.delete(_waiting_users_key(input_hash))
+    waiting_user_ids, _ = pipe.execute()
+    return sorted(int(user_id) for user_id in waiting_user_ids)
@@ -0,0 +1,13 @@
+# forecasting/signals.py
+
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from . import export_jobs
+from .models import ForecastExportArtifact
+
+
+@receiver(post_delete, sender=ForecastExportArtifact)
+def _delete_export_artifact_file(sender, instance: ForecastExportArtifact, **kwargs) -> None:
+    # Записи экспорта удаляются каскадом вместе с прогнозом; файл на диске удаляется вместе с записью
+    export_jobs.delete_export_file(instance)
@@ -7,34 +7,96 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
-    // Обработчики для кнопок экспорта в истории
-    document.querySelectorAll('.export-csv-history-link').forEach(link => {
+    // Экспорт в истории. Большие прогнозы экспортируются фоновой задачей: запрос на запуск возвращает
+    // status_url, который опрашивается до готовности файла; небольшие (status='direct') и уже
+    // сформированные (status='completed') скачиваются сразу по download_url.
+    const EXPORT_STATUS_POLL_INTERVAL_MS = 1000;
+    const csrfInput = document.querySelector('[name=csrfmiddlewaretoken]');
+
+    function setExportLinkBusy(link, busyText) {
+        if (!link.dataset.originalText) link.dataset.originalText = link.textContent;
+        link.textContent = busyText;
+        link.classList.add('disabled');
+    }
+
+    function resetExportLink(link) {
+        if (link.dataset.originalText) link.textContent = link.dataset.originalText;
+        link.classList.remove('disabled');
+        delete link.dataset.exportInProgress;
+    }
+
+    function handleExportJobState(link, jobState) {
+        if ((jobState.status === 'direct' || jobState.status === 'completed') && jobState.download_url) {
+            resetExportLink(link);
+            window.location.href = jobState.download_url;
+            return;
+        }
+        if (jobState.status === 'error') {
+            resetExportLink(link);
+            alert(jobState.error_message || "Не удалось сформировать файл экспорта.");
+            return;
+        }
+        // pending / running
+        const progressText = jobState.total_groups
+            ? ` ${jobState.completed_groups} из ${jobState.total_groups}` : '';
+        setExportLinkBusy(link, `Подготовка файла...${progressText}`);
+        setTimeout(() => {
+            fetch(jobState.status_url, { headers: { 'Accept': 'application/json' } })
+                .then(response => {
+                    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                    return response.json();
+                })
+                .then(nextState => handleExportJobState(link, nextState))
+                .catch(error => {
+                    console.error("Ошибка при получении состояния экспорта:", error);
+                    resetExportLink(link);
+                    alert("Не удалось получить состояние экспорта. Попробуйте позже.");
+                });
+        }, EXPORT_STATUS_POLL_INTERVAL_MS);
+    }
+
+    document.querySelectorAll('.export-csv-history-link, .export-xlsx-history-link, .export-history-link').forEach(link => {
         link.addEventListener('click', function(e) {
             e.preventDefault();
-            const forecastId = this.dataset.forecastId;
-            if (forecastId) {
-                // Предполагается, что у вас есть URL с именем 'export_forecast' в приложении 'forecasting'
-                // и он принимает forecast_run_id и format
-                // Если ваш URL настроен иначе, адаптируйте эту строку
-                window.location.href = `/forecast/export/${forecastId}/csv/`;
-            } else {
-                console.error("Не удалось получить ID прогноза для экспорта CSV");
+            const exportJobUrl = this.dataset.exportJobUrl;
+            if (!exportJobUrl) {
+                console.error("Не удалось получить адрес экспорта прогноза", this.dataset.forecastId);
                 alert("Не удалось экспортировать: ID прогноза не найден.");
+                return;
             }
+            if (this.dataset.exportInProgress) return;
+            this.dataset.exportInProgress = '1';
+            setExportLinkBusy(this, "Подготовка файла...");
+
+            fetch(exportJobUrl, {
+                method: 'POST',
+                headers: {
+                    'Accept': 'application/json',
+                    'X-CSRFToken': csrfInput ? csrfInput.value : ''
+                }
+            })
+                .then(response => {
+                    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                    return response.json();
+                })
+                .then(jobState => handleExportJobState(this, jobState))
+                .catch(error => {
+                    console.error("Ошибка при запуске экспорта:", error);
+                    resetExportLink(this);
+                    // Запасной вариант - экспорт в запросе по обычной ссылке
+                    window.location.href = this.href;
+                });
         });
     });
 
-    document.querySelectorAll('.export-xlsx-history-link').forEach(link => {
-        link.addEventListener('click', function(e) {
-            e.preventDefault();
-            const forecastId = this.dataset.forecastId;
-            if (forecastId) {
-                window.location.href = `/forecast/export/${forecastId}/xlsx/`;
-            } else {
-                console.error("Не удалось получить ID прогноза для экспорта XLSX");
-                alert("Не удалось экспортировать: ID прогноза не найден.");
+    const batchExportForm = document.getElementById('batchExportForm');
+    if (batchExportForm) {
+        batchExportForm.addEventListener('submit', function(e) {
+            if (!document.querySelector('input[name="run"][form="batchExportForm"]:checked')) {
+                e.preventDefault();
+                alert("Выберите прогнозы для экспорта.");
             }
         });
-    });
+    }
 
 });
\ No newline at end of file
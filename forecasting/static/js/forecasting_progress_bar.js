@@ -6,6 +6,8 @@ document.addEventListener('DOMContentLoaded', function() {
     const progressTextElement = document.querySelector('#loadingOverlay .loading-text');
     let progressIntervalId;
     let currentForecastTaskId = null;
+    let currentForecastTaskJoined = false; // Присоединились к общему расчету, запущенному другим пользователем
+    let progressEventSource = null;
 
     const apiUrlInput = document.getElementById('forecastProgressApiUrl');
     if (!apiUrlInput) {
@@ -15,6 +17,13 @@ document.addEventListener('DOMContentLoaded', function() {
     const progressApiUrl = apiUrlInput ? apiUrlInput.value : '/SOME_INVALID_URL_SEE_CONSOLE_ERROR/';
     console.log("Progress API URL (from DOMContentLoaded):", progressApiUrl);
 
+    const streamUrlInput = document.getElementById('forecastProgressStreamUrl');
+    const progressStreamUrl = streamUrlInput ? streamUrlInput.value : null;
+
+    const cancelUrlInput = document.getElementById('forecastCancelUrl');
+    const forecastCancelUrl = cancelUrlInput ? cancelUrlInput.value : null;
+    const cancelButton = document.getElementById('cancelForecastButton');
+
     if (form && loadingOverlay && progressBar) {
         form.addEventListener('submit', function(event) {
             event.preventDefault();
@@ -45,9 +54,9 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (!response.ok) {
                     // Пытаемся получить JSON с ошибкой, если сервер его прислал
                     return response.json().then(errData => {
-                        // Используем errData.message или стандартное сообщение
+                        // Используем errData.message или стандартное сообщение (например, 429 - лимит больших прогнозов)
                         throw new Error( (errData && errData.message) ? errData.message : `Ошибка сервера: ${response.status}`);
-                    }).catch(() => { // Если ответ не JSON или другая ошибка парсинга
+                    }, () => { // Если ответ не JSON
                         throw new Error(`Ошибка сервера: ${response.status} (ответ не JSON)`);
                     });
                 }
@@ -55,11 +64,18 @@ document.addEventListener('DOMContentLoaded', function() {
             })
             .then(data => { // data - это ответ от ForecastView.post
                 console.log("Initial POST response data:", data);
-                if (data.task_id && (data.status === 'processing_initiated' || data.status === 'processing_complete')) {
+                if (data.task_id && data.status === 'processing_complete' && data.result_url) {
+                    // Прогноз рассчитан прямо в запросе (или взят готовым) - прогресс не нужен
+                    if (progressTextElement) progressTextElement.textContent = 'Прогноз готов! Загрузка результатов...';
+                    progressBar.style.width = '100%';
+                    progressBar.textContent = '100%';
+                    loadResultPage(data.task_id, data.result_url);
+                } else if (data.task_id && (data.status === 'processing_initiated' || data.status === 'processing_complete')) {
                     currentForecastTaskId = data.task_id;
+                    currentForecastTaskJoined = data.joined === true;
                     console.log("Forecast task started with ID:", currentForecastTaskId);
                     if (progressTextElement) progressTextElement.textContent = 'Расчет запущен, ожидание прогресса...';
-                    pollProgress(currentForecastTaskId); // Первый вызов pollProgress
+                    streamProgress(currentForecastTaskId);
                 } else if (data.status === 'error') {
                     handleForecastError(data.message || "Ошибка при запуске прогноза на сервере.");
                 } else {
@@ -117,95 +133,169 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             return response.json();
         })
-        .then(data => { // data - это ответ от ForecastProgressView
-            console.log(`Progress API data for task ${taskIdArgument}:`, data);
-            // ---- НОВЫЕ ЛОГИ ДЛЯ АНАЛИЗА ----
-            console.log(` JS received from poll: task_id=${data.task_id}, status=${data.status}, progress=${data.progress}, completed_configs=${data.completed_configurations}, total_configs=${data.total_configurations}`);
-            // ---- КОНЕЦ НОВЫХ ЛОГОВ ----
-
-            if (data.task_id !== currentForecastTaskId) { // Важная проверка, если задачи могли смениться
-                console.warn(`Received progress data for task ${data.task_id}, but current task is ${currentForecastTaskId}. Ignoring.`);
-                return;
-            }
+        .then(data => applyProgressData(taskIdArgument, data, () => {
+            progressIntervalId = setTimeout(() => pollProgress(taskIdArgument), 200);
+        }))
+        .catch(error => {
+            console.error(`Ошибка при опросе прогресса для задачи ${taskIdArgument}:`, error);
+            if (progressTextElement) progressTextElement.textContent = 'Ошибка связи при проверке статуса...';
+            if (progressIntervalId) clearInterval(progressIntervalId);
+            // Повторная попытка через больший интервал
+            progressIntervalId = setTimeout(() => pollProgress(taskIdArgument), 5000); // Используем аргумент функции
+        });
+    }
 
-            // Обновление progressBar и progressTextElement - это происходит до проверки на completed
-            console.log(`Updating progress bar (from poll data): value=${data.progress}, text=${Math.round(data.progress)}%`);
-            progressBar.style.width = (data.progress || 0) + '%'; // Защита от undefined/null
-            progressBar.textContent = Math.round(data.progress || 0) + '%'; // Защита
+    // Обработка очередного состояния задачи (общая для SSE и опроса)
+    // data - это ответ от ForecastProgressView или событие ForecastProgressStreamView
+    function applyProgressData(taskIdArgument, data, scheduleNextPoll) {
+        console.log(`Progress API data for task ${taskIdArgument}:`, data);
+        // ---- НОВЫЕ ЛОГИ ДЛЯ АНАЛИЗА ----
+        console.log(` JS received from poll: task_id=${data.task_id}, status=${data.status}, progress=${data.progress}, completed_configs=${data.completed_configurations}, total_configs=${data.total_configurations}`);
+        // ---- КОНЕЦ НОВЫХ ЛОГОВ ----
 
-            if (progressTextElement) {
-                if (data.status === 'running' || data.status === 'starting' || data.status === 'queued') {
-                    progressTextElement.textContent = `Выполнено процессов: ${data.completed_configurations || 0} из ${data.total_configurations || 'N/A'} `;
-                } else if (data.status === 'completed') {
-                     progressTextElement.textContent = 'Прогноз готов! Загрузка результатов...';
-                } else if (data.status === 'error') {
-                    progressTextElement.textContent = `Ошибка: ${data.message || 'Неизвестная ошибка вычисления'}`;
-                } else {
-                    progressTextElement.textContent = `Статус: ${data.status || 'неизвестен'}`;
-                }
-            }
+        if (data.task_id !== currentForecastTaskId) { // Важная проверка, если задачи могли смениться
+            console.warn(`Received progress data for task ${data.task_id}, but current task is ${currentForecastTaskId}. Ignoring.`);
+            return;
+        }
 
-            // Теперь проверяем статус
-            console.log(`Checking status for task ${taskIdArgument}: Current status is '${data.status}'`);
-
-            if (data.status === 'completed') {
-                console.log(`Task ${taskIdArgument} is COMPLETED. Preparing to write results.`);
-                if (progressIntervalId) clearInterval(progressIntervalId);
-
-                console.log(`Task ${taskIdArgument} html_result present:`, !!data.html_result);
-                if (data.html_result && typeof data.html_result === 'string') {
-                    console.log(`Task ${taskIdArgument}: html_result length: ${data.html_result.length}`);
-                    setTimeout(function() { // Даем браузеру шанс перерисовать 100%
-                        console.log(`Task ${taskIdArgument}: Attempting document.write().`);
-                        try {
-                            document.open();
-                            document.write(data.html_result);
-                            document.close();
-                            console.log(`Task ${taskIdArgument}: document.write() finished.`);
-                            if (typeof feather !== 'undefined') {
-                                feather.replace(); // Повторная инициализация иконок
-                            }
-                        } catch (e) {
-                            console.error(`Task ${taskIdArgument}: Error during document.write():`, e);
-                            handleForecastError("Ошибка при отображении результатов: " + e.message);
-                        }
-                    }, 50);
-                } else {
-                    console.error(`Task ${taskIdArgument} COMPLETED but html_result is missing or not a string:`, data.html_result);
-                    handleForecastError("Прогноз завершен, но результаты не были получены (данные неполные).");
-                }
-                currentForecastTaskId = null; // Сбрасываем ID текущей задачи
-            } else if (data.status === 'error') {
-                console.error(`Task ${taskIdArgument} reported ERROR:`, data.message);
-                if (progressIntervalId) clearInterval(progressIntervalId);
-                handleForecastError(data.message || "Произошла ошибка при обработке прогноза на сервере.");
+        // Обновление progressBar и progressTextElement - это происходит до проверки на completed
+        console.log(`Updating progress bar (from poll data): value=${data.progress}, text=${Math.round(data.progress)}%`);
+        progressBar.style.width = (data.progress || 0) + '%'; // Защита от undefined/null
+        progressBar.textContent = Math.round(data.progress || 0) + '%'; // Защита
+
+        if (progressTextElement) {
+            if (data.status === 'queued' && data.queue_position !== undefined) {
+                progressTextElement.textContent = `В очереди, перед этим прогнозом: ${data.queue_position}`;
             } else if (data.status === 'running' || data.status === 'starting' || data.status === 'queued') {
-                console.log(`Task ${taskIdArgument} is still ${data.status}. Will poll again.`);
-                if (progressIntervalId) clearInterval(progressIntervalId);
-                progressIntervalId = setTimeout(() => pollProgress(taskIdArgument), 200); // Используем аргумент функции
-            } else if (data.status === 'not_found') {
-                 console.warn(`Task ${taskIdArgument} reported NOT_FOUND.`);
-                 if (progressIntervalId) clearInterval(progressIntervalId);
-                 handleForecastError(data.message || "Задача прогнозирования не найдена (возможно, устарела).");
+                progressTextElement.textContent = `Выполнено процессов: ${data.completed_configurations || 0} из ${data.total_configurations || 'N/A'} `;
+            } else if (data.status === 'completed') {
+                 progressTextElement.textContent = 'Прогноз готов! Загрузка результатов...';
+            } else if (data.status === 'cancelled') {
+                progressTextElement.textContent = data.message || 'Прогноз остановлен.';
+            } else if (data.status === 'error') {
+                progressTextElement.textContent = `Ошибка: ${data.message || 'Неизвестная ошибка вычисления'}`;
             } else {
-                console.warn(`Task ${taskIdArgument} has UNKNOWN status: '${data.status}'. Stopping polling.`);
-                if (progressIntervalId) clearInterval(progressIntervalId);
-                // Можно решить, показывать ли ошибку или просто остановить опрос
-                // handleForecastError(`Неизвестный статус задачи: ${data.status}`);
+                progressTextElement.textContent = `Статус: ${data.status || 'неизвестен'}`;
+            }
+        }
+
+        // Теперь проверяем статус
+        console.log(`Checking status for task ${taskIdArgument}: Current status is '${data.status}'`);
+
+        if (data.status === 'completed') {
+            console.log(`Task ${taskIdArgument} is COMPLETED. Preparing to write results.`);
+            if (progressIntervalId) clearInterval(progressIntervalId);
+
+            if (data.result_url) {
+                loadResultPage(taskIdArgument, data.result_url);
+            } else {
+                console.error(`Task ${taskIdArgument} COMPLETED but result_url is missing:`, data);
+                handleForecastError("Прогноз завершен, но результаты не были получены (данные неполные).");
+            }
+            currentForecastTaskId = null; // Сбрасываем ID текущей задачи
+        } else if (data.status === 'cancelled') {
+            console.log(`Task ${taskIdArgument} is CANCELLED.`);
+            if (progressIntervalId) clearInterval(progressIntervalId);
+            currentForecastTaskId = null;
+            if (data.result_url) {
+                // Пользователь остановил расчет с сохранением уже рассчитанных конфигураций
+                loadResultPage(taskIdArgument, data.result_url);
+            } else {
+                resetProgressOverlay();
+            }
+        } else if (data.status === 'error') {
+            console.error(`Task ${taskIdArgument} reported ERROR:`, data.message);
+            if (progressIntervalId) clearInterval(progressIntervalId);
+            handleForecastError(data.message || "Произошла ошибка при обработке прогноза на сервере.");
+        } else if (data.status === 'running' || data.status === 'starting' || data.status === 'queued') {
+            console.log(`Task ${taskIdArgument} is still ${data.status}. Waiting for next update.`);
+            if (progressIntervalId) clearInterval(progressIntervalId);
+            scheduleNextPoll();
+        } else if (data.status === 'not_found') {
+             console.warn(`Task ${taskIdArgument} reported NOT_FOUND.`);
+             if (progressIntervalId) clearInterval(progressIntervalId);
+             handleForecastError(data.message || "Задача прогнозирования не найдена (возможно, устарела).");
+        } else {
+            console.warn(`Task ${taskIdArgument} has UNKNOWN status: '${data.status}'. Stopping polling.`);
+            if (progressIntervalId) clearInterval(progressIntervalId);
+            // Можно решить, показывать ли ошибку или просто остановить опрос
+            // handleForecastError(`Неизвестный статус задачи: ${data.status}`);
+        }
+    }
+
+    // HTML результатов не входит в ответ о прогрессе, он загружается один раз по ссылке
+    function loadResultPage(taskIdArgument, resultUrl) {
+        console.log(`Task ${taskIdArgument} result_url:`, resultUrl);
+        fetch(resultUrl)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Ошибка при загрузке результатов: ${response.status}`);
             }
+            return response.text();
+        })
+        .then(htmlResult => {
+            console.log(`Task ${taskIdArgument}: html_result length: ${htmlResult.length}`);
+            setTimeout(function() { // Даем браузеру шанс перерисовать 100%
+                console.log(`Task ${taskIdArgument}: Attempting document.write().`);
+                try {
+                    document.open();
+                    document.write(htmlResult);
+                    document.close();
+                    console.log(`Task ${taskIdArgument}: document.write() finished.`);
+                    if (typeof feather !== 'undefined') {
+                        feather.replace(); // Повторная инициализация иконок
+                    }
+                } catch (e) {
+                    console.error(`Task ${taskIdArgument}: Error during document.write():`, e);
+                    handleForecastError("Ошибка при отображении результатов: " + e.message);
+                }
+            }, 50);
         })
         .catch(error => {
-            console.error(`Ошибка при опросе прогресса для задачи ${taskIdArgument}:`, error);
-            if (progressTextElement) progressTextElement.textContent = 'Ошибка связи при проверке статуса...';
-            if (progressIntervalId) clearInterval(progressIntervalId);
-            // Повторная попытка через больший интервал
-            progressIntervalId = setTimeout(() => pollProgress(taskIdArgument), 5000); // Используем аргумент функции
+            console.error(`Task ${taskIdArgument}: Error while loading results:`, error);
+            handleForecastError(error.message);
         });
     }
 
-    function handleForecastError(message) {
-        console.error("handleForecastError called with message:", message);
+    // Прогресс через Server-Sent Events: сервер сам присылает изменения состояния задачи.
+    // Если браузер не поддерживает EventSource или поток недоступен - переходим на опрос.
+    function streamProgress(taskIdArgument) {
+        if (!window.EventSource || !progressStreamUrl) {
+            pollProgress(taskIdArgument);
+            return;
+        }
+        const streamUrl = `${progressStreamUrl.endsWith('/') ? progressStreamUrl : progressStreamUrl + '/'}?task_id=${taskIdArgument}`;
+        console.log("Progress stream URL:", streamUrl);
+
+        progressEventSource = new EventSource(streamUrl);
+        progressEventSource.onmessage = function(event) {
+            const data = JSON.parse(event.data);
+            if (data.status !== 'running' && data.status !== 'starting' && data.status !== 'queued') {
+                closeProgressStream(); // Финальное состояние, иначе EventSource переподключится
+            }
+            applyProgressData(taskIdArgument, data, () => {}); // Следующее состояние придет само
+        };
+        progressEventSource.onerror = function() {
+            // При обрыве соединения и когда сервер закрывает поток по времени (не дольше минуты)
+            // EventSource переподключается сам через интервал retry; CLOSED - поток недоступен
+            if (progressEventSource && progressEventSource.readyState === EventSource.CLOSED) {
+                console.warn(`Progress stream for task ${taskIdArgument} is unavailable, falling back to polling.`);
+                closeProgressStream();
+                if (currentForecastTaskId === taskIdArgument) pollProgress(taskIdArgument);
+            }
+        };
+    }
+
+    function closeProgressStream() {
+        if (progressEventSource) {
+            progressEventSource.close();
+            progressEventSource = null;
+        }
+    }
+
+    function resetProgressOverlay() {
         if (progressIntervalId) clearInterval(progressIntervalId);
+        closeProgressStream();
         currentForecastTaskId = null;
         if (loadingOverlay) loadingOverlay.style.display = 'none';
         // progressBar и progressTextElement уже должны быть объявлены выше,
@@ -215,10 +305,56 @@ document.addEventListener('DOMContentLoaded', function() {
             progressBar.textContent = '0%';
         }
         if (progressTextElement) progressTextElement.textContent = 'Идет расчет прогноза, пожалуйста, подождите';
+        if (cancelButton) cancelButton.disabled = false;
+    }
 
+    function handleForecastError(message) {
+        console.error("handleForecastError called with message:", message);
+        resetProgressOverlay();
         alert(`Ошибка прогнозирования: ${message}`);
     }
 
+    // Запрос на отмену задачи. keepPartial - показать результаты конфигураций, рассчитанных до остановки
+    function buildCancelFormData(taskIdArgument, keepPartial) {
+        const cancelFormData = new FormData();
+        cancelFormData.append('task_id', taskIdArgument);
+        cancelFormData.append('keep_partial', keepPartial ? '1' : '0');
+        if (form) {
+            const csrfInput = form.querySelector('[name=csrfmiddlewaretoken]');
+            if (csrfInput) cancelFormData.append('csrfmiddlewaretoken', csrfInput.value);
+        }
+        return cancelFormData;
+    }
+
+    if (cancelButton) {
+        cancelButton.addEventListener('click', function() {
+            if (!currentForecastTaskId || !forecastCancelUrl) return;
+            cancelButton.disabled = true;
+            if (progressTextElement) progressTextElement.textContent = 'Остановка расчета...';
+            fetch(forecastCancelUrl, {method: 'POST', body: buildCancelFormData(currentForecastTaskId, true)})
+            .then(response => response.json())
+            .then(data => {
+                // Итоговое состояние (cancelled, с частичными результатами или без) придет с прогрессом.
+                // detached - расчет ждут другие пользователи, он продолжится без нас
+                console.log("Cancel response:", data);
+                if (data.status === 'detached') resetProgressOverlay();
+            })
+            .catch(error => {
+                console.error('Ошибка при отмене прогноза:', error);
+                cancelButton.disabled = false;
+            });
+        });
+    }
+
+    // Пользователь уходит со страницы во время расчета - задача больше не нужна.
+    // Общий расчет, к которому мы присоединились, не отменяем: если его больше никто не ждет,
+    // задачу остановит проверка брошенных задач (клиенты перестанут запрашивать прогресс)
+    window.addEventListener('pagehide', function() {
+        if (currentForecastTaskId && !currentForecastTaskJoined && forecastCancelUrl && navigator.sendBeacon) {
+            navigator.sendBeacon(forecastCancelUrl, buildCancelFormData(currentForecastTaskId, false));
+        }
+    });
+
     window.addEventListener('pageshow', function(event) {
         const overlayStillVisible = loadingOverlay && loadingOverlay.style.display === 'block';
         const noActiveTask = !currentForecastTaskId;
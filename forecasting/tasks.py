@@ -1,12 +1,17 @@
 from celery import \
     shared_task  # current_task можно убрать, если self.request.id не используется для чего-то специфичного
-from django.core.cache import cache
+from celery import chord, group
+from celery.signals import worker_process_init
+from billiard.pool import Pool
 from django.template.loader import render_to_string
 import copy
 import logging
-from typing import Dict, List, Any, Tuple, Union, Optional  # Добавлен для типизации
+import time
+from typing import Dict, List, Any, Tuple, Union, Optional, Callable  # Добавлен для типизации
 import json
-from .forecaster import PopulationForecaster
+from .forecaster import PopulationForecaster, ForecastCancelled, preload_input_data_for_configurations, input_data_key
+from . import admission, columnar_results, export_jobs, progress, result_rows, shared_results, worker_warmup
+from data_collector import region_registry
 
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
@@ -43,18 +48,29 @@ SCENARIO_LAST_YEAR = 'last_year'
 SCENARIO_HISTORICAL_TREND = 'historical_trend'
 SCENARIO_MANUAL_PERCENT = 'manual_percent'
 
+# Режимы выполнения конфигураций прогноза (settings.FORECAST_EXECUTION_MODE)
+EXECUTION_MODE_CHORD = 'chord'
+EXECUTION_MODE_PROCESS_POOL = 'process_pool'
+EXECUTION_MODE_SEQUENTIAL = 'sequential'
+
+# Вид результата задачи: HTML страницы результатов (форма) или колоночный JSON (JSON API, см. api_v1).
+# RESULT_FORMAT_ARTIFACT - только общий файл результатов по хешу (предварительный расчет, см. default_forecasts)
+RESULT_FORMAT_HTML = 'html'
+RESULT_FORMAT_COLUMNAR = 'columnar'
+RESULT_FORMAT_ARTIFACT = 'artifact'
+
 
 # === КОНЕЦ КОНСТАНТ ===
 
 
 # === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ (лучше вынести в forecasting/utils.py) ===
 def _get_region_name_by_id_for_task(region_id: int) -> str:
-    from data_collector.models import Region  # Импорт внутри, чтобы избежать проблем при старте Celery
-    try:
-        return Region.objects.get(id=region_id).name
-    except Region.DoesNotExist:
+    # Справочник регионов загружается при старте процесса воркера (worker_warmup)
+    region_name = region_registry.get_region_name(region_id)
+    if region_name is None:
         logger.warning(f"Region with ID {region_id} not found in task helper.")
         return f"Регион ID {region_id}"
+    return region_name
 
 
 def _prepare_display_params_for_task(forecast_params_source: Dict, form_warnings_list: List) -> Dict:
@@ -66,14 +82,13 @@ def _prepare_display_params_for_task(forecast_params_source: Dict, form_warnings
         if region_ids_list:
             is_all_russia_display = False
             if len(region_ids_list) == 1 and region_ids_list[0] == ID_FOR_ALL_RUSSIA:
-                from data_collector.models import Region
-                russia_obj_check = Region.objects.filter(id=ID_FOR_ALL_RUSSIA,
-                                                         map_code=MAP_CODE_FOR_ALL_RUSSIA).first()
-                if russia_obj_check: is_all_russia_display = True
+                russia_obj_check = region_registry.get_region(ID_FOR_ALL_RUSSIA)
+                if russia_obj_check and russia_obj_check['map_code'] == MAP_CODE_FOR_ALL_RUSSIA:
+                    is_all_russia_display = True
 
             if is_all_russia_display:
                 params_for_display['region_names_display'] = [
-                    russia_obj_check.name if russia_obj_check else "Российская Федерация (по ID)"]
+                    russia_obj_check['name'] if russia_obj_check else "Российская Федерация (по ID)"]
             elif len(region_ids_list) == 1:
                 params_for_display['region_names_display'] = [_get_region_name_by_id_for_task(region_ids_list[0])]
             else:
@@ -123,6 +138,11 @@ def _prepare_display_params_for_task(forecast_params_source: Dict, form_warnings
     params_for_display['target_age_group_input_display'] = f"{target_age[0]} - {target_age[1]} лет" if isinstance(
         target_age, tuple) else str(target_age)
 
+    if forecast_params_source.get('target_age_bands'):
+        params_for_display['target_age_bands_display'] = [
+            f"{band_name}: {band_start_age} - {band_end_age} лет"
+            for band_name, band_start_age, band_end_age in forecast_params_source['target_age_bands']]
+
     params_for_display.setdefault('output_detailed_by_age', False)
     params_for_display.setdefault('include_migration', False)
     return params_for_display
@@ -132,6 +152,554 @@ def _prepare_display_params_for_task(forecast_params_source: Dict, form_warnings
 User = get_user_model()
 
 
+@worker_process_init.connect
+def _warm_up_forecast_worker_process(**kwargs) -> None:
+    # Прогрев каждого процесса воркера, чтобы первый прогноз после старта не был медленнее остальных
+    worker_warmup.warm_up_worker_process(DEFAULT_HISTORICAL_START_YEAR, DEFAULT_HISTORICAL_END_YEAR)
+
+
+def _register_completed_configurations(task_id: str, count: int = 1) -> int:
+    # Счетчик в Redis увеличивается атомарно, т.к. конфигурации могут выполняться
+    # параллельно в разных воркерах.
+    completed = progress.increment_completed(task_id, count)
+    logger.debug(f"Task {task_id}: Progress updated: {completed} configurations completed")
+    return completed
+
+
+def _data_key_base_for_run(task_id: str, settlement_id_of_this_run: int, sex_code_of_this_run: str) -> str:
+    settlement_prefix = "urban_" if settlement_id_of_this_run == ID_SETTLEMENT_URBAN else \
+        ("rural_" if settlement_id_of_this_run == ID_SETTLEMENT_RURAL else \
+             ("total_" if settlement_id_of_this_run == ID_SETTLEMENT_TOTAL else "unknown_sett_"))
+    sex_suffix = "male" if sex_code_of_this_run == SEX_CODE_MALE else \
+        ("female" if sex_code_of_this_run == SEX_CODE_FEMALE else \
+             ("total" if sex_code_of_this_run == SEX_CODE_TOTAL else "unknown_sex_"))
+
+    data_key_base = f"{settlement_prefix}{sex_suffix}"
+    if "unknown" in data_key_base:
+        logger.warning(
+            f"Task {task_id}: Unknown settlement/sex combination for data_key_base: sett_id={settlement_id_of_this_run}, sex_code={sex_code_of_this_run}")
+    return data_key_base
+
+
+def _merge_run_result(task_id: str, grouped_results_data: Dict[str, Dict[str, Any]], run_spec: Dict,
+                      run_result_data: Dict, output_detailed_by_age_global: bool,
+                      params_for_group_context_map: Dict) -> None:
+    """Добавляет результат одной конфигурации в grouped_results_data (группировка по региону и году)."""
+    region_group_key = run_spec['region_group_key']
+    current_params_of_this_run = run_spec['params']
+    settlement_id_of_this_run = current_params_of_this_run['settlement_type_id']
+    sex_code_of_this_run = current_params_of_this_run['sex_code_target']
+
+    group_entry = grouped_results_data.setdefault(region_group_key, {
+        'title': region_group_key,
+        'params_for_display_group_context': params_for_group_context_map.get(region_group_key, {}),
+        'warnings': set(),
+        'data_by_year': {}
+    })
+
+    if run_result_data.get('warnings'):
+        group_entry['warnings'].update(run_result_data['warnings'])
+
+    data_key_base = _data_key_base_for_run(task_id, settlement_id_of_this_run, sex_code_of_this_run)
+
+    for year_result in run_result_data.get('results', []):
+        year = year_result['year']
+        year_data_entry = group_entry['data_by_year'].setdefault(year, {})
+        if output_detailed_by_age_global:
+            age_data_map = year_data_entry.setdefault('age_data_map', {})
+            for age_pop_item in year_result.get('population_by_age', []):
+                age_key = str(age_pop_item['age'])
+                age_specific_entry = age_data_map.setdefault(age_key, {'age_display': age_key})
+                age_specific_entry[data_key_base] = age_pop_item['population']
+        else:
+            year_data_entry[data_key_base] = year_result['total_population_in_target_group']
+        # Именованные возрастные группы (target_age_bands): численность группы по ключам данных
+        for band_item in year_result.get('age_bands', []):
+            band_data_map = year_data_entry.setdefault('band_data_map', {})
+            band_data_map.setdefault(band_item['name'], {'band_name': band_item['name']})[data_key_base] = \
+                band_item['population']
+
+
+def _run_single_configuration(config_index: int, run_spec: Dict,
+                              preloaded_data: Optional[Dict[str, Any]],
+                              should_cancel: Optional[Callable[[], bool]] = None) -> Dict[str, Any]:
+    """
+    Выполняет прогноз одной конфигурации. Ошибка не пробрасывается, а возвращается как {'index', 'error'},
+    чтобы не прерывать остальные конфигурации. Пробрасывается только ForecastCancelled (отмена задачи).
+    """
+    try:
+        forecaster = PopulationForecaster(run_spec['params'], preloaded_data=preloaded_data,
+                                          should_cancel=should_cancel)
+        run_result_data = forecaster.run_forecast()
+        return {
+            'index': config_index,
+            'warnings': run_result_data.get('warnings', []),
+            'results': run_result_data.get('results', []),
+        }
+    except ForecastCancelled:
+        raise
+    except Exception as e_config:
+        logger.error(f"Error in configuration #{config_index} ({run_spec['region_group_key']}): {e_config}",
+                     exc_info=True)
+        return {
+            'index': config_index,
+            'error': f"({type(e_config).__name__}) {e_config}",
+        }
+
+
+def _run_configurations(task_id: str, indexed_run_configurations: List[Tuple[int, Dict]],
+                        should_cancel: Optional[Callable[[], bool]] = None) -> List[Dict[str, Any]]:
+    """
+    Последовательно выполняет прогноз для списка конфигураций [(index, run_spec), ...].
+    При отмене задачи возвращает результаты конфигураций, рассчитанных до отмены.
+    """
+    if should_cancel is not None and should_cancel():
+        logger.info(f"Task {task_id}: Cancelled before running {len(indexed_run_configurations)} configurations.")
+        return []
+
+    preloaded_input_data = preload_input_data_for_configurations(
+        [run_spec for _, run_spec in indexed_run_configurations])
+
+    batch_results: List[Dict[str, Any]] = []
+    for config_index, run_spec in indexed_run_configurations:
+        logger.debug(f"Task {task_id}: Processing config #{config_index} for group {run_spec['region_group_key']}")
+        try:
+            if should_cancel is not None and should_cancel():
+                raise ForecastCancelled(f"Task {task_id} cancelled")
+            batch_results.append(_run_single_configuration(
+                config_index, run_spec, preloaded_input_data.get(input_data_key(run_spec['params'])),
+                should_cancel=should_cancel))
+        except ForecastCancelled:
+            logger.info(f"Task {task_id}: Cancelled at config #{config_index}, "
+                        f"{len(batch_results)} configurations of this batch completed.")
+            break
+        _register_completed_configurations(task_id)
+    return batch_results
+
+
+# Исходные данные, переданные в процессы пула через initializer (при fork они наследуются без копирования)
+_pool_preloaded_input_data: Dict[Tuple, Dict[str, Any]] = {}
+
+
+def _init_process_pool_worker(preloaded_input_data: Dict[Tuple, Dict[str, Any]]) -> None:
+    global _pool_preloaded_input_data
+    _pool_preloaded_input_data = preloaded_input_data
+
+
+def _run_configuration_in_process_pool(config_index: int, run_spec: Dict, task_id: str) -> Dict[str, Any]:
+    # Функцию проверки отмены нельзя передать в дочерний процесс, поэтому она создается в нем
+    try:
+        return _run_single_configuration(
+            config_index, run_spec, _pool_preloaded_input_data.get(input_data_key(run_spec['params'])),
+            should_cancel=progress.make_cancellation_checker(task_id))
+    except ForecastCancelled:
+        return {'index': config_index, 'cancelled': True}
+
+
+def _run_configurations_in_process_pool(task_id: str, indexed_run_configurations: List[Tuple[int, Dict]],
+                                        should_cancel: Optional[Callable[[], bool]] = None) -> List[Dict[str, Any]]:
+    """
+    Выполняет прогнозы в локальном пуле процессов (для воркера с concurrency 1 на многоядерной машине).
+    Данные загружаются один раз в родительском процессе; результаты возвращаются в порядке конфигураций.
+    При отмене задачи пул останавливается, возвращаются уже полученные результаты.
+    """
+    pool_size = getattr(settings, 'FORECAST_PROCESS_POOL_SIZE', None) or os.cpu_count() or 1
+    pool_size = min(pool_size, len(indexed_run_configurations))
+    if pool_size <= 1:
+        return _run_configurations(task_id, indexed_run_configurations, should_cancel=should_cancel)
+
+    preloaded_input_data = preload_input_data_for_configurations(
+        [run_spec for _, run_spec in indexed_run_configurations])
+
+    logger.info(f"Task {task_id}: Running {len(indexed_run_configurations)} configurations "
+                f"in a process pool of {pool_size} processes.")
+    # billiard (из состава Celery) позволяет создавать дочерние процессы из демонизированного воркера
+    pool = Pool(processes=pool_size, initializer=_init_process_pool_worker, initargs=(preloaded_input_data,))
+    pool_terminated = False
+    try:
+        async_results = [pool.apply_async(_run_configuration_in_process_pool, (config_index, run_spec, task_id))
+                         for config_index, run_spec in indexed_run_configurations]
+        batch_results: List[Dict[str, Any]] = []
+        for async_result in async_results:
+            run_result = async_result.get()
+            if not run_result.get('cancelled'):
+                batch_results.append(run_result)
+                _register_completed_configurations(task_id)
+            if run_result.get('cancelled') or (should_cancel is not None and should_cancel()):
+                logger.info(f"Task {task_id}: Cancelled, terminating process pool "
+                            f"({len(batch_results)} configurations completed).")
+                pool.terminate()
+                pool_terminated = True
+                break
+    finally:
+        if not pool_terminated:
+            pool.close()
+        pool.join()
+    return batch_results
+
+
+def _split_configurations_into_batches(indexed_run_configurations: List[Tuple[int, Dict]]
+                                       ) -> List[List[Tuple[int, Dict]]]:
+    """Группирует конфигурации с общими исходными данными (регионы + тип поселения) в пакеты."""
+    batches: Dict[Tuple, List[Tuple[int, Dict]]] = {}
+    for config_index, run_spec in indexed_run_configurations:
+        batches.setdefault(input_data_key(run_spec['params']), []).append((config_index, run_spec))
+    return list(batches.values())
+
+
+def _split_configurations_by_fetch(indexed_run_configurations: List[Tuple[int, Dict]]
+                                   ) -> List[List[Tuple[int, Dict]]]:
+    """
+    Группирует конфигурации с общим набором запросов к БД (тип поселения и период; все регионы вместе,
+    см. preload_input_data_for_configurations) в пакеты.
+    """
+    batches: Dict[Tuple, List[Tuple[int, Dict]]] = {}
+    for config_index, run_spec in indexed_run_configurations:
+        batches.setdefault(input_data_key(run_spec['params'])[1:], []).append((config_index, run_spec))
+    return list(batches.values())
+
+
+def _create_forecast_run(run_id: Optional[str], user, params_display_overall: Dict,
+                         results_file_path: Optional[str], warnings_list: List[str],
+                         input_hash: Optional[str]) -> Optional[str]:
+    """Создает запись ForecastRun. Возвращает текст предупреждения, если запись сохранить не удалось."""
+    try:
+        forecast_run_fields = dict(
+            user=user,
+            input_parameters_json=params_display_overall,
+            results_file_path=results_file_path,
+            input_hash=input_hash,
+            warnings_json=warnings_list
+        )
+        if run_id is not None:
+            forecast_run_fields['id'] = run_id
+        ForecastRun.objects.create(**forecast_run_fields)
+        logger.info(f"Запись о прогнозе для пользователя {user.username} сохранена в ForecastRun ({input_hash}).")
+        return None
+    except Exception as e_db:
+        logger.error(f"Ошибка сохранения записи ForecastRun в БД для пользователя {user.username}: {e_db}")
+        return f"Внимание: Ошибка при сохранении записи о прогнозе в историю БД ({e_db})."
+
+
+def _finalize_forecast(task_id: str, all_run_configurations: List[Dict], batch_results: List[Dict[str, Any]],
+                       base_forecast_params_no_combination_specifics: Dict,
+                       output_detailed_by_age_global: bool,
+                       user_selected_settlement_id: int,
+                       user_selected_sex_code: str,
+                       initial_processed_region_db_ids: List[int],
+                       form_warnings_initial: List[str],
+                       params_for_group_context_map: Dict,
+                       active_data_keys_list: List[str],
+                       results_template_name: Optional[str],
+                       current_user_id: Optional[int],
+                       input_hash: Optional[str] = None,
+                       result_format: str = RESULT_FORMAT_HTML) -> None:
+    """
+    Группирует результаты всех конфигураций, сохраняет историю и рендерит страницу результатов.
+    Если задача была отменена, частичный результат (при keep_partial) только показывается пользователю:
+    в общий файл результатов и в историю он не сохраняется.
+    Для JSON API (result_format='columnar') сохраняется только колоночный JSON: без параметров
+    отображения, общего файла результатов, истории и рендеринга шаблона.
+    При result_format='artifact' сохраняются только общий файл результатов и строки результатов:
+    без истории, прогресса и рендеринга шаблона.
+    """
+    is_html_result = result_format == RESULT_FORMAT_HTML
+    is_artifact_only = result_format == RESULT_FORMAT_ARTIFACT
+    total_configurations = len(all_run_configurations)
+    grouped_results_data: Dict[str, Dict[str, Any]] = {}
+    run_warnings_set = set()
+
+    # Порядок объединения не зависит от порядка завершения подзадач
+    for batch_item in sorted(batch_results, key=lambda item: item['index']):
+        run_spec = all_run_configurations[batch_item['index']]
+        if batch_item.get('error'):
+            run_warnings_set.add(
+                f"Ошибка расчета для «{run_spec['region_group_key']}» "
+                f"(тип поселения {run_spec['params']['settlement_type_id']}, пол {run_spec['params']['sex_code_target']}): "
+                f"{batch_item['error']}")
+            continue
+        if batch_item.get('warnings'):
+            run_warnings_set.update(batch_item['warnings'])
+        _merge_run_result(task_id, grouped_results_data, run_spec, batch_item,
+                          output_detailed_by_age_global, params_for_group_context_map)
+
+    # Отмена учитывается, только если она успела прервать расчет
+    cancel_state = progress.get_cancel_state(task_id)
+    is_partial_result = cancel_state is not None and len(batch_results) < total_configurations
+    if is_partial_result:
+        logger.info(f"Task {task_id}: Cancelled ({cancel_state['reason']}), "
+                    f"{len(batch_results)} of {total_configurations} configurations completed.")
+        # Пользователи, ожидавшие этот же результат, запустят расчет заново
+        if is_html_result:
+            shared_results.pop_waiting_users(input_hash)
+        if not cancel_state['keep_partial'] or not grouped_results_data:
+            progress.set_status(task_id, progress.STATUS_CANCELLED, cancel_reason=cancel_state['reason'])
+            shared_results.release_in_flight(input_hash, task_id)
+            admission.release_heavy_slot(task_id)
+            return
+        run_warnings_set.add(f"Прогноз остановлен пользователем: рассчитано {len(batch_results)} "
+                             f"из {total_configurations} конфигураций. Результаты неполные и не сохранены в истории.")
+
+    if not grouped_results_data and batch_results:
+        raise RuntimeError("Ни одна конфигурация прогноза не была рассчитана успешно. " +
+                           "; ".join(sorted(run_warnings_set)))
+
+    final_grouped_list_for_template: List[Dict[str, Any]] = []
+    for region_title_key, group_data_item in grouped_results_data.items():
+        processed_group_item = copy.deepcopy(group_data_item)
+        processed_group_item['warnings'] = sorted(list(group_data_item['warnings']))
+        sorted_years_data_list: List[Dict[str, Any]] = []
+        for year_val, year_content_data in sorted(group_data_item['data_by_year'].items()):
+            year_item_for_list: Dict[str, Any] = {'year': year_val}
+            if output_detailed_by_age_global:
+                age_data_map_for_year = year_content_data.get('age_data_map', {})
+
+                def age_sort_key_func(age_str_key: str) -> Union[int, str]:
+                    if age_str_key.isdigit(): return int(age_str_key)
+                    parts = age_str_key.split('-')[0].split('+')[0]
+                    return int(parts) if parts.isdigit() else age_str_key
+
+                sorted_age_keys_list = sorted(list(age_data_map_for_year.keys()), key=age_sort_key_func)
+                year_item_for_list['age_rows'] = [age_data_map_for_year[key] for key in sorted_age_keys_list]
+            else:
+                year_item_for_list.update((key, value) for key, value in year_content_data.items()
+                                          if key != 'band_data_map')
+            if 'band_data_map' in year_content_data:  # Группы - в порядке target_age_bands
+                year_item_for_list['band_rows'] = list(year_content_data['band_data_map'].values())
+            sorted_years_data_list.append(year_item_for_list)
+        processed_group_item['data_by_year'] = sorted_years_data_list
+        final_grouped_list_for_template.append(processed_group_item)
+
+    if result_format == RESULT_FORMAT_COLUMNAR:
+        _store_columnar_result(task_id, final_grouped_list_for_template, output_detailed_by_age_global,
+                               set(form_warnings_initial) | run_warnings_set, total_configurations,
+                               cancel_state if is_partial_result else None)
+        return
+
+    overall_display_params_src_task = base_forecast_params_no_combination_specifics.copy()
+    overall_display_params_src_task['settlement_type_id'] = user_selected_settlement_id
+    overall_display_params_src_task['sex_code_target'] = user_selected_sex_code
+    overall_display_params_src_task['region_ids'] = initial_processed_region_db_ids
+
+    current_task_form_warnings_copy = list(form_warnings_initial)
+    params_display_overall = _prepare_display_params_for_task(overall_display_params_src_task,
+                                                              current_task_form_warnings_copy)
+
+    # final_all_task_warnings_set включает current_task_form_warnings_copy (с возможными добавлениями из _prepare...)
+    # и предупреждения, собранные при расчете конфигураций
+    final_all_task_warnings_set = set(current_task_form_warnings_copy)
+    final_all_task_warnings_set.update(run_warnings_set)
+
+    user_for_template = None
+    if current_user_id is not None:
+        try:
+            user_for_template = User.objects.get(id=current_user_id)
+            logger.info(f"Task {task_id}: User '{user_for_template.username}' found for template rendering.")
+        except User.DoesNotExist:
+            logger.warning(
+                f"Task {task_id}: User with ID {current_user_id} not found. Template will be rendered as for anonymous user.")
+    else:
+        logger.info(f"Task {task_id}: No user ID provided. Template will be rendered as for anonymous user.")
+
+    # Инициализируем final_all_warnings_list на основе всех собранных до этого момента предупреждений
+    final_all_warnings_list = sorted(list(final_all_task_warnings_set))
+
+    saved_file_path = None
+
+    # Частичный результат отмененной задачи не сохраняется ни в общий файл, ни в историю
+    if not is_partial_result:
+        # Результат сохраняется всегда (и для анонимных пользователей) в общий файл по хешу входных
+        # параметров: повторные запросы с теми же параметрами используют его без пересчета. Файлы, на которые
+        # не ссылается история, удаляет shared_results.cleanup_shared_results
+        data_for_file_storage = {
+            'original_input_params': base_forecast_params_no_combination_specifics,
+            'display_params_overall': params_display_overall,
+            'all_warnings': final_all_warnings_list,  # Используем уже существующий список
+            'grouped_forecasts_data': final_grouped_list_for_template,
+            'output_detailed_by_age_global': output_detailed_by_age_global,
+            'user_selected_settlement_id': user_selected_settlement_id,
+            'user_selected_sex_code': user_selected_sex_code,
+            'ID_SETTLEMENT_TOTAL': ID_SETTLEMENT_TOTAL, 'ID_SETTLEMENT_URBAN': ID_SETTLEMENT_URBAN,
+            'ID_SETTLEMENT_RURAL': ID_SETTLEMENT_RURAL,
+            'SEX_CODE_TOTAL': SEX_CODE_TOTAL, 'SEX_CODE_MALE': SEX_CODE_MALE, 'SEX_CODE_FEMALE': SEX_CODE_FEMALE,
+            'active_data_keys': sorted(active_data_keys_list),
+            'input_hash': input_hash,
+        }
+        try:
+            saved_file_path = shared_results.save_artifact(input_hash, data_for_file_storage)
+            logger.info(f"Task {task_id}: Результаты прогноза сохранены в общий файл: {saved_file_path}")
+        except IOError as e:
+            logger.error(f"Task {task_id}: Ошибка сохранения файла результатов {input_hash}: {e}")
+            # Добавляем ошибку в ОБЩИЙ список предупреждений
+            final_all_warnings_list.append(f"Внимание: Ошибка при сохранении файла результатов для истории ({e}).")
+            final_all_warnings_list = sorted(list(set(final_all_warnings_list)))  # Обновить и отсортировать
+
+        # Те же результаты строками таблицы - для сводок и сравнения прогнозов в истории
+        try:
+            saved_rows_count = result_rows.save_result_rows(input_hash, final_grouped_list_for_template,
+                                                            output_detailed_by_age_global)
+            logger.info(f"Task {task_id}: {saved_rows_count} result rows saved for {input_hash}.")
+        except Exception as e_rows:
+            logger.error(f"Task {task_id}: Failed to save result rows for {input_hash}: {e_rows}", exc_info=True)
+
+        if is_artifact_only:
+            return
+
+        # Записи истории: для пользователя, запустившего расчет, и для пользователей,
+        # отправивших такой же запрос, пока расчет выполнялся
+        history_user_ids = shared_results.pop_waiting_users(input_hash)
+        if user_for_template:
+            logger.info(f"Task {task_id}: Preparing to save forecast history for user {user_for_template.username}.")
+            history_error = _create_forecast_run(task_id, user_for_template, params_display_overall,
+                                                 saved_file_path, final_all_warnings_list, input_hash)
+            if history_error:
+                final_all_warnings_list.append(history_error)
+                final_all_warnings_list = sorted(list(set(final_all_warnings_list)))
+            history_user_ids = [user_id for user_id in history_user_ids if user_id != user_for_template.id]
+        else:
+            logger.info(f"Task {task_id}: Пользователь не аутентифицирован. История прогноза не будет сохранена.")
+        for waiting_user in User.objects.filter(id__in=history_user_ids):
+            _create_forecast_run(None, waiting_user, params_display_overall, saved_file_path,
+                                 final_all_warnings_list, input_hash)
+
+    context = {
+        'grouped_forecasts': final_grouped_list_for_template,
+        'params_display_overall': params_display_overall,
+        'form_warnings': final_all_warnings_list,  # Список со всеми предупреждениями
+        'output_detailed_by_age_global': output_detailed_by_age_global,
+        'active_data_keys': sorted(active_data_keys_list),
+        'user_selected_settlement_id': user_selected_settlement_id,
+        'user_selected_sex_code': user_selected_sex_code,
+        'ID_SETTLEMENT_TOTAL': ID_SETTLEMENT_TOTAL,
+        'ID_SETTLEMENT_URBAN': ID_SETTLEMENT_URBAN,
+        'ID_SETTLEMENT_RURAL': ID_SETTLEMENT_RURAL,
+        'SEX_CODE_TOTAL': SEX_CODE_TOTAL,
+        'SEX_CODE_MALE': SEX_CODE_MALE,
+        'SEX_CODE_FEMALE': SEX_CODE_FEMALE,
+        'scenarios': {
+            'last_year': SCENARIO_LAST_YEAR,
+            'historical_trend': SCENARIO_HISTORICAL_TREND,
+            'manual_percent': SCENARIO_MANUAL_PERCENT
+        },
+        'user': user_for_template
+    }
+
+    context['grouped_forecasts_json'] = json.dumps(final_grouped_list_for_template)
+    context['active_data_keys_json'] = json.dumps(sorted(list(active_data_keys_list)))
+    context['output_detailed_by_age_global_js'] = json.dumps(output_detailed_by_age_global)
+
+    html_result_rendered = render_to_string(results_template_name, context)
+
+    progress.save_result_html(task_id, html_result_rendered)
+    if is_partial_result:
+        progress.set_status(task_id, progress.STATUS_CANCELLED, warnings=final_all_warnings_list,
+                            cancel_reason=cancel_state['reason'])
+    else:
+        progress.set_status(task_id, progress.STATUS_COMPLETED, warnings=final_all_warnings_list,
+                            completed_configurations=total_configurations)
+    shared_results.release_in_flight(input_hash, task_id)
+    admission.release_heavy_slot(task_id)
+
+
+def _store_columnar_result(task_id: str, final_grouped_list: List[Dict[str, Any]], output_detailed_by_age_global: bool,
+                           all_warnings: set, total_configurations: int,
+                           partial_cancel_state: Optional[Dict[str, Any]]) -> None:
+    """Завершение задачи JSON API: колоночный результат сохраняется в Redis и отдается api_v1."""
+    result_data = columnar_results.build_columnar_result(final_grouped_list, output_detailed_by_age_global,
+                                                         all_warnings)
+    progress.save_result_json(task_id, result_data)
+    if partial_cancel_state is not None:
+        progress.set_status(task_id, progress.STATUS_CANCELLED, warnings=result_data['warnings'],
+                            cancel_reason=partial_cancel_state['reason'])
+    else:
+        progress.set_status(task_id, progress.STATUS_COMPLETED, warnings=result_data['warnings'],
+                            completed_configurations=total_configurations)
+    admission.release_heavy_slot(task_id)
+
+
+def run_forecast_inline(task_id: str, all_run_configurations: List[Dict], form_warnings_initial: List[str],
+                        time_budget_seconds: float, **finalize_kwargs) -> Optional[List[Dict[str, Any]]]:
+    """
+    Рассчитывает дешевый прогноз в текущем процессе (в запросе ForecastView, без Celery) и завершает его
+    так же, как задача (_finalize_forecast); тогда возвращается None. Исходные данные загружаются пакетами
+    по типу поселения, срок time_budget_seconds проверяется после загрузки каждого пакета и перед каждой
+    конфигурацией (тот же механизм, что и отмена задачи), поэтому медленная БД задерживает запрос не больше
+    чем на загрузку одного пакета. Если срок истек, возвращаются результаты уже рассчитанных конфигураций:
+    вызывающий код ставит задачу в очередь с ними (calculate_forecast_task, completed_batch_results).
+    """
+    deadline = time.monotonic() + time_budget_seconds
+
+    def budget_exceeded() -> bool:
+        return time.monotonic() > deadline
+
+    total_configurations = len(all_run_configurations)
+    progress.init_progress(task_id, total_configurations, form_warnings_initial, status=progress.STATUS_RUNNING)
+    batch_results: List[Dict[str, Any]] = []
+    for fetch_batch in _split_configurations_by_fetch(list(enumerate(all_run_configurations))):
+        batch_results.extend(_run_configurations(task_id, fetch_batch, should_cancel=budget_exceeded))
+        if budget_exceeded():
+            break
+    if len(batch_results) < total_configurations:
+        logger.info(f"Task {task_id}: Inline time budget of {time_budget_seconds}s exceeded after "
+                    f"{len(batch_results)} of {total_configurations} configurations.")
+        return batch_results
+    _finalize_forecast(task_id=task_id, all_run_configurations=all_run_configurations, batch_results=batch_results,
+                       form_warnings_initial=form_warnings_initial, **finalize_kwargs)
+    return None
+
+
+def store_precomputed_forecasts(forecast_plans: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Рассчитывает прогнозы нескольких запросов (forecast_params.build_forecast_plan с ключом 'input_hash')
+    в текущем процессе и сохраняет их в общие файлы результатов по хешу, как сделала бы задача прогноза.
+    Исходные данные всех запросов загружаются вместе (один набор запросов к БД на тип поселения).
+    Возвращает {'stored': сохранено запросов, 'failed': не удалось рассчитать, 'configurations': конфигураций}.
+    """
+    preloaded_input_data = preload_input_data_for_configurations(
+        [run_spec for forecast_plan in forecast_plans for run_spec in forecast_plan['all_run_configurations']])
+
+    stats = {'stored': 0, 'failed': 0, 'configurations': 0}
+    for forecast_plan in forecast_plans:
+        all_run_configurations = forecast_plan['all_run_configurations']
+        batch_results = [
+            _run_single_configuration(config_index, run_spec,
+                                      preloaded_input_data.get(input_data_key(run_spec['params'])))
+            for config_index, run_spec in enumerate(all_run_configurations)]
+        stats['configurations'] += len(batch_results)
+        try:
+            _finalize_forecast(
+                task_id=f"precomputed-{forecast_plan['input_hash'][:12]}",
+                all_run_configurations=all_run_configurations,
+                batch_results=batch_results,
+                base_forecast_params_no_combination_specifics=forecast_plan[
+                    'base_forecast_params_no_combination_specifics'],
+                output_detailed_by_age_global=forecast_plan['output_detailed_by_age_global'],
+                user_selected_settlement_id=forecast_plan['user_selected_settlement_id'],
+                user_selected_sex_code=forecast_plan['user_selected_sex_code'],
+                initial_processed_region_db_ids=forecast_plan['initial_processed_region_db_ids'],
+                form_warnings_initial=forecast_plan.get('form_warnings', []),
+                params_for_group_context_map=forecast_plan['params_for_group_context_map'],
+                active_data_keys_list=forecast_plan['active_data_keys'],
+                results_template_name=None,
+                current_user_id=None,
+                input_hash=forecast_plan['input_hash'],
+                result_format=RESULT_FORMAT_ARTIFACT)
+            stats['stored'] += 1
+        except Exception as e_plan:
+            logger.error(f"Precomputed forecast {forecast_plan['input_hash']} "
+                         f"(regions {forecast_plan['initial_processed_region_db_ids']}) failed: {e_plan}")
+            stats['failed'] += 1
+    return stats
+
+
+def _set_task_error(task_id: str, error_message: str, total_configurations: int = 0,
+                    form_warnings_initial: Optional[List[str]] = None) -> None:
+    if progress.get_progress(task_id, include_warnings=False) is None:
+        progress.init_progress(task_id, total_configurations, form_warnings_initial or [])
+    progress.set_status(task_id, progress.STATUS_ERROR, error_message=error_message)
+    admission.release_heavy_slot(task_id)
+
+
 @shared_task(bind=True)
 def calculate_forecast_task(self, task_id: str, all_run_configurations: List[Dict],
                             base_forecast_params_no_combination_specifics: Dict,
@@ -142,240 +710,90 @@ def calculate_forecast_task(self, task_id: str, all_run_configurations: List[Dic
                             form_warnings_initial: List[str],
                             params_for_group_context_map: Dict,
                             active_data_keys_list: List[str],
-                            results_template_name: str,
+                            results_template_name: Optional[str],
                             current_user_id: Optional[int],
-                            current_warnings_accumulator=None):  # current_warnings_accumulator теперь не используется активно
+                            current_warnings_accumulator=None,  # current_warnings_accumulator теперь не используется активно
+                            input_hash: Optional[str] = None,
+                            queue_name: Optional[str] = None,
+                            result_format: str = RESULT_FORMAT_HTML,
+                            completed_batch_results: Optional[List[Dict[str, Any]]] = None):
+    """
+    Координатор прогноза. Способ расчета конфигураций задается settings.FORECAST_EXECUTION_MODE:
+    - 'chord': конфигурации с общими исходными данными объединяются в пакеты, пакеты считаются
+      параллельно подзадачами (Celery chord), группировка, сохранение и рендеринг - в finalize_forecast_task;
+    - 'process_pool': все конфигурации считаются в локальном пуле процессов внутри задачи;
+    - 'sequential': все конфигурации считаются последовательно внутри задачи.
+    Подзадачи chord отправляются в ту же очередь queue_name, что и сама задача (см. admission.queue_for_cost).
+    result_format='columnar' - задача JSON API: вместо HTML сохраняется колоночный JSON (см. _finalize_forecast).
+    Отмена задачи (progress.request_cancel) проверяется между конфигурациями и между годами прогноза.
+    completed_batch_results - конфигурации, рассчитанные в запросе до истечения срока (run_forecast_inline);
+    они не пересчитываются.
+    """
     try:
         celery_task_id_str = self.request.id if self.request.id else "NOT_AVAILABLE"
         logger.info(f"Task {task_id} (Celery ID: {celery_task_id_str}): Starting forecast calculation.")
 
-        grouped_results_data: Dict[str, Dict[str, Any]] = {}
-        completed_configurations = 0
         total_configurations = len(all_run_configurations)
 
-        progress_data_init = {
-            'total_configurations': total_configurations,
-            'completed_configurations': 0,
-            'status': 'starting',
-            'warnings': list(form_warnings_initial),
-            'html_result': None,
-            'error_message': None
-        }
-        cache.set(f'forecast_progress_{task_id}', progress_data_init, timeout=3600)
-        logger.debug(f"Task {task_id}: Initial progress set: {progress_data_init}")
-
-        for i, run_spec in enumerate(all_run_configurations):
-            logger.debug(
-                f"Task {task_id}: Processing config {i + 1}/{total_configurations} for group {run_spec['region_group_key']}")
-
-            forecaster = PopulationForecaster(run_spec['params'])
-            run_result_data = forecaster.run_forecast()
-
-            region_group_key = run_spec['region_group_key']
-            current_params_of_this_run = run_spec['params']  # noqa: F841
-            settlement_id_of_this_run = current_params_of_this_run['settlement_type_id']
-            sex_code_of_this_run = current_params_of_this_run['sex_code_target']
-
-            group_entry = grouped_results_data.setdefault(region_group_key, {
-                'title': region_group_key,
-                'params_for_display_group_context': params_for_group_context_map.get(region_group_key, {}),
-                'warnings': set(),
-                'data_by_year': {}
-            })
-
-            if run_result_data.get('warnings'):
-                group_entry['warnings'].update(run_result_data['warnings'])
-
-            settlement_prefix = "urban_" if settlement_id_of_this_run == ID_SETTLEMENT_URBAN else \
-                ("rural_" if settlement_id_of_this_run == ID_SETTLEMENT_RURAL else \
-                     ("total_" if settlement_id_of_this_run == ID_SETTLEMENT_TOTAL else "unknown_sett_"))
-            sex_suffix = "male" if sex_code_of_this_run == SEX_CODE_MALE else \
-                ("female" if sex_code_of_this_run == SEX_CODE_FEMALE else \
-                     ("total" if sex_code_of_this_run == SEX_CODE_TOTAL else "unknown_sex_"))
-
-            data_key_base = f"{settlement_prefix}{sex_suffix}"
-            if "unknown" in data_key_base:
-                logger.warning(
-                    f"Task {task_id}: Unknown settlement/sex combination for data_key_base: sett_id={settlement_id_of_this_run}, sex_code={sex_code_of_this_run}")
-
-            for year_result in run_result_data.get('results', []):
-                year = year_result['year']
-                year_data_entry = group_entry['data_by_year'].setdefault(year, {})
-                if output_detailed_by_age_global:
-                    age_data_map = year_data_entry.setdefault('age_data_map', {})
-                    for age_pop_item in year_result.get('population_by_age', []):
-                        age_key = str(age_pop_item['age'])
-                        age_specific_entry = age_data_map.setdefault(age_key, {'age_display': age_key})
-                        age_specific_entry[data_key_base] = age_pop_item['population']
-                else:
-                    year_data_entry[data_key_base] = year_result['total_population_in_target_group']
-
-            completed_configurations += 1
-            current_progress_data = cache.get(f'forecast_progress_{task_id}')
-            if not current_progress_data:
-                current_progress_data = copy.deepcopy(progress_data_init)
-                current_progress_data['warnings'] = list(form_warnings_initial)
-                logger.warning(f"Task {task_id}: Cache miss for progress data during loop, re-initialized.")
-
-            current_progress_data['completed_configurations'] = completed_configurations
-            current_progress_data['status'] = 'running'
-
-            task_warnings_set = set(current_progress_data.get('warnings', []))
-            if run_result_data.get('warnings'):
-                task_warnings_set.update(run_result_data['warnings'])
-            current_progress_data['warnings'] = list(task_warnings_set)
-
-            cache.set(f'forecast_progress_{task_id}', current_progress_data, timeout=3600)
-            logger.debug(f"Task {task_id}: Progress updated: {completed_configurations}/{total_configurations}")
-
-        final_grouped_list_for_template: List[Dict[str, Any]] = []
-        for region_title_key, group_data_item in grouped_results_data.items():
-            processed_group_item = copy.deepcopy(group_data_item)
-            processed_group_item['warnings'] = sorted(list(group_data_item['warnings']))
-            sorted_years_data_list: List[Dict[str, Any]] = []
-            for year_val, year_content_data in sorted(group_data_item['data_by_year'].items()):
-                year_item_for_list: Dict[str, Any] = {'year': year_val}
-                if output_detailed_by_age_global:
-                    age_data_map_for_year = year_content_data.get('age_data_map', {})
-
-                    def age_sort_key_func(age_str_key: str) -> Union[int, str]:
-                        if age_str_key.isdigit(): return int(age_str_key)
-                        parts = age_str_key.split('-')[0].split('+')[0]
-                        return int(parts) if parts.isdigit() else age_str_key
-
-                    sorted_age_keys_list = sorted(list(age_data_map_for_year.keys()), key=age_sort_key_func)
-                    year_item_for_list['age_rows'] = [age_data_map_for_year[key] for key in sorted_age_keys_list]
-                else:
-                    year_item_for_list.update(year_content_data)
-                sorted_years_data_list.append(year_item_for_list)
-            processed_group_item['data_by_year'] = sorted_years_data_list
-            final_grouped_list_for_template.append(processed_group_item)
-
-        overall_display_params_src_task = base_forecast_params_no_combination_specifics.copy()
-        overall_display_params_src_task['settlement_type_id'] = user_selected_settlement_id
-        overall_display_params_src_task['sex_code_target'] = user_selected_sex_code
-        overall_display_params_src_task['region_ids'] = initial_processed_region_db_ids
-
-        current_task_form_warnings_copy = list(form_warnings_initial)
-        params_display_overall = _prepare_display_params_for_task(overall_display_params_src_task,
-                                                                  current_task_form_warnings_copy)
-
-        # final_all_task_warnings_set включает current_task_form_warnings_copy (с возможными добавлениями из _prepare...)
-        # и предупреждения из кеша (собранные во время цикла)
-        final_all_task_warnings_set = set(current_task_form_warnings_copy)
-        current_progress_final_read = cache.get(f'forecast_progress_{task_id}')
-        if current_progress_final_read and current_progress_final_read.get('warnings'):
-            final_all_task_warnings_set.update(current_progress_final_read['warnings'])
-
-        user_for_template = None
-        if current_user_id is not None:
-            try:
-                user_for_template = User.objects.get(id=current_user_id)
-                logger.info(f"Task {task_id}: User '{user_for_template.username}' found for template rendering.")
-            except User.DoesNotExist:
-                logger.warning(
-                    f"Task {task_id}: User with ID {current_user_id} not found. Template will be rendered as for anonymous user.")
-        else:
-            logger.info(f"Task {task_id}: No user ID provided. Template will be rendered as for anonymous user.")
-
-        # Инициализируем final_all_warnings_list на основе всех собранных до этого момента предупреждений
-        final_all_warnings_list = sorted(list(final_all_task_warnings_set))  # <--- ИЗМЕНЕНИЕ 1
-
-        saved_file_path = None
-
-        if user_for_template:
-            logger.info(f"Task {task_id}: Preparing to save forecast history for user {user_for_template.username}.")
-            data_for_file_storage = {
-                'original_input_params': base_forecast_params_no_combination_specifics,
-                'display_params_overall': params_display_overall,
-                'all_warnings': final_all_warnings_list,  # Используем уже существующий список
-                'grouped_forecasts_data': final_grouped_list_for_template,
-                'output_detailed_by_age_global': output_detailed_by_age_global,
-                'user_selected_settlement_id': user_selected_settlement_id,
-                'user_selected_sex_code': user_selected_sex_code,
-                'ID_SETTLEMENT_TOTAL': ID_SETTLEMENT_TOTAL, 'ID_SETTLEMENT_URBAN': ID_SETTLEMENT_URBAN,
-                'ID_SETTLEMENT_RURAL': ID_SETTLEMENT_RURAL,
-                'SEX_CODE_TOTAL': SEX_CODE_TOTAL, 'SEX_CODE_MALE': SEX_CODE_MALE, 'SEX_CODE_FEMALE': SEX_CODE_FEMALE,
-                'active_data_keys': sorted(active_data_keys_list)
-            }
-
-            results_filename = f"forecast_results_{task_id}.json"
-            user_folder_name_for_path = str(current_user_id)
-            relative_file_path_for_db = os.path.join('forecast_history', user_folder_name_for_path, results_filename)
-            full_storage_path = os.path.join(settings.MEDIA_ROOT, relative_file_path_for_db)
-
-            try:
-                os.makedirs(os.path.dirname(full_storage_path), exist_ok=True)
-                with open(full_storage_path, 'w', encoding='utf-8') as f:
-                    json.dump(data_for_file_storage, f, ensure_ascii=False, indent=4)
-                logger.info(f"Task {task_id}: Результаты прогноза для истории сохранены в файл: {full_storage_path}")
-                saved_file_path = relative_file_path_for_db
-            except IOError as e:
-                logger.error(f"Task {task_id}: Ошибка сохранения файла результатов истории {full_storage_path}: {e}")
-                # Добавляем ошибку в ОБЩИЙ список предупреждений
-                final_all_warnings_list.append(f"Внимание: Ошибка при сохранении файла результатов для истории ({e}).")
-                final_all_warnings_list = sorted(list(set(final_all_warnings_list)))  # Обновить и отсортировать
-
-            try:
-                ForecastRun.objects.create(
-                    id=task_id,
-                    user=user_for_template,
-                    input_parameters_json=params_display_overall,  # <--- ИЗМЕНЕНИЕ ЗДЕСЬ
-                    results_file_path=saved_file_path,
-                    warnings_json=final_all_warnings_list  # Используем обновленный список
-                )
-                logger.info(
-                    f"Task {task_id}: Запись о прогнозе для пользователя {user_for_template.username} сохранена в ForecastRun.")
-            except Exception as e_db:
-                logger.error(
-                    f"Task {task_id}: Ошибка сохранения записи ForecastRun в БД для пользователя {user_for_template.username}: {e_db}")
-                final_all_warnings_list.append(
-                    f"Внимание: Ошибка при сохранении записи о прогнозе в историю БД ({e_db}).")
-                final_all_warnings_list = sorted(list(set(final_all_warnings_list)))
-        else:
-            logger.info(f"Task {task_id}: Пользователь не аутентифицирован. История прогноза не будет сохранена.")
-
-        context = {
-            'grouped_forecasts': final_grouped_list_for_template,
-            'params_display_overall': params_display_overall,
-            'form_warnings': final_all_warnings_list,  # <--- ИЗМЕНЕНИЕ 2 (используем список со всеми предупреждениями)
+        progress.dequeue(task_id)
+        if not progress.mark_started(task_id, total_configurations, form_warnings_initial):
+            logger.info(f"Task {task_id}: Cancelled while queued, skipping calculation.")
+            admission.release_heavy_slot(task_id)
+            if input_hash is not None:
+                shared_results.release_in_flight(input_hash, task_id)
+            return f"Task {task_id} cancelled before start."
+        logger.debug(f"Task {task_id}: Initial progress set: {total_configurations} configurations")
+
+        if input_hash is None:
+            input_hash = shared_results.compute_input_hash(
+                base_forecast_params_no_combination_specifics, initial_processed_region_db_ids,
+                user_selected_settlement_id, user_selected_sex_code)
+
+        finalize_kwargs = {
+            'task_id': task_id,
+            'all_run_configurations': all_run_configurations,
+            'base_forecast_params_no_combination_specifics': base_forecast_params_no_combination_specifics,
             'output_detailed_by_age_global': output_detailed_by_age_global,
-            'active_data_keys': sorted(active_data_keys_list),
             'user_selected_settlement_id': user_selected_settlement_id,
             'user_selected_sex_code': user_selected_sex_code,
-            'ID_SETTLEMENT_TOTAL': ID_SETTLEMENT_TOTAL,
-            'ID_SETTLEMENT_URBAN': ID_SETTLEMENT_URBAN,
-            'ID_SETTLEMENT_RURAL': ID_SETTLEMENT_RURAL,
-            'SEX_CODE_TOTAL': SEX_CODE_TOTAL,
-            'SEX_CODE_MALE': SEX_CODE_MALE,
-            'SEX_CODE_FEMALE': SEX_CODE_FEMALE,
-            'scenarios': {
-                'last_year': SCENARIO_LAST_YEAR,
-                'historical_trend': SCENARIO_HISTORICAL_TREND,
-                'manual_percent': SCENARIO_MANUAL_PERCENT
-            },
-            'user': user_for_template
+            'initial_processed_region_db_ids': initial_processed_region_db_ids,
+            'form_warnings_initial': form_warnings_initial,
+            'params_for_group_context_map': params_for_group_context_map,
+            'active_data_keys_list': active_data_keys_list,
+            'results_template_name': results_template_name,
+            'current_user_id': current_user_id,
+            'input_hash': input_hash,
+            'result_format': result_format,
         }
 
-        context['grouped_forecasts_json'] = json.dumps(final_grouped_list_for_template)
-        context['active_data_keys_json'] = json.dumps(sorted(list(active_data_keys_list)))
-        context['output_detailed_by_age_global_js'] = json.dumps(output_detailed_by_age_global)
-
-        html_result_rendered = render_to_string(results_template_name, context)
-
-        final_progress_data_to_set = cache.get(f'forecast_progress_{task_id}')
-        if not final_progress_data_to_set:
-            final_progress_data_to_set = copy.deepcopy(progress_data_init)
-            logger.warning(
-                f"Task {task_id}: Cache miss for final progress data just before setting completion, re-initialized.")
-
-        final_progress_data_to_set['status'] = 'completed'
-        final_progress_data_to_set['html_result'] = html_result_rendered
-        final_progress_data_to_set['completed_configurations'] = total_configurations
-        final_progress_data_to_set[
-            'warnings'] = final_all_warnings_list  # <--- ИЗМЕНЕНИЕ 3 (сохраняем все собранные предупреждения)
-
-        cache.set(f'forecast_progress_{task_id}', final_progress_data_to_set, timeout=3600)
+        completed_batch_results = list(completed_batch_results or [])
+        if completed_batch_results:
+            _register_completed_configurations(task_id, len(completed_batch_results))
+        completed_indexes = {run_result['index'] for run_result in completed_batch_results}
+        indexed_run_configurations = [(config_index, run_spec)
+                                      for config_index, run_spec in enumerate(all_run_configurations)
+                                      if config_index not in completed_indexes]
+
+        execution_mode = getattr(settings, 'FORECAST_EXECUTION_MODE', EXECUTION_MODE_CHORD)
+        if execution_mode == EXECUTION_MODE_CHORD:
+            batches = _split_configurations_into_batches(indexed_run_configurations)
+            if len(batches) > 1:
+                logger.info(f"Task {task_id}: Dispatching {len(batches)} configuration batches as a Celery chord.")
+                subtask_options = {'queue': queue_name} if queue_name else {}
+                chord(
+                    group(run_forecast_batch_task.s(task_id, batch).set(**subtask_options) for batch in batches),
+                    finalize_forecast_task.s(completed_batch_results=completed_batch_results,
+                                             **finalize_kwargs).set(**subtask_options)
+                ).on_error(forecast_chord_error_task.s(task_id=task_id).set(**subtask_options)).delay()
+                return f"Task {task_id} dispatched {len(batches)} batches."
+
+        should_cancel = progress.make_cancellation_checker(task_id)
+        if execution_mode == EXECUTION_MODE_PROCESS_POOL:
+            batch_results = _run_configurations_in_process_pool(task_id, indexed_run_configurations,
+                                                                should_cancel=should_cancel)
+        else:
+            batch_results = _run_configurations(task_id, indexed_run_configurations, should_cancel=should_cancel)
+        _finalize_forecast(batch_results=completed_batch_results + batch_results, **finalize_kwargs)
 
         logger.info(f"Task {task_id} (Celery ID: {celery_task_id_str}): Forecast calculation completed.")
         return f"Task {task_id} completed successfully."
@@ -385,20 +803,74 @@ def calculate_forecast_task(self, task_id: str, all_run_configurations: List[Dic
         logger.error(
             f"Task {task_id} (Celery ID: {celery_task_id_str_err}): Error during forecast calculation: {e_task}",
             exc_info=True)
+        _set_task_error(task_id, f"Ошибка в фоновой задаче: ({type(e_task).__name__}) {str(e_task)}",
+                        len(all_run_configurations), form_warnings_initial)
+        return f"Task {task_id} failed: {e_task}"
+
+
+@shared_task(bind=True)
+def run_forecast_batch_task(self, task_id: str, indexed_run_configurations: List[List]):
+    """Подзадача: рассчитывает пакет конфигураций с общими исходными данными."""
+    logger.info(f"Task {task_id} (Celery ID: {self.request.id}): "
+                f"Running batch of {len(indexed_run_configurations)} configurations.")
+    # После JSON-сериализации пары (index, run_spec) приходят списками
+    return _run_configurations(task_id, [(int(index), run_spec) for index, run_spec in indexed_run_configurations],
+                               should_cancel=progress.make_cancellation_checker(task_id))
+
+
+@shared_task(bind=True)
+def finalize_forecast_task(self, batch_results_per_subtask: List[List[Dict[str, Any]]],
+                           completed_batch_results: Optional[List[Dict[str, Any]]] = None, **finalize_kwargs):
+    """
+    Callback chord'а: объединяет результаты всех подзадач (и конфигураций, рассчитанных до постановки
+    в очередь), сохраняет историю и рендерит страницу.
+    """
+    task_id = finalize_kwargs['task_id']
+    try:
+        batch_results = list(completed_batch_results or [])
+        batch_results.extend(item for batch in batch_results_per_subtask for item in batch)
+        _finalize_forecast(batch_results=batch_results, **finalize_kwargs)
+        logger.info(f"Task {task_id} (Celery ID: {self.request.id}): Forecast calculation completed.")
+        return f"Task {task_id} completed successfully."
+    except Exception as e_task:
+        logger.error(f"Task {task_id}: Error while finalizing forecast: {e_task}", exc_info=True)
+        _set_task_error(task_id, f"Ошибка в фоновой задаче: ({type(e_task).__name__}) {str(e_task)}",
+                        len(finalize_kwargs.get('all_run_configurations', [])),
+                        finalize_kwargs.get('form_warnings_initial'))
+        return f"Task {task_id} failed: {e_task}"
+
+
+@shared_task
+def forecast_chord_error_task(request, exc, traceback, task_id: str):
+    """Errback chord'а: подзадача упала вне обработки ошибок конфигураций (например, потерян воркер)."""
+    logger.error(f"Task {task_id}: Chord subtask {request.id} failed: {exc}")
+    _set_task_error(task_id, f"Ошибка в фоновой задаче: ({type(exc).__name__}) {exc}")
+
+
+@shared_task
+def generate_export_artifact_task(artifact_id: int):
+    """Фоновый экспорт прогноза в файл (см. export_jobs). Состояние - в ForecastExportArtifact."""
+    artifact = export_jobs.run_export_job(artifact_id)
+    if artifact is None:
+        return f"Export artifact {artifact_id} not found."
+    return f"Export artifact {artifact_id}: {artifact.status}."
+
+
+@shared_task
+def precompute_default_forecasts_task():
+    """Периодический (Celery beat) расчет прогнозов с параметрами по умолчанию для всех регионов."""
+    from .default_forecasts import precompute_default_forecasts
+
+    stats = precompute_default_forecasts()
+    logger.info(f"Default forecasts precomputed: {stats}")
+    return stats
+
+
+@shared_task
+def cleanup_shared_results_task():
+    """Периодическое (Celery beat) удаление общих файлов результатов и строк, которые больше не нужны."""
+    from .default_forecasts import default_forecast_input_hashes
 
-        error_progress_data_cache = cache.get(f'forecast_progress_{task_id}')
-        if not error_progress_data_cache:
-            completed_conf_val = completed_configurations if 'completed_configurations' in locals() else 0
-            total_conf_val = total_configurations if 'total_configurations' in locals() else (
-                len(all_run_configurations) if 'all_run_configurations' in locals() else 0)
-            error_progress_data_cache = {
-                'total_configurations': total_conf_val,
-                'completed_configurations': completed_conf_val,
-                'warnings': list(form_warnings_initial) if 'form_warnings_initial' in locals() else [],
-                'html_result': None,
-            }
-        error_progress_data_cache['status'] = 'error'
-        error_progress_data_cache['error_message'] = f"Ошибка в фоновой задаче: ({type(e_task).__name__}) {str(e_task)}"
-        cache.set(f'forecast_progress_{task_id}', error_progress_data_cache, timeout=3600)
-
-        return f"Task {task_id} failed: {e_task}"
\ No newline at end of file
+    stats = shared_results.cleanup_shared_results(protected_hashes=default_forecast_input_hashes())
+    logger.info(f"Shared results cleaned up: {stats}")
+    return stats
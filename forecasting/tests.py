@@ -1,3 +1,196 @@
-from django.test import TestCase
+import io
+import json
+import os
+import random
+import tempfile
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from . import columnar_results, result_store
+from .data_providers.db_data_provider import DATASET_INITIAL_POPULATION, DATASET_POPULATION_FOR_DEATHS, \
+    DATASET_FEMALE_POPULATION_FOR_BIRTHS, DATASET_DEATH_COUNTS, DATASET_BIRTH_COUNTS, SEX_MALE_CODE, \
+    SEX_FEMALE_CODE, SEX_TOTAL_CODE
+from .forecast_params import parse_age_bands, format_age_bands
+from .forecaster import PopulationForecaster
+from .tasks import _merge_run_result, ID_SETTLEMENT_URBAN
+
+HISTORICAL_YEARS = range(2018, 2023)
+FORECAST_YEARS = range(2023, 2026)
+AGE_BANDS = [['Дети', 0, 14], ['Трудоспособные', 15, 64], ['Старшие', 65, 100]]
+
+
+def _synthetic_dataset(seed: int = 1) -> dict:
+    """Исходные данные одного региона и типа поселения в структуре get_historical_datasets_by_region."""
+    rng = random.Random(seed)
+    dataset = {DATASET_POPULATION_FOR_DEATHS: {}, DATASET_DEATH_COUNTS: {},
+               DATASET_FEMALE_POPULATION_FOR_BIRTHS: {}, DATASET_BIRTH_COUNTS: {}, DATASET_INITIAL_POPULATION: {}}
+    for sex_code in (SEX_MALE_CODE, SEX_FEMALE_CODE):
+        for age in range(101):
+            population_by_year = {year: rng.randint(500, 5000) if age < 90 else rng.randint(10, 300)
+                                  for year in HISTORICAL_YEARS}
+            dataset[DATASET_POPULATION_FOR_DEATHS].setdefault(sex_code, {})[age] = population_by_year
+            dataset[DATASET_DEATH_COUNTS].setdefault(sex_code, {})[age] = {
+                year: population * (0.001 + age * 0.0008) for year, population in population_by_year.items()}
+            dataset[DATASET_INITIAL_POPULATION].setdefault(age, {})[sex_code] = population_by_year[2022]
+            if sex_code == SEX_FEMALE_CODE and 15 <= age <= 55:
+                dataset[DATASET_FEMALE_POPULATION_FOR_BIRTHS][age] = population_by_year
+                dataset[DATASET_BIRTH_COUNTS][age] = {year: rng.randint(10, 200) for year in HISTORICAL_YEARS}
+    return dataset
+
+
+def _stored_results_data(output_detailed_by_age: bool) -> dict:
+    """Результат в структуре data_for_file_storage: две группы, во второй - именованные возрастные группы."""
+    grouped_forecasts_data = []
+    for group_number, title in enumerate(('Регион Б', 'Регион А')):
+        data_by_year = []
+        for year in FORECAST_YEARS:
+            if output_detailed_by_age:
+                age_rows = [{'age_display': age_display, 'urban_male': year + age_number + group_number,
+                             'urban_female': (year + age_number) / 7}
+                            for age_number, age_display in enumerate(('0', '1', '2', '100+'))]
+                del age_rows[1]['urban_female']
+                year_item = {'year': year, 'age_rows': age_rows}
+            else:
+                year_item = {'year': year, 'total_population_in_target_group': year * 10 + group_number,
+                             'natural_increase_rate': year / 3}
+                if year == FORECAST_YEARS[-1]:
+                    del year_item['natural_increase_rate']
+            if group_number == 1:
+                year_item['band_rows'] = [{'band_name': band_name, 'urban_total': year + band_start_age}
+                                          for band_name, band_start_age, _ in AGE_BANDS]
+            data_by_year.append(year_item)
+        grouped_forecasts_data.append({'title': title, 'warnings': [f'{title}: предупреждение'],
+                                       'data_by_year': data_by_year})
+    return {'output_detailed_by_age_global': output_detailed_by_age,
+            'display_params_overall': {'region_names_display': ['Регион Б', 'Регион А']},
+            'warnings': [], 'grouped_forecasts_data': grouped_forecasts_data}
+
+
+def _forecast_params(**overrides) -> dict:
+    params = {
+        'region_ids': [2], 'settlement_type_id': ID_SETTLEMENT_URBAN, 'sex_code_target': SEX_TOTAL_CODE,
+        'historical_data_start_year': 2018, 'historical_data_end_year': 2022,
+        'forecast_start_year': 2023, 'forecast_end_year': 2030,
+        'target_age_group_input': "Все возрасты", 'output_detailed_by_age': False,
+        'birth_rate_scenario': 'historical_trend', 'death_rate_scenario_male': 'last_year',
+        'death_rate_scenario_female': 'last_year', 'include_migration': False,
+    }
+    params.update(overrides)
+    return params
+
+
+class AgeBandsTests(SimpleTestCase):
+    def setUp(self):
+        self.dataset = _synthetic_dataset()
+
+    def test_band_totals_match_single_range_runs(self):
+        for sex_code in (SEX_MALE_CODE, SEX_FEMALE_CODE, SEX_TOTAL_CODE):
+            banded_result = PopulationForecaster(
+                _forecast_params(sex_code_target=sex_code, target_age_bands=AGE_BANDS),
+                preloaded_data=self.dataset).run_forecast()
+            for band_name, band_start_age, band_end_age in AGE_BANDS:
+                single_result = PopulationForecaster(
+                    _forecast_params(sex_code_target=sex_code, target_age_group_input=(band_start_age, band_end_age)),
+                    preloaded_data=self.dataset).run_forecast()
+                for banded_year, single_year in zip(banded_result['results'], single_result['results']):
+                    band_item = next(item for item in banded_year['age_bands'] if item['name'] == band_name)
+                    self.assertEqual(band_item['population'], single_year['total_population_in_target_group'],
+                                     f"{sex_code} {band_name} {banded_year['year']}")
+
+    def test_band_rows_survive_merge_and_result_store(self):
+        run_spec = {'region_group_key': 'Регион', 'params': _forecast_params(target_age_bands=AGE_BANDS)}
+        run_result = PopulationForecaster(run_spec['params'], preloaded_data=self.dataset).run_forecast()
+        grouped_results_data = {}
+        _merge_run_result('test', grouped_results_data, run_spec, run_result, False, {})
+        data_by_year = []
+        for year, year_content_data in sorted(grouped_results_data['Регион']['data_by_year'].items()):
+            year_item = {key: value for key, value in year_content_data.items() if key != 'band_data_map'}
+            year_item.update(year=year, band_rows=list(year_content_data['band_data_map'].values()))
+            data_by_year.append(year_item)
+        self.assertEqual([band_row['band_name'] for band_row in data_by_year[0]['band_rows']],
+                         [band_name for band_name, _, _ in AGE_BANDS])
+
+        result_file = io.BytesIO()
+        group_data = {'title': 'Регион', 'warnings': [], 'data_by_year': data_by_year}
+        result_store.write_result(result_file, {'output_detailed_by_age_global': False,
+                                                'grouped_forecasts_data': [group_data]})
+        result_file.seek(0)
+        with result_store.ForecastResultReader(result_file) as reader:
+            self.assertEqual(reader.read_group(0)['data_by_year'], data_by_year)
+            columnar_group = columnar_results.columnar_result_from_reader(reader)['groups'][0]
+        self.assertEqual(columnar_group['age_bands'], [band_name for band_name, _, _ in AGE_BANDS])
+        self.assertEqual(columnar_group['band_columns']['urban_total'][:3],
+                         [band_row['urban_total'] for band_row in data_by_year[0]['band_rows']])
+
+    def test_parse_age_bands(self):
+        form_warnings = []
+        self.assertEqual(parse_age_bands(format_age_bands(AGE_BANDS), form_warnings), AGE_BANDS)
+        self.assertEqual(form_warnings, [])
+        self.assertEqual(parse_age_bands("Дети: 0-14\nДети: 1-2; без возрастов; Старшие: 70-60", form_warnings),
+                         [['Дети', 0, 14]])
+        self.assertEqual(len(form_warnings), 3)
+
+
+class ResultStoreTests(SimpleTestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+
+    def _write_files(self, results_data: dict) -> tuple:
+        """Один и тот же результат в колоночном и в прежнем (JSON) формате."""
+        result_path = os.path.join(self.temp_dir, 'result' + result_store.RESULT_FILE_EXTENSION)
+        with open(result_path, 'wb') as f:
+            result_store.write_result(f, results_data)
+        legacy_path = os.path.join(self.temp_dir, 'result.json')
+        with open(legacy_path, 'w', encoding='utf-8') as f:
+            json.dump(results_data, f, ensure_ascii=False)
+        return result_path, legacy_path
+
+    def test_round_trip(self):
+        for output_detailed_by_age in (False, True):
+            with self.subTest(output_detailed_by_age=output_detailed_by_age):
+                results_data = _stored_results_data(output_detailed_by_age)
+                result_path, legacy_path = self._write_files(results_data)
+                with result_store.open_result(result_path) as reader:
+                    self.assertNotIsInstance(reader, result_store.LegacyJsonResultReader)
+                    self.assertEqual(reader.to_results_data(), dict(
+                        results_data, format_version=result_store.RESULT_FORMAT_VERSION))
+                    row_count = reader.row_count()
+                with result_store.open_result(legacy_path) as legacy_reader:
+                    self.assertIsInstance(legacy_reader, result_store.LegacyJsonResultReader)
+                    self.assertEqual(legacy_reader.to_results_data(), results_data)
+                    self.assertEqual(legacy_reader.row_count(), row_count)
+                self.assertEqual(row_count, 2 * len(FORECAST_YEARS) * (4 if output_detailed_by_age else 1))
+
+    def test_read_group_slices_years_and_ages(self):
+        for output_detailed_by_age in (False, True):
+            with self.subTest(output_detailed_by_age=output_detailed_by_age):
+                results_data = _stored_results_data(output_detailed_by_age)
+                expected_years = []
+                for year_item in results_data['grouped_forecasts_data'][1]['data_by_year'][1:]:
+                    if output_detailed_by_age:
+                        year_item = dict(year_item, age_rows=[age_row for age_row in year_item['age_rows']
+                                                              if age_row['age_display'] in ('1', '2')])
+                    expected_years.append(year_item)
+
+                for result_path in self._write_files(results_data):
+                    with result_store.open_result(result_path) as reader:
+                        group_data = reader.read_group(1, year_range=(2024, None), age_range=(1, 2))
+                    self.assertEqual(group_data['title'], 'Регион А')
+                    self.assertEqual(group_data['data_by_year'], expected_years)
+                    self.assertEqual(group_data['data_by_year'][0]['band_rows'][0],
+                                     {'band_name': 'Дети', 'urban_total': 2024})
+
+    def test_group_order(self):
+        result_path, legacy_path = self._write_files(_stored_results_data(False))
+        for path in (result_path, legacy_path):
+            results_data = result_store.load_result_data(path, group_order=['Регион А', 'Регион Б'])
+            self.assertEqual([group_data['title'] for group_data in results_data['grouped_forecasts_data']],
+                             ['Регион А', 'Регион Б'])
+            self.assertEqual(results_data['display_params_overall']['region_names_display'],
+                             ['Регион А', 'Регион Б'])
+            with result_store.open_result(path, group_order=['Регион А']) as reader:
+                columnar_groups = columnar_results.columnar_result_from_reader(reader)['groups']
+            self.assertEqual([group['title'] for group in columnar_groups], ['Регион А', 'Регион Б'])
+            self.assertEqual(columnar_groups[0]['age_bands'], [band_name for band_name, _, _ in AGE_BANDS])
@@ -0,0 +1,114 @@
+# forecasting/tidy_export.py
+
+import json
+import logging
+from typing import Dict, List, Any, Optional, Iterable, Iterator, IO
+
+from .result_rows import parse_data_key
+
+logger = logging.getLogger(__name__)
+
+# Машиночитаемый экспорт результата прогноза в "длинном" виде: одна запись на группу регионов, год,
+# тип поселения, пол и возраст; для именованных возрастных групп (target_age_bands) - на группу вместо
+# возраста (band - название группы, у остальных записей - null). В отличие от CSV/XLSX (csv_export_utils, excel_export_utils) здесь нет
+# параметров, предупреждений и заголовков таблиц - только данные, которые сразу загружаются в датафрейм:
+#   NDJSON  - одна JSON-запись на строку, формируется потоком;
+#   Parquet - колоночный двоичный формат, одна группа строк (row group) на группу регионов.
+#             Требует пакет pyarrow (необязательная зависимость, импортируется при первом экспорте).
+TIDY_COLUMNS = ('year', 'group', 'settlement', 'sex', 'age', 'band', 'population')
+
+NDJSON_STREAM_CHUNK_SIZE = 64 * 1024  # Как и для CSV: записи копятся в куске примерно такого размера (символов)
+
+# Тип поселения в записях - по префиксу ключа данных результата (urban_male -> urban)
+SETTLEMENT_LABELS = {1: 'total', 2: 'urban', 3: 'rural'}
+
+
+def _age_from_display(age_display: str) -> Optional[int]:
+    age_str = str(age_display).split('-')[0].rstrip('+')
+    return int(age_str) if age_str.isdigit() else None
+
+
+class TidyExportUnavailable(Exception):
+    """Формат экспорта недоступен на сервере (не установлена необязательная зависимость)."""
+    pass
+
+
+def iter_tidy_records(grouped_forecasts_data: Iterable[Dict], output_detailed_by_age_global: bool) -> Iterator[Dict[str, Any]]:
+    """
+    Записи {year, group, settlement, sex, age, band, population}. age - нижняя граница возраста
+    (None для прогноза без вывода по возрастам и для возрастных групп). Группы читаются из
+    grouped_forecasts_data по одной.
+    """
+    for group_data in grouped_forecasts_data:
+        group_title = group_data['title']
+        for year_item in group_data['data_by_year']:
+            year = year_item['year']
+            value_rows = year_item.get('age_rows', []) if output_detailed_by_age_global else [year_item]
+            for value_row in value_rows + year_item.get('band_rows', []):
+                age = _age_from_display(value_row['age_display']) if 'age_display' in value_row else None
+                for data_key, population in value_row.items():
+                    settlement_and_sex = parse_data_key(data_key)
+                    if settlement_and_sex is None or population is None:
+                        continue
+                    settlement_type_id, sex_code = settlement_and_sex
+                    yield {
+                        'year': year,
+                        'group': group_title,
+                        'settlement': SETTLEMENT_LABELS[settlement_type_id],
+                        'sex': sex_code,
+                        'age': age,
+                        'band': value_row.get('band_name'),
+                        'population': round(population),
+                    }
+
+
+def iter_ndjson_chunks(grouped_forecasts_data: Iterable[Dict], output_detailed_by_age_global: bool) -> Iterator[str]:
+    """NDJSON кусками текста (для StreamingHttpResponse)."""
+    chunk_lines: List[str] = []
+    chunk_size = 0
+    for record in iter_tidy_records(grouped_forecasts_data, output_detailed_by_age_global):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        chunk_lines.append(line)
+        chunk_size += len(line)
+        if chunk_size >= NDJSON_STREAM_CHUNK_SIZE:
+            yield ''.join(chunk_lines)
+            chunk_lines = []
+            chunk_size = 0
+    if chunk_lines:
+        yield ''.join(chunk_lines)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise TidyExportUnavailable("Экспорт в Parquet недоступен: на сервере не установлен пакет pyarrow.") from e
+    return pyarrow, pyarrow.parquet
+
+
+def write_parquet(output_file: IO[bytes], grouped_forecasts_data: Iterable[Dict],
+                  output_detailed_by_age_global: bool) -> None:
+    """
+    Записывает результат в Parquet (в открытый бинарный файл). В памяти одновременно
+    только колонки одной группы регионов. TidyExportUnavailable, если нет pyarrow.
+    """
+    pa, pq = _import_pyarrow()
+    schema = pa.schema([
+        ('year', pa.int16()),
+        ('group', pa.dictionary(pa.int32(), pa.string())),
+        ('settlement', pa.dictionary(pa.int8(), pa.string())),
+        ('sex', pa.dictionary(pa.int8(), pa.string())),
+        ('age', pa.int16()),
+        ('band', pa.dictionary(pa.int8(), pa.string())),
+        ('population', pa.int64()),
+    ])
+    with pq.ParquetWriter(output_file, schema, compression='zstd') as parquet_writer:
+        for group_data in grouped_forecasts_data:
+            columns: Dict[str, List[Any]] = {column_name: [] for column_name in TIDY_COLUMNS}
+            for record in iter_tidy_records([group_data], output_detailed_by_age_global):
+                for column_name in TIDY_COLUMNS:
+                    columns[column_name].append(record[column_name])
+            if not columns['year']:
+                continue
+            parquet_writer.write_table(pa.Table.from_pydict(columns, schema=schema))
@@ -1,21 +1,37 @@
 # forecasting/urls.py
 from django.urls import path
 from .views import ForecastView # Импортируем наше классовое представление
-from . import views
+from . import api_v1, views
 app_name = 'forecasting' # Пространство имен для URL-ов этого приложения
 
 urlpatterns = [
     path('run-forecast/', ForecastView.as_view(), name='run_forecast'),
+    path('solve/', views.ForecastSolveView.as_view(), name='forecast_solve'),
     # - API для скачивания результатов в CSV/JSON
     path('history/', views.forecast_history_view, name='forecast_history'),
+    path('history/compare/', views.compare_forecasts_view, name='compare_forecasts'),
     # path('download-forecast/<int:forecast_id>/csv/', DownloadCsvView.as_view(), name='download_csv'),
   path('progress/', views.ForecastProgressView.as_view(), name='forecast_progress_api'),
+    path('progress/stream/', views.ForecastProgressStreamView.as_view(), name='forecast_progress_stream'),
+    path('result/', views.ForecastResultView.as_view(), name='forecast_result'),
+    path('cancel/', views.ForecastCancelView.as_view(), name='forecast_cancel'),
 
     path('history/<uuid:forecast_run_id>/view/', views.view_historical_forecast, name='view_historical_forecast'),
 
+    path('export/batch/', views.batch_export_view, name='batch_export'),
     path('export/<uuid:forecast_run_id>/<str:export_format>/',
          views.export_forecast_data_view,
          name='export_forecast_data'),
+    path('export/<uuid:forecast_run_id>/<str:export_format>/job/', views.start_export_job_view,
+         name='start_export_job'),
+    path('export/<uuid:forecast_run_id>/<str:export_format>/status/', views.export_job_status_view,
+         name='export_job_status'),
+
+    # JSON API (версия 1), см. api_v1.py
+    path('api/v1/forecasts/', api_v1.submit_forecast_view, name='api_v1_submit_forecast'),
+    path('api/v1/forecasts/<uuid:task_id>/', api_v1.forecast_status_view, name='api_v1_forecast_status'),
+    path('api/v1/forecasts/<uuid:task_id>/events/', api_v1.forecast_events_view, name='api_v1_forecast_events'),
+    path('api/v1/forecasts/<uuid:task_id>/result/', api_v1.forecast_result_view, name='api_v1_forecast_result'),
 
 
 ]
@@ -1,31 +1,40 @@
 
+import gzip
+import hashlib
 import json
 import logging
 import copy  # Необходим для deepcopy, если используется
 from django.shortcuts import render
-from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.http import HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse
 from django.views import View
 from typing import Any, Optional, List, Dict, Union, Tuple
 from django.template.loader import render_to_string  # Остается, но используется в задаче
-from django.core.cache import cache
 import uuid
-from .csv_export_utils import write_forecast_data_to_csv
+from .csv_export_utils import iter_forecast_csv_chunks
 import os
 import csv
-from io import BytesIO
+import tempfile
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET, require_POST
+from datetime import datetime, timezone as dt_timezone
+from django.urls import reverse
 from django.core.paginator import Paginator # Для пагинации, если прогнозов много
-from .models import ForecastRun
-from .excel_export_utils import generate_forecast_excel_workbook
+from django.core.exceptions import ValidationError
+from .models import ForecastRun, ForecastExportArtifact
+from . import progress as forecast_progress
+from . import admission, batch_export, export_jobs, forecast_params, result_rows, result_store, scenario_solver, \
+    shared_results, tidy_export
+from .excel_export_utils import save_forecast_excel_workbook
 from django.shortcuts import render, get_object_or_404
 from django.http import HttpResponse, Http404, JsonResponse
 from .tasks import (ID_SETTLEMENT_TOTAL, ID_SETTLEMENT_URBAN, ID_SETTLEMENT_RURAL,
                     SEX_CODE_TOTAL, SEX_CODE_MALE, SEX_CODE_FEMALE,
                     SCENARIO_LAST_YEAR, SCENARIO_HISTORICAL_TREND, SCENARIO_MANUAL_PERCENT)
 from .forecaster import PopulationForecaster  # Нужен только если _prepare_display_params или что-то еще его использует
-from data_collector.models import Region
-from .tasks import calculate_forecast_task  # Импорт вашей задачи Celery
+from data_collector import region_registry
+from .tasks import calculate_forecast_task, generate_export_artifact_task, run_forecast_inline  # Импорт вашей задачи Celery
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +54,11 @@ DEFAULT_FORECAST_END_YEAR = DEFAULT_HISTORICAL_END_YEAR + 10
 SCENARIO_LAST_YEAR = 'last_year'  # Предполагаемые значения
 SCENARIO_HISTORICAL_TREND = 'historical_trend'
 SCENARIO_MANUAL_PERCENT = 'manual_percent'
+MAX_COMPARED_FORECASTS = 5  # Сколько прогнозов из истории можно сравнить одновременно
+MAX_BATCH_EXPORT_FORECASTS = 100  # Сколько прогнозов можно выгрузить одним архивом
+# Версия представления сохраненных результатов (страница истории, экспорт) в ETag: увеличить при изменении
+# шаблона результатов или формата файлов экспорта, чтобы браузеры не использовали закешированные ответы
+HISTORY_RESPONSE_CACHE_VERSION = 1
 
 
 
@@ -56,8 +70,7 @@ class ForecastView(View):
     results_template_name = 'forecast_results.html'  # Имя шаблона будет передано в задачу
 
     def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
-        regions_from_db = Region.objects.filter(map_code__isnull=False, map_code__startswith="RU-")
-        regions_js_map_data = {r.map_code: r.id for r in regions_from_db}
+        regions_js_map_data = region_registry.get_map_code_to_region_id_map(map_code_prefix="RU-")
         context = {
             'default_hist_start': DEFAULT_HISTORICAL_START_YEAR,
             'default_hist_end': DEFAULT_HISTORICAL_END_YEAR,
@@ -80,10 +93,8 @@ class ForecastView(View):
 
     # Эта версия остается во view, если нужна для GET или какой-то другой логики во view
     def _get_region_name_by_id_view_version(self, region_id: int) -> str:
-        try:
-            return Region.objects.get(id=region_id).name
-        except Region.DoesNotExist:
-            return f"Регион ID {region_id}"
+        region_name = region_registry.get_region_name(region_id)
+        return region_name if region_name is not None else f"Регион ID {region_id}"
 
     def _prepare_display_params_view_version(self, forecast_params_source: Dict, form_warnings_list: List) -> Dict:
         # Эта функция может остаться, если вы ее используете для чего-то в GET-запросе,
@@ -101,13 +112,12 @@ class ForecastView(View):
             if region_ids_list:
                 is_all_russia_display = False
                 if len(region_ids_list) == 1 and region_ids_list[0] == ID_FOR_ALL_RUSSIA:
-                    russia_obj_check = Region.objects.filter(id=ID_FOR_ALL_RUSSIA,
-                                                             map_code=MAP_CODE_FOR_ALL_RUSSIA).first()
-                    if russia_obj_check: is_all_russia_display = True
+                    russia_obj_check = region_registry.get_region(ID_FOR_ALL_RUSSIA)
+                    if russia_obj_check and russia_obj_check['map_code'] == MAP_CODE_FOR_ALL_RUSSIA:
+                        is_all_russia_display = True
 
                 if is_all_russia_display:
-                    params_for_display['region_names_display'] = [
-                        russia_obj_check.name if russia_obj_check else "Российская Федерация (по ID)"]
+                    params_for_display['region_names_display'] = [russia_obj_check['name']]
                 elif len(region_ids_list) == 1:
                     params_for_display['region_names_display'] = [
                         self._get_region_name_by_id_view_version(region_ids_list[0])]
@@ -158,186 +168,122 @@ class ForecastView(View):
         params_for_display['target_age_group_input_display'] = f"{target_age[0]} - {target_age[1]} лет" if isinstance(
             target_age, tuple) else str(target_age)
 
+        if forecast_params_source.get('target_age_bands'):
+            params_for_display['target_age_bands_display'] = [
+                f"{band_name}: {band_start_age} - {band_end_age} лет"
+                for band_name, band_start_age, band_end_age in forecast_params_source['target_age_bands']]
+
         params_for_display.setdefault('output_detailed_by_age', False)
         params_for_display.setdefault('include_migration', False)
         return params_for_display
 
+    def _respond_with_stored_result(self, request: HttpRequest, task_id_str: str, input_hash: str,
+                                    stored_results_data: Dict[str, Any], total_configurations: int,
+                                    form_warnings: List[str]) -> JsonResponse:
+        """
+        Отдает ранее рассчитанный результат без запуска задачи: результат рендерится и сохраняется
+        так же, как по завершении задачи, а клиент получает статус 'processing_complete'.
+        """
+        all_warnings = sorted(set(stored_results_data.get('all_warnings', [])) | set(form_warnings))
+
+        if request.user.is_authenticated:
+            ForecastRun.objects.create(
+                id=task_id_str,
+                user=request.user,
+                input_parameters_json=stored_results_data.get('display_params_overall', {}),
+                results_file_path=shared_results.find_artifact(input_hash),
+                input_hash=input_hash,
+                warnings_json=all_warnings
+            )
+
+        context = _results_context_from_stored_data(stored_results_data, warnings_fallback=all_warnings)
+        context['form_warnings'] = all_warnings
+        html_result_rendered = render_to_string(self.results_template_name, context, request=request)
+
+        forecast_progress.init_progress(task_id_str, total_configurations, all_warnings)
+        forecast_progress.save_result_html(task_id_str, html_result_rendered)
+        forecast_progress.set_status(task_id_str, forecast_progress.STATUS_COMPLETED,
+                                     completed_configurations=total_configurations)
+        return JsonResponse({'status': 'processing_complete', 'task_id': task_id_str,
+                             'result_url': f"{reverse('forecasting:forecast_result')}?task_id={task_id_str}",
+                             'message': 'Прогноз с такими же параметрами уже был рассчитан.'})
+
+    def _run_inline(self, task_id_str: str, forecast_cost: int,
+                    forecast_task_kwargs: Dict[str, Any]) -> Optional[JsonResponse]:
+        """
+        Считает дешевый прогноз в запросе, без Celery: результат сохраняется так же, как задачей,
+        и клиент сразу получает ссылку на него. None - прогноз не уложился в отведенное время
+        (FORECAST_INLINE_TIME_BUDGET_SECONDS) или упал, и его нужно поставить в очередь; уже рассчитанные
+        конфигурации добавляются в forecast_task_kwargs (completed_batch_results) и задачей не пересчитываются.
+        """
+        time_budget_seconds = getattr(settings, 'FORECAST_INLINE_TIME_BUDGET_SECONDS', 1.5)
+        try:
+            completed_batch_results = run_forecast_inline(time_budget_seconds=time_budget_seconds,
+                                                          **forecast_task_kwargs)
+        except Exception as e_inline:
+            logger.warning(f"Task ID {task_id_str}: Inline forecast failed, falling back to Celery: {e_inline}",
+                           exc_info=True)
+            return None
+        if completed_batch_results is not None:
+            forecast_task_kwargs['completed_batch_results'] = completed_batch_results
+            return None
+        logger.info(f"Task ID {task_id_str}: Forecast cost {forecast_cost} calculated inline.")
+        return JsonResponse({'status': 'processing_complete', 'task_id': task_id_str,
+                             'result_url': f"{reverse('forecasting:forecast_result')}?task_id={task_id_str}",
+                             'message': 'Прогноз рассчитан.'})
+
     def post(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
         task_id_str = str(uuid.uuid4())  # Это task_id для нашего кеша, не путать с Celery task id
         request.session['forecast_task_id'] = task_id_str  # Если используем сессию для чего-то еще
+        if not request.session.session_key:
+            # Форма всегда работает через сессию: ключ нужен сразу, чтобы отмена задачи (ForecastCancelView)
+            # пришла от того же ожидающего (admission.user_key_for_request), что и запуск
+            request.session.save()
         logger.info(f"ForecastView POST for Task Cache ID {task_id_str}: Received request, preparing Celery task.")
 
         form_warnings: List[str] = []
 
         try:
             # --- 1. ИЗВЛЕЧЕНИЕ И ПОДГОТОВКА ПАРАМЕТРОВ ДЛЯ ЗАДАЧИ CELERY ---
-            # Этот блок должен содержать ВСЮ логику из вашего предыдущего ForecastView.post
-            # до цикла for run_spec in all_run_configurations:
-            # (Извлечение из request.POST, формирование base_forecast_params..., all_run_configurations, etc.)
-
-            region_map_codes_str = request.POST.get('region_ids', MAP_CODE_FOR_ALL_RUSSIA).strip()
-            initial_processed_region_db_ids: List[int] = []
-            # ... (Ваша логика определения initial_processed_region_db_ids из region_map_codes_str)
-            if not region_map_codes_str: region_map_codes_str = MAP_CODE_FOR_ALL_RUSSIA
-            map_codes_to_query_initial = [MAP_CODE_FOR_ALL_RUSSIA] if region_map_codes_str == MAP_CODE_FOR_ALL_RUSSIA \
-                else [code.strip() for code in region_map_codes_str.split(',') if code.strip()]
-            if not map_codes_to_query_initial: map_codes_to_query_initial = [MAP_CODE_FOR_ALL_RUSSIA]
-
-            regions_in_db_initial = Region.objects.filter(map_code__in=map_codes_to_query_initial)
-            map_code_to_id_dict = {r.map_code: r.id for r in regions_in_db_initial}
-            for mc_req in map_codes_to_query_initial:
-                if mc_req in map_code_to_id_dict:
-                    initial_processed_region_db_ids.append(map_code_to_id_dict[mc_req])
-                else:
-                    form_warnings.append(f"Код региона '{mc_req}' не найден в БД и будет проигнорирован.")
-            if not initial_processed_region_db_ids:
-                russia_fallback = Region.objects.filter(
-                    map_code=MAP_CODE_FOR_ALL_RUSSIA).first() or Region.objects.filter(id=ID_FOR_ALL_RUSSIA).first()
-                if russia_fallback:
-                    initial_processed_region_db_ids = [russia_fallback.id]
-                    form_warnings.append(f"Запрошенные регионы не найдены. Используется '{russia_fallback.name}'.")
-                else:
-                    raise ValueError(f"Не удалось определить регионы из '{region_map_codes_str}'. РФ не найдена.")
-
-            user_selected_settlement_id = int(request.POST.get('settlement_type_id', ID_SETTLEMENT_TOTAL))
-            user_selected_sex_code = request.POST.get('sex_code_target', SEX_CODE_TOTAL)
-            historical_data_end_year = int(request.POST.get('historical_data_end_year', DEFAULT_HISTORICAL_END_YEAR))
-            forecast_start_year_from_form = int(request.POST.get('forecast_start_year', historical_data_end_year + 1))
-            forecast_end_year = int(request.POST.get('forecast_end_year', DEFAULT_FORECAST_END_YEAR))
-            historical_data_start_year = int(
-                request.POST.get('historical_data_start_year', DEFAULT_HISTORICAL_START_YEAR))
-            expected_start_year = historical_data_end_year + 1
-            actual_forecast_start_year = forecast_start_year_from_form
-            if forecast_start_year_from_form != expected_start_year:
-                msg = (
-                    f"Год начала прогноза ({forecast_start_year_from_form}) скорректирован на {expected_start_year}.")
-                form_warnings.append(msg);
-                logger.warning(msg)
-                actual_forecast_start_year = expected_start_year
-            if actual_forecast_start_year > forecast_end_year: raise ValueError("Год начала прогноза > года окончания.")
-
-            target_age_group_type = request.POST.get('target_age_group_type', 'all_ages')
-            target_age_val: Union[str, Tuple[int, int]] = "Все возрасты"
-            if target_age_group_type == 'specific_range':
-                start_a_str, end_a_str = request.POST.get('target_age_start'), request.POST.get('target_age_end')
-                if not (start_a_str and end_a_str and start_a_str.isdigit() and end_a_str.isdigit()):
-                    form_warnings.append("Некорректный диапазон возраста. Используются 'Все возрасты'.")
-                else:
-                    start_a, end_a = int(start_a_str), int(end_a_str)
-                    if start_a > end_a:
-                        form_warnings.append("Начальный возраст > конечного. Используются 'Все возрасты'.")
-                    else:
-                        target_age_val = (start_a, end_a)
-
-            output_detailed_by_age_global = 'output_detailed_by_age' in request.POST
-
-            def safe_float(val_str: Optional[str]) -> Optional[float]:  # Эта функция остаётся здесь
-                if val_str is None or val_str.strip() == '': return None
-                try:
-                    return float(val_str.replace(',', '.'))
-                except (ValueError, TypeError):
-                    logger.warning(f"Не удалось преобразовать '{val_str}' в float."); return None
-
-            base_forecast_params_no_combination_specifics: Dict[str, Any] = {
-                'forecast_start_year': actual_forecast_start_year, 'forecast_end_year': forecast_end_year,
-                # ... (все остальные поля для base_forecast_params_no_combination_specifics)
-                'historical_data_start_year': historical_data_start_year,
-                'historical_data_end_year': historical_data_end_year,
-                'target_age_group_input': target_age_val, 'output_detailed_by_age': output_detailed_by_age_global,
-                'settlement_type_id': user_selected_settlement_id,  # Будет перезаписано в цикле конфигураций
-                'sex_code_target': user_selected_sex_code,  # Будет перезаписано в цикле конфигураций
-                'birth_rate_scenario': request.POST.get('birth_rate_scenario', SCENARIO_LAST_YEAR),
-                'birth_rate_manual_change_percent': safe_float(request.POST.get('birth_rate_manual_change_percent')),
-                'death_rate_scenario_male': request.POST.get('death_rate_scenario_male', SCENARIO_LAST_YEAR),
-                'death_rate_manual_change_percent_male': safe_float(
-                    request.POST.get('death_rate_manual_change_percent_male')),
-                'death_rate_scenario_female': request.POST.get('death_rate_scenario_female', SCENARIO_LAST_YEAR),
-                'death_rate_manual_change_percent_female': safe_float(
-                    request.POST.get('death_rate_manual_change_percent_female')),
-                'include_migration': 'include_migration' in request.POST,
-                'migration_scenario': request.POST.get('migration_scenario', SCENARIO_LAST_YEAR),
-                'migration_manual_change_percent': safe_float(request.POST.get('migration_manual_change_percent')),
-            }
-            for cat_key in ['birth_rate', 'death_rate_male', 'death_rate_female', 'migration']:
-                scenario_val_key = f'{cat_key}_scenario';
-                manual_perc_key = f'{cat_key}_manual_change_percent'
-                if base_forecast_params_no_combination_specifics.get(scenario_val_key) != SCENARIO_MANUAL_PERCENT or \
-                        (cat_key == 'migration' and not base_forecast_params_no_combination_specifics.get(
-                            'include_migration')):
-                    base_forecast_params_no_combination_specifics[manual_perc_key] = None
-
-            region_configs: List[Tuple[List[int], str]] = []
-            is_selected_all_russia_by_id = (
-                        len(initial_processed_region_db_ids) == 1 and initial_processed_region_db_ids[
-                    0] == ID_FOR_ALL_RUSSIA)
-            if len(initial_processed_region_db_ids) > 1 and not is_selected_all_russia_by_id:
-                for rid in initial_processed_region_db_ids: region_configs.append(
-                    ([rid], self._get_region_name_by_id_view_version(rid)))
-            sum_title_regions = self._get_region_name_by_id_view_version(initial_processed_region_db_ids[0]) if len(
-                initial_processed_region_db_ids) == 1 \
-                else f"Сумма по {len(initial_processed_region_db_ids)} выбранным регионам"
-            region_configs.append((initial_processed_region_db_ids, sum_title_regions))
-
-            params_for_group_context_map: Dict[str, Dict] = {}
-            for region_ids_to_run_cfg, region_title_part_cfg in region_configs:
-                temp_params_for_group_ctx = base_forecast_params_no_combination_specifics.copy()
-                temp_params_for_group_ctx['region_ids'] = region_ids_to_run_cfg
-                temp_params_for_group_ctx['settlement_type_id'] = user_selected_settlement_id
-                temp_params_for_group_ctx['sex_code_target'] = user_selected_sex_code
-                # Передаем form_warnings в _prepare_display_params_view_version
-                params_for_group_context_map[region_title_part_cfg] = self._prepare_display_params_view_version(
-                    temp_params_for_group_ctx, form_warnings
-                )
-
-            settlement_ids_to_run_forecaster: List[int] = []
-            if user_selected_settlement_id == ID_SETTLEMENT_TOTAL:
-                settlement_ids_to_run_forecaster.extend([ID_SETTLEMENT_URBAN, ID_SETTLEMENT_RURAL])
-            else:
-                settlement_ids_to_run_forecaster.append(user_selected_settlement_id)
-
-            sex_codes_to_run_forecaster: List[str] = []
-            if user_selected_sex_code == SEX_CODE_TOTAL:
-                sex_codes_to_run_forecaster.extend([SEX_CODE_MALE, SEX_CODE_FEMALE, SEX_CODE_TOTAL])
-            else:
-                sex_codes_to_run_forecaster.append(user_selected_sex_code)
-
-            all_run_configurations: List[Dict[str, Any]] = []
-            active_data_keys: set[str] = set()
-            for region_ids_to_run, region_title_part in region_configs:
-                for settlement_id_for_run in settlement_ids_to_run_forecaster:
-                    for sex_code_for_run in sex_codes_to_run_forecaster:
-                        current_run_params = base_forecast_params_no_combination_specifics.copy()
-                        current_run_params['region_ids'] = region_ids_to_run
-                        current_run_params['settlement_type_id'] = settlement_id_for_run
-                        current_run_params['sex_code_target'] = sex_code_for_run
-                        all_run_configurations.append(
-                            {'params': current_run_params, 'region_group_key': region_title_part})
-
-                        s_prefix = "urban_" if settlement_id_for_run == ID_SETTLEMENT_URBAN else \
-                            ("rural_" if settlement_id_for_run == ID_SETTLEMENT_RURAL else \
-                                 ("total_" if settlement_id_for_run == ID_SETTLEMENT_TOTAL else "unknown_sett_"))
-                        g_suffix = "male" if sex_code_for_run == SEX_CODE_MALE else \
-                            ("female" if sex_code_for_run == SEX_CODE_FEMALE else \
-                                 ("total" if sex_code_for_run == SEX_CODE_TOTAL else "unknown_sex_"))
-                        active_data_keys.add(f"{s_prefix}{g_suffix}")
-            # --- КОНЕЦ БЛОКА ПОДГОТОВКИ ПАРАМЕТРОВ ---
-
-            initial_progress_data_for_cache = {
-                'total_configurations': len(all_run_configurations),
-                'completed_configurations': 0,
-                'status': 'queued',  # Задача поставлена в очередь
-                'warnings': list(form_warnings),  # Копия начальных предупреждений из парсинга формы
-                'html_result': None, 'error_message': None
-            }
-            cache.set(f'forecast_progress_{task_id_str}', initial_progress_data_for_cache, timeout=3600)
-            logger.debug(f"Task Cache ID {task_id_str}: Initial progress data (queued) set to cache.")
-
-            ser_id_for_celery_task = None
-            if request.user.is_authenticated:
-                user_id_for_celery_task = request.user.id
-
-            # Запуск задачи Celery
-            calculate_forecast_task.delay(
+            forecast_plan = forecast_params.build_forecast_plan(
+                request.POST, form_warnings,
+                region_name_func=self._get_region_name_by_id_view_version,
+                display_params_func=self._prepare_display_params_view_version)
+            initial_processed_region_db_ids = forecast_plan['initial_processed_region_db_ids']
+            user_selected_settlement_id = forecast_plan['user_selected_settlement_id']
+            user_selected_sex_code = forecast_plan['user_selected_sex_code']
+            output_detailed_by_age_global = forecast_plan['output_detailed_by_age_global']
+            base_forecast_params_no_combination_specifics = forecast_plan['base_forecast_params_no_combination_specifics']
+            params_for_group_context_map = forecast_plan['params_for_group_context_map']
+            all_run_configurations = forecast_plan['all_run_configurations']
+            active_data_keys = forecast_plan['active_data_keys']
+
+            user_id_for_celery_task = request.user.id if request.user.is_authenticated else None
+
+            # --- 2. ПОИСК УЖЕ РАССЧИТАННОГО ИЛИ РАССЧИТЫВАЕМОГО РЕЗУЛЬТАТА ---
+            input_hash = shared_results.compute_input_hash(
+                base_forecast_params_no_combination_specifics, initial_processed_region_db_ids,
+                user_selected_settlement_id, user_selected_sex_code)
+
+            shared_artifact = shared_results.load_artifact(
+                input_hash, group_order=[group_title for _, group_title in forecast_plan['region_configs']])
+            if shared_artifact is not None:
+                logger.info(f"Task ID {task_id_str}: Found stored result {input_hash}, skipping calculation.")
+                return self._respond_with_stored_result(request, task_id_str, input_hash, shared_artifact,
+                                                        len(all_run_configurations), form_warnings)
+
+            in_flight_task_id = shared_results.claim_in_flight(input_hash, task_id_str)
+            if in_flight_task_id:
+                logger.info(f"Task ID {task_id_str}: Result {input_hash} is being calculated by {in_flight_task_id}.")
+                if user_id_for_celery_task is not None:
+                    shared_results.add_waiting_user(input_hash, user_id_for_celery_task)
+                forecast_progress.add_subscriber(in_flight_task_id, admission.user_key_for_request(request))
+                request.session['forecast_task_id'] = in_flight_task_id
+                # joined: клиент не отменяет общий расчет при закрытии вкладки (см. ForecastCancelView)
+                return JsonResponse({'status': 'processing_initiated', 'task_id': in_flight_task_id, 'joined': True,
+                                     'message': 'Прогноз с такими же параметрами уже рассчитывается.'})
+
+            forecast_task_kwargs = dict(
                 task_id=task_id_str,
                 all_run_configurations=all_run_configurations,
                 base_forecast_params_no_combination_specifics=base_forecast_params_no_combination_specifics,
@@ -347,11 +293,44 @@ class ForecastView(View):
                 initial_processed_region_db_ids=initial_processed_region_db_ids,
                 form_warnings_initial=list(form_warnings),  # Передаем копию
                 params_for_group_context_map=params_for_group_context_map,
-                active_data_keys_list=list(active_data_keys),  # set в list для Celery
+                active_data_keys_list=list(active_data_keys),
                 results_template_name=self.results_template_name,
-                current_user_id = user_id_for_celery_task
+                current_user_id=user_id_for_celery_task,
+                input_hash=input_hash,
             )
-            logger.info(f"Task Cache ID {task_id_str}: Celery task calculate_forecast_task.delay() called.")
+
+            # --- 3. ДЕШЕВЫЙ ПРОГНОЗ СЧИТАЕТСЯ ПРЯМО В ЗАПРОСЕ ---
+            forecast_cost = admission.estimate_forecast_cost(all_run_configurations, output_detailed_by_age_global)
+            if admission.can_run_inline(forecast_cost):
+                inline_response = self._run_inline(task_id_str, forecast_cost, forecast_task_kwargs)
+                if inline_response is not None:
+                    return inline_response
+
+            # Задача поставлена в очередь; копия начальных предупреждений из парсинга формы.
+            # Если клиент перестанет запрашивать прогресс (закрыл вкладку), задача будет отменена
+            forecast_progress.init_progress(task_id_str, len(all_run_configurations), form_warnings,
+                                            track_abandonment=True)
+            forecast_progress.add_subscriber(task_id_str, admission.user_key_for_request(request))
+            logger.debug(f"Task ID {task_id_str}: Initial progress data (queued) set in Redis.")
+
+            # --- 4. ДОПУСК В ОЧЕРЕДЬ ПО СТОИМОСТИ ---
+            queue_name = admission.queue_for_cost(forecast_cost)
+            if queue_name == admission.heavy_queue_name():
+                try:
+                    admission.acquire_heavy_slot(admission.user_key_for_request(request), task_id_str)
+                except admission.HeavyForecastLimitExceeded as e_limit:
+                    logger.info(f"Task ID {task_id_str}: Heavy forecast rejected (cost {forecast_cost}): {e_limit}")
+                    forecast_progress.set_status(task_id_str, forecast_progress.STATUS_ERROR,
+                                                 error_message=str(e_limit))
+                    shared_results.release_in_flight(input_hash, task_id_str)
+                    return JsonResponse({'status': 'error', 'message': str(e_limit)}, status=429)
+            forecast_progress.enqueue(task_id_str, queue_name)
+            logger.info(f"Task ID {task_id_str}: Forecast cost {forecast_cost}, queue '{queue_name}'.")
+
+            # Запуск задачи Celery
+            calculate_forecast_task.apply_async(kwargs=dict(forecast_task_kwargs, queue_name=queue_name),
+                                                queue=queue_name)
+            logger.info(f"Task Cache ID {task_id_str}: Celery task calculate_forecast_task.apply_async() called.")
 
             return JsonResponse({'status': 'processing_initiated', 'task_id': task_id_str,
                                  'message': 'Задача генерации прогноза поставлена в очередь.'})
@@ -359,24 +338,56 @@ class ForecastView(View):
         except ValueError as ve:
             logger.warning(f"Task Cache ID {task_id_str}: ValueError before Celery task dispatch: {ve}", exc_info=True)
             # ... (обработка ошибок как в предыдущей версии)
-            error_data = cache.get(f'forecast_progress_{task_id_str}')
-            if error_data:
-                error_data['status'] = 'error'
-                error_data['error_message'] = f"Ошибка в параметрах (view): {ve}"
-                cache.set(f'forecast_progress_{task_id_str}', error_data, timeout=3600)
+            if forecast_progress.get_progress(task_id_str, include_warnings=False):
+                forecast_progress.set_status(task_id_str, forecast_progress.STATUS_ERROR,
+                                             error_message=f"Ошибка в параметрах (view): {ve}")
             return JsonResponse({'status': 'error', 'message': f"Ошибка в параметрах: {ve}"}, status=400)
         except Exception as e:
             logger.error(f"Task Cache ID {task_id_str}: Unexpected error before Celery task dispatch: {e}",
                          exc_info=True)
             # ... (обработка ошибок как в предыдущей версии)
-            error_data_e = cache.get(f'forecast_progress_{task_id_str}')
-            if error_data_e:
-                error_data_e['status'] = 'error'
-                error_data_e['error_message'] = f"Системная ошибка (view): ({type(e).__name__}) {e}"
-                cache.set(f'forecast_progress_{task_id_str}', error_data_e, timeout=3600)
+            if forecast_progress.get_progress(task_id_str, include_warnings=False):
+                forecast_progress.set_status(task_id_str, forecast_progress.STATUS_ERROR,
+                                             error_message=f"Системная ошибка (view): ({type(e).__name__}) {e}")
+                forecast_progress.dequeue(task_id_str)
+                admission.release_heavy_slot(task_id_str)
+            return JsonResponse({'status': 'error', 'message': f"Произошла системная ошибка: ({type(e).__name__})"},
+                                status=500)
+
+
+class ForecastSolveView(View):
+    """
+    Подбор сценария под цель: какое ежегодное изменение (%) рождаемости, смертности мужчин или женщин
+    либо сальдо миграции (solve_for) дает численность solve_target_population в году solve_target_year.
+    Остальные параметры - поля формы прогноза. Считается в запросе, без задачи Celery; в ответе -
+    найденный процент, численность по годам и поля формы для полного прогноза с ним.
+    """
+
+    def post(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
+        form_warnings: List[str] = []
+        try:
+            solve_for = request.POST.get('solve_for', '')
+            target_year = forecast_params.safe_float(request.POST.get('solve_target_year'))
+            target_population = forecast_params.safe_float(request.POST.get('solve_target_population'))
+            if target_year is None or target_year != int(target_year):
+                raise ValueError("Год цели должен быть целым числом.")
+            if target_population is None or target_population < 0:
+                raise ValueError("Целевая численность должна быть неотрицательным числом.")
+
+            forecast_plan = forecast_params.build_forecast_plan(request.POST, form_warnings)
+            solution = scenario_solver.solve_scenario_percent(forecast_plan, solve_for, int(target_year),
+                                                              target_population)
+        except ValueError as ve:
+            logger.warning(f"ForecastSolveView: Invalid parameters: {ve}")
+            return JsonResponse({'status': 'error', 'message': f"Ошибка в параметрах: {ve}"}, status=400)
+        except Exception as e:
+            logger.error(f"ForecastSolveView: Unexpected error: {e}", exc_info=True)
             return JsonResponse({'status': 'error', 'message': f"Произошла системная ошибка: ({type(e).__name__})"},
                                 status=500)
 
+        solution['warnings'] = sorted(set(solution['warnings']) | set(form_warnings))
+        return JsonResponse(solution)
+
 
 class ForecastProgressView(View):
     def get(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
@@ -388,7 +399,7 @@ class ForecastProgressView(View):
         if not task_id:
             return JsonResponse({'status': 'error', 'message': 'Task ID not provided.'}, status=400)
 
-        progress_data = cache.get(f'forecast_progress_{task_id}')
+        progress_data = forecast_progress.get_progress(task_id, include_warnings=False)
 
         if not progress_data:
             return JsonResponse({
@@ -397,76 +408,113 @@ class ForecastProgressView(View):
                 'progress': 0  # Provide a default progress
             }, status=404)
 
-        response_data = {
-            'task_id': task_id,
-            'status': progress_data.get('status', 'unknown'),
-            'progress': 0,
-            'total_configurations': progress_data.get('total_configurations', 0),
-            'completed_configurations': progress_data.get('completed_configurations', 0),
-            'message': ''
-        }
+        forecast_progress.touch(task_id)  # Клиент все еще ждет результат
+        # Status will be 200 OK for errors too, content indicates error
+        return JsonResponse(forecast_progress.build_progress_payload(task_id, progress_data))
 
-        if response_data['status'] == 'error':
-            response_data['message'] = progress_data.get('error_message', 'Произошла неизвестная ошибка.')
-            return JsonResponse(response_data)  # Status will be 200 OK, but content indicates error
-
-        if response_data['status'] == 'completed':
-            response_data['progress'] = 100
-            response_data['html_result'] = progress_data.get('html_result')
-            # Optional: Clear cache after sending completed result to prevent re-sending large HTML.
-            # cache.delete(f'forecast_progress_{task_id}')
-            # if 'forecast_task_id' in request.session and request.session['forecast_task_id'] == task_id:
-            #    del request.session['forecast_task_id']
-            return JsonResponse(response_data)
-
-        if response_data['total_configurations'] > 0:
-            response_data['progress'] = round(
-                (response_data['completed_configurations'] / response_data['total_configurations']) * 100
-            )
 
-        return JsonResponse(response_data)
+class ForecastCancelView(View):
+    """
+    Отмена задачи прогноза. Задача в очереди отменяется сразу; выполняющаяся задача
+    останавливается между годами прогноза. При keep_partial=1 пользователь получит
+    результаты конфигураций, рассчитанных до остановки.
+    Расчет с одинаковыми параметрами общий для всех ожидающих его пользователей: запрос
+    отписывает только отправившего его, а задача отменяется, когда ожидающих не остается.
+    """
 
+    def post(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
+        task_id = request.POST.get('task_id') or request.session.get('forecast_task_id')
+        if not task_id:
+            return JsonResponse({'status': 'error', 'message': 'Task ID not provided.'}, status=400)
 
-@login_required
-def forecast_history_view(request):
-    user_forecasts_list = ForecastRun.objects.filter(user=request.user).order_by('-created_at')
+        if forecast_progress.get_progress(task_id, include_warnings=False) is None:
+            return JsonResponse({'status': 'not_found',
+                                 'message': 'Задача не найдена. Возможно, она устарела или была удалена.'},
+                                status=404)
+        remaining_subscribers = forecast_progress.remove_subscriber(task_id, admission.user_key_for_request(request))
+        if remaining_subscribers is None:
+            return JsonResponse({'status': 'error', 'message': 'Нет доступа к этой задаче.'}, status=403)
+        if remaining_subscribers > 0:
+            logger.info(f"Task ID {task_id}: Subscriber detached, {remaining_subscribers} still waiting.")
+            return JsonResponse({'status': 'detached', 'task_id': task_id,
+                                 'message': 'Расчет продолжится для других пользователей, ожидающих этот прогноз.'})
+
+        keep_partial = request.POST.get('keep_partial') == '1'
+        outcome = forecast_progress.request_cancel(task_id, keep_partial=keep_partial)
+        if outcome is None:
+            return JsonResponse({'status': 'not_found',
+                                 'message': 'Задача не найдена. Возможно, она устарела или была удалена.'},
+                                status=404)
+        logger.info(f"Task ID {task_id}: Cancel requested (keep_partial={keep_partial}), outcome: {outcome}.")
+        return JsonResponse({'status': outcome, 'task_id': task_id})
+
+
+class ForecastProgressStreamView(View):
+    """
+    Поток Server-Sent Events с прогрессом задачи: события отправляются при каждом изменении
+    состояния в Redis, поэтому клиенту не нужно опрашивать ForecastProgressView по таймеру.
+    Под WSGI поток занимает поток веб-сервера, поэтому соединение короткое (не дольше
+    progress.PROGRESS_STREAM_MAX_SECONDS_LIMIT), а EventSource в браузере переподключается.
+    """
 
-    paginator = Paginator(user_forecasts_list, 10)  # По 10 прогнозов на страницу
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        task_id = request.GET.get('task_id') or request.session.get('forecast_task_id')
+        if not task_id:
+            return JsonResponse({'status': 'error', 'message': 'Task ID not provided.'}, status=400)
 
-    context = {
-        'page_obj': page_obj
-    }
-    return render(request, 'forecast_history.html', context)
+        response = StreamingHttpResponse(forecast_progress.iter_progress_events(task_id),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Отключает буферизацию ответа в nginx
+        return response
 
 
-@login_required
+class ForecastResultView(View):
+    """
+    Отдает HTML результатов завершенной задачи. Результат хранится в Redis сжатым gzip,
+    поэтому клиентам, принимающим gzip, он отдается без распаковки. ETag позволяет
+    не пересылать результат повторно.
+    """
 
-def view_historical_forecast(request,  forecast_run_id):
-    forecast_run_instance = get_object_or_404(ForecastRun, id= forecast_run_id, user=request.user)
+    def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        task_id = request.GET.get('task_id') or request.session.get('forecast_task_id')
+        if not task_id:
+            return JsonResponse({'status': 'error', 'message': 'Task ID not provided.'}, status=400)
 
-    # Загружаем данные результатов из файла (или из JSONField, если храните там)
-    results_data_from_file = None
-    if forecast_run_instance.results_file_path:
-        try:
-            full_file_path = os.path.join(settings.MEDIA_ROOT, forecast_run_instance.results_file_path)
-            with open(full_file_path, 'r', encoding='utf-8') as f:
-                results_data_from_file = json.load(f)
-        except Exception as e:
-            logger.error(f"Ошибка чтения файла для просмотра истории {forecast_run_instance.results_file_path}: {e}")
-            # Обработка ошибки - можно показать сообщение или пустые данные
-            results_data_from_file = {}  # Пустые данные, чтобы шаблон не упал
-    else:
-        results_data_from_file = {}
+        stored_result = forecast_progress.get_result_gzip(task_id)
+        if stored_result is None:
+            raise Http404("Результаты прогноза не найдены. Возможно, они устарели или были удалены.")
+        compressed_html, result_etag = stored_result
+        return gzip_result_response(request, compressed_html, result_etag, 'text/html; charset=utf-8')
 
-    logger.info(f"ID для URL: {forecast_run_instance.id}, тип: {type(forecast_run_instance.id)}")
 
-    context = {
-        'params_display_overall': results_data_from_file.get('display_params_overall',
-                                                             forecast_run_instance.input_parameters_json),
-        # Фоллбэк на input_params
-        'form_warnings': results_data_from_file.get('all_warnings', forecast_run_instance.warnings_json),  # Фоллбэк
+def gzip_result_response(request: HttpRequest, compressed_result: bytes, result_etag: Optional[str],
+                         content_type: str) -> HttpResponse:
+    """Ответ с результатом, хранящимся сжатым gzip: без распаковки, если клиент принимает gzip; 304 по ETag."""
+    quoted_etag = f'"{result_etag}"' if result_etag else None
+
+    if quoted_etag and quoted_etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponse(status=304)
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(compressed_result, content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(compressed_result), content_type=content_type)
+
+    if quoted_etag:
+        response['ETag'] = quoted_etag
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = 'private, no-cache'  # Браузер перепроверяет результат по ETag
+    return response
+
+
+def _results_context_from_stored_data(results_data_from_file: Dict[str, Any],
+                                     params_fallback: Optional[Dict] = None,
+                                     warnings_fallback: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Контекст шаблона forecast_results.html из сохраненного файла результатов."""
+    return {
+        'params_display_overall': results_data_from_file.get('display_params_overall', params_fallback),
+        'form_warnings': results_data_from_file.get('all_warnings', warnings_fallback),  # Фоллбэк
         'grouped_forecasts': results_data_from_file.get('grouped_forecasts_data', []),
 
         # Данные для JavaScript на странице результатов (для графиков)
@@ -477,13 +525,11 @@ def view_historical_forecast(request,  forecast_run_id):
 
         # Флаги для рендеринга таблицы в шаблоне
         'output_detailed_by_age_global': results_data_from_file.get('output_detailed_by_age_global', False),
+        'active_data_keys': results_data_from_file.get('active_data_keys', []),
         'user_selected_settlement_id': results_data_from_file.get('user_selected_settlement_id', ID_SETTLEMENT_TOTAL),
         # Используйте константы
         'user_selected_sex_code': results_data_from_file.get('user_selected_sex_code', SEX_CODE_TOTAL),
 
-        # --- ВАЖНО: Передаем ID текущего исторического прогноза ---
-        'forecast_run_id_for_template': str(forecast_run_instance.id),  # Преобразуем UUID в строку
-
         # Константы, если они нужны в шаблоне (лучше их сделать доступными через кастомный context processor)
         'ID_SETTLEMENT_TOTAL': ID_SETTLEMENT_TOTAL,
         'ID_SETTLEMENT_URBAN': ID_SETTLEMENT_URBAN,
@@ -497,6 +543,174 @@ def view_historical_forecast(request,  forecast_run_id):
             'manual_percent': SCENARIO_MANUAL_PERCENT
         }
     }
+
+
+def _optional_int_param(request: HttpRequest, name: str) -> Optional[int]:
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def _result_slice_from_request(request: HttpRequest) -> Dict[str, Any]:
+    """
+    Часть результата, запрошенная в параметрах GET: group (можно несколько), year_from/year_to,
+    age_from/age_to. Без параметров - весь результат. Передается в result_store.
+    """
+    year_range = (_optional_int_param(request, 'year_from'), _optional_int_param(request, 'year_to'))
+    age_range = (_optional_int_param(request, 'age_from'), _optional_int_param(request, 'age_to'))
+    return {
+        'group_titles': request.GET.getlist('group') or None,
+        'year_range': year_range if year_range != (None, None) else None,
+        'age_range': age_range if age_range != (None, None) else None,
+    }
+
+
+@login_required
+def forecast_history_view(request):
+    user_forecasts_list = ForecastRun.objects.filter(user=request.user).order_by('-created_at')
+
+    paginator = Paginator(user_forecasts_list, 10)  # По 10 прогнозов на страницу
+    page_number = request.GET.get('page')
+    page_obj = paginator.get_page(page_number)
+
+    # Сводка по каждому прогнозу страницы - одним запросом к строкам результатов, без чтения файлов
+    summary_series = result_rows.get_summary_series(
+        forecast_run.input_hash for forecast_run in page_obj.object_list if forecast_run.input_hash)
+    for forecast_run in page_obj.object_list:
+        target_sex_code = (forecast_run.input_parameters_json or {}).get('sex_code_target', SEX_CODE_TOTAL)
+        forecast_run.result_summary = result_rows.summarize_series(
+            summary_series.get(forecast_run.input_hash, {}).get(target_sex_code, {}))
+
+    context = {
+        'page_obj': page_obj
+    }
+    return render(request, 'forecast_history.html', context)
+
+
+@login_required
+def compare_forecasts_view(request):
+    """
+    Сравнение прогнозов из истории (?run=<id>&run=<id>...): численность итоговой группы
+    (выбранный регион или сумма по регионам) по годам для каждого прогноза.
+    """
+    run_ids = request.GET.getlist('run')
+    if not 2 <= len(run_ids) <= MAX_COMPARED_FORECASTS:
+        return JsonResponse({'status': 'error',
+                             'message': f"Выберите от 2 до {MAX_COMPARED_FORECASTS} прогнозов для сравнения."},
+                            status=400)
+    try:
+        forecast_runs = list(ForecastRun.objects.filter(id__in=run_ids, user=request.user))
+    except ValidationError:
+        return JsonResponse({'status': 'error', 'message': 'Некорректный идентификатор прогноза.'}, status=400)
+    if len(forecast_runs) != len(set(run_ids)):
+        raise Http404("Прогноз не найден или у вас нет к нему доступа.")
+
+    summary_series = result_rows.get_summary_series(
+        forecast_run.input_hash for forecast_run in forecast_runs if forecast_run.input_hash)
+    compared_runs = []
+    for forecast_run in sorted(forecast_runs, key=lambda run: run_ids.index(str(run.id))):
+        params = forecast_run.input_parameters_json or {}
+        target_sex_code = params.get('sex_code_target', SEX_CODE_TOTAL)
+        population_by_year = summary_series.get(forecast_run.input_hash, {}).get(target_sex_code, {})
+        compared_runs.append({
+            'id': str(forecast_run.id),
+            'title': forecast_run.custom_title or f"Прогноз от {forecast_run.created_at:%d.%m.%Y %H:%M}",
+            'region_names_display': params.get('region_names_display', []),
+            'sex_code': target_sex_code,
+            # Пустой ряд - прогноз рассчитан до появления таблицы результатов
+            'population_by_year': {str(year): population for year, population in population_by_year.items()},
+            'summary': result_rows.summarize_series(population_by_year),
+        })
+    return JsonResponse({'status': 'ok', 'runs': compared_runs})
+
+
+def _forecast_run_results_stat(request: HttpRequest, forecast_run_id) -> Optional[os.stat_result]:
+    """
+    stat файла результатов прогноза пользователя (None, если прогноза или файла нет). Запоминается в запросе:
+    condition вызывает функции ETag и Last-Modified по очереди, а файл и БД не должны читаться дважды.
+    """
+    cached_stats = request.__dict__.setdefault('_forecast_results_stat', {})
+    if forecast_run_id not in cached_stats:
+        results_stat = None
+        results_file_path = ForecastRun.objects.filter(id=forecast_run_id, user=request.user).values_list(
+            'results_file_path', flat=True).first()
+        if results_file_path:
+            try:
+                results_stat = os.stat(os.path.join(settings.MEDIA_ROOT, results_file_path))
+            except OSError:
+                results_stat = None
+        cached_stats[forecast_run_id] = results_stat
+    return cached_stats[forecast_run_id]
+
+
+def _forecast_run_etag(request: HttpRequest, forecast_run_id, export_format: str = '') -> Optional[str]:
+    """
+    ETag ответа по сохраненному результату: результат прогноза после сохранения не меняется, поэтому
+    ответ определяется id прогноза, файлом результатов (время изменения и размер), форматом и частью
+    результата из параметров GET. None - прогноз или файл не найден (ответ формирует сама view).
+    """
+    results_stat = _forecast_run_results_stat(request, forecast_run_id)
+    if results_stat is None:
+        return None
+    etag_source = ':'.join([str(forecast_run_id), str(results_stat.st_mtime_ns), str(results_stat.st_size),
+                            export_format.lower(), request.GET.urlencode(), str(HISTORY_RESPONSE_CACHE_VERSION)])
+    return hashlib.sha1(etag_source.encode('utf-8')).hexdigest()
+
+
+def _forecast_run_page_etag(request: HttpRequest, forecast_run_id) -> Optional[str]:
+    """
+    ETag страницы прогноза: страница содержит формы с CSRF-токеном (base.html), поэтому в ETag входят
+    секрет CSRF и ключ сессии - после повторного входа браузер получает новую страницу, а не 304 со старым
+    токеном. Используется секрет из cookie, а не get_token(): маскированный токен меняется при каждом вызове.
+    """
+    forecast_run_etag = _forecast_run_etag(request, forecast_run_id)
+    if forecast_run_etag is None:
+        return None
+    etag_source = ':'.join([forecast_run_etag, request.META.get('CSRF_COOKIE', ''),
+                            request.session.session_key or ''])
+    return hashlib.sha1(etag_source.encode('utf-8')).hexdigest()
+
+
+def _forecast_run_last_modified(request: HttpRequest, forecast_run_id, export_format: str = '') -> Optional[datetime]:
+    results_stat = _forecast_run_results_stat(request, forecast_run_id)
+    if results_stat is None:
+        return None
+    return datetime.fromtimestamp(results_stat.st_mtime, tz=dt_timezone.utc)
+
+
+# Повторный просмотр и повторное скачивание получают 304 без чтения файла результатов (браузер
+# перепроверяет ответ при каждом запросе: no-cache, а не max-age - прогноз могут удалить).
+# Для страницы - только по ETag (с CSRF-токеном): по одной дате изменения файла браузер получил бы
+# 304 и после смены токена
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_forecast_run_page_etag)
+def view_historical_forecast(request,  forecast_run_id):
+    forecast_run_instance = get_object_or_404(ForecastRun, id= forecast_run_id, user=request.user)
+
+    # Загружаем из файла результатов только запрошенные группы, годы и возрасты
+    results_data_from_file = None
+    if forecast_run_instance.results_file_path:
+        try:
+            full_file_path = os.path.join(settings.MEDIA_ROOT, forecast_run_instance.results_file_path)
+            results_data_from_file = result_store.load_result_data(
+                full_file_path, group_order=shared_results.run_group_order(forecast_run_instance),
+                **_result_slice_from_request(request))
+        except Exception as e:
+            logger.error(f"Ошибка чтения файла для просмотра истории {forecast_run_instance.results_file_path}: {e}")
+            # Обработка ошибки - можно показать сообщение или пустые данные
+            results_data_from_file = {}  # Пустые данные, чтобы шаблон не упал
+    else:
+        results_data_from_file = {}
+
+    logger.info(f"ID для URL: {forecast_run_instance.id}, тип: {type(forecast_run_instance.id)}")
+
+    context = _results_context_from_stored_data(results_data_from_file,
+                                                forecast_run_instance.input_parameters_json,  # Фоллбэк на input_params
+                                                forecast_run_instance.warnings_json)
+    # --- ВАЖНО: Передаем ID текущего исторического прогноза ---
+    context['forecast_run_id_for_template'] = str(forecast_run_instance.id)  # Преобразуем UUID в строку
     # Предполагаем, что страница детального просмотра использует тот же шаблон,
     # что и страница результатов после AJAX-запроса
     return render(request, 'forecast_results.html', context)
@@ -504,6 +718,8 @@ def view_historical_forecast(request,  forecast_run_id):
 
 
 @login_required  # Только аутентифицированные пользователи могут экспортировать
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_forecast_run_etag, last_modified_func=_forecast_run_last_modified)
 def export_forecast_data_view(request, forecast_run_id, export_format):
     """
     Обрабатывает запрос на экспорт данных конкретного прогноза в формате CSV или XLSX.
@@ -516,17 +732,28 @@ def export_forecast_data_view(request, forecast_run_id, export_format):
             f"Попытка экспорта несуществующего прогноза или прогноза другого пользователя. ID: {forecast_run_id}, User: {request.user.username}")
         raise Http404("Прогноз не найден или у вас нет к нему доступа.")
 
+    # Полный экспорт, уже сформированный фоновой задачей, отдается готовым файлом
+    if not any(_result_slice_from_request(request).values()):
+        ready_artifact = export_jobs.get_ready_artifact(forecast_run, export_format.lower())
+        if ready_artifact is not None:
+            return FileResponse(
+                open(os.path.join(settings.MEDIA_ROOT, ready_artifact.file_path), 'rb'),
+                as_attachment=True,
+                filename=export_jobs.export_filename(forecast_run_id, ready_artifact.export_format),
+                content_type=export_jobs.EXPORT_CONTENT_TYPES[ready_artifact.export_format]
+            )
+
     # --- Извлекаем сохраненные данные прогноза из файла ---
     # (Предполагается, что результаты хранятся в файле, указанном в ForecastRun.results_file_path)
     input_params_from_db = forecast_run.input_parameters_json  # Исходные параметры, как они были на момент запуска
 
-    results_data_from_file = None
+    result_reader = None
     if forecast_run.results_file_path:
         try:
             full_file_path = os.path.join(settings.MEDIA_ROOT, forecast_run.results_file_path)
             logger.info(f"Попытка чтения файла для экспорта: {full_file_path}")
-            with open(full_file_path, 'r', encoding='utf-8') as f:
-                results_data_from_file = json.load(f)
+            result_reader = result_store.open_result(full_file_path,
+                                                     group_order=shared_results.run_group_order(forecast_run))
         except FileNotFoundError:
             logger.error(f"Файл результатов для экспорта не найден: {full_file_path} (прогноз ID: {forecast_run_id})")
             raise Http404("Файл результатов прогноза не найден. Возможно, он был удален или перемещен.")
@@ -543,75 +770,214 @@ def export_forecast_data_view(request, forecast_run_id, export_format):
             f"Для прогноза ID {forecast_run_id} не указан путь к файлу результатов (results_file_path is null/empty).")
         raise Http404("Для этого прогноза отсутствует ссылка на файл с результатами.")
 
-    if not results_data_from_file:  # Дополнительная проверка, хотя исключения выше должны были сработать
-        raise Http404("Данные для экспорта не были загружены из файла.")
+    # Для CSV файл результатов закрывает генератор потокового ответа (после отправки последней строки)
+    close_result_reader = True
+    try:
+        # Извлекаем компоненты из метаданных результата; данные групп читаются по одной при записи файла
+        results_meta = result_reader.meta
+        params_display_overall_export = results_meta.get('display_params_overall', {})
+        all_warnings_export = results_meta.get('all_warnings', [])
+        grouped_forecasts_export = result_reader.iter_groups(**_result_slice_from_request(request))
+
+        # Эти параметры нужны для правильного построения заголовков таблиц.
+        # Они были сохранены в data_for_file_storage в tasks.py.
+        output_detailed_by_age_global_export = results_meta.get('output_detailed_by_age_global', False)
+        user_selected_settlement_id_export = results_meta.get('user_selected_settlement_id', ID_SETTLEMENT_TOTAL)
+        user_selected_sex_code_export = results_meta.get('user_selected_sex_code', SEX_CODE_TOTAL)
+
+        filename_base = f"forecast_export_{str(forecast_run_id)[:8]}"  # Короткий префикс из UUID
+
+        # --- Генерация EXCEL ---
+        if export_format.lower() == 'xlsx':
+            # Книга пишется построчно во временный файл (удаляется при закрытии, FileResponse закрывает его сам)
+            export_file = tempfile.TemporaryFile(suffix='.xlsx')
+            try:
+                save_forecast_excel_workbook(
+                    export_file,
+                    params_display_overall=params_display_overall_export,
+                    all_warnings=all_warnings_export,
+                    grouped_forecasts_data=grouped_forecasts_export,
+                    output_detailed_by_age_global=output_detailed_by_age_global_export,
+                    user_selected_settlement_id=user_selected_settlement_id_export,
+                    user_selected_sex_code=user_selected_sex_code_export
+                )
+                export_file.seek(0)
 
-    # Извлекаем компоненты из загруженных данных
-    params_display_overall_export = results_data_from_file.get('display_params_overall', {})
-    all_warnings_export = results_data_from_file.get('all_warnings', [])
-    grouped_forecasts_export = results_data_from_file.get('grouped_forecasts_data', [])
+                response = FileResponse(
+                    export_file,
+                    as_attachment=True,
+                    filename=f"{filename_base}.xlsx",
+                    content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+                )
+                logger.info(f"Успешно сформирован Excel файл для прогноза ID: {forecast_run_id}")
+                return response
+            except Exception as e:
+                export_file.close()
+                logger.error(f"Ошибка при генерации Excel для прогноза ID {forecast_run_id}: {e}", exc_info=True)
+                # Можно вернуть более дружелюбное сообщение или страницу ошибки
+                return HttpResponse(f"Произошла ошибка при генерации Excel файла: {e}", status=500)
+
+        # --- Генерация CSV ---
+        elif export_format.lower() == 'csv':
+            # Файл отдается потоком: группы читаются и записываются по одной, первые байты уходят сразу
+            response = StreamingHttpResponse(
+                _stream_export(
+                    result_reader, forecast_run_id, 'CSV',
+                    iter_forecast_csv_chunks(
+                        params_display_overall=params_display_overall_export,
+                        all_warnings=all_warnings_export,
+                        grouped_forecasts_data=grouped_forecasts_export,
+                        output_detailed_by_age_global=output_detailed_by_age_global_export,
+                        user_selected_settlement_id=user_selected_settlement_id_export,
+                        user_selected_sex_code=user_selected_sex_code_export
+                    )
+                ),
+                content_type='text/csv; charset=utf-8'
+            )
+            response['Content-Disposition'] = f'attachment; filename="{filename_base}.csv"'
+            close_result_reader = False
+            return response
 
-    # Эти параметры нужны для правильного построения заголовков таблиц.
-    # Они были сохранены в data_for_file_storage в tasks.py.
-    output_detailed_by_age_global_export = results_data_from_file.get('output_detailed_by_age_global', False)
-    user_selected_settlement_id_export = results_data_from_file.get('user_selected_settlement_id', ID_SETTLEMENT_TOTAL)
-    user_selected_sex_code_export = results_data_from_file.get('user_selected_sex_code', SEX_CODE_TOTAL)
+        # --- Машиночитаемые форматы (только данные, см. tidy_export) ---
+        elif export_format.lower() == 'ndjson':
+            response = StreamingHttpResponse(
+                _stream_export(
+                    result_reader, forecast_run_id, 'NDJSON',
+                    tidy_export.iter_ndjson_chunks(grouped_forecasts_export, output_detailed_by_age_global_export)
+                ),
+                content_type='application/x-ndjson; charset=utf-8'
+            )
+            response['Content-Disposition'] = f'attachment; filename="{filename_base}.ndjson"'
+            close_result_reader = False
+            return response
 
-    filename_base = f"forecast_export_{str(forecast_run_id)[:8]}"  # Короткий префикс из UUID
+        elif export_format.lower() == 'parquet':
+            export_file = tempfile.TemporaryFile(suffix='.parquet')
+            try:
+                tidy_export.write_parquet(export_file, grouped_forecasts_export, output_detailed_by_age_global_export)
+                export_file.seek(0)
+                logger.info(f"Успешно сформирован Parquet файл для прогноза ID: {forecast_run_id}")
+                return FileResponse(export_file, as_attachment=True, filename=f"{filename_base}.parquet",
+                                    content_type='application/vnd.apache.parquet')
+            except tidy_export.TidyExportUnavailable as e:
+                export_file.close()
+                logger.warning(f"Экспорт в Parquet для прогноза ID {forecast_run_id} недоступен: {e}")
+                return HttpResponse(str(e), status=501)
+            except Exception as e:
+                export_file.close()
+                logger.error(f"Ошибка при генерации Parquet для прогноза ID {forecast_run_id}: {e}", exc_info=True)
+                return HttpResponse(f"Произошла ошибка при генерации Parquet файла: {e}", status=500)
+
+        else:
+            logger.warning(
+                f"Запрошен неподдерживаемый формат экспорта: '{export_format}' для прогноза ID {forecast_run_id}")
+            raise Http404("Неподдерживаемый формат экспорта. Доступные форматы: xlsx, csv, ndjson, parquet.")
+    finally:
+        if close_result_reader:
+            result_reader.close()
+
+
+def _stream_export(result_reader, forecast_run_id, format_name: str, chunks):
+    """
+    Генератор для StreamingHttpResponse: отдает куски файла экспорта и закрывает файл результатов по завершении.
+    Ответ уже начат, поэтому ошибку можно только записать в лог (файл у пользователя будет обрезан).
+    """
+    try:
+        yield from chunks
+        logger.info(f"Успешно сформирован {format_name} файл для прогноза ID: {forecast_run_id}")
+    except Exception as e:
+        logger.error(f"Ошибка при генерации {format_name} для прогноза ID {forecast_run_id}: {e}", exc_info=True)
+        raise
+    finally:
+        result_reader.close()
+
+
+def _export_job_payload(forecast_run: ForecastRun, export_format: str,
+                        artifact: Optional[ForecastExportArtifact] = None) -> Dict[str, Any]:
+    """Состояние фонового экспорта для JavaScript страницы истории."""
+    download_url = reverse('forecasting:export_forecast_data',
+                           kwargs={'forecast_run_id': forecast_run.id, 'export_format': export_format})
+    if artifact is None:
+        # Экспорт формируется в запросе при скачивании
+        return {'status': 'direct', 'download_url': download_url}
+    payload = {
+        'status': artifact.status,
+        'total_groups': artifact.total_groups,
+        'completed_groups': artifact.completed_groups,
+        'status_url': reverse('forecasting:export_job_status',
+                              kwargs={'forecast_run_id': forecast_run.id, 'export_format': export_format}),
+    }
+    if artifact.status == ForecastExportArtifact.STATUS_COMPLETED:
+        payload['download_url'] = download_url
+        payload['file_size'] = artifact.file_size
+    elif artifact.status == ForecastExportArtifact.STATUS_ERROR:
+        payload['error_message'] = artifact.error_message
+    return payload
 
-    # --- Генерация EXCEL ---
-    if export_format.lower() == 'xlsx':
-        try:
-            workbook = generate_forecast_excel_workbook(
-                params_display_overall=params_display_overall_export,
-                all_warnings=all_warnings_export,
-                grouped_forecasts_data=grouped_forecasts_export,
-                output_detailed_by_age_global=output_detailed_by_age_global_export,
-                user_selected_settlement_id=user_selected_settlement_id_export,
-                user_selected_sex_code=user_selected_sex_code_export
-            )
 
-            output_stream = BytesIO()
-            workbook.save(output_stream)
-            output_stream.seek(0)  # Перемещаем указатель в начало BytesIO объекта
+@login_required
+@require_POST
+def start_export_job_view(request, forecast_run_id, export_format):
+    """
+    Запускает фоновый экспорт прогноза. Для небольших прогнозов возвращает status='direct'
+    (файл формируется при скачивании), для уже сформированных - status='completed' и download_url.
+    """
+    forecast_run = get_object_or_404(ForecastRun, id=forecast_run_id, user=request.user)
+    export_format = export_format.lower()
+    if export_format not in export_jobs.EXPORT_CONTENT_TYPES:
+        raise Http404("Неподдерживаемый формат экспорта. Доступные форматы: xlsx, csv, ndjson, parquet.")
 
-            response = HttpResponse(
-                output_stream.getvalue(),  # getvalue() чтобы получить байты
-                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-            response['Content-Disposition'] = f'attachment; filename="{filename_base}.xlsx"'
-            logger.info(f"Успешно сформирован Excel файл для прогноза ID: {forecast_run_id}")
-            return response
-        except Exception as e:
-            logger.error(f"Ошибка при генерации Excel для прогноза ID {forecast_run_id}: {e}", exc_info=True)
-            # Можно вернуть более дружелюбное сообщение или страницу ошибки
-            return HttpResponse(f"Произошла ошибка при генерации Excel файла: {e}", status=500)
+    ready_artifact = export_jobs.get_ready_artifact(forecast_run, export_format)
+    if ready_artifact is not None:
+        return JsonResponse(_export_job_payload(forecast_run, export_format, ready_artifact))
+    if not export_jobs.is_large_export(forecast_run):
+        return JsonResponse(_export_job_payload(forecast_run, export_format))
 
-    # --- Генерация CSV ---
-    elif export_format.lower() == 'csv':
-        try:
-            response = HttpResponse(content_type='text/csv; charset=utf-8')
-            response.write(u'\ufeff'.encode('utf8'))  # BOM для Excel, чтобы кириллица отображалась корректно
-            response['Content-Disposition'] = f'attachment; filename="{filename_base}.csv"'
+    artifact, should_enqueue = export_jobs.claim_export_job(forecast_run, export_format)
+    if should_enqueue:
+        logger.info(f"Запуск фонового экспорта {export_format} для прогноза ID: {forecast_run_id}")
+        generate_export_artifact_task.delay(artifact.id)
+        artifact.refresh_from_db()
+    return JsonResponse(_export_job_payload(forecast_run, export_format, artifact), status=202)
 
-            csv_writer = csv.writer(response, delimiter=';')  # Используем точку с запятой
 
-            write_forecast_data_to_csv(
-                writer=csv_writer,
-                params_display_overall=params_display_overall_export,
-                all_warnings=all_warnings_export,
-                grouped_forecasts_data=grouped_forecasts_export,
-                output_detailed_by_age_global=output_detailed_by_age_global_export,
-                user_selected_settlement_id=user_selected_settlement_id_export,
-                user_selected_sex_code=user_selected_sex_code_export
-            )
-            logger.info(f"Успешно сформирован CSV файл для прогноза ID: {forecast_run_id}")
-            return response
-        except Exception as e:
-            logger.error(f"Ошибка при генерации CSV для прогноза ID {forecast_run_id}: {e}", exc_info=True)
-            return HttpResponse(f"Произошла ошибка при генерации CSV файла: {e}", status=500)
+@login_required
+@require_GET
+def export_job_status_view(request, forecast_run_id, export_format):
+    forecast_run = get_object_or_404(ForecastRun, id=forecast_run_id, user=request.user)
+    artifact = ForecastExportArtifact.objects.filter(forecast_run=forecast_run,
+                                                     export_format=export_format.lower()).first()
+    if artifact is None:
+        raise Http404("Экспорт этого прогноза не запускался.")
+    return JsonResponse(_export_job_payload(forecast_run, artifact.export_format, artifact))
 
-    else:
-        logger.warning(
-            f"Запрошен неподдерживаемый формат экспорта: '{export_format}' для прогноза ID {forecast_run_id}")
-        raise Http404("Неподдерживаемый формат экспорта. Доступные форматы: xlsx, csv.")
+
+@login_required
+@require_GET
+def batch_export_view(request):
+    """
+    Экспорт нескольких прогнозов из истории одним ZIP-архивом (?run=<id>&run=<id>...&format=csv).
+    Архив формируется и отдается потоком, по одному файлу на прогноз.
+    """
+    run_ids = request.GET.getlist('run')
+    export_format = request.GET.get('format', export_jobs.EXPORT_FORMAT_CSV).lower()
+    if export_format not in batch_export.BATCH_EXPORT_FORMATS:
+        return JsonResponse({'status': 'error',
+                             'message': f"Неподдерживаемый формат экспорта. Доступные форматы: "
+                                        f"{', '.join(batch_export.BATCH_EXPORT_FORMATS)}."}, status=400)
+    if not 1 <= len(run_ids) <= MAX_BATCH_EXPORT_FORECASTS:
+        return JsonResponse({'status': 'error',
+                             'message': f"Выберите от 1 до {MAX_BATCH_EXPORT_FORECASTS} прогнозов для экспорта."},
+                            status=400)
+    try:
+        forecast_runs = list(ForecastRun.objects.filter(id__in=run_ids, user=request.user).order_by('-created_at'))
+    except ValidationError:
+        return JsonResponse({'status': 'error', 'message': 'Некорректный идентификатор прогноза.'}, status=400)
+    if len(forecast_runs) != len(set(run_ids)):
+        raise Http404("Прогноз не найден или у вас нет к нему доступа.")
+
+    logger.info(f"Пакетный экспорт {export_format}: {len(forecast_runs)} прогнозов, User: {request.user.username}")
+    response = StreamingHttpResponse(batch_export.iter_batch_export_zip(forecast_runs, export_format),
+                                     content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="forecasts_export_{export_format}.zip"'
+    return response
@@ -0,0 +1,62 @@
+# forecasting/worker_warmup.py
+
+import logging
+import time
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+
+from data_collector import region_registry
+from data_collector.db_connector import get_shared_connector
+from .data_providers.db_data_provider import SETTLEMENT_TYPE_URBAN_ID, SETTLEMENT_TYPE_RURAL_ID
+from .forecaster import prefetch_hot_region_datasets
+
+logger = logging.getLogger(__name__)
+
+# Прогрев процесса воркера Celery (вызывается из сигнала worker_process_init, см. tasks.py):
+# - справочник регионов загружается одним запросом вместо запроса на каждый регион в задаче;
+# - шаблоны результатов компилируются заранее (кешируются загрузчиком шаблонов Django);
+# - открывается общее соединение процесса с БД исторических данных;
+# - для регионов из FORECAST_WORKER_HOT_REGION_IDS заранее загружаются исходные данные прогноза.
+# Ошибка любого шага только записывается в лог: воркер должен стартовать и без прогрева.
+
+# Прогноз всегда считается отдельно для городского и сельского населения
+HOT_REGION_SETTLEMENT_TYPE_IDS = (SETTLEMENT_TYPE_URBAN_ID, SETTLEMENT_TYPE_RURAL_ID)
+
+
+def warm_up_worker_process(hist_start_year: int, hist_end_year: int) -> None:
+    """hist_start_year/hist_end_year - исторический период, для которого загружаются данные горячих регионов."""
+    if not getattr(settings, 'FORECAST_WORKER_WARMUP_ENABLED', True):
+        return
+    started_at = time.monotonic()
+
+    try:
+        regions_count = region_registry.load_region_registry()
+        logger.info(f"Worker warm-up: region registry loaded ({regions_count} regions).")
+    except Exception as e:
+        logger.warning(f"Worker warm-up: failed to load region registry: {e}")
+
+    for template_name in getattr(settings, 'FORECAST_WORKER_WARMUP_TEMPLATES', ['forecast_results.html']):
+        try:
+            get_template(template_name)
+        except TemplateDoesNotExist:
+            logger.warning(f"Worker warm-up: template {template_name} not found.")
+        except Exception as e:
+            logger.warning(f"Worker warm-up: failed to compile template {template_name}: {e}")
+
+    try:
+        get_shared_connector().get_connection()
+    except Exception as e:
+        logger.warning(f"Worker warm-up: failed to open database connection: {e}")
+
+    hot_region_ids = list(getattr(settings, 'FORECAST_WORKER_HOT_REGION_IDS', []))
+    if hot_region_ids:
+        try:
+            datasets_count = prefetch_hot_region_datasets(hot_region_ids, list(HOT_REGION_SETTLEMENT_TYPE_IDS),
+                                                          hist_start_year, hist_end_year)
+            logger.info(f"Worker warm-up: prefetched {datasets_count} datasets for hot regions {hot_region_ids}.")
+        except Exception as e:
+            logger.warning(f"Worker warm-up: failed to prefetch data for hot regions {hot_region_ids}: {e}")
+
+    logger.info(f"Worker warm-up completed in {time.monotonic() - started_at:.2f} s.")